@@ -1,6 +1,7 @@
 #include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
+#include <stdint.h>
 #include <fcntl.h>
 #include <unistd.h>
 #include <scsi/sg.h>
@@ -14,8 +15,230 @@
 #define INQ_REPLY_LEN 96
 #define SENSE_BUFFER_LEN 32
 
+/*
+ * --serve: run as a co-process that executes a stream of SG_IO requests.
+ * All integers are little-endian.
+ *
+ * Request:  u8 direction (0 none, 1 from device, 2 to device), u8 cdb_len, u16 device_len,
+ *           u32 transfer_len, u32 timeout_ms, u32 tag,
+ *           device path (device_len bytes), CDB (cdb_len bytes),
+ *           data-out (transfer_len bytes, direction 2 only)
+ * Response: u32 tag, i32 error (errno from open/ioctl, 0 if the command was issued),
+ *           u8 status, u8 sense_len, u16 host_status, u16 driver_status, u16 info,
+ *           u32 duration_ms, u32 data_len,
+ *           sense (sense_len bytes), data-in (data_len bytes)
+ *
+ * Requests are handled in order, one response per request. Device file descriptors
+ * are opened on first use and kept open until EOF on stdin.
+ *
+ * Handshake: a request with direction 0, cdb_len 0 and device_len 0 runs no command
+ * and is answered with PROTOCOL_VERSION in the info field, so a client can tell a
+ * current build from a stale one before sending anything real.
+ */
+#define PROTOCOL_VERSION 1
+#define REQUEST_HDR_LEN 16
+#define RESPONSE_HDR_LEN 24
+#define MAX_CDB_LEN 16
+#define MAX_DEVICE_LEN 255
+#define MAX_DEVICES 64
+#define DIR_NONE 0
+#define DIR_FROM_DEV 1
+#define DIR_TO_DEV 2
+
+struct open_device {
+    char path[MAX_DEVICE_LEN + 1];
+    int fd;
+};
+
+static struct open_device devices[MAX_DEVICES];
+static int device_count = 0;
+
+static int read_full(int fd, void *buf, size_t len) {
+    unsigned char *p = buf;
+    while (len > 0) {
+        ssize_t n = read(fd, p, len);
+        if (n == 0)
+            return 0;
+        if (n < 0) {
+            if (errno == EINTR)
+                continue;
+            return -1;
+        }
+        p += n;
+        len -= n;
+    }
+    return 1;
+}
+
+static int write_full(int fd, const void *buf, size_t len) {
+    const unsigned char *p = buf;
+    while (len > 0) {
+        ssize_t n = write(fd, p, len);
+        if (n < 0) {
+            if (errno == EINTR)
+                continue;
+            return -1;
+        }
+        p += n;
+        len -= n;
+    }
+    return 0;
+}
+
+static uint16_t get_u16(const unsigned char *p) {
+    return p[0] | (p[1] << 8);
+}
+
+static uint32_t get_u32(const unsigned char *p) {
+    return p[0] | (p[1] << 8) | (p[2] << 16) | ((uint32_t)p[3] << 24);
+}
+
+static void put_u16(unsigned char *p, uint16_t v) {
+    p[0] = v & 0xFF;
+    p[1] = v >> 8;
+}
+
+static void put_u32(unsigned char *p, uint32_t v) {
+    p[0] = v & 0xFF;
+    p[1] = (v >> 8) & 0xFF;
+    p[2] = (v >> 16) & 0xFF;
+    p[3] = v >> 24;
+}
+
+static int device_fd(const char *path) {
+    for (int i = 0; i < device_count; i++) {
+        if (strcmp(devices[i].path, path) == 0)
+            return devices[i].fd;
+    }
+    // Read/write if allowed so data-out commands work, read-only otherwise
+    int fd = open(path, O_RDWR);
+    if (fd < 0 && (errno == EACCES || errno == EROFS))
+        fd = open(path, O_RDONLY);
+    if (fd < 0)
+        return -errno;
+    if (device_count == MAX_DEVICES) {
+        close(devices[0].fd);
+        memmove(&devices[0], &devices[1], sizeof(devices[0]) * (MAX_DEVICES - 1));
+        device_count--;
+    }
+    strcpy(devices[device_count].path, path);
+    devices[device_count].fd = fd;
+    device_count++;
+    return fd;
+}
+
+static int serve(void) {
+    unsigned char req[REQUEST_HDR_LEN];
+    unsigned char resp[RESPONSE_HDR_LEN];
+    unsigned char cdb[MAX_CDB_LEN];
+    unsigned char sense_buf[SENSE_BUFFER_LEN];
+    char path[MAX_DEVICE_LEN + 1];
+    unsigned char *data = NULL;
+    size_t data_cap = 0;
+
+    for (;;) {
+        int r = read_full(STDIN_FILENO, req, sizeof(req));
+        if (r == 0)
+            break;
+        if (r < 0) {
+            perror("Failed to read request");
+            return 1;
+        }
+
+        int direction = req[0];
+        int cdb_len = req[1];
+        uint16_t device_len = get_u16(req + 2);
+        uint32_t transfer_len = get_u32(req + 4);
+        uint32_t timeout_ms = get_u32(req + 8);
+        uint32_t tag = get_u32(req + 12);
+
+        if (direction == DIR_NONE && cdb_len == 0 && device_len == 0) {
+            memset(resp, 0, sizeof(resp));
+            put_u32(resp, tag);
+            put_u16(resp + 14, PROTOCOL_VERSION);
+            if (write_full(STDOUT_FILENO, resp, sizeof(resp)) < 0) {
+                perror("Failed to write response");
+                return 1;
+            }
+            continue;
+        }
+        if (cdb_len == 0 || cdb_len > MAX_CDB_LEN || device_len == 0 || device_len > MAX_DEVICE_LEN ||
+            direction > DIR_TO_DEV) {
+            fprintf(stderr, "Malformed request (tag %u)\n", tag);
+            return 1;
+        }
+        if (transfer_len > data_cap) {
+            free(data);
+            data = malloc(transfer_len);
+            if (data == NULL) {
+                perror("Failed to allocate transfer buffer");
+                return 1;
+            }
+            data_cap = transfer_len;
+        }
+        if (read_full(STDIN_FILENO, path, device_len) <= 0 ||
+            read_full(STDIN_FILENO, cdb, cdb_len) <= 0 ||
+            (direction == DIR_TO_DEV && transfer_len > 0 && read_full(STDIN_FILENO, data, transfer_len) <= 0)) {
+            fprintf(stderr, "Truncated request (tag %u)\n", tag);
+            return 1;
+        }
+        path[device_len] = '\0';
+
+        sg_io_hdr_t io_hdr;
+        memset(&io_hdr, 0, SG_IO_HDR_LEN);
+        memset(sense_buf, 0, sizeof(sense_buf));
+        int error = 0;
+        int fd = device_fd(path);
+        if (fd < 0) {
+            error = -fd;
+        } else {
+            io_hdr.interface_id = 'S';
+            io_hdr.dxfer_direction = direction == DIR_FROM_DEV ? SG_DXFER_FROM_DEV :
+                                     direction == DIR_TO_DEV ? SG_DXFER_TO_DEV : SG_DXFER_NONE;
+            io_hdr.cmd_len = cdb_len;
+            io_hdr.mx_sb_len = sizeof(sense_buf);
+            io_hdr.dxfer_len = direction == DIR_NONE ? 0 : transfer_len;
+            io_hdr.dxferp = data;
+            io_hdr.cmdp = cdb;
+            io_hdr.sbp = sense_buf;
+            io_hdr.timeout = timeout_ms;
+            if (ioctl(fd, SG_IO, &io_hdr) < 0)
+                error = errno;
+        }
+
+        uint32_t data_len = 0;
+        if (error == 0 && direction == DIR_FROM_DEV && io_hdr.resid >= 0 && (uint32_t)io_hdr.resid <= transfer_len)
+            data_len = transfer_len - io_hdr.resid;
+        int sense_len = error == 0 ? io_hdr.sb_len_wr : 0;
+
+        put_u32(resp, tag);
+        put_u32(resp + 4, (uint32_t)error);
+        resp[8] = io_hdr.status;
+        resp[9] = sense_len;
+        put_u16(resp + 10, io_hdr.host_status);
+        put_u16(resp + 12, io_hdr.driver_status);
+        put_u16(resp + 14, io_hdr.info);
+        put_u32(resp + 16, io_hdr.duration);
+        put_u32(resp + 20, data_len);
+        if (write_full(STDOUT_FILENO, resp, sizeof(resp)) < 0 ||
+            write_full(STDOUT_FILENO, sense_buf, sense_len) < 0 ||
+            write_full(STDOUT_FILENO, data, data_len) < 0) {
+            perror("Failed to write response");
+            return 1;
+        }
+    }
+
+    for (int i = 0; i < device_count; i++)
+        close(devices[i].fd);
+    free(data);
+    return 0;
+}
+
 int main(int argc, char *argv[]) {
     const char *device = "/dev/sda"; // Change this to your target device
+    if (argc > 1 && strcmp(argv[1], "--serve") == 0) {
+        return serve();
+    }
     if (argc > 1) {
         device = argv[1];
     }
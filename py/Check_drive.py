@@ -1,11 +1,18 @@
+import os
 import subprocess
 import struct
 import sys
 import re
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+import scsi_cdb
+from retry import DEFAULT_POLICY, failure_detail
+from sg_transport import scsi_command_error, sg_raw_transport
+from verifier import zero_verifier
+
 DEVICE = "/dev/sda"  # Change to your actual sg device
 BLOCK_SIZE = 512     # We will get actual size from the device
-CHUNK_BLOCKS = 128   # How many blocks to read per READ(10), tune for speed
+CHUNK_BLOCKS = 128   # How many blocks to read per READ, tune for speed (READ(16) above 65535)
 
 
 def parse_hex_from_stderr(stderr_text):
@@ -53,6 +60,8 @@ def run_sg_raw_read_capacity(device):
         raise RuntimeError("Failed to parse 8 bytes from stderr output")
 
     last_lba, block_len = struct.unpack(">II", ldata[:8])
+    if last_lba == scsi_cdb.READ_10_MAX_LBA:
+        last_lba, block_len = run_sg_raw_read_capacity16(device)
     total_blocks = last_lba + 1
     print(f"\nParsed READ CAPACITY response:")
     print(f"    Total blocks : {total_blocks}")
@@ -60,36 +69,39 @@ def run_sg_raw_read_capacity(device):
 
     return total_blocks, block_len
 
-def sg_raw_read10(device, lba, num_blocks, block_size):
-    lba_bytes = struct.pack(">I", lba)
-    blocks_byte = struct.pack(">H", num_blocks)
+def run_sg_raw_read_capacity16(device):
+    print(f"[+] Capacity saturated READ CAPACITY (10), sending READ CAPACITY (16) to {device}")
+    cdb = [f"{byte:02x}" for byte in scsi_cdb.read_capacity16()]
+    cmd = ["sg_raw", "-r", str(scsi_cdb.READ_CAPACITY_16_REPLY_LEN), device] + cdb
+    result = subprocess.run(cmd, capture_output=True, check=True, text=True)
+
+    ldata = parse_hex_from_stderr(result.stderr)
+    if len(ldata) < 12:
+        raise RuntimeError("Failed to parse 12 bytes of READ CAPACITY (16) from stderr output")
 
-    # Construct READ(10) CDB: 28 00 [LBA:4] 00 [TransferLen:2] 00
-    cdb = [
-        "28", "00",
-        f"{lba_bytes[0]:02x}", f"{lba_bytes[1]:02x}", f"{lba_bytes[2]:02x}", f"{lba_bytes[3]:02x}",
-        "00",
-        f"{blocks_byte[0]:02x}", f"{blocks_byte[1]:02x}",
-        "00"
-    ]
+    return struct.unpack(">QI", ldata[:12])
 
-    read_len = num_blocks * block_size
-    cmd = ["sg_raw", "-r", str(read_len), device] + cdb
-    result = subprocess.run(cmd, capture_output=True, check=True)
-    return result.stdout
+def sg_raw_read(device, lba, num_blocks, block_size):
+    # READ(10) while the LBA and length fit, READ(16) beyond 2 TiB or 65535 blocks.
+    # sg_raw's exit status gives the sense key, so UNIT ATTENTION and NOT READY are retried
+    data = memoryview(bytearray(num_blocks * block_size))
+    received = DEFAULT_POLICY.run(sg_raw_transport(device).execute, scsi_cdb.read(lba, num_blocks), data)
+    return data[:received]
 
 def blank_check(device, total_blocks, block_size):
-    print(f"[+] Beginning blank check using READ(10)...")
+    print(f"[+] Beginning blank check using READ(10)/READ(16)...")
+    verifier = zero_verifier(CHUNK_BLOCKS * block_size)
     lba = 0
     while lba < total_blocks:
         blocks_to_read = min(CHUNK_BLOCKS, total_blocks - lba)
         try:
-            data = sg_raw_read10(device, lba, blocks_to_read, block_size)
-            if any(byte != 0x00 for byte in data):
-                print(f"[!] Non-zero data found at LBA {lba}")
+            data = sg_raw_read(device, lba, blocks_to_read, block_size)
+            found = verifier.locate(data, lba, block_size)
+            if found is not None:
+                print(f"[!] Non-zero data found at LBA {found[0]}, byte offset {found[1]}")
                 return False
-        except subprocess.CalledProcessError as e:
-            print(f"[!] READ(10) failed at LBA {lba}: {e}")
+        except (scsi_command_error, OSError) as e:
+            print(f"[!] READ failed at LBA {lba}{failure_detail(e)}: {e}")
             return False
 
         print(f"    Checked up to block {lba + blocks_to_read} / {total_blocks}", end="\r")
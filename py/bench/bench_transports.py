@@ -0,0 +1,195 @@
+import argparse
+import asyncio
+import contextlib
+import os
+import stat
+import sys
+import tempfile
+import time
+
+PY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(PY_DIR, "src"))
+sys.path.insert(0, PY_DIR)
+import full_device_info
+import metrics
+import scsi_cdb
+from scsi_class import scsi_device
+from sg_async import blank_check_devices
+from sg_emulator import create_image, emulated_async_device, emulated_sg_io_transport, scsi_emulator
+
+BLOCK_SIZE = 512
+IMAGE_BLOCKS = 1 << 18        # 128 MiB sparse image
+CHUNK_BLOCKS = 1000
+
+
+class result:
+    def __init__(self, path: str, commands: int, nbytes: int, elapsed: float):
+        self.path: str = path
+        self.commands: int = commands
+        self.nbytes: int = nbytes
+        self.elapsed: float = elapsed
+
+    def __str__(self) -> str:
+        return (f"    {self.path:<48} {self.commands / self.elapsed:>10.0f} cmd/s "
+                f"{self.nbytes / self.elapsed / 1e6:>9.1f} MB/s {self.elapsed / self.commands * 1e6:>9.1f} us/cmd")
+
+
+def timed(path: str, commands: int, nbytes: int, run) -> result:
+    start = time.perf_counter()
+    run()
+    return result(path, commands, nbytes, time.perf_counter() - start)
+
+
+def sg_raw_shim(directory: str) -> None:
+    """
+    Puts an 'sg_raw' on PATH that runs the emulator's sg_raw compatible command line.
+    """
+    shim = os.path.join(directory, "sg_raw")
+    emulator = os.path.join(PY_DIR, "src", "sg_emulator.py")
+    with open(shim, "w") as f:
+        f.write(f'#!/bin/sh\nexec "{sys.executable}" "{emulator}" "$@"\n')
+    os.chmod(shim, os.stat(shim).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    os.environ["PATH"] = directory + os.pathsep + os.environ.get("PATH", "")
+
+
+def bench_scsi_class(image: str, transport, small: int, blocks: int) -> list[result]:
+    """
+    scsi_class: single-block READs for per-command cost, then blank_check for the scanner.
+    """
+    name = transport if isinstance(transport, str) else transport.name
+    results = []
+    with scsi_device(image, transport=transport) as dev:
+        data = memoryview(bytearray(BLOCK_SIZE))
+        def single_blocks():
+            for lba in range(small):
+                dev.transport.execute(scsi_cdb.read(lba, 1), data)
+        results.append(timed(f"scsi_class {name} 1-block READ", small, small * BLOCK_SIZE, single_blocks))
+
+        commands = -(-blocks // CHUNK_BLOCKS)
+        def scan():
+            if not dev.blank_check(blocks, BLOCK_SIZE, progress=lambda done, total: None, chunk_blocks=CHUNK_BLOCKS):
+                raise RuntimeError(f"blank_check failed: {dev.errors}")
+        results.append(timed(f"scsi_class {name} blank_check", commands, blocks * BLOCK_SIZE, scan))
+    return results
+
+
+def bench_direct(image: str, blocks: int) -> result:
+    """
+    scsi_class blank_check with read_mode "direct": O_DIRECT reads verified in place.
+    """
+    with scsi_device(image, transport="emulated") as dev:
+        def scan():
+            if not dev.blank_check(blocks, BLOCK_SIZE, progress=lambda done, total: None,
+                                   chunk_blocks=CHUNK_BLOCKS, read_mode="direct"):
+                raise RuntimeError(f"blank_check failed: {dev.errors}")
+        return timed("scsi_class O_DIRECT blank_check", -(-blocks // CHUNK_BLOCKS), blocks * BLOCK_SIZE, scan)
+
+
+def bench_pipeline(image: str, latency: float, blocks: int, buffers: int = 2) -> list[result]:
+    """
+    blank_check with each READ followed by its verify ("sg") against read_mode "pipeline",
+    where the next READ is in flight while the last chunk is verified.
+    """
+    results = []
+    commands = -(-blocks // CHUNK_BLOCKS)
+    for read_mode, queue_depth in (("sg", 1), ("pipeline", buffers)):
+        emulator = scsi_emulator(image, latency={scsi_cdb.READ_10: latency, scsi_cdb.READ_16: latency})
+        with scsi_device(image, transport=emulated_sg_io_transport(image, emulator=emulator)) as dev:
+            def scan():
+                if not dev.blank_check(blocks, BLOCK_SIZE, queue_depth=queue_depth, read_mode=read_mode,
+                                       progress=lambda done, total: None, chunk_blocks=CHUNK_BLOCKS):
+                    raise RuntimeError(f"blank_check failed: {dev.errors}")
+            results.append(timed(f"scsi_class {read_mode} mode blank_check", commands,
+                                 blocks * BLOCK_SIZE, scan))
+        emulator.close()
+    return results
+
+
+def bench_async(directory: str, devices: int, queue_depth: int = 8) -> result:
+    """
+    sg_async: blank_check of several devices at once from one event loop thread.
+    """
+    images = [create_image(os.path.join(directory, f"async{i}.img"), IMAGE_BLOCKS, BLOCK_SIZE) for i in range(devices)]
+    def scan():
+        errors = asyncio.run(blank_check_devices(images, queue_depth, CHUNK_BLOCKS, device_class=emulated_async_device))
+        if any(errors.values()):
+            raise RuntimeError(f"blank_check failed: {errors}")
+    commands = devices * -(-IMAGE_BLOCKS // CHUNK_BLOCKS)
+    return timed(f"sg_async {devices} devices blank_check, qd {queue_depth}", commands,
+                 devices * IMAGE_BLOCKS * BLOCK_SIZE, scan)
+
+
+def bench_full_device_info(image: str, latency: float, small: int, blocks: int) -> list[result]:
+    """
+    full_device_info: read_block over the ctypes SG_IO path, answered by the emulator.
+    """
+    emulator = scsi_emulator(image, latency={scsi_cdb.READ_10: latency, scsi_cdb.READ_16: latency})
+    results = []
+    with emulated_sg_io_transport(image, emulator=emulator) as transport:
+        def single_blocks():
+            for lba in range(small):
+                if full_device_info.read_block(transport, lba) is None:
+                    raise RuntimeError(f"read_block failed at LBA {lba}")
+        results.append(timed("full_device_info read_block 1-block", small, small * BLOCK_SIZE, single_blocks))
+
+        commands = -(-blocks // CHUNK_BLOCKS)
+        def chunks():
+            for lba in range(0, blocks, CHUNK_BLOCKS):
+                full_device_info.read_block(transport, lba, min(CHUNK_BLOCKS, blocks - lba))
+        results.append(timed(f"full_device_info read_block {CHUNK_BLOCKS}-block", commands, blocks * BLOCK_SIZE, chunks))
+    emulator.close()
+    return results
+
+
+def bench_read_blocks(image: str, small: int, count: int) -> list[result]:
+    """
+    full_device_info.read_blocks: plain buffered reads of the start of the device, one open per call.
+    """
+    results = []
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        results.append(timed("read_blocks 1 block", small, small * BLOCK_SIZE,
+                             lambda: [full_device_info.read_blocks(image, BLOCK_SIZE, 1) for _ in range(small)]))
+        loops = max(1, small // 10)
+        results.append(timed(f"read_blocks {count} blocks", loops, loops * count * BLOCK_SIZE,
+                             lambda: [full_device_info.read_blocks(image, BLOCK_SIZE, count) for _ in range(loops)]))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the command paths against the file-backed emulator")
+    parser.add_argument("--commands", type=int, default=20000, help="single-block commands per in-process path")
+    parser.add_argument("--sg-raw-commands", type=int, default=200, help="commands for the sg_raw path (one process each)")
+    parser.add_argument("--latency", type=float, default=0.0, help="emulated seconds per READ")
+    parser.add_argument("--skip-sg-raw", action="store_true", help="leave out the sg_raw subprocess path")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        image = create_image(os.path.join(tmp, "disk.img"), IMAGE_BLOCKS, BLOCK_SIZE)
+        print(f"[+] Emulated device: {IMAGE_BLOCKS} x {BLOCK_SIZE} byte blocks, READ latency {args.latency * 1e6:.0f} us")
+
+        results: list[result] = []
+        if not args.skip_sg_raw:
+            sg_raw_shim(tmp)
+            raw_blocks = args.sg_raw_commands * CHUNK_BLOCKS // 10
+            results += bench_scsi_class(image, "sg_raw", args.sg_raw_commands, raw_blocks)
+
+        emulator = scsi_emulator(image, latency={scsi_cdb.READ_10: args.latency, scsi_cdb.READ_16: args.latency})
+        results += bench_scsi_class(image, emulated_sg_io_transport(image, emulator=emulator), args.commands, IMAGE_BLOCKS)
+        metrics.enable()
+        results += bench_scsi_class(image, emulated_sg_io_transport(image, emulator=emulator), args.commands,
+                                    IMAGE_BLOCKS // 8)[:1]
+        results[-1].path += " +metrics"
+        metrics.disable()
+        emulator.close()
+        results.append(bench_direct(image, IMAGE_BLOCKS))
+        results.append(bench_async(tmp, 4))
+        results += bench_pipeline(image, args.latency, IMAGE_BLOCKS // 4)
+        results += bench_full_device_info(image, args.latency, args.commands, IMAGE_BLOCKS)
+        results += bench_read_blocks(image, args.commands, 100)
+
+    for line in results:
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
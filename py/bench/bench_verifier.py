@@ -0,0 +1,63 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from verifier import zero_verifier
+
+TARGET_GBPS = 2.0
+CHUNK_BLOCKS = 1000
+BLOCK_SIZE = 512
+TOTAL_BYTES = 8 * (1 << 30)  # 8 GiB of simulated reads per run
+
+
+def bench_is_zero(verifier: zero_verifier, chunk: memoryview, total_bytes: int) -> float:
+    """
+    Runs is_zero over the same chunk until total_bytes have been checked and returns GB/s.
+    """
+    loops = max(1, total_bytes // len(chunk))
+    start = time.perf_counter()
+    for _ in range(loops):
+        if not verifier.is_zero(chunk):
+            raise RuntimeError("Zero chunk reported as non-zero")
+    elapsed = time.perf_counter() - start
+    return loops * len(chunk) / elapsed / 1e9
+
+
+def bench_locate(verifier: zero_verifier, chunk: memoryview, loops: int = 1000) -> float:
+    """
+    Times the failure path: finding the exact first non-zero byte in the last block of a chunk.
+    Returns microseconds per lookup.
+    """
+    dirty = len(chunk) - 7
+    chunk[dirty] = 0xA5
+    start = time.perf_counter()
+    for _ in range(loops):
+        found = verifier.locate(chunk, 0, BLOCK_SIZE)
+    elapsed = time.perf_counter() - start
+    chunk[dirty] = 0x00
+    if found != (dirty // BLOCK_SIZE, dirty % BLOCK_SIZE):
+        raise RuntimeError(f"locate returned {found}, expected offset {dirty}")
+    return elapsed / loops * 1e6
+
+
+def main():
+    chunk_sizes = [64 * BLOCK_SIZE, CHUNK_BLOCKS * BLOCK_SIZE, 8 * (1 << 20)]
+    slowest = None
+    print(f"[+] zero_verifier throughput (target {TARGET_GBPS:.1f} GB/s on one core)")
+    for size in chunk_sizes:
+        chunk = memoryview(bytearray(size))
+        verifier = zero_verifier(size)
+        gbps = bench_is_zero(verifier, chunk, TOTAL_BYTES)
+        locate_us = bench_locate(verifier, chunk)
+        slowest = gbps if slowest is None else min(slowest, gbps)
+        print(f"    chunk {size:>9} bytes: {gbps:8.2f} GB/s, first non-zero lookup {locate_us:8.2f} us")
+
+    if slowest < TARGET_GBPS:
+        print(f"[!] Verifier below target: {slowest:.2f} GB/s")
+        sys.exit(1)
+    print(f"[+] Verifier keeps up with {TARGET_GBPS:.1f} GB/s (slowest {slowest:.2f} GB/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,130 +1,52 @@
-import ctypes
-import fcntl
+import argparse
 import os
-import time
 import sys
 
-SG_IO = 0x2285
-SG_DXFER_TO_DEV = -2
-SG_DXFER_FROM_DEV = -3
-SENSE_BUFFER_LEN = 32
-SEND_DIAG_LEN = 6
-LOG_SENSE_LEN = 10
-LOG_SENSE_REPLY_LEN = 512
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+import scsi_cdb
+from log_pages import LOG_SELF_TEST_RESULTS, log_engine
+from log_pages import parse_self_test_results as parse_self_test_results_page
+from self_test_runner import SELF_TESTS, self_test_orchestrator
+from sg_transport import scsi_command_error, sg_io_transport, sg_transport
 
-class sg_io_hdr(ctypes.Structure):
-    _fields_ = [
-        ("interface_id", ctypes.c_int),
-        ("dxfer_direction", ctypes.c_int),
-        ("cmd_len", ctypes.c_ubyte),
-        ("mx_sb_len", ctypes.c_ubyte),
-        ("iovec_count", ctypes.c_ushort),
-        ("dxfer_len", ctypes.c_uint),
-        ("dxferp", ctypes.c_void_p),
-        ("cmdp", ctypes.c_void_p),
-        ("sbp", ctypes.c_void_p),
-        ("timeout", ctypes.c_uint),
-        ("flags", ctypes.c_uint),
-        ("pack_id", ctypes.c_int),
-        ("usr_ptr", ctypes.c_void_p),
-        ("status", ctypes.c_ubyte),
-        ("masked_status", ctypes.c_ubyte),
-        ("msg_status", ctypes.c_ubyte),
-        ("sb_len_wr", ctypes.c_ubyte),
-        ("host_status", ctypes.c_ushort),
-        ("driver_status", ctypes.c_ushort),
-        ("resid", ctypes.c_int),
-        ("duration", ctypes.c_uint),
-        ("info", ctypes.c_uint),
-    ]
-
-def send_self_test(fd):
-    # SEND DIAGNOSTIC: self-test bit = 1, self-test code = 1 (short test)
-    cdb = (ctypes.c_ubyte * SEND_DIAG_LEN)(0x1D, 0x04, 0x00, 0x00, 0x00, 0x00)
-    sense_buf = (ctypes.c_ubyte * SENSE_BUFFER_LEN)()
-    data_buf = (ctypes.c_ubyte * LOG_SENSE_REPLY_LEN)()
-    hdr = sg_io_hdr()
-    hdr.interface_id = ord('S')
-    hdr.dxfer_direction = SG_DXFER_TO_DEV
-    hdr.cmd_len = SEND_DIAG_LEN
-    hdr.mx_sb_len = SENSE_BUFFER_LEN
-    hdr.dxfer_len = 0
-    hdr.dxferp = ctypes.cast(data_buf, ctypes.c_void_p)
-    hdr.cmdp = ctypes.cast(cdb, ctypes.c_void_p)
-    hdr.sbp = ctypes.cast(sense_buf, ctypes.c_void_p)
-    hdr.timeout = 10000  # ms
-
-    fcntl.ioctl(fd, SG_IO, hdr)
-
-    if hdr.status != 0:
+def send_self_test(transport: sg_transport):
+    # SEND DIAGNOSTIC: self-test bit = 1 (default self-test), no parameter list
+    try:
+        transport.execute(scsi_cdb.send_diagnostic(self_test=True), timeout_ms=10000)
+    except scsi_command_error:
         print("SEND DIAGNOSTIC command failed.")
         return False
     return True
 
-def read_self_test_log(fd):
-    cdb = (ctypes.c_ubyte * LOG_SENSE_LEN)(
-        0x4D, 0xE0,      # LOG SENSE, PC=0 (current), Page=0x10  
-        0x10, 0x00,       # Page Code = 0x10
-        0x00, 0x00,       # Reserved
-        0x00, (LOG_SENSE_REPLY_LEN >> 8) & 0xFF, (LOG_SENSE_REPLY_LEN & 0xFF), 0x00
-    )
-    data_buf = (ctypes.c_ubyte * LOG_SENSE_REPLY_LEN)()
-    sense_buf = (ctypes.c_ubyte * SENSE_BUFFER_LEN)()
-
-    hdr = sg_io_hdr()
-    hdr.interface_id = ord('S')
-    hdr.dxfer_direction = SG_DXFER_FROM_DEV
-    hdr.cmd_len = LOG_SENSE_LEN
-    hdr.mx_sb_len = SENSE_BUFFER_LEN
-    hdr.dxfer_len = LOG_SENSE_REPLY_LEN
-    hdr.dxferp = ctypes.cast(data_buf, ctypes.c_void_p)
-    hdr.cmdp = ctypes.cast(cdb, ctypes.c_void_p)
-    hdr.sbp = ctypes.cast(sense_buf, ctypes.c_void_p)
-    hdr.timeout = 10000  # ms
-
-    fcntl.ioctl(fd, SG_IO, hdr)
-
-    # if hdr.status != 0:
-    #     print("LOG SENSE command failed.")
-    #     return None
-
-    return bytes(data_buf)
+def read_self_test_log(transport: sg_transport):
+    # LOG SENSE, PC=1 (cumulative), Page=0x10, read to its full 16-bit page length
+    try:
+        return bytes(log_engine(transport).read_page(LOG_SELF_TEST_RESULTS))
+    except scsi_command_error as e:
+        print(f"LOG SENSE command failed: status=0x{e.status:02x}, sense {e.sense.hex()}")
+        return None
+    except RuntimeError as e:
+        print(f"LOG SENSE returned an invalid page: {e}")
+        return None
 
 def parse_self_test_results(data):
     if not data or len(data) < 4:
         print("No data to parse")
-        return
+        return []
 
     print("Parsing self-test results:")
-    param_len = data[3] + 4
-    i = 4
-    while i + 4 < param_len:
-        param_code = (data[i] << 8) | data[i+1]
-        length = data[i+3]
-        if param_code == 0x0001:  # Self-test results parameter
-            entry = data[i+4:i+4+length]
-            if not entry:
-                print("No self-test result entry.")
-            else:
-                desc = entry[0] & 0x0F
-                status = {
-                    0: "Completed without error",
-                    1: "Aborted by user",
-                    2: "Aborted by device",
-                    3: "Fatal error",
-                    4: "Unknown error",
-                    5: "Test in progress",
-                    6: "Test failed",
-                    7: "Partial failure"
-                }.get(desc, f"Unknown status ({desc})")
-                print(f"Self-test status: {status}")
-                return
-        i += 4 + length
-    print("No self-test results found in log.")
+    entries = parse_self_test_results_page(data)
+    if not entries:
+        print("No self-test results found in log.")
+    for entry in entries:
+        failure = f", first failure at LBA {entry['failure_lba']}" if entry["failure_lba"] is not None else ""
+        print(f"Test {entry['number']}: {entry['test']}, {entry['status']}, "
+              f"{entry['power_on_hours']} hours{failure}")
+    return entries
 
 def run_self_test(device="/dev/sda"):
     try:
-        fd = os.open(device, os.O_RDONLY)
+        transport = sg_io_transport(device)
     except PermissionError:
         print("Permission denied. Use sudo.")
         return
@@ -132,20 +54,26 @@ def run_self_test(device="/dev/sda"):
         print(f"Error opening device: {e}")
         return
 
-    # print(f"Starting short self-test on {device}...")
-    # if not send_self_test(fd):
-    #     os.close(fd)
-    #     return
-
-    # print("Waiting for test to complete (5s)...")
-    # time.sleep(5)
-
     print("Retrieving test result...")
-    data = read_self_test_log(fd)
-    os.close(fd)
+    data = read_self_test_log(transport)
+    transport.close()
     print(data)
     parse_self_test_results(data)
 
+def run_self_tests(devices, test="short"):
+    # Starts the test on every device and polls them all until each one reports a result
+    orchestrator = self_test_orchestrator(devices, test=test,
+                                          on_result=lambda job: print(f"{job.device}: {job.state} {job.message}"))
+    passed = orchestrator.run(live=False)
+    print(orchestrator.summary())
+    return passed
+
 if __name__ == "__main__":
-    dev = sys.argv[1] if len(sys.argv) > 1 else "/dev/sda"
-    run_self_test(dev)
+    parser = argparse.ArgumentParser(description="Read the self-test log, or run a self-test first with --test")
+    parser.add_argument("devices", nargs="*", default=["/dev/sda"])
+    parser.add_argument("--test", choices=tuple(SELF_TESTS), help="start this self-test and wait for the results")
+    args = parser.parse_args()
+    if args.test:
+        sys.exit(0 if run_self_tests(args.devices, args.test) else 1)
+    for dev in args.devices:
+        run_self_test(dev)
@@ -0,0 +1,340 @@
+"""
+ATA SMART for SATA drives behind a SCSI/SAS HBA, through SAT ATA PASS-THROUGH (16).
+
+smart_session reads everything from one drive over one open transport:
+  SMART READ DATA / READ THRESHOLDS   attribute table, offline and self-test status
+  SMART READ LOG 0x06                 SMART self-test log
+  SMART READ LOG 0x01                 summary error log
+  READ LOG EXT 0x04                   General Purpose Log device statistics
+The fixed-size sectors are decoded with struct.iter_unpack over memoryviews.
+"""
+import struct
+from typing import Union
+
+import scsi_cdb
+from scsi_tools import read_fleet
+from sg_transport import open_transport, scsi_command_error, sg_transport
+
+SECTOR = scsi_cdb.ATA_SECTOR_SIZE
+SMART_LOG_SUMMARY_ERROR = 0x01
+SMART_LOG_SELF_TEST = 0x06
+GPL_DEVICE_STATISTICS = 0x04
+
+ATTRIBUTE = struct.Struct("<BHBB6sB")       # id, flags, current, worst, raw, reserved
+THRESHOLD = struct.Struct("<BB10s")         # id, threshold, reserved
+SELF_TEST_ENTRY = struct.Struct("<BBHBI15s")  # type, status, hours, checkpoint, failing LBA, vendor
+ERROR_ENTRY = struct.Struct("<60s8B19sBH")  # 5 commands, error registers, extended, state, hours
+ERROR_COMMAND = struct.Struct("<8BI")       # control, features, count, LBA low/mid/high, device, command, ms
+ATTRIBUTE_COUNT = 30
+SELF_TEST_ENTRIES = 21
+ERROR_ENTRIES = 5
+
+ATTRIBUTE_NAMES = {
+    1: "raw_read_error_rate",
+    3: "spin_up_time",
+    4: "start_stop_count",
+    5: "reallocated_sector_count",
+    7: "seek_error_rate",
+    9: "power_on_hours",
+    10: "spin_retry_count",
+    12: "power_cycle_count",
+    177: "wear_leveling_count",
+    183: "runtime_bad_block",
+    184: "end_to_end_error",
+    187: "reported_uncorrectable",
+    188: "command_timeout",
+    190: "airflow_temperature",
+    193: "load_cycle_count",
+    194: "temperature",
+    196: "reallocation_event_count",
+    197: "current_pending_sector",
+    198: "offline_uncorrectable",
+    199: "udma_crc_error_count",
+    231: "ssd_life_left",
+    241: "total_lbas_written",
+    242: "total_lbas_read",
+}
+
+SELF_TEST_TYPES = {
+    0x01: "short offline",
+    0x02: "extended offline",
+    0x03: "conveyance offline",
+    0x81: "short captive",
+    0x82: "extended captive",
+    0x83: "conveyance captive",
+}
+SELF_TEST_STATUS = {
+    0x0: "completed without error",
+    0x1: "aborted by host",
+    0x2: "interrupted by reset",
+    0x3: "fatal error",
+    0x4: "failed, unknown element",
+    0x5: "failed, electrical element",
+    0x6: "failed, servo element",
+    0x7: "failed, read element",
+    0x8: "failed, handling damage",
+    0xF: "in progress",
+}
+
+# Device statistics: page -> names of its statistics, in qword order after the page header
+DEVICE_STATISTICS = {
+    0x01: ("lifetime_power_on_resets", "power_on_hours", "logical_sectors_written", "write_commands",
+           "logical_sectors_read", "read_commands", "date_and_time_timestamp", "pending_error_count",
+           "workload_utilization", "utilization_usage_rate", "resource_availability", "random_write_resources_used"),
+    0x02: ("free_fall_events", "overlimit_shock_events"),
+    0x03: ("spindle_motor_power_on_hours", "head_flying_hours", "head_load_events", "reallocated_logical_sectors",
+           "read_recovery_attempts", "mechanical_start_failures", "reallocation_candidate_sectors",
+           "high_priority_unload_events"),
+    0x04: ("reported_uncorrectable_errors", "resets_between_command_acceptance_and_completion",
+           "physical_element_status_changed"),
+    0x05: ("current_temperature", "average_short_term_temperature", "average_long_term_temperature",
+           "highest_temperature", "lowest_temperature", "highest_average_short_term_temperature",
+           "lowest_average_short_term_temperature", "highest_average_long_term_temperature",
+           "lowest_average_long_term_temperature", "time_in_over_temperature", "specified_maximum_temperature",
+           "time_in_under_temperature", "specified_minimum_temperature"),
+    0x06: ("hardware_resets", "asr_events", "interface_crc_errors"),
+    0x07: ("percentage_used_endurance_indicator",),
+}
+STAT_SUPPORTED = 1 << 63
+STAT_VALID = 1 << 62
+STAT_NORMALIZED = 1 << 61
+STAT_MONITORED_CONDITION_MET = 1 << 59
+TEMPERATURE_PAGE = 0x05
+
+
+def checksum_ok(sector) -> bool:
+    """
+    SMART and GPL data sectors end with a checksum byte that makes the 512-byte sum zero.
+    """
+    return sum(sector[:SECTOR]) & 0xFF == 0
+
+
+def parse_smart_data(data, thresholds=None) -> dict:
+    """
+    SMART READ DATA, with each attribute's threshold merged in from SMART READ THRESHOLDS
+    when that sector is given. An attribute whose current value has fallen to or below a
+    non-zero threshold is flagged failing.
+    """
+    view = memoryview(data)[:SECTOR]
+    limits: dict[int, int] = {}
+    if thresholds is not None:
+        for attribute_id, threshold, _ in THRESHOLD.iter_unpack(memoryview(thresholds)[2:2 + ATTRIBUTE_COUNT * THRESHOLD.size]):
+            if attribute_id:
+                limits[attribute_id] = threshold
+    attributes = []
+    for attribute_id, flags, current, worst, raw, _ in ATTRIBUTE.iter_unpack(view[2:2 + ATTRIBUTE_COUNT * ATTRIBUTE.size]):
+        if not attribute_id:
+            continue
+        threshold = limits.get(attribute_id)
+        attributes.append({
+            "id": attribute_id,
+            "name": ATTRIBUTE_NAMES.get(attribute_id, f"attribute_{attribute_id}"),
+            "flags": flags,
+            "prefailure": bool(flags & 0x01),
+            "current": current,
+            "worst": worst,
+            "threshold": threshold,
+            "raw": int.from_bytes(raw, "little"),
+            "failing": bool(threshold) and current <= threshold,
+        })
+    self_test_status = view[363]
+    short_minutes, extended_minutes = view[372], view[373]
+    if extended_minutes == 0xFF:
+        extended_minutes = struct.unpack_from("<H", view, 375)[0]
+    return {
+        "revision": struct.unpack_from("<H", view, 0)[0],
+        "attributes": attributes,
+        "offline_collection_status": view[362],
+        "self_test_status": self_test_status >> 4,
+        "self_test_percent_remaining": (self_test_status & 0x0F) * 10,
+        "short_self_test_minutes": short_minutes,
+        "extended_self_test_minutes": extended_minutes,
+        "checksum_ok": checksum_ok(view),
+    }
+
+
+def parse_self_test_log(data) -> list[dict]:
+    """
+    SMART self-test log (0x06): up to 21 entries in a circular buffer, returned newest first.
+    Byte 508 holds the 1-based index of the most recent entry.
+    """
+    view = memoryview(data)[:SECTOR]
+    newest = view[508]
+    entries = []
+    for index, (test_type, status, hours, checkpoint, failing_lba, _) in enumerate(
+            SELF_TEST_ENTRY.iter_unpack(view[2:2 + SELF_TEST_ENTRIES * SELF_TEST_ENTRY.size])):
+        if test_type == 0 and status == 0 and hours == 0:
+            continue
+        result = status >> 4
+        entries.append({
+            "index": index + 1,
+            "type": SELF_TEST_TYPES.get(test_type, f"type 0x{test_type:02x}"),
+            "status": SELF_TEST_STATUS.get(result, f"status 0x{result:x}"),
+            "result": result,
+            "percent_remaining": (status & 0x0F) * 10,
+            "power_on_hours": hours,
+            "checkpoint": checkpoint,
+            # Only meaningful for failed tests; 28-bit LBA
+            "failing_lba": failing_lba & 0x0FFFFFFF if 0x3 <= result <= 0x8 else None,
+        })
+    if newest:
+        # Rotate so the entry at the newest index comes first, then walk backwards
+        entries.sort(key=lambda entry: (newest - entry["index"]) % SELF_TEST_ENTRIES)
+    return entries
+
+
+def parse_error_log(data) -> dict:
+    """
+    SMART summary error log (0x01): the last five errors with the commands leading up to
+    each, newest first, plus the drive's lifetime error count.
+    """
+    view = memoryview(data)[:SECTOR]
+    newest = view[1]
+    errors = []
+    for index, (commands, _, error, count, lba_low, lba_mid, lba_high, device, status, _, state, hours) in enumerate(
+            ERROR_ENTRY.iter_unpack(view[2:2 + ERROR_ENTRIES * ERROR_ENTRY.size])):
+        if not (error or status or hours):
+            continue
+        errors.append({
+            "index": index + 1,
+            "error": error,
+            "status": status,
+            "count": count,
+            "lba": ((device & 0x0F) << 24) | (lba_high << 16) | (lba_mid << 8) | lba_low,
+            "state": state,
+            "power_on_hours": hours,
+            "commands": [
+                {"command": command, "features": features, "count": sectors,
+                 "lba": (lba_h << 16) | (lba_m << 8) | lba_l, "timestamp_ms": timestamp}
+                for _, features, sectors, lba_l, lba_m, lba_h, _, command, timestamp in ERROR_COMMAND.iter_unpack(commands)
+                if command
+            ],
+        })
+    if newest:
+        errors.sort(key=lambda entry: (newest - entry["index"]) % ERROR_ENTRIES)
+    return {
+        "error_count": struct.unpack_from("<H", view, 452)[0],
+        "errors": errors,
+        "checksum_ok": checksum_ok(view),
+    }
+
+
+def parse_statistics_page(data) -> dict:
+    """
+    One device statistics page: each qword after the header holds flags in bits 63:56
+    and the value below. Unsupported and invalid statistics are left out.
+    """
+    qwords = struct.iter_unpack("<Q", memoryview(data)[:SECTOR])
+    header = next(qwords)[0]
+    page = (header >> 16) & 0xFF
+    names = DEVICE_STATISTICS.get(page, ())
+    stats: dict[str, Union[int, bool]] = {}
+    for index, (qword,) in enumerate(qwords):
+        if not qword & STAT_SUPPORTED or not qword & STAT_VALID:
+            continue
+        name = names[index] if index < len(names) else f"statistic_{(index + 1) * 8}"
+        value = qword & 0xFFFFFFFFFFFF
+        if page == TEMPERATURE_PAGE and not name.startswith("time_in"):
+            # Temperatures are signed bytes in degrees Celsius
+            value = struct.unpack("<b", bytes((qword & 0xFF,)))[0]
+        stats[name] = value
+        if qword & STAT_MONITORED_CONDITION_MET:
+            stats[f"{name}_condition_met"] = True
+    return {"page": page, "statistics": stats}
+
+
+def supported_statistics_pages(data) -> list[int]:
+    """
+    Page 0 of the device statistics log: byte 8 is the entry count, the page numbers follow.
+    """
+    view = memoryview(data)
+    count = view[8]
+    return [page for page in view[9:9 + count] if page]
+
+
+class smart_session:
+    """
+    One drive, one open transport. read_all issues the SMART and log reads as a single
+    batch (transport.execute_batch, which the co-process transport pipelines), then one
+    READ LOG EXT for every supported device statistics page. A log the drive refuses is
+    reported as {'error': message} in its place.
+    """
+    def __init__(self, device: str, transport: Union[str, sg_transport] = "sg_io"):
+        self.device: str = device
+        self.transport: sg_transport = open_transport(device, transport)
+        # One buffer for the whole session, carved into per-command sectors
+        self._buffer: memoryview = memoryview(bytearray(SECTOR * 8))
+
+    def __enter__(self) -> "smart_session":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.transport.close()
+
+    def _sector(self, index: int) -> memoryview:
+        return self._buffer[index * SECTOR:(index + 1) * SECTOR]
+
+    def read_all(self) -> dict:
+        commands = [
+            scsi_cdb.ata_smart_read_data(),
+            scsi_cdb.ata_smart_read_thresholds(),
+            scsi_cdb.ata_smart_read_log(SMART_LOG_SELF_TEST),
+            scsi_cdb.ata_smart_read_log(SMART_LOG_SUMMARY_ERROR),
+            scsi_cdb.ata_read_log_ext(GPL_DEVICE_STATISTICS, page=0),
+        ]
+        results = self.transport.execute_batch([(cdb, self._sector(i)) for i, cdb in enumerate(commands)])
+        data, thresholds, self_tests, errors, statistics = (
+            result if isinstance(result, scsi_command_error) else self._sector(i)[:result]
+            for i, result in enumerate(results)
+        )
+
+        report: dict = {"device": self.device}
+        if isinstance(data, scsi_command_error):
+            report["smart"] = {"error": str(data)}
+        else:
+            report["smart"] = parse_smart_data(data, None if isinstance(thresholds, scsi_command_error) else thresholds)
+        report["self_test_log"] = ({"error": str(self_tests)} if isinstance(self_tests, scsi_command_error)
+                                   else parse_self_test_log(self_tests))
+        report["error_log"] = ({"error": str(errors)} if isinstance(errors, scsi_command_error)
+                               else parse_error_log(errors))
+        if isinstance(statistics, scsi_command_error):
+            report["device_statistics"] = {"error": str(statistics)}
+        else:
+            report["device_statistics"] = self._read_statistics(supported_statistics_pages(statistics))
+        return report
+
+    def _read_statistics(self, pages: list[int]) -> dict:
+        """
+        Reads pages 1 up to the highest supported page with one READ LOG EXT.
+        """
+        wanted = [page for page in pages if page]
+        if not wanted:
+            return {}
+        last = max(wanted)
+        buffer = self._buffer if last <= len(self._buffer) // SECTOR else memoryview(bytearray(last * SECTOR))
+        try:
+            received = self.transport.execute(scsi_cdb.ata_read_log_ext(GPL_DEVICE_STATISTICS, page=1, pages=last),
+                                              buffer[:last * SECTOR])
+        except scsi_command_error as e:
+            return {"error": str(e)}
+        statistics: dict = {}
+        for page in wanted:
+            if page * SECTOR <= received:
+                parsed = parse_statistics_page(buffer[(page - 1) * SECTOR:page * SECTOR])
+                statistics[page] = parsed["statistics"]
+        return statistics
+
+
+def read_device_smart(device: str, transport: str = "sg_io") -> dict:
+    with smart_session(device, transport) as session:
+        return session.read_all()
+
+
+def read_fleet_smart(devices: list[str], max_workers: int = 16, transport: str = "sg_io") -> dict[str, dict]:
+    """
+    Reads SMART from many devices at once, see scsi_tools.read_fleet.
+    """
+    return read_fleet(devices, read_device_smart, max_workers, transport)
@@ -0,0 +1,55 @@
+import mmap
+from contextlib import contextmanager
+from typing import Iterator
+
+PAGE_SIZE = mmap.PAGESIZE
+MIN_BUFFER = 512
+
+
+class buffer_pool:
+    """
+    Reusable, page-aligned data buffers for SCSI commands on one device.
+    Buffers come from anonymous mmaps, so they are aligned for DMA and O_DIRECT,
+    and are grouped by power-of-two size class. A buffer is only allocated the
+    first time its size class is needed; after that acquire/release just move it
+    between free lists, so steady-state command loops allocate nothing.
+    """
+    def __init__(self):
+        self._free: dict[int, list[mmap.mmap]] = {}
+        self.allocated: int = 0
+
+    @staticmethod
+    def _size_class(size: int) -> int:
+        size_class = MIN_BUFFER
+        while size_class < size:
+            size_class <<= 1
+        return size_class
+
+    def acquire(self, size: int) -> memoryview:
+        """
+        Returns a writable view of exactly size bytes backed by a pooled buffer.
+        The contents are whatever the previous user left there.
+        """
+        size_class = self._size_class(size)
+        free = self._free.setdefault(size_class, [])
+        if free:
+            buf = free.pop()
+        else:
+            buf = mmap.mmap(-1, size_class)
+            self.allocated += size_class
+        return memoryview(buf)[:size]
+
+    def release(self, view: memoryview) -> None:
+        """
+        Hands a view from acquire() back to the pool. The view must not be used afterwards.
+        """
+        buf = view.obj
+        self._free.setdefault(len(buf), []).append(buf)
+
+    @contextmanager
+    def borrow(self, size: int) -> Iterator[memoryview]:
+        view = self.acquire(size)
+        try:
+            yield view
+        finally:
+            self.release(view)
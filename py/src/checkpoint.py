@@ -0,0 +1,156 @@
+import json
+import os
+import time
+from typing import Optional
+
+CHECKPOINT_VERSION = 1
+DEFAULT_INTERVAL = 30.0
+
+
+class checkpoint_mismatch(RuntimeError):
+    """
+    Raised when a journal is resumed against a drive that is not the one it was written for.
+    """
+
+
+class scan_journal:
+    """
+    On-disk record of which LBA ranges of one drive have been verified, so a long
+    scan can be resumed after an interrupt instead of starting again from LBA 0.
+    The drive is identified by serial number, capacity (blocks and block size) and, when
+    it reports one, its WWID (the logical unit's VPD 0x83 designator).
+    Verified ranges are kept merged as [start, end) pairs. The file is rewritten
+    atomically at most every interval seconds, and whenever save() or finish() is called.
+    """
+    def __init__(self, path: str, device: str, serial: str, blocks: int, block_size: int,
+                 interval: float = DEFAULT_INTERVAL, wwid: Optional[str] = None):
+        self.path: str = path
+        self.device: str = device
+        self.serial: str = serial
+        self.wwid: Optional[str] = wwid
+        self.blocks: int = blocks
+        self.block_size: int = block_size
+        self.interval: float = interval
+        self.ranges: list[list[int]] = []
+        self.state: str = "running"
+        self.started: float = time.time()
+        self._last_save: float = time.monotonic()
+
+    @classmethod
+    def load(cls, path: str, interval: float = DEFAULT_INTERVAL) -> "scan_journal":
+        """
+        Reads a journal back. Raises OSError or ValueError if the file is missing or unreadable.
+        """
+        with open(path, "r") as f:
+            data = json.load(f)
+        if data.get("version") != CHECKPOINT_VERSION:
+            raise ValueError(f"{path} is not a version {CHECKPOINT_VERSION} scan journal")
+        journal = cls(path, data["device"], data["serial"], data["blocks"], data["block_size"], interval,
+                      data.get("wwid"))
+        journal.ranges = [list(r) for r in data.get("verified", [])]
+        journal.state = data.get("state", "running")
+        journal.started = data.get("started", journal.started)
+        return journal
+
+    def check_identity(self, serial: str, blocks: int, block_size: int, wwid: Optional[str] = None) -> None:
+        """
+        Raises checkpoint_mismatch unless the drive matches the one the journal was written for.
+        The WWID is only compared when both the journal and the drive have one.
+        """
+        expected = (self.serial, self.blocks, self.block_size)
+        found = (serial, blocks, block_size)
+        if expected != found:
+            raise checkpoint_mismatch(
+                f"Journal {self.path} is for serial {self.serial}, {self.blocks} x {self.block_size} bytes; "
+                f"{self.device} is now serial {serial}, {blocks} x {block_size} bytes"
+            )
+        if self.wwid and wwid and self.wwid != wwid:
+            raise checkpoint_mismatch(f"Journal {self.path} is for WWID {self.wwid}; {self.device} is now WWID {wwid}")
+
+    def record(self, lba: int, blocks: int) -> None:
+        """
+        Marks [lba, lba + blocks) verified and saves if the interval has passed.
+        """
+        end = lba + blocks
+        merged: list[list[int]] = []
+        for start, stop in self.ranges:
+            if stop < lba or start > end:
+                merged.append([start, stop])
+            else:
+                lba, end = min(lba, start), max(end, stop)
+        merged.append([lba, end])
+        merged.sort()
+        self.ranges = merged
+        if time.monotonic() - self._last_save >= self.interval:
+            self.save()
+
+    def resume_lba(self) -> int:
+        """
+        The first LBA not covered by the verified range that starts at 0.
+        """
+        if self.ranges and self.ranges[0][0] == 0:
+            return self.ranges[0][1]
+        return 0
+
+    def verified_blocks(self) -> int:
+        return sum(stop - start for start, stop in self.ranges)
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({
+                "version": CHECKPOINT_VERSION,
+                "device": self.device,
+                "serial": self.serial,
+                "wwid": self.wwid,
+                "blocks": self.blocks,
+                "block_size": self.block_size,
+                "state": self.state,
+                "started": self.started,
+                "updated": time.time(),
+                "verified": self.ranges,
+            }, f, indent=1)
+            f.flush()
+            # The journal is only useful if it survives the crash it is there for
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._last_save = time.monotonic()
+
+    def finish(self, state: str) -> None:
+        """
+        Records the final verdict ('pass', 'fail' or 'stopped') and saves immediately.
+        """
+        self.state = state
+        self.save()
+
+
+def default_journal_path(serial: str, unit: str = "") -> str:
+    """
+    The journal file for a drive: its serial number plus unit, the WWID or H:C:T:L that
+    tells apart drives with a blank or duplicated serial.
+    """
+    name = "_".join(part for part in (serial, unit) if part).replace(os.sep, "_") or "unknown"
+    return os.path.join(os.path.expanduser("~"), ".cache", "scsi_testing", "checkpoints", f"{name}.json")
+
+
+def open_journal(path: Optional[str], device: str, serial: str, blocks: int, block_size: int,
+                 resume: bool = False, interval: float = DEFAULT_INTERVAL, wwid: Optional[str] = None,
+                 unit: str = "") -> scan_journal:
+    """
+    Returns the journal for a scan of device. With resume, an existing journal at path is
+    loaded and checked against the drive (raising checkpoint_mismatch if it is a different
+    drive or capacity); a missing journal starts a new scan. Without resume, any existing
+    journal is replaced. path defaults to a file under ~/.cache/scsi_testing named after
+    the serial and unit (see default_journal_path).
+    """
+    path = path or default_journal_path(serial, unit)
+    if resume and os.path.exists(path):
+        journal = scan_journal.load(path, interval)
+        journal.check_identity(serial, blocks, block_size, wwid)
+        journal.device = device
+        journal.state = "running"
+        return journal
+    journal = scan_journal(path, device, serial, blocks, block_size, interval, wwid)
+    journal.save()
+    return journal
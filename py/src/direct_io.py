@@ -0,0 +1,117 @@
+"""
+Zero-copy read paths for surface scans.
+
+sg_mmap_transport  READs land in the sg driver's reserved buffer, which is mmapped into
+                   the process (SG_FLAG_MMAP_IO); the returned view is that mapping.
+direct_reader      O_DIRECT reads of the block device straight into a page-aligned buffer,
+                   bypassing the page cache.
+
+Either way the verifier looks at the data where the kernel put it: nothing is copied per
+chunk and the scanning host's page cache is left alone.
+"""
+import ctypes
+import errno
+import fcntl
+import mmap
+import os
+from typing import Optional
+
+from buffer_pool import buffer_pool
+from sg_transport import (DEFAULT_TIMEOUT_MS, SG_DXFER_FROM_DEV, SG_FLAG_MMAP_IO, SG_GET_RESERVED_SIZE,
+                          SG_SET_RESERVED_SIZE, TRANSPORTS, sg_io_transport)
+
+# "pipeline" reads on a separate thread (read_pipeline.py) so verification overlaps the reads
+READ_MODES = ("sg", "mmap", "direct", "pipeline")
+DEFAULT_RESERVE = 1 << 20
+
+
+class sg_mmap_transport(sg_io_transport):
+    """
+    sg_io_transport whose read_data returns a view of the sg reserved buffer. The driver
+    may grant less than the requested reserve (it is capped by the host's max transfer),
+    so callers size their commands by self.reserved. Longer reads fall back to the
+    ordinary pooled buffer. As with read_data everywhere, the view is only valid until
+    the next command.
+    """
+    name = "sg_mmap"
+    # Always opened read/write (the mapping needs it), so there are no open flags to pass
+    takes_open_flags = False
+
+    def __init__(self, device: str, reserve: int = DEFAULT_RESERVE):
+        # Mapping the reserved buffer read/write needs the device opened read/write
+        super().__init__(device, os.O_RDWR)
+        self._map: Optional[mmap.mmap] = None
+        size = ctypes.c_int(reserve)
+        try:
+            fcntl.ioctl(self.fd, SG_SET_RESERVED_SIZE, size)
+            fcntl.ioctl(self.fd, SG_GET_RESERVED_SIZE, size)
+            self.reserved: int = size.value
+            self._map = mmap.mmap(self.fd, self.reserved, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        except OSError:
+            super().close()
+            raise
+        self._mapped: memoryview = memoryview(self._map)
+
+    def read_data(self, cdb: bytes, length: int, timeout_ms: int = DEFAULT_TIMEOUT_MS) -> memoryview:
+        if length > self.reserved:
+            return super().read_data(cdb, length, timeout_ms)
+        hdr = self._hdr
+        ctypes.memmove(self._cdb, cdb, len(cdb))
+        hdr.cmd_len = len(cdb)
+        hdr.timeout = timeout_ms
+        hdr.dxfer_direction = SG_DXFER_FROM_DEV
+        hdr.dxfer_len = length
+        hdr.dxferp = None
+        hdr.flags = SG_FLAG_MMAP_IO
+        try:
+            received = self._issue(cdb)
+        finally:
+            hdr.flags = 0
+        return self._mapped[:received]
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._mapped.release()
+            self._map.close()
+            self._map = None
+        super().close()
+
+
+class direct_reader:
+    """
+    Reads a block device (or file) with O_DIRECT into one page-aligned buffer of
+    buffer_size bytes. Offsets and lengths must be multiples of the logical block size.
+    """
+    def __init__(self, path: str, buffer_size: int):
+        self.path: str = path
+        self.fd: int = os.open(path, os.O_RDONLY | os.O_DIRECT)
+        self.pool: buffer_pool = buffer_pool()
+        self._buffer: Optional[memoryview] = self.pool.acquire(buffer_size)
+
+    def read(self, offset: int, length: int) -> memoryview:
+        """
+        Returns a view of the buffer holding length bytes from offset, valid until the next read.
+        Raises OSError on a short read.
+        """
+        view = self._buffer[:length]
+        received = os.preadv(self.fd, [view], offset)
+        if received != length:
+            raise OSError(errno.EIO, f"Short read from {self.path} at byte {offset}: {received} of {length}")
+        return view
+
+    def close(self) -> None:
+        if self._buffer is not None:
+            self.pool.release(self._buffer)
+            self._buffer = None
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def __enter__(self) -> "direct_reader":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+TRANSPORTS[sg_mmap_transport.name] = sg_mmap_transport
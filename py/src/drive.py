@@ -1,33 +1,312 @@
 from scsi_class import scsi_device
 from scsi_tools import scan_scsi_devices
+from ata_smart import read_fleet_smart
+from checkpoint import DEFAULT_INTERVAL
+from direct_io import READ_MODES
+from fleet import DEFAULT_PER_HBA, DEFAULT_STALL_TIMEOUT, fleet_blank_check
+from inventory import inventory_cache
+from log_pages import read_fleet_logs
+from metrics import enable as enable_metrics, metrics_exporter
+from sampling import DEFAULT_SAMPLES
+from self_test_runner import SELF_TESTS, self_test_orchestrator
+from sg_coproc import sg_coproc_transport
+from sg_transport import TRANSPORTS
+from surface_hash import DEFAULT_RANGE_BYTES, DEFAULT_WORKERS, surface_hash, surface_hasher
+from surface_map import diff_maps, surface_map
+from verifier import PATTERN_HELP
+from vpd import read_fleet_vpd
+from wipe import DEFAULT_TIMEOUT as DEFAULT_WIPE_TIMEOUT, ERASE_METHODS, wipe_orchestrator
 
+import argparse
+import atexit
+import json
 import sys
 
-def main():
-    if len(sys.argv) != 2:
-        print("Usage: python run_drive_size_check.py /dev/sgX")
+def run_fleet(args: argparse.Namespace, devices: list[str]) -> None:
+    selected = args.devices or devices
+    missing = [device for device in selected if device not in devices]
+    if missing:
+        print(f"[!] Devices not found: {', '.join(missing)}")
+        sys.exit(1)
+
+    if args.provisioning and (args.checkpoint or args.resume):
+        print("[!] --provisioning scans are not journaled, drop --checkpoint/--resume")
+        sys.exit(1)
+    if args.sample_only and not args.sample:
+        args.sample = DEFAULT_SAMPLES
+    print(f"[+] Blank checking {len(selected)} devices, {args.per_hba} at a time per HBA")
+    fleet = fleet_blank_check(selected, per_hba=args.per_hba, queue_depth=args.queue_depth, transport=args.transport,
+                              stall_timeout=args.stall_timeout, chunk_blocks=args.chunk_blocks,
+                              read_mode=args.read_mode, checkpoint=args.checkpoint, resume=args.resume,
+                              checkpoint_interval=args.checkpoint_interval, samples=args.sample,
+                              sample_only=args.sample_only, time_budget=args.time_budget, pattern=args.pattern,
+                              provisioning=args.provisioning)
+    passed = fleet.run()
+    print(fleet.summary())
+    sys.exit(0 if passed else 1)
+
+def run_self_tests(args: argparse.Namespace, devices: list[str]) -> None:
+    selected = args.devices or devices
+    missing = [device for device in selected if device not in devices]
+    if missing:
+        print(f"[!] Devices not found: {', '.join(missing)}")
+        sys.exit(1)
+
+    print(f"[+] Running {args.self_test} self-tests on {len(selected)} devices")
+    orchestrator = self_test_orchestrator(selected, test=args.self_test, transport=args.transport,
+                                          timeout=args.self_test_timeout)
+    passed = orchestrator.run()
+    print(orchestrator.summary())
+    sys.exit(0 if passed else 1)
+
+def run_inventory(args: argparse.Namespace, devices: list[str]) -> None:
+    cache = inventory_cache()
+    for entry in cache.inventory(args.devices or devices, refresh=args.refresh):
+        if "error" in entry:
+            print(f"{entry['device']:<10} ERROR {entry['error']}")
+            continue
+        print(f"{entry['device']:<10} {entry['vendor']:<8} {entry['model']:<16} {entry['revision']:<4} "
+              f"{entry['serial']:<20} {entry['blocks']} x {entry['block_size']} bytes")
+    sys.exit(0)
+
+def run_vpd(args: argparse.Namespace, devices: list[str]) -> None:
+    results = read_fleet_vpd(args.devices or devices, transport=args.transport)
+    # JSON object keys must be strings, so page codes are written as hex
+    printable = {
+        device: {f"0x{page:02x}" if isinstance(page, int) else page: fields for page, fields in pages.items()}
+        for device, pages in results.items()
+    }
+    print(json.dumps(printable, indent=2))
+    sys.exit(0)
+
+def run_logs(args: argparse.Namespace, devices: list[str]) -> None:
+    results = read_fleet_logs(args.devices or devices, transport=args.transport)
+    printable = {
+        device: {f"0x{page:02x}" if isinstance(page, int) else page: fields for page, fields in pages.items()}
+        for device, pages in results.items()
+    }
+    print(json.dumps(printable, indent=2))
+    sys.exit(0)
+
+def run_smart(args: argparse.Namespace, devices: list[str]) -> None:
+    print(json.dumps(read_fleet_smart(args.devices or devices, transport=args.transport), indent=2))
+    sys.exit(0)
+
+def run_surface(args: argparse.Namespace, devices: list[str]) -> None:
+    if len(args.devices) != 1 or args.devices[0] not in devices:
+        print("[!] --surface-map needs exactly one device")
+        sys.exit(1)
+    with scsi_device(args.devices[0], transport=args.transport) as dev:
+        result = dev.surface_scan(chunk_blocks=args.chunk_blocks)
+    result.save(args.surface_map)
+    print(f"[+] Surface map written to {args.surface_map}")
+    sys.exit(0 if not result.regions else 1)
+
+def run_image(args: argparse.Namespace, devices: list[str]) -> None:
+    if len(args.devices) != 1 or args.devices[0] not in devices:
+        print("[!] --image needs exactly one device")
+        sys.exit(1)
+    read_mode, queue_depth = args.read_mode, args.queue_depth
+    if read_mode == "sg" and queue_depth == 1:
+        # Overlap the image writes with the reads unless a queued or zero-copy mode was asked for
+        read_mode, queue_depth = "pipeline", 2
+    with scsi_device(args.devices[0], transport=args.transport) as dev:
+        result = dev.image(args.image, map_path=args.image_map, read_mode=read_mode, queue_depth=queue_depth)
+    sys.exit(0 if result.state == "complete" and not result.unreadable else 1)
+
+def run_surface_hash(args: argparse.Namespace, devices: list[str]) -> None:
+    if len(args.devices) != 1 or args.devices[0] not in devices:
+        print("[!] --surface-hash needs exactly one device")
         sys.exit(1)
+    hasher = surface_hasher(args.devices[0], transport=args.transport, workers=args.hash_workers,
+                            range_bytes=args.hash_range_mib << 20, chunk_blocks=args.chunk_blocks,
+                            read_mode=args.read_mode)
+    result = hasher.run(progress=lambda done, total: print(f"    Hashed {done} / {total} ranges", end="\r"))
+    result.save(args.surface_hash)
+    print("\n" + result.summary())
+    print(f"[+] Surface hash written to {args.surface_hash}")
+    sys.exit(0 if result.complete else 1)
+
+def run_verify_hash(args: argparse.Namespace, devices: list[str]) -> None:
+    if len(args.devices) != 1 or args.devices[0] not in devices:
+        print("[!] --verify-hash needs exactly one device")
+        sys.exit(1)
+    saved = surface_hash.load(args.verify_hash)
+    start, end = 0, saved.blocks
+    if args.lba_range:
+        first, _, last = args.lba_range.partition(":")
+        start, end = int(first), int(last) if last else saved.blocks
+    hasher = surface_hasher(args.devices[0], transport=args.transport, workers=args.hash_workers,
+                            chunk_blocks=args.chunk_blocks, read_mode=args.read_mode)
+    results = hasher.verify_ranges(saved, start, end)
+    for entry in results:
+        if entry["state"] != "match":
+            print(f"[!] LBA {entry['start']}-{entry['end'] - 1}: {entry['state']} {entry.get('error', '')}")
+    matched = sum(entry["state"] == "match" for entry in results)
+    print(f"[{'+' if matched == len(results) else '!'}] {matched} / {len(results)} ranges match root "
+          f"{saved.root.hex()}")
+    sys.exit(0 if matched == len(results) else 1)
+
+def run_wipe(args: argparse.Namespace, devices: list[str]) -> None:
+    # Erasing is never done to "all devices": every drive has to be named
+    if not args.devices:
+        print("[!] --wipe needs the devices to erase listed explicitly")
+        sys.exit(1)
+    missing = [device for device in args.devices if device not in devices]
+    if missing:
+        print(f"[!] Devices not found: {', '.join(missing)}")
+        sys.exit(1)
+    try:
+        orchestrator = wipe_orchestrator(args.devices, method=args.wipe, pattern=args.pattern,
+                                         verify=not args.no_verify, transport=args.transport, per_hba=args.per_hba,
+                                         timeout=args.wipe_timeout, queue_depth=args.queue_depth,
+                                         chunk_blocks=args.chunk_blocks, read_mode=args.read_mode,
+                                         provisioning=args.provisioning)
+    except ValueError as e:
+        print(f"[!] {e}")
+        sys.exit(1)
+    if not args.yes:
+        answer = input(f"[!] This destroys all data on {', '.join(args.devices)}. Type 'erase' to continue: ")
+        if answer.strip() != "erase":
+            print("[!] Not erasing")
+            sys.exit(1)
+    print(f"[+] Erasing {len(args.devices)} devices ({args.wipe}, pattern {args.pattern})")
+    passed = orchestrator.run()
+    print(orchestrator.summary())
+    sys.exit(0 if passed else 1)
+
+def run_diff(args: argparse.Namespace) -> None:
+    old, new = (surface_map.load(path) for path in args.diff_maps)
+    print(json.dumps(diff_maps(old, new), indent=2))
+    sys.exit(0)
+
+def main():
+    parser = argparse.ArgumentParser(description="Query SCSI drives, or blank check a whole shelf with --fleet")
+    parser.add_argument("devices", nargs="*", help="/dev/sgX devices (all devices in --fleet/--self-test/--inventory/--vpd/--logs/--smart mode if omitted)")
+    parser.add_argument("--fleet", action="store_true", help="blank check the devices in parallel")
+    parser.add_argument("--inventory", action="store_true", help="list drive identities from the inventory cache")
+    parser.add_argument("--refresh", action="store_true", help="ignore the inventory cache and query the drives")
+    parser.add_argument("--vpd", action="store_true", help="dump every supported VPD page of the devices as JSON")
+    parser.add_argument("--logs", action="store_true",
+                        help="decode every supported LOG SENSE page of the devices as JSON")
+    parser.add_argument("--smart", action="store_true",
+                        help="dump ATA SMART attributes, logs and device statistics of SATA drives as JSON")
+    parser.add_argument("--surface-map", metavar="PATH",
+                        help="scan the whole device, mapping every non-zero and unreadable region, and save the map")
+    parser.add_argument("--self-test", choices=tuple(SELF_TESTS),
+                        help="run a background self-test on the devices and wait for every result")
+    parser.add_argument("--self-test-timeout", type=float, default=None,
+                        help="seconds before a self-test is aborted (default depends on the test)")
+    parser.add_argument("--wipe", choices=("auto",) + ERASE_METHODS,
+                        help="erase the listed devices on the drives themselves (auto: fastest supported method), "
+                             "then blank check them against --pattern")
+    parser.add_argument("--no-verify", action="store_true", help="with --wipe, skip the blank check after erasing")
+    parser.add_argument("--wipe-timeout", type=float, default=DEFAULT_WIPE_TIMEOUT,
+                        help="seconds an erase may run before the drive is given up on")
+    parser.add_argument("--yes", action="store_true", help="with --wipe, do not ask for confirmation")
+    parser.add_argument("--image", metavar="PATH",
+                        help="copy the whole device into a sparse image file, leaving zero chunks as holes")
+    parser.add_argument("--image-map", metavar="PATH",
+                        help="where --image records unreadable ranges (default PATH.map.json)")
+    parser.add_argument("--surface-hash", metavar="PATH",
+                        help="hash the whole device into a Merkle tree, saved to PATH and PATH.tree")
+    parser.add_argument("--verify-hash", metavar="PATH",
+                        help="re-read the device and check it against a saved surface hash")
+    parser.add_argument("--lba-range", metavar="START:END",
+                        help="with --verify-hash, only re-read the ranges covering these LBAs")
+    parser.add_argument("--hash-workers", type=int, default=DEFAULT_WORKERS,
+                        help="ranges read and hashed in parallel")
+    parser.add_argument("--hash-range-mib", type=int, default=DEFAULT_RANGE_BYTES >> 20,
+                        help="MiB of the device hashed into each Merkle leaf")
+    parser.add_argument("--diff-maps", nargs=2, metavar=("OLD", "NEW"), help="compare two saved surface maps")
+    parser.add_argument("--metrics", metavar="PATH",
+                        help="record every command's latency and export it to PATH (.json for JSON, "
+                             "otherwise a Prometheus textfile)")
+    parser.add_argument("--metrics-interval", type=float, default=15.0, help="seconds between metrics exports")
+    parser.add_argument("--transport", choices=sorted(TRANSPORTS), default="sg_io",
+                        help=f"how commands reach the drives: sg_io (ioctl), sg_raw (fork per command) or "
+                             f"{sg_coproc_transport.name} (the c/scsi_serial --serve co-process)")
+    parser.add_argument("--per-hba", type=int, default=DEFAULT_PER_HBA, help="concurrent drives per host adapter")
+    parser.add_argument("--queue-depth", type=int, default=1, help="READ commands in flight per drive")
+    parser.add_argument("--chunk-blocks", type=int, default=1000,
+                        help="blocks per READ; READ(16) is used automatically above 65535")
+    parser.add_argument("--read-mode", choices=READ_MODES, default="sg",
+                        help="sg: READ through SG_IO, mmap: sg reserved buffer mapped in place, "
+                             "direct: O_DIRECT reads of the block device (no page cache), "
+                             "pipeline: READ through the transport on a reader thread, overlapped with verifying")
+    parser.add_argument("--pattern", default="zero",
+                        help=f"what every block must hold after an erase: {PATTERN_HELP}")
+    parser.add_argument("--provisioning", action="store_true",
+                        help="with --fleet/--wipe, only read the extents a thin-provisioned drive reports as mapped "
+                             "(GET LBA STATUS) and count the rest as zeros when the drive guarantees it")
+    parser.add_argument("--checkpoint", action="store_true",
+                        help="journal verified ranges per drive so an interrupted --fleet run can be resumed")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue each drive from its journal; drives whose serial or capacity changed are refused")
+    parser.add_argument("--checkpoint-interval", type=float, default=DEFAULT_INTERVAL,
+                        help="seconds between journal writes")
+    parser.add_argument("--sample", type=int, default=0, metavar="N",
+                        help="triage each drive with N random regions plus hot spots before the full scan")
+    parser.add_argument("--sample-only", action="store_true", help="stop after sampling, skip the full scan")
+    parser.add_argument("--time-budget", type=float, default=None,
+                        help="seconds each drive may spend on random samples")
+    parser.add_argument("--stall-timeout", type=float, default=DEFAULT_STALL_TIMEOUT,
+                        help="seconds without progress before a drive is marked stalled")
+    args = parser.parse_args()
+
+    if args.diff_maps:
+        run_diff(args)
+    if args.metrics:
+        enable_metrics()
+        atexit.register(metrics_exporter(args.metrics, args.metrics_interval).start().stop)
+
     devices = scan_scsi_devices()
+    if args.fleet:
+        run_fleet(args, devices)
+    if args.self_test:
+        run_self_tests(args, devices)
+    if args.inventory:
+        run_inventory(args, devices)
+    if args.vpd:
+        run_vpd(args, devices)
+    if args.logs:
+        run_logs(args, devices)
+    if args.smart:
+        run_smart(args, devices)
+    if args.surface_map:
+        run_surface(args, devices)
+    if args.wipe:
+        run_wipe(args, devices)
+    if args.image:
+        run_image(args, devices)
+    if args.surface_hash:
+        run_surface_hash(args, devices)
+    if args.verify_hash:
+        run_verify_hash(args, devices)
+
+    if len(args.devices) != 1:
+        parser.print_usage()
+        sys.exit(1)
     print(f"Found SCSI devices: {devices}")
-    device_path = sys.argv[1]
-    
+    device_path = args.devices[0]
+
     if device_path not in devices:
         print(f"[!] Device {device_path} not found.")
         sys.exit(1)
-    
-    dev = scsi_device(device_path)
+
+    dev = scsi_device(device_path, transport=args.transport)
 
     try:
-        total_blocks, block_size = dev.run_sg_raw_read_capacity(device_path)
-        dev.size = total_blocks * block_size
-        dev.block_size = block_size
+        inventory_cache().apply(dev, refresh=args.refresh)
 
         print("\n[+] Device Summary:")
         print(dev)
 
     except Exception as e:
-        print(f"[!] Failed to query drive size: {e}")
+        print(f"[!] Failed to query drive: {e}")
         sys.exit(1)
+    finally:
+        dev.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,232 @@
+import sys
+import threading
+import time
+from typing import Optional
+
+from checkpoint import DEFAULT_INTERVAL
+from sampling import HOT_SPOT_BYTES
+from scsi_class import scsi_device
+from scsi_tools import get_scsi_host, scan_scsi_devices
+from verifier import DEFAULT_ZERO_BUFFER, make_verifier
+
+DEFAULT_PER_HBA = 4
+DEFAULT_STALL_TIMEOUT = 120.0  # seconds without progress before a drive is declared stalled
+
+
+class fleet_job:
+    """
+    Progress and outcome of the blank check of one device in a fleet run.
+    state moves from 'queued' to 'running' and ends as 'pass', 'fail', 'error' or 'stalled'.
+    holding_slot is True while the worker thread holds one of its HBA's slots.
+    """
+    def __init__(self, device: str, host: str):
+        self.device: str = device
+        self.host: str = host
+        self.state: str = "queued"
+        self.checked: int = 0
+        self.total: int = 0
+        self.block_size: int = 0
+        self.started: float = 0.0
+        self.last_progress: float = 0.0
+        self.ended: float = 0.0
+        self.message: str = ""
+        self.cancelled: bool = False
+        self.holding_slot: bool = False
+
+    @property
+    def finished(self) -> bool:
+        return self.state in ("pass", "fail", "error", "stalled")
+
+    def status_line(self) -> str:
+        percent = 100.0 * self.checked / self.total if self.total else 0.0
+        elapsed = (self.ended or time.monotonic()) - self.started if self.started else 0.0
+        rate = self.checked * self.block_size / elapsed / 1e6 if elapsed > 0 else 0.0
+        line = (f"{self.device:<10} {self.host:<8} {self.state.upper():<8} [{percent:6.2f}%] "
+                f"{self.checked}/{self.total} blocks {rate:8.1f} MB/s")
+        if self.message:
+            line += f"  {self.message}"
+        return line
+
+
+class fleet_blank_check:
+    """
+    Runs scsi_device.blank_check on many devices at once, one worker thread per device.
+    At most per_hba drives behind the same host adapter are read at the same time.
+    A drive that makes no progress for stall_timeout seconds is marked stalled and
+    cancelled, but keeps its HBA slot until its worker exits: its command may still be
+    reading, and a slot handed on would put per_hba + 1 drives on the adapter. Drives
+    queued behind an adapter whose slots are all held by stalled drives end as 'error'
+    rather than waiting forever.
+    With checkpoint, each drive's progress is journaled under its serial number and WWID;
+    resume continues every drive from its journal.
+    With samples, each drive is first triaged with scsi_device.sample_check; drives that
+    fail sampling are rejected without a full scan, and sample_only stops after triage
+    (an inconclusive sample then counts as a failure).
+    pattern is what every block must hold, as a verifier.make_verifier spec.
+    With provisioning, thin-provisioned drives only have their mapped extents read (see
+    scsi_device.provisioning_check); those scans are not journaled.
+    """
+    def __init__(self, devices: Optional[list[str]] = None, per_hba: int = DEFAULT_PER_HBA,
+                 queue_depth: int = 1, stall_timeout: float = DEFAULT_STALL_TIMEOUT,
+                 transport: str = "sg_io", chunk_blocks: int = 1000, read_mode: str = "sg",
+                 checkpoint: bool = False, resume: bool = False,
+                 checkpoint_interval: float = DEFAULT_INTERVAL, samples: int = 0,
+                 sample_only: bool = False, time_budget: Optional[float] = None, pattern: str = "zero",
+                 provisioning: bool = False):
+        if devices is None:
+            devices = scan_scsi_devices()
+        self.per_hba: int = per_hba
+        self.queue_depth: int = queue_depth
+        self.stall_timeout: float = stall_timeout
+        self.transport: str = transport
+        self.chunk_blocks: int = chunk_blocks
+        self.read_mode: str = read_mode
+        # Resuming implies journaling the rest of the scan
+        self.checkpoint: bool = checkpoint or resume
+        self.resume: bool = resume
+        self.checkpoint_interval: float = checkpoint_interval
+        self.samples: int = samples
+        self.sample_only: bool = sample_only
+        self.time_budget: Optional[float] = time_budget
+        self.pattern: str = pattern
+        self.provisioning: bool = provisioning
+        make_verifier(pattern)  # reject a bad spec before any drive is touched
+        self.jobs: list[fleet_job] = [fleet_job(device, get_scsi_host(device)) for device in devices]
+        self._lock = threading.Lock()
+        self._host_slots: dict[str, threading.BoundedSemaphore] = {
+            job.host: threading.BoundedSemaphore(per_hba) for job in self.jobs
+        }
+
+    def _finish(self, job: fleet_job, state: str, message: str) -> None:
+        with self._lock:
+            # A stalled drive keeps that verdict even if its command eventually returns
+            if job.state == "stalled":
+                return
+            job.state = state
+            job.message = message
+            job.ended = time.monotonic()
+
+    def _progress(self, job: fleet_job, checked: int, total: int) -> bool:
+        job.checked = checked
+        job.total = total
+        job.last_progress = time.monotonic()
+        return not job.cancelled
+
+    def _worker(self, job: fleet_job) -> None:
+        slots = self._host_slots[job.host]
+        slots.acquire()
+        try:
+            with self._lock:
+                job.holding_slot = True
+                # Given up on while it waited behind stalled drives
+                if job.finished:
+                    return
+                job.state = "running"
+                job.started = job.last_progress = time.monotonic()
+            self._check(job)
+        finally:
+            with self._lock:
+                job.holding_slot = False
+            slots.release()
+
+    def _check(self, job: fleet_job) -> None:
+        dev = scsi_device(job.device, transport=self.transport)
+        try:
+            dev.read_capacity()
+            job.total = dev.no_blocks
+            job.block_size = dev.block_size
+            if self.samples:
+                job.message = "sampling"
+                report = dev.sample_check(self.samples, self.time_budget,
+                                          progress=lambda done, total: self._progress(job, job.checked, job.total),
+                                          verifier=make_verifier(self.pattern, HOT_SPOT_BYTES))
+                # A drive the sample could say nothing about still gets its full scan
+                if (not report and not report.inconclusive) or self.sample_only:
+                    self._finish(job, "pass" if report else "fail", str(report))
+                    return
+                job.message = ""
+            verifier = make_verifier(self.pattern, min(self.chunk_blocks * job.block_size, DEFAULT_ZERO_BUFFER))
+            if self.provisioning:
+                job.last_progress = time.monotonic()
+                report = dev.provisioning_check(queue_depth=self.queue_depth, chunk_blocks=self.chunk_blocks,
+                                                read_mode=self.read_mode, verifier=verifier,
+                                                progress=lambda checked, total: self._progress(job, checked, total))
+                self._finish(job, "pass" if report else "fail", str(report))
+                return
+            journal = None
+            if self.checkpoint:
+                journal = dev.open_journal(resume=self.resume, interval=self.checkpoint_interval)
+                job.checked = journal.resume_lba()
+            job.last_progress = time.monotonic()
+            if dev.blank_check(queue_depth=self.queue_depth, chunk_blocks=self.chunk_blocks,
+                               read_mode=self.read_mode, journal=journal,
+                               progress=lambda checked, total: self._progress(job, checked, total),
+                               verifier=verifier):
+                self._finish(job, "pass", "")
+            else:
+                self._finish(job, "fail", dev.errors[-1] if dev.errors else "")
+        except Exception as e:
+            self._finish(job, "error", str(e))
+        finally:
+            dev.close()
+
+    def _check_stalls(self) -> None:
+        now = time.monotonic()
+        for job in self.jobs:
+            with self._lock:
+                if job.state != "running" or now - job.last_progress <= self.stall_timeout:
+                    continue
+                job.state = "stalled"
+                job.ended = now
+                job.message = f"no progress for {self.stall_timeout:.0f}s at block {job.checked}"
+                job.cancelled = True
+        for job in self.jobs:
+            with self._lock:
+                if job.state != "queued":
+                    continue
+                holders = [other for other in self.jobs if other.host == job.host and other.holding_slot]
+                if len(holders) < self.per_hba or any(other.state != "stalled" for other in holders):
+                    continue
+                job.state = "error"
+                job.ended = now
+                job.message = f"every {job.host} slot is held by a stalled drive"
+
+    def _render(self, first: bool) -> None:
+        lines = [job.status_line() for job in self.jobs]
+        if not first:
+            sys.stdout.write(f"\x1b[{len(lines)}A")
+        for line in lines:
+            sys.stdout.write(f"\x1b[2K{line}\n")
+        sys.stdout.flush()
+
+    def run(self, refresh: float = 0.5, live: bool = True) -> bool:
+        """
+        Checks every device and returns True only if all of them passed.
+        With live set, one status line per device is redrawn every refresh seconds.
+        """
+        for job in self.jobs:
+            # Daemon threads: a drive stuck inside an ioctl must not keep the process alive
+            threading.Thread(target=self._worker, args=(job,), name=f"blank-{job.device}", daemon=True).start()
+
+        first = True
+        while True:
+            self._check_stalls()
+            if live:
+                self._render(first)
+                first = False
+            if all(job.finished for job in self.jobs):
+                break
+            time.sleep(refresh)
+
+        return all(job.state == "pass" for job in self.jobs)
+
+    def summary(self) -> str:
+        counts: dict[str, int] = {}
+        lines = ["[+] Fleet blank check summary:"]
+        for job in self.jobs:
+            counts[job.state] = counts.get(job.state, 0) + 1
+            detail = f" - {job.message}" if job.message else ""
+            lines.append(f"    {job.device:<10} {job.host:<8} {job.state.upper()}{detail}")
+        totals = ", ".join(f"{count} {state}" for state, count in sorted(counts.items()))
+        lines.append(f"    {len(self.jobs)} devices: {totals}")
+        return "\n".join(lines)
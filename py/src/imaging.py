@@ -0,0 +1,142 @@
+"""
+Sparse device imaging.
+
+image_map is the record of one imaging run: how far the image got, how much was
+written and how much was left as holes, and every range that could not be read. It is
+saved as JSON next to the image, atomically and at most every interval seconds while the
+run goes on, so an interrupted run still says what the image holds.
+
+The image itself is sized to the device up front and written with pwrite at each
+chunk's offset. All-zero chunks are never written, so they stay holes in the file and a
+mostly empty drive gives a small sparse image; unreadable blocks stay holes too and are
+listed in the map.
+"""
+import json
+import os
+import time
+from typing import Optional
+
+from checkpoint import DEFAULT_INTERVAL
+
+IMAGE_MAP_VERSION = 1
+IMAGE_CHUNK_BYTES = 4 << 20   # 4 MiB READs: large enough to stream, small enough to retry
+MAP_SUFFIX = ".map.json"
+
+
+def format_eta(seconds: float) -> str:
+    if seconds < 0 or seconds != seconds or seconds == float("inf"):
+        return "--:--:--"
+    seconds = int(seconds)
+    return f"{seconds // 3600:d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+class image_map:
+    """
+    Progress and bad ranges of imaging device into image. unreadable holds merged
+    [start, end) LBA ranges; imaged_blocks is how far the run got, readable or not.
+    """
+    def __init__(self, path: str, device: str, image: str, blocks: int, block_size: int,
+                 serial: Optional[str] = None, interval: float = DEFAULT_INTERVAL):
+        self.path: str = path
+        self.device: str = device
+        self.image: str = image
+        self.serial: Optional[str] = serial
+        self.blocks: int = blocks
+        self.block_size: int = block_size
+        self.interval: float = interval
+        self.imaged_blocks: int = 0
+        self.written_bytes: int = 0
+        self.hole_bytes: int = 0
+        self.unreadable: list[list[int]] = []
+        self.state: str = "running"
+        self.started: float = time.time()
+        self.elapsed: float = 0.0
+        self._last_save: float = time.monotonic()
+
+    def add_unreadable(self, start: int, end: int) -> None:
+        if self.unreadable and self.unreadable[-1][1] >= start:
+            self.unreadable[-1][1] = max(self.unreadable[-1][1], end)
+        else:
+            self.unreadable.append([start, end])
+
+    @property
+    def unreadable_blocks(self) -> int:
+        return sum(end - start for start, end in self.unreadable)
+
+    def advance(self, end_lba: int) -> None:
+        """
+        Records that everything below end_lba has been handled and saves if the interval has passed.
+        """
+        self.imaged_blocks = end_lba
+        if time.monotonic() - self._last_save >= self.interval:
+            self.save()
+
+    def rate(self) -> float:
+        """
+        Bytes per second imaged so far.
+        """
+        return self.imaged_blocks * self.block_size / self.elapsed if self.elapsed > 0 else 0.0
+
+    def progress_line(self) -> str:
+        rate = self.rate()
+        remaining = (self.blocks - self.imaged_blocks) * self.block_size
+        eta = format_eta(remaining / rate) if rate > 0 else format_eta(-1)
+        return (f"    Imaged {self.imaged_blocks * self.block_size / 1e9:.2f} / {self.blocks * self.block_size / 1e9:.2f} GB, "
+                f"{rate / 1e6:.1f} MB/s, ETA {eta}, {self.unreadable_blocks} unreadable blocks")
+
+    def summary(self) -> str:
+        lines = [
+            f"[+] Image of {self.device} in {self.image}: {self.imaged_blocks}/{self.blocks} blocks in "
+            f"{self.elapsed:.1f}s ({self.rate() / 1e6:.1f} MB/s), {self.state}",
+            f"    Written: {self.written_bytes} bytes, left as holes: {self.hole_bytes} bytes",
+            f"    Unreadable: {self.unreadable_blocks} blocks, {len(self.unreadable)} ranges (map {self.path})",
+        ]
+        for start, end in self.unreadable[:20]:
+            lines.append(f"      unreadable LBA {start}-{end - 1} ({(end - start) * self.block_size} bytes)")
+        if len(self.unreadable) > 20:
+            lines.append(f"      ... {len(self.unreadable) - 20} more ranges")
+        return "\n".join(lines)
+
+    def to_dict(self) -> dict:
+        return {
+            "version": IMAGE_MAP_VERSION,
+            "device": self.device,
+            "serial": self.serial,
+            "image": self.image,
+            "blocks": self.blocks,
+            "block_size": self.block_size,
+            "state": self.state,
+            "imaged_blocks": self.imaged_blocks,
+            "written_bytes": self.written_bytes,
+            "hole_bytes": self.hole_bytes,
+            "unreadable": self.unreadable,
+            "started": self.started,
+            "elapsed": self.elapsed,
+        }
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.to_dict(), f, indent=1)
+        os.replace(tmp_path, self.path)
+        self._last_save = time.monotonic()
+
+    def finish(self, state: str) -> None:
+        """
+        Records how the run ended ('complete', 'stopped' or 'failed') and saves immediately.
+        """
+        self.state = state
+        self.save()
+
+    @classmethod
+    def load(cls, path: str) -> "image_map":
+        with open(path, "r") as f:
+            data = json.load(f)
+        if data.get("version") != IMAGE_MAP_VERSION:
+            raise ValueError(f"{path} is not a version {IMAGE_MAP_VERSION} image map")
+        result = cls(path, data["device"], data["image"], data["blocks"], data["block_size"], data.get("serial"))
+        for key in ("state", "imaged_blocks", "written_bytes", "hole_bytes", "started", "elapsed"):
+            setattr(result, key, data[key])
+        result.unreadable = [list(r) for r in data["unreadable"]]
+        return result
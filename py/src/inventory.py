@@ -0,0 +1,165 @@
+import glob
+import json
+import os
+import time
+from typing import Optional
+
+from scsi_class import scsi_device
+from scsi_tools import scan_scsi_devices
+
+SG_SYSFS = "/sys/class/scsi_generic"
+UDEV_DATA = "/run/udev/data"
+DEFAULT_CACHE_PATH = os.environ.get(
+    "SCSI_INVENTORY_CACHE",
+    os.path.join(os.path.expanduser("~"), ".cache", "scsi_testing", "inventory.json"),
+)
+CACHE_VERSION = 1
+
+
+def _read_sysfs(path: str) -> str:
+    try:
+        with open(path, "rb") as f:
+            return f.read().decode("ascii", errors="replace").strip()
+    except OSError:
+        return ""
+
+
+def sysfs_identity(device: str) -> tuple[str, str]:
+    """
+    Returns (key, fingerprint) for a /dev/sgX device using only sysfs and the udev database.
+    The key is the scsi_generic entry plus a stable identity (the wwid if the kernel exposes
+    one, otherwise the H:C:T:L address). The fingerprint covers everything that changes
+    when the drive is swapped, reformatted, rescanned or re-processed by udev.
+    """
+    name = os.path.basename(device)
+    base = os.path.join(SG_SYSFS, name)
+    scsi_dev = os.path.join(base, "device")
+    if not os.path.isdir(base):
+        raise RuntimeError(f"{device} is not a SCSI generic device, it cannot be cached")
+    hctl = os.path.basename(os.path.realpath(scsi_dev))
+    wwid = _read_sysfs(os.path.join(scsi_dev, "wwid"))
+    dev_number = _read_sysfs(os.path.join(base, "dev"))
+
+    block_sizes = [_read_sysfs(path) for path in sorted(glob.glob(os.path.join(scsi_dev, "block", "*", "size")))]
+    try:
+        udev_mtime = os.stat(os.path.join(UDEV_DATA, f"c{dev_number}")).st_mtime_ns
+    except OSError:
+        udev_mtime = 0
+
+    fingerprint = "|".join([
+        dev_number,
+        hctl,
+        wwid,
+        _read_sysfs(os.path.join(scsi_dev, "vendor")),
+        _read_sysfs(os.path.join(scsi_dev, "model")),
+        _read_sysfs(os.path.join(scsi_dev, "rev")),
+        ",".join(block_sizes),
+        str(udev_mtime),
+    ])
+    return f"{name}:{wwid or hctl}", fingerprint
+
+
+class inventory_cache:
+    """
+    On-disk cache of drive identity: vendor, model, revision, serial, capacity and block size.
+    Entries are validated against a sysfs/udev fingerprint on every lookup, so a warm
+    lookup only reads a handful of sysfs files and never sends a command to the drive.
+    A missing or stale entry is refreshed by querying the drive once.
+    """
+    def __init__(self, path: str = DEFAULT_CACHE_PATH):
+        self.path: str = path
+        self.entries: dict[str, dict] = {}
+        self.dirty: bool = False
+        self.load()
+
+    def load(self) -> None:
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get("version") == CACHE_VERSION:
+            self.entries = data.get("entries", {})
+
+    def save(self) -> None:
+        if not self.dirty:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"version": CACHE_VERSION, "entries": self.entries}, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+
+    def lookup(self, device: str) -> Optional[dict]:
+        """
+        Returns the cached entry for device if its fingerprint still matches, otherwise None.
+        """
+        key, fingerprint = sysfs_identity(device)
+        entry = self.entries.get(key)
+        if entry is None or entry.get("fingerprint") != fingerprint:
+            return None
+        return entry
+
+    def refresh(self, device: str) -> dict:
+        """
+        Queries the drive for its identity and capacity and stores the result.
+        """
+        key, fingerprint = sysfs_identity(device)
+        with scsi_device(device) as dev:
+            dev.identify()
+        # Drop entries left behind by whatever used to sit on this sg node
+        prefix = f"{os.path.basename(device)}:"
+        for stale in [k for k in self.entries if k.startswith(prefix) and k != key]:
+            del self.entries[stale]
+        entry = {
+            "device": device,
+            "fingerprint": fingerprint,
+            "vendor": dev.vendor,
+            "model": dev.model,
+            "revision": dev.firmware_version,
+            "serial": dev.serial_number,
+            "blocks": dev.no_blocks,
+            "block_size": dev.block_size,
+            "size": dev.size,
+            "updated": time.time(),
+        }
+        self.entries[key] = entry
+        self.dirty = True
+        return entry
+
+    def get(self, device: str, refresh: bool = False) -> dict:
+        entry = None if refresh else self.lookup(device)
+        return entry if entry is not None else self.refresh(device)
+
+    def inventory(self, devices: Optional[list[str]] = None, refresh: bool = False) -> list[dict]:
+        """
+        Returns one entry per device (all scsi_generic devices by default) and writes
+        back any entries that had to be refreshed. Devices that cannot be queried are
+        reported with an 'error' field instead of being left out.
+        """
+        if devices is None:
+            devices = scan_scsi_devices()
+        results: list[dict] = []
+        for device in devices:
+            try:
+                results.append(self.get(device, refresh))
+            except (OSError, RuntimeError) as e:
+                results.append({"device": device, "error": str(e)})
+        self.save()
+        return results
+
+    def apply(self, dev: scsi_device, refresh: bool = False) -> scsi_device:
+        """
+        Fills a scsi_device's identity and capacity fields from the cache.
+        """
+        entry = self.get(dev.device, refresh)
+        self.save()
+        dev.vendor = entry["vendor"]
+        dev.model = entry["model"]
+        dev.firmware_version = entry["revision"]
+        dev.serial_number = entry["serial"]
+        dev.no_blocks = entry["blocks"]
+        dev.block_size = entry["block_size"]
+        dev.size = entry["size"]
+        return dev
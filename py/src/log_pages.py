@@ -0,0 +1,302 @@
+"""
+LOG SENSE page reading and parsing.
+
+Every log page is a 4-byte header (page code, subpage, 2-byte page length) followed by
+parameters, each a 4-byte header (2-byte parameter code, control byte, length) and its
+value. Parameters are handed out as memoryview slices of the page, so decoding a page
+copies nothing until a decoder turns the values into numbers or text.
+
+log_engine reads the supported-pages list (0x00) once, then every listed page.
+"""
+import struct
+from typing import Callable, Iterator, Optional
+
+import scsi_cdb
+from scsi_tools import read_fleet
+from sg_transport import open_transport, scsi_command_error, sg_transport
+
+LOG_SUPPORTED_PAGES = 0x00
+LOG_WRITE_ERRORS = 0x02
+LOG_READ_ERRORS = 0x03
+LOG_VERIFY_ERRORS = 0x05
+LOG_TEMPERATURE = 0x0D
+LOG_START_STOP_CYCLES = 0x0E
+LOG_SELF_TEST_RESULTS = 0x10
+LOG_INFORMATIONAL_EXCEPTIONS = 0x2F
+LOG_HEADER_LEN = 4
+PARAM_HEADER_LEN = 4
+
+FIRST_ALLOC_LEN = 1024     # enough for most pages in a single LOG SENSE
+MAX_ALLOC_LEN = 0xFFFF     # LOG SENSE allocation length is 16 bits
+COMMAND_TIMEOUT_MS = 10000
+
+ERROR_COUNTERS = {
+    0x0000: "corrected_without_delay",
+    0x0001: "corrected_with_delay",
+    0x0002: "total_rewrites_or_rereads",
+    0x0003: "total_corrected",
+    0x0004: "correction_algorithm_invocations",
+    0x0005: "bytes_processed",
+    0x0006: "total_uncorrected",
+}
+TEMPERATURE_UNKNOWN = 0xFF
+
+SELF_TEST_RESULT_IN_PROGRESS = 0xF
+SELF_TEST_RESULTS = {
+    0x0: "completed without error",
+    0x1: "aborted by SEND DIAGNOSTIC",
+    0x2: "aborted by another method",
+    0x3: "could not complete, unknown error",
+    0x4: "failed, segment unknown",
+    0x5: "failed in the first segment",
+    0x6: "failed in the second segment",
+    0x7: "failed in another segment",
+    0xF: "in progress",
+}
+SELF_TEST_CODES = {
+    0x0: "default",
+    0x1: "background short",
+    0x2: "background extended",
+    0x5: "foreground short",
+    0x6: "foreground extended",
+}
+
+
+def page_length(data) -> int:
+    """
+    Total length of the page in data, header included, from the 16-bit length in bytes 2-3.
+    """
+    return LOG_HEADER_LEN + struct.unpack_from(">H", data, 2)[0]
+
+
+def iter_log_parameters(data) -> Iterator[tuple[int, int, memoryview]]:
+    """
+    Yields (parameter code, control byte, value) for each parameter of a page, the value
+    a view into data. A page cut short by the allocation length yields the parameters
+    that arrived complete.
+    """
+    view = memoryview(data)
+    if len(view) < LOG_HEADER_LEN:
+        raise RuntimeError("Invalid LOG SENSE response")
+    end = min(len(view), page_length(view))
+    offset = LOG_HEADER_LEN
+    while offset + PARAM_HEADER_LEN <= end:
+        code, control, length = struct.unpack_from(">HBB", view, offset)
+        value_start = offset + PARAM_HEADER_LEN
+        if value_start + length > end:
+            break
+        yield code, control, view[value_start:value_start + length]
+        offset = value_start + length
+
+
+def parse_log_page(data) -> tuple[int, int, list[tuple[int, int, memoryview]]]:
+    """
+    Splits a log page into (page code, subpage, [(parameter code, control byte, value), ...]).
+    The values are views into data and only valid as long as it is.
+    """
+    params = list(iter_log_parameters(data))
+    subpage = data[1] if data[0] & 0x40 else 0
+    return data[0] & 0x3F, subpage, params
+
+
+def _counter(value) -> int:
+    return int.from_bytes(value, "big")
+
+
+def parse_supported_log_pages(data) -> dict:
+    """
+    Supported Log Pages (0x00): the page codes follow the header directly, one byte each.
+    """
+    end = min(len(data), page_length(data))
+    return {"pages": [code & 0x3F for code in data[LOG_HEADER_LEN:end]]}
+
+
+def parse_error_counters(data) -> dict:
+    """
+    Write (0x02), Read (0x03) and Verify (0x05) Error Counter pages: variable-length
+    big-endian counters keyed by parameter code.
+    """
+    counters: dict = {}
+    for code, _, value in iter_log_parameters(data):
+        counters[ERROR_COUNTERS.get(code, f"parameter_{code:04x}")] = _counter(value)
+    return counters
+
+
+def parse_temperature(data) -> dict:
+    """
+    Temperature (0x0D): current (parameter 0) and reference (parameter 1) in degrees
+    Celsius, None when the drive reports 0xFF for unknown.
+    """
+    result: dict = {}
+    names = {0x0000: "current_temperature", 0x0001: "reference_temperature"}
+    for code, _, value in iter_log_parameters(data):
+        if code in names and len(value) >= 2:
+            result[names[code]] = None if value[1] == TEMPERATURE_UNKNOWN else value[1]
+    return result
+
+
+def parse_start_stop_cycles(data) -> dict:
+    """
+    Start-Stop Cycle Counter (0x0E): manufacture and accounting dates (year and week as
+    ASCII) and lifetime start-stop and load-unload counts.
+    """
+    result: dict = {}
+    dates = {0x0001: "manufacture_date", 0x0002: "accounting_date"}
+    counts = {
+        0x0003: "specified_start_stop_cycles",
+        0x0004: "accumulated_start_stop_cycles",
+        0x0005: "specified_load_unload_cycles",
+        0x0006: "accumulated_load_unload_cycles",
+    }
+    for code, _, value in iter_log_parameters(data):
+        if code in dates and len(value) >= 6:
+            year, week = str(value[:4], "ascii", "ignore").strip(), str(value[4:6], "ascii", "ignore").strip()
+            result[dates[code]] = f"{year}-W{week}" if year and week else None
+        elif code in counts:
+            result[counts[code]] = _counter(value)
+    return result
+
+
+def parse_self_test_entry(number: int, value) -> Optional[dict]:
+    """
+    One Self-Test Results parameter (16 bytes), or None for an unused slot.
+    """
+    if len(value) < 16:
+        return None
+    code = value[0] >> 5
+    result = value[0] & 0x0F
+    segment = value[1]
+    hours, failure_lba = struct.unpack_from(">HQ", value, 2)
+    if value[0] == 0 and segment == 0 and hours == 0 and failure_lba == 0:
+        return None
+    return {
+        "number": number,
+        "code": code,
+        "test": SELF_TEST_CODES.get(code, f"code {code}"),
+        "result": result,
+        "status": SELF_TEST_RESULTS.get(result, f"reserved ({result})"),
+        "segment": segment,
+        "power_on_hours": hours,
+        "failure_lba": None if failure_lba == 0xFFFFFFFFFFFFFFFF else failure_lba,
+        "sense_key": value[12] & 0x0F,
+        "asc": value[13],
+        "ascq": value[14],
+    }
+
+
+def parse_self_test_results(data) -> list[dict]:
+    """
+    The Self-Test Results page (0x10) as a list of entries, newest first.
+    """
+    page, _, params = parse_log_page(data)
+    if page != LOG_SELF_TEST_RESULTS:
+        raise RuntimeError(f"Expected log page 0x{LOG_SELF_TEST_RESULTS:02x}, got 0x{page:02x}")
+    entries = []
+    for code, _, value in sorted(params, key=lambda param: param[0]):
+        entry = parse_self_test_entry(code, value)
+        if entry is not None:
+            entries.append(entry)
+    return entries
+
+
+def parse_informational_exceptions(data) -> dict:
+    """
+    Informational Exceptions (0x2F): parameter 0 carries the ASC/ASCQ of the most recent
+    predicted failure (0/0 when there is none) and the most recent temperature reading.
+    """
+    for code, _, value in iter_log_parameters(data):
+        if code == 0x0000 and len(value) >= 3:
+            result = {
+                "asc": value[0],
+                "ascq": value[1],
+                "failure_predicted": value[0] != 0,
+                "temperature": None if value[2] == TEMPERATURE_UNKNOWN else value[2],
+            }
+            if len(value) >= 4:
+                result["temperature_trip_point"] = None if value[3] == TEMPERATURE_UNKNOWN else value[3]
+            return result
+    return {}
+
+
+def _raw(data) -> dict:
+    return {"parameters": {f"0x{code:04x}": value.hex() for code, _, value in iter_log_parameters(data)}}
+
+
+PAGE_PARSERS: dict[int, Callable] = {
+    LOG_SUPPORTED_PAGES: parse_supported_log_pages,
+    LOG_WRITE_ERRORS: parse_error_counters,
+    LOG_READ_ERRORS: parse_error_counters,
+    LOG_VERIFY_ERRORS: parse_error_counters,
+    LOG_TEMPERATURE: parse_temperature,
+    LOG_START_STOP_CYCLES: parse_start_stop_cycles,
+    LOG_SELF_TEST_RESULTS: lambda data: {"entries": parse_self_test_results(data)},
+    LOG_INFORMATIONAL_EXCEPTIONS: parse_informational_exceptions,
+}
+
+
+class log_engine:
+    """
+    Reads log pages from one device. The supported-pages list (0x00) is fetched once and
+    cached. Every page is first read with FIRST_ALLOC_LEN; only when the page header says
+    it is longer than that is it read a second time with the exact length.
+    """
+    def __init__(self, transport: sg_transport):
+        self.transport: sg_transport = transport
+        self._supported: Optional[list[int]] = None
+
+    def read_page(self, page: int, subpage: int = 0) -> memoryview:
+        """
+        Returns the complete raw page, header included, as a view of the transport's
+        scratch buffer that is only valid until the next command.
+        """
+        data = self.transport.read_data(scsi_cdb.log_sense(page, subpage, alloc_len=FIRST_ALLOC_LEN),
+                                        FIRST_ALLOC_LEN, timeout_ms=COMMAND_TIMEOUT_MS)
+        if len(data) < LOG_HEADER_LEN:
+            raise RuntimeError(f"Log page 0x{page:02x} response too short")
+        if data[0] & 0x3F != page:
+            raise RuntimeError(f"Asked for log page 0x{page:02x}, got 0x{data[0] & 0x3F:02x}")
+        length = min(page_length(data), MAX_ALLOC_LEN)
+        if length > FIRST_ALLOC_LEN:
+            data = self.transport.read_data(scsi_cdb.log_sense(page, subpage, alloc_len=length), length,
+                                            timeout_ms=COMMAND_TIMEOUT_MS)
+        return data[:length]
+
+    def supported_pages(self) -> list[int]:
+        if self._supported is None:
+            self._supported = parse_supported_log_pages(self.read_page(LOG_SUPPORTED_PAGES))["pages"]
+        return self._supported
+
+    def page(self, page: int) -> dict:
+        """
+        Reads and decodes one page. Pages without a decoder come back as their raw parameters.
+        """
+        return PAGE_PARSERS.get(page, _raw)(self.read_page(page))
+
+    def all_pages(self) -> dict[int, dict]:
+        """
+        Reads every page the device lists as supported, in one pass. A page the device
+        then refuses is reported as {'error': message} rather than aborting the rest.
+        """
+        pages: dict[int, dict] = {}
+        for code in self.supported_pages():
+            if code == LOG_SUPPORTED_PAGES:
+                pages[code] = {"pages": list(self.supported_pages())}
+                continue
+            try:
+                pages[code] = self.page(code)
+            except (scsi_command_error, RuntimeError, OSError) as e:
+                pages[code] = {"error": str(e)}
+        return pages
+
+
+def read_device_logs(device: str, transport: str = "sg_io") -> dict[int, dict]:
+    with open_transport(device, transport) as t:
+        return log_engine(t).all_pages()
+
+
+def read_fleet_logs(devices: list[str], max_workers: int = 16, transport: str = "sg_io") -> dict[str, dict]:
+    """
+    Reads all log pages from many devices at once as {device: {page: decoded}}, see
+    scsi_tools.read_fleet.
+    """
+    return read_fleet(devices, read_device_logs, max_workers, transport)
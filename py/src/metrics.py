@@ -0,0 +1,218 @@
+"""
+Per-command latency instrumentation.
+
+Transports check the module-level recorder before every command; while it is None
+(the default) that check is the only cost. enable() installs a metrics_recorder and
+every command's opcode, device, wall time, kernel duration, residual and status is
+written to a fixed-size ring buffer, from which per device/opcode percentiles are
+computed on export. The Prometheus summaries (quantiles, _sum and _count) all cover
+that same window; lifetime totals are exported as separate counters. Exports are a
+Prometheus textfile (for node_exporter's textfile collector) or JSON, both written
+atomically.
+"""
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+DEFAULT_CAPACITY = 65536
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def _percentile(sorted_values: list[float], quantile: float) -> float:
+    """
+    Nearest-rank percentile of an already sorted, non-empty list.
+    """
+    rank = max(0, min(len(sorted_values) - 1, int(quantile * len(sorted_values) + 0.5) - 1))
+    return sorted_values[rank]
+
+
+class metrics_recorder:
+    """
+    Ring buffer of the last capacity commands, each a tuple of (timestamp, device, opcode,
+    wall seconds, kernel duration ms or None, resid, status, host_status, driver_status),
+    plus running totals per (device, opcode) that are never dropped, so exported counters
+    stay monotonic.
+    """
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        self.capacity: int = capacity
+        self._ring: list[Optional[tuple]] = [None] * capacity
+        self._next: int = 0
+        self._lock = threading.Lock()
+        # (device, opcode) -> [commands, errors, total wall seconds]
+        self.totals: dict[tuple[str, int], list] = {}
+
+    def record(self, device: str, opcode: int, wall: float, duration_ms: Optional[int] = None, resid: int = 0,
+               status: int = 0, host_status: int = 0, driver_status: int = 0) -> None:
+        failed = bool(status or host_status or driver_status)
+        entry = (time.time(), device, opcode, wall, duration_ms, resid, status, host_status, driver_status)
+        with self._lock:
+            self._ring[self._next % self.capacity] = entry
+            self._next += 1
+            totals = self.totals.get((device, opcode))
+            if totals is None:
+                totals = self.totals[(device, opcode)] = [0, 0, 0.0]
+            totals[0] += 1
+            totals[1] += failed
+            totals[2] += wall
+
+    def records(self) -> list[tuple]:
+        """
+        The buffered commands, oldest first.
+        """
+        with self._lock:
+            if self._next <= self.capacity:
+                return list(self._ring[:self._next])
+            split = self._next % self.capacity
+            return self._ring[split:] + self._ring[:split]
+
+    def percentiles(self) -> dict[tuple[str, int], dict]:
+        """
+        Per (device, opcode) latency percentiles over the commands still in the ring buffer:
+        wall time and, where the transport reports it, kernel duration, both in milliseconds,
+        each with the count and sum of that window.
+        """
+        walls: dict[tuple[str, int], list[float]] = {}
+        kernel: dict[tuple[str, int], list[float]] = {}
+        for _, device, opcode, wall, duration_ms, *_ in self.records():
+            walls.setdefault((device, opcode), []).append(wall * 1000.0)
+            if duration_ms is not None:
+                kernel.setdefault((device, opcode), []).append(float(duration_ms))
+        stats: dict[tuple[str, int], dict] = {}
+        for key, values in walls.items():
+            values.sort()
+            entry = {"window": len(values), "sum_ms": sum(values), "max_ms": values[-1]}
+            for quantile in QUANTILES:
+                entry[f"p{int(quantile * 100)}_ms"] = _percentile(values, quantile)
+            kernel_values = sorted(kernel.get(key, []))
+            if kernel_values:
+                entry["kernel_window"] = len(kernel_values)
+                entry["kernel_sum_ms"] = sum(kernel_values)
+                for quantile in QUANTILES:
+                    entry[f"kernel_p{int(quantile * 100)}_ms"] = _percentile(kernel_values, quantile)
+            stats[key] = entry
+        return stats
+
+    def to_json(self) -> dict:
+        stats = self.percentiles()
+        with self._lock:
+            totals = {key: list(values) for key, values in self.totals.items()}
+        groups = []
+        for (device, opcode), (commands, errors, wall) in sorted(totals.items()):
+            group = {"device": device, "opcode": f"0x{opcode:02x}", "commands": commands, "errors": errors,
+                     "total_seconds": round(wall, 6)}
+            group.update({k: round(v, 4) if isinstance(v, float) else v
+                          for k, v in stats.get((device, opcode), {}).items()})
+            groups.append(group)
+        return {"generated": time.time(), "capacity": self.capacity, "groups": groups}
+
+    def _summary(self, lines: list[str], name: str, stats: dict[tuple[str, int], dict], prefix: str = "") -> None:
+        """
+        Appends one (device, opcode) labelled summary: quantiles, _sum and _count all taken
+        from the same window of entries in stats.
+        """
+        for (device, opcode), entry in sorted(stats.items()):
+            count = entry.get(f"{prefix}window")
+            if not count:
+                continue
+            labels = f'device="{device}",opcode="0x{opcode:02x}"'
+            for quantile in QUANTILES:
+                value = entry[f"{prefix}p{int(quantile * 100)}_ms"]
+                lines.append(f'{name}{{{labels},quantile="{quantile}"}} {value / 1000.0:.6f}')
+            lines.append(f"{name}_sum{{{labels}}} {entry[f'{prefix}sum_ms'] / 1000.0:.6f}")
+            lines.append(f"{name}_count{{{labels}}} {count}")
+
+    def to_prometheus(self) -> str:
+        stats = self.percentiles()
+        with self._lock:
+            totals = {key: list(values) for key, values in self.totals.items()}
+        lines = [
+            "# HELP scsi_command_latency_seconds SCSI command wall time over the recent command window",
+            "# TYPE scsi_command_latency_seconds summary",
+        ]
+        self._summary(lines, "scsi_command_latency_seconds", stats)
+        lines += [
+            "# HELP scsi_command_kernel_duration_seconds Command duration reported by the sg driver over the "
+            "recent command window",
+            "# TYPE scsi_command_kernel_duration_seconds summary",
+        ]
+        self._summary(lines, "scsi_command_kernel_duration_seconds", stats, "kernel_")
+        lines += [
+            "# HELP scsi_commands_total SCSI commands sent",
+            "# TYPE scsi_commands_total counter",
+        ]
+        for (device, opcode), (commands, errors, wall) in sorted(totals.items()):
+            lines.append(f'scsi_commands_total{{device="{device}",opcode="0x{opcode:02x}"}} {commands}')
+        lines += [
+            "# HELP scsi_command_seconds_total SCSI command wall time",
+            "# TYPE scsi_command_seconds_total counter",
+        ]
+        for (device, opcode), (commands, errors, wall) in sorted(totals.items()):
+            lines.append(f'scsi_command_seconds_total{{device="{device}",opcode="0x{opcode:02x}"}} {wall:.6f}')
+        lines += [
+            "# HELP scsi_command_errors_total SCSI commands that did not complete with GOOD status",
+            "# TYPE scsi_command_errors_total counter",
+        ]
+        for (device, opcode), (commands, errors, wall) in sorted(totals.items()):
+            lines.append(f'scsi_command_errors_total{{device="{device}",opcode="0x{opcode:02x}"}} {errors}')
+        return "\n".join(lines) + "\n"
+
+    def export(self, path: str, fmt: Optional[str] = None) -> None:
+        """
+        Writes the metrics to path as 'prometheus' or 'json'; by default the format
+        follows the extension (.json is JSON, anything else Prometheus text).
+        """
+        if fmt is None:
+            fmt = "json" if path.endswith(".json") else "prometheus"
+        text = json.dumps(self.to_json(), indent=1) if fmt == "json" else self.to_prometheus()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+
+recorder: Optional[metrics_recorder] = None
+
+
+def enable(capacity: int = DEFAULT_CAPACITY) -> metrics_recorder:
+    global recorder
+    if recorder is None or recorder.capacity != capacity:
+        recorder = metrics_recorder(capacity)
+    return recorder
+
+
+def disable() -> None:
+    global recorder
+    recorder = None
+
+
+class metrics_exporter:
+    """
+    Background thread that exports the active recorder every interval seconds,
+    and once more on stop().
+    """
+    def __init__(self, path: str, interval: float = 15.0, fmt: Optional[str] = None):
+        self.path: str = path
+        self.interval: float = interval
+        self.fmt: Optional[str] = fmt
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="metrics-export", daemon=True)
+
+    def start(self) -> "metrics_exporter":
+        self._thread.start()
+        return self
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.export()
+
+    def export(self) -> None:
+        if recorder is not None:
+            recorder.export(self.path, self.fmt)
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.export()
@@ -0,0 +1,89 @@
+"""
+Logical block provisioning: which LBAs of a thin-provisioned device hold data.
+
+A device that sets LBPME in READ CAPACITY (16) tracks which blocks are mapped, and GET
+LBA STATUS reports the status of consecutive extents from any LBA on. When the Logical
+Block Provisioning VPD page (0xB2) also reports LBPRZ 001b, every unmapped block reads
+back as zeros, so a blank check only has to read the mapped extents. provisioning_report
+keeps the two apart: what was verified by reading, and what is zero because the device
+guarantees it.
+"""
+import struct
+from typing import Optional
+
+LBA_STATUS_MAPPED = 0
+LBA_STATUS_DEALLOCATED = 1
+LBA_STATUS_ANCHORED = 2
+LBA_STATUS_MAPPED_OR_UNKNOWN = 3
+LBA_STATUS_UNKNOWN = 4
+# The only statuses that say a block holds no data; anything else, reserved values
+# included, has to be read
+UNMAPPED_STATUSES = (LBA_STATUS_DEALLOCATED, LBA_STATUS_ANCHORED)
+LBPRZ_ZEROS = 1  # LBPRZ 010b only promises the provisioning initialization pattern
+
+
+def parse_lba_status(data) -> list[tuple[int, int, int]]:
+    """
+    (lba, blocks, status) for every descriptor in a GET LBA STATUS reply.
+    """
+    if len(data) < 8:
+        return []
+    end = min(len(data), 4 + struct.unpack_from(">I", data, 0)[0])
+    extents = []
+    for offset in range(8, end - 15, 16):
+        lba, blocks, status = struct.unpack_from(">QIB", data, offset)
+        extents.append((lba, blocks, status & 0x0F))
+    return extents
+
+
+class provisioning_report:
+    """
+    Outcome of a provisioning-aware blank check. verified_blocks were read and matched;
+    zero_blocks were unmapped on a device that reads unmapped blocks as zeros and were
+    not read. When the device cannot guarantee that, provisioned is False, reason says
+    why and every block was read instead.
+    """
+    def __init__(self, device: str, total_blocks: int, block_size: int, lbpme: bool = False, lbprz: int = 0):
+        self.device: str = device
+        self.total_blocks: int = total_blocks
+        self.block_size: int = block_size
+        self.lbpme: bool = lbpme
+        self.lbprz: int = lbprz
+        self.provisioned: bool = False
+        self.reason: str = ""
+        self.verified_blocks: int = 0
+        self.verified_extents: int = 0
+        self.zero_blocks: int = 0
+        self.zero_extents: int = 0
+        self.passed: bool = True
+        self.error: Optional[str] = None
+        self.elapsed: float = 0.0
+
+    @property
+    def covered_blocks(self) -> int:
+        return self.verified_blocks + self.zero_blocks
+
+    def __bool__(self) -> bool:
+        return self.passed
+
+    def __str__(self) -> str:
+        verdict = "PASS" if self.passed else f"FAIL: {self.error}"
+        return (f"{verdict}; {self.verified_blocks * self.block_size} bytes verified by read, "
+                f"{self.zero_blocks * self.block_size} bytes guaranteed zero by provisioning")
+
+    def summary(self) -> str:
+        lines = [
+            f"[+] Provisioning-aware blank check of {self.device}: {'PASS' if self.passed else 'FAIL'} "
+            f"in {self.elapsed:.1f}s",
+            f"    Verified by read: {self.verified_blocks} blocks ({self.verified_blocks * self.block_size} bytes) "
+            f"in {self.verified_extents} extents",
+            f"    Guaranteed zero by provisioning: {self.zero_blocks} blocks "
+            f"({self.zero_blocks * self.block_size} bytes) in {self.zero_extents} extents",
+        ]
+        if not self.provisioned:
+            lines.append(f"    Provisioning not used ({self.reason}), every block was read")
+        if self.covered_blocks < self.total_blocks:
+            lines.append(f"    Not reached: {self.total_blocks - self.covered_blocks} blocks")
+        if self.error is not None:
+            lines.append(f"    {self.error}")
+        return "\n".join(lines)
@@ -0,0 +1,105 @@
+"""
+Overlapped read and verify.
+
+pipelined_reader runs READs on a reader thread into a small ring of reusable buffers and
+hands the filled ones to the consumer (the verifier) in LBA order. The buffers travel
+between two queues: the reader takes an empty buffer from 'free', fills it and puts it
+on 'filled'; the consumer takes it from 'filled' and returns it to 'free' when done. With
+two or more buffers the drive is reading the next chunk while the last one is checked,
+and the SG_IO ioctl drops the GIL, so throughput is that of the slower stage.
+"""
+import queue
+import threading
+import time
+from typing import Iterator
+
+import scsi_cdb
+from buffer_pool import buffer_pool
+from retry import DEFAULT_POLICY, retry_policy
+from sg_transport import check_transfer, sg_transport
+
+DEFAULT_BUFFERS = 2
+
+
+class pipelined_reader:
+    """
+    Reads a device through transport with a reader thread that keeps chunks buffered ahead
+    of the consumer. The transport belongs to the reader thread while read_stream is running.
+    read_busy and consumer_busy accumulate the seconds each stage spent working, so a
+    caller can tell which one limits throughput.
+    """
+    def __init__(self, transport: sg_transport, block_size: int, chunk_blocks: int = 1000,
+                 buffers: int = DEFAULT_BUFFERS, retry: retry_policy = DEFAULT_POLICY):
+        if buffers < 1:
+            raise ValueError("buffers must be at least 1")
+        self.transport: sg_transport = transport
+        self.block_size: int = block_size
+        self.chunk_blocks: int = chunk_blocks
+        self.buffers: int = buffers
+        self.retry: retry_policy = retry
+        self.pool: buffer_pool = buffer_pool()
+        self.read_busy: float = 0.0
+        self.consumer_busy: float = 0.0
+
+    @property
+    def bottleneck(self) -> str:
+        return "read" if self.read_busy >= self.consumer_busy else "verify"
+
+    def _reader(self, start_lba: int, end_lba: int, free: queue.Queue, filled: queue.Queue,
+                stop: threading.Event) -> None:
+        try:
+            for lba in range(start_lba, end_lba, self.chunk_blocks):
+                buffer = free.get()
+                if stop.is_set():
+                    return
+                blocks = min(self.chunk_blocks, end_lba - lba)
+                data = buffer[:blocks * self.block_size]
+                cdb = scsi_cdb.read(lba, blocks)
+                began = time.perf_counter()
+                received = self.retry.run(self.transport.execute, cdb, data)
+                self.read_busy += time.perf_counter() - began
+                check_transfer(self.transport.device, cdb, received, len(data))
+                filled.put((lba, blocks, data, buffer))
+            filled.put(None)
+        except BaseException as e:
+            filled.put(e)
+
+    def read_stream(self, start_lba: int, total_blocks: int) -> Iterator[tuple[int, int, memoryview]]:
+        """
+        Yields (lba, blocks, data) for total_blocks starting at start_lba, in order. data is
+        only valid until the generator is resumed, when its buffer goes back to the reader.
+        A failed READ (after retries) or one that transferred less than its chunk
+        (short_transfer_error) is raised here, once the chunks before it have been yielded.
+        """
+        chunk_bytes = self.chunk_blocks * self.block_size
+        buffers = [self.pool.acquire(chunk_bytes) for _ in range(self.buffers)]
+        free: queue.Queue = queue.Queue()
+        filled: queue.Queue = queue.Queue()
+        for buffer in buffers:
+            free.put(buffer)
+        stop = threading.Event()
+        reader = threading.Thread(target=self._reader, name=f"reader {self.transport.device}", daemon=True,
+                                  args=(start_lba, start_lba + total_blocks, free, filled, stop))
+        reader.start()
+        try:
+            while True:
+                item = filled.get()
+                if item is None:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                lba, blocks, data, buffer = item
+                began = time.perf_counter()
+                try:
+                    yield lba, blocks, data
+                finally:
+                    self.consumer_busy += time.perf_counter() - began
+                    free.put(buffer)
+        finally:
+            # Stop the reader after at most the READ it has in flight, then reclaim the buffers
+            stop.set()
+            free.put(buffers[0])
+            reader.join()
+            for buffer in buffers:
+                self.pool.release(buffer)
+
@@ -0,0 +1,103 @@
+"""
+When to retry a failed SCSI command.
+
+A retry_policy looks at a scsi_command_error and says whether, and after how long, the
+command should be sent again:
+- UNIT ATTENTION (a reset, power on, changed mode page) is reported once and then
+  cleared by the device, so it is retried straight away, up to unit_attention_retries.
+- NOT READY while the drive is becoming ready (04/01, or no ASC known) is retried with
+  backoff until not_ready_timeout seconds have passed since the first failure.
+- ABORTED COMMAND, BUSY / TASK SET FULL status and the transient host statuses the
+  kernel reports for resets and timeouts are retried with backoff, up to retries.
+- Anything else, MEDIUM ERROR in particular, fails at once. scsi_command_error.lba
+  carries the LBA the drive reported so the scanner can record it.
+"""
+import time
+from typing import Callable, Optional, TypeVar
+
+from sense import ABORTED_COMMAND, MEDIUM_ERROR, NOT_READY, UNIT_ATTENTION
+from sg_transport import scsi_command_error
+
+STATUS_BUSY = 0x08
+STATUS_TASK_SET_FULL = 0x28
+BUSY_STATUSES = (STATUS_BUSY, STATUS_TASK_SET_FULL)
+# DID_BUS_BUSY, DID_TIME_OUT, DID_RESET, DID_SOFT_ERROR, DID_IMM_RETRY, DID_REQUEUE
+TRANSIENT_HOST_STATUSES = (0x02, 0x03, 0x08, 0x0B, 0x0C, 0x0D)
+BECOMING_READY = (0x04, 0x01)
+
+T = TypeVar("T")
+
+
+class retry_policy:
+    """
+    retries bounds the backoff retries of ABORTED COMMAND, BUSY and transient host
+    errors; unit_attention_retries the immediate retries of UNIT ATTENTION;
+    not_ready_timeout how long a drive may stay NOT READY. Backoff starts at backoff
+    seconds and doubles per attempt up to max_backoff.
+    """
+    def __init__(self, retries: int = 3, unit_attention_retries: int = 8, not_ready_timeout: float = 120.0,
+                 backoff: float = 0.5, max_backoff: float = 10.0):
+        self.retries: int = retries
+        self.unit_attention_retries: int = unit_attention_retries
+        self.not_ready_timeout: float = not_ready_timeout
+        self.backoff: float = backoff
+        self.max_backoff: float = max_backoff
+
+    def _backoff(self, attempt: int) -> float:
+        return min(self.backoff * (2 ** (attempt - 1)), self.max_backoff)
+
+    def delay(self, error: BaseException, attempt: int, elapsed: float) -> Optional[float]:
+        """
+        Seconds to wait before retry number attempt (1 for the first retry), or None if
+        the command should fail now. elapsed is the time since the first attempt failed.
+        """
+        if not isinstance(error, scsi_command_error):
+            return None
+        key = error.sense_key
+        if key == MEDIUM_ERROR:
+            return None
+        if key == UNIT_ATTENTION:
+            return 0.0 if attempt <= self.unit_attention_retries else None
+        if key == NOT_READY:
+            if error.asc not in (None, BECOMING_READY) or elapsed >= self.not_ready_timeout:
+                return None
+            return min(self._backoff(attempt), self.not_ready_timeout - elapsed)
+        if (key == ABORTED_COMMAND or error.status in BUSY_STATUSES
+                or error.host_status in TRANSIENT_HOST_STATUSES):
+            return self._backoff(attempt) if attempt <= self.retries else None
+        return None
+
+    def run(self, command: Callable[..., T], *args, **kwargs) -> T:
+        """
+        Calls command(*args, **kwargs), retrying it for as long as the policy allows,
+        and returns its result or raises the last error.
+        """
+        attempt = 0
+        first_failure = 0.0
+        while True:
+            try:
+                return command(*args, **kwargs)
+            except scsi_command_error as e:
+                attempt += 1
+                now = time.monotonic()
+                if attempt == 1:
+                    first_failure = now
+                wait = self.delay(e, attempt, now - first_failure)
+                if wait is None:
+                    raise
+                if wait > 0:
+                    time.sleep(wait)
+
+
+DEFAULT_POLICY = retry_policy()
+NO_RETRY = retry_policy(retries=0, unit_attention_retries=0, not_ready_timeout=0.0)
+
+
+def failure_detail(error: BaseException) -> str:
+    """
+    The reported medium error LBA, if any, as text for scan error messages.
+    """
+    lba = getattr(error, "lba", None)
+    if isinstance(error, scsi_command_error) and error.sense_key == MEDIUM_ERROR and lba is not None:
+        return f" (medium error at LBA {lba})"
+    return ""
@@ -0,0 +1,148 @@
+"""
+Sampling blank check: a quick estimate of whether a drive has been wiped, read from a
+stratified random sample of the surface plus the places data is most likely to survive.
+
+If n sampled regions are all zero, then with confidence c the fraction of non-zero
+regions on the drive is below 1 - (1 - c) ** (1 / n). At 95% that is about 3 / n,
+the "rule of three". Sampling can prove a drive dirty, but it can only bound how
+dirty a drive that passes might be.
+"""
+import math
+import random
+from typing import Optional
+
+DEFAULT_SAMPLES = 1000
+DEFAULT_CONFIDENCE = 0.95
+SAMPLE_BYTES = 4096          # one sample region, a typical filesystem block
+HOT_SPOT_BYTES = 64 * 1024   # read around each hot spot
+
+MIB = 1 << 20
+GIB = 1 << 30
+# Byte offsets from the start of the drive where partition tables, boot sectors and
+# filesystem superblocks live: MBR/GPT, the common 1 MiB partition start (NTFS/XFS
+# boot sector, ext superblock at +1024, LVM label), btrfs superblocks at 64 KiB,
+# 64 MiB and 256 GiB, and the first ext4 backup superblocks (4 KiB blocks, groups of 128 MiB).
+HOT_SPOT_OFFSETS = (
+    0,
+    1 * MIB,
+    64 * 1024,
+    1 * MIB + 64 * 1024,
+    64 * MIB,
+    1 * MIB + 64 * MIB,
+    256 * GIB,
+    1 * MIB + 256 * GIB,
+    1 * MIB + 128 * MIB,
+    1 * MIB + 3 * 128 * MIB,
+    1 * MIB + 5 * 128 * MIB,
+    1 * MIB + 7 * 128 * MIB,
+    1 * MIB + 9 * 128 * MIB,
+)
+
+
+def confidence_bound(samples: int, confidence: float = DEFAULT_CONFIDENCE) -> float:
+    """
+    Upper bound on the fraction of non-zero regions when samples regions were all zero.
+    """
+    if samples <= 0:
+        return 1.0
+    return 1.0 - (1.0 - confidence) ** (1.0 / samples)
+
+
+def samples_needed(bound: float, confidence: float = DEFAULT_CONFIDENCE) -> int:
+    """
+    Number of clean samples needed to push the bound below bound at the given confidence.
+    """
+    return math.ceil(math.log(1.0 - confidence) / math.log(1.0 - bound))
+
+
+def hot_spots(total_blocks: int, block_size: int) -> list[tuple[int, int]]:
+    """
+    (lba, blocks) ranges to read before the random sample: HOT_SPOT_OFFSETS that fit on the
+    drive and the last HOT_SPOT_BYTES, where the backup GPT and md/RAID metadata live.
+    """
+    span = max(1, HOT_SPOT_BYTES // block_size)
+    ranges: list[tuple[int, int]] = []
+    for offset in HOT_SPOT_OFFSETS:
+        lba = offset // block_size
+        if lba < total_blocks:
+            ranges.append((lba, min(span, total_blocks - lba)))
+    tail = max(0, total_blocks - span)
+    ranges.append((tail, total_blocks - tail))
+    # Merge overlaps so no block is read twice
+    ranges.sort()
+    merged: list[tuple[int, int]] = []
+    for lba, blocks in ranges:
+        if merged and lba <= merged[-1][0] + merged[-1][1]:
+            start, length = merged[-1]
+            merged[-1] = (start, max(length, lba + blocks - start))
+        else:
+            merged.append((lba, blocks))
+    return merged
+
+
+def stratified_sample(total_blocks: int, block_size: int, samples: int,
+                      seed: Optional[int] = None) -> list[tuple[int, int]]:
+    """
+    Splits the drive into samples equal strata and picks one SAMPLE_BYTES region at a
+    random position inside each. The list is shuffled, so cutting it short under a time
+    budget still leaves a sample spread over the whole drive.
+    """
+    rng = random.Random(seed)
+    span = max(1, SAMPLE_BYTES // block_size)
+    regions = max(1, total_blocks // span)
+    samples = min(samples, regions)
+    picks: list[tuple[int, int]] = []
+    for stratum in range(samples):
+        first = stratum * regions // samples
+        last = (stratum + 1) * regions // samples
+        lba = rng.randrange(first, max(first + 1, last)) * span
+        picks.append((lba, min(span, total_blocks - lba)))
+    rng.shuffle(picks)
+    return picks
+
+
+class sample_report:
+    """
+    Outcome of a sampling blank check. passed is False as soon as one sample holds
+    non-zero data or cannot be read; otherwise bound is the confidence_bound for the
+    random samples actually read. A check that read no random sample at all (the time
+    budget ran out first) proves nothing about the drive: it is inconclusive and does
+    not count as a pass.
+    """
+    def __init__(self, total_blocks: int, block_size: int, confidence: float):
+        self.total_blocks: int = total_blocks
+        self.block_size: int = block_size
+        self.confidence: float = confidence
+        self.hot_spots_read: int = 0
+        self.samples_read: int = 0
+        self.samples_planned: int = 0
+        self.blocks_read: int = 0
+        self.passed: bool = True
+        self.dirty: Optional[tuple[int, int]] = None
+        self.error: Optional[str] = None
+        self.elapsed: float = 0.0
+        self.budget_exhausted: bool = False
+
+    @property
+    def bound(self) -> float:
+        return confidence_bound(self.samples_read, self.confidence)
+
+    @property
+    def inconclusive(self) -> bool:
+        return self.passed and self.samples_read == 0
+
+    def __bool__(self) -> bool:
+        return self.passed and not self.inconclusive
+
+    def __str__(self) -> str:
+        read = (f"{self.hot_spots_read} hot spots and {self.samples_read}/{self.samples_planned} samples "
+                f"({self.blocks_read * self.block_size} bytes) in {self.elapsed:.1f}s")
+        if self.dirty is not None:
+            return f"FAIL: non-zero data at LBA {self.dirty[0]}, byte offset {self.dirty[1]} after {read}"
+        if self.error is not None:
+            return f"FAIL: {self.error} after {read}"
+        budget = ", time budget reached" if self.budget_exhausted else ""
+        if self.inconclusive:
+            return f"INCONCLUSIVE: no random sample read after {read}{budget}"
+        return (f"PASS: {read}{budget}. With {self.confidence:.0%} confidence less than {self.bound:.4%} "
+                f"of the drive's {SAMPLE_BYTES}-byte regions hold data")
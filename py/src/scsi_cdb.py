@@ -0,0 +1,296 @@
+import struct
+from typing import Optional
+
+REQUEST_SENSE = 0x03
+FORMAT_UNIT = 0x04
+INQUIRY = 0x12
+SEND_DIAGNOSTIC = 0x1D
+READ_CAPACITY_10 = 0x25
+READ_10 = 0x28
+UNMAP = 0x42
+SANITIZE = 0x48
+LOG_SENSE = 0x4D
+ATA_PASS_THROUGH_16 = 0x85
+READ_16 = 0x88
+WRITE_SAME_16 = 0x93
+SERVICE_ACTION_IN_16 = 0x9E
+SA_READ_CAPACITY_16 = 0x10
+SA_GET_LBA_STATUS = 0x12
+MAINTENANCE_IN = 0xA3
+SA_REPORT_SUPPORTED_OPCODES = 0x0C
+
+# SANITIZE service actions
+SANITIZE_OVERWRITE = 0x01
+SANITIZE_BLOCK_ERASE = 0x02
+SANITIZE_CRYPTO_ERASE = 0x03
+SANITIZE_EXIT_FAILURE_MODE = 0x1F
+
+# REPORT SUPPORTED OPERATION CODES reporting options and support values
+RSOC_ONE_COMMAND = 0x1
+RSOC_ONE_SERVICE_ACTION = 0x2
+RSOC_NOT_SUPPORTED = 0x1
+RSOC_SUPPORTED = 0x3
+RSOC_SUPPORTED_VENDOR = 0x5
+
+# LOG SENSE page control
+LOG_PC_THRESHOLD = 0
+LOG_PC_CUMULATIVE = 1
+
+# SEND DIAGNOSTIC self-test codes
+SELF_TEST_BACKGROUND_SHORT = 0x1
+SELF_TEST_BACKGROUND_EXTENDED = 0x2
+SELF_TEST_ABORT = 0x4
+SELF_TEST_FOREGROUND_SHORT = 0x5
+SELF_TEST_FOREGROUND_EXTENDED = 0x6
+
+# ATA PASS-THROUGH protocols and fields
+ATA_PROTO_NON_DATA = 3
+ATA_PROTO_PIO_IN = 4
+ATA_PROTO_PIO_OUT = 5
+ATA_TLEN_SECTOR_COUNT = 2
+ATA_SMART = 0xB0
+ATA_READ_LOG_EXT = 0x2F
+SMART_READ_DATA = 0xD0
+SMART_READ_THRESHOLDS = 0xD1
+SMART_READ_LOG = 0xD5
+SMART_LBA_MID = 0x4F
+SMART_LBA_HIGH = 0xC2
+ATA_SECTOR_SIZE = 512
+
+REQUEST_SENSE_REPLY_LEN = 252
+READ_CAPACITY_10_REPLY_LEN = 8
+READ_CAPACITY_16_REPLY_LEN = 32
+LBA_STATUS_DESCRIPTOR_LEN = 16
+GET_LBA_STATUS_REPLY_LEN = 8 + LBA_STATUS_DESCRIPTOR_LEN * 4095
+READ_10_MAX_LBA = 0xFFFFFFFF
+READ_10_MAX_BLOCKS = 0xFFFF
+READ_16_MAX_BLOCKS = 0xFFFFFFFF
+WRITE_SAME_16_MAX_BLOCKS = 0xFFFFFFFF
+UNMAP_DESCRIPTOR_LEN = 16
+UNMAP_MAX_DESCRIPTORS = (0xFFFF - 8) // UNMAP_DESCRIPTOR_LEN
+
+
+def read_capacity10() -> bytes:
+    """
+    READ CAPACITY (10): 25 00 [LBA:4] 00 00 [PMI] 00
+    Reply is 8 bytes: last LBA (4) and block length (4), both big-endian.
+    A last LBA of 0xFFFFFFFF means the device is too big and READ CAPACITY (16) is needed.
+    """
+    return bytes((READ_CAPACITY_10, 0, 0, 0, 0, 0, 0, 0, 0, 0))
+
+
+def read_capacity16(alloc_len: int = READ_CAPACITY_16_REPLY_LEN) -> bytes:
+    """
+    READ CAPACITY (16): 9E 10 [LBA:8] [AllocLen:4] [PMI] 00
+    Reply starts with last LBA (8) and block length (4), both big-endian.
+    """
+    return struct.pack(">BBQIBB", SERVICE_ACTION_IN_16, SA_READ_CAPACITY_16, 0, alloc_len, 0, 0)
+
+
+def get_lba_status(lba: int, alloc_len: int = GET_LBA_STATUS_REPLY_LEN, report_type: int = 0) -> bytes:
+    """
+    GET LBA STATUS: 9E 12 [StartLBA:8] [AllocLen:4] [ReportType] 00
+    Reply is an 8-byte header, then 16-byte descriptors [LBA:8] [Blocks:4] [Status] 00 00 00
+    for consecutive extents from the starting LBA on.
+    """
+    return struct.pack(">BBQIBB", SERVICE_ACTION_IN_16, SA_GET_LBA_STATUS, lba, alloc_len, report_type, 0)
+
+
+def read10(lba: int, num_blocks: int) -> bytes:
+    """
+    READ (10): 28 00 [LBA:4] 00 [TransferLen:2] 00
+    """
+    return struct.pack(">BBIBHB", READ_10, 0, lba, 0, num_blocks, 0)
+
+
+def read16(lba: int, num_blocks: int) -> bytes:
+    """
+    READ (16): 88 00 [LBA:8] [TransferLen:4] 00 00
+    """
+    return struct.pack(">BBQIBB", READ_16, 0, lba, num_blocks, 0, 0)
+
+
+def needs_read16(last_lba: int, num_blocks: int) -> bool:
+    """
+    True if a read ending at last_lba, or one of num_blocks blocks, does not fit in READ (10).
+    """
+    return last_lba > READ_10_MAX_LBA or num_blocks > READ_10_MAX_BLOCKS
+
+
+def read(lba: int, num_blocks: int) -> bytes:
+    """
+    Returns READ (10) when the LBA range and length fit in it and READ (16) otherwise.
+    """
+    if needs_read16(lba + num_blocks - 1, num_blocks):
+        return read16(lba, num_blocks)
+    return read10(lba, num_blocks)
+
+
+def request_sense(alloc_len: int = REQUEST_SENSE_REPLY_LEN, descriptor: bool = False) -> bytes:
+    """
+    REQUEST SENSE: 03 [Desc] 00 00 [AllocLen] 00
+    While a background self-test runs the reply carries its progress in the
+    sense-key specific field.
+    """
+    return bytes((REQUEST_SENSE, 0x01 if descriptor else 0x00, 0, 0, alloc_len & 0xFF, 0))
+
+
+def inquiry(evpd: int = 0, page: int = 0x00, alloc_len: int = 96) -> bytes:
+    """
+    INQUIRY: 12 [EVPD] [Page] [AllocLen:2] 00
+    With evpd=0 this is the standard INQUIRY and page must be 0.
+    """
+    return struct.pack(">BBBHB", INQUIRY, evpd & 0x01, page, alloc_len, 0)
+
+
+def log_sense(page: int, subpage: int = 0, pc: int = LOG_PC_CUMULATIVE, alloc_len: int = 512,
+              param_pointer: int = 0) -> bytes:
+    """
+    LOG SENSE: 4D 00 [PC:2|Page:6] [Subpage] 00 [ParamPointer:2] [AllocLen:2] 00
+    """
+    return struct.pack(">BBBBBHHB", LOG_SENSE, 0, ((pc & 0x03) << 6) | (page & 0x3F), subpage, 0,
+                       param_pointer, alloc_len, 0)
+
+
+def send_diagnostic(self_test_code: int = 0, self_test: bool = False, param_len: int = 0) -> bytes:
+    """
+    SEND DIAGNOSTIC: 1D [SelfTestCode:3|PF|0|SelfTest|DevOffL|UnitOffL] 00 [ParamLen:2] 00
+    self_test=True runs the default self-test; otherwise self_test_code picks one of the
+    SELF_TEST_* codes (background short/extended, abort, foreground ...).
+    """
+    byte1 = ((self_test_code & 0x07) << 5) | (0x04 if self_test else 0)
+    return struct.pack(">BBBHB", SEND_DIAGNOSTIC, byte1, 0, param_len, 0)
+
+
+def report_supported_opcode(opcode: int, service_action: Optional[int] = None, alloc_len: int = 64) -> bytes:
+    """
+    REPORT SUPPORTED OPERATION CODES for one command:
+    A3 0C [Options] [Opcode] [ServiceAction:2] [AllocLen:4] 00 00
+    The reply's byte 1 holds the SUPPORT field (RSOC_*) in bits 2:0.
+    """
+    options = RSOC_ONE_COMMAND if service_action is None else RSOC_ONE_SERVICE_ACTION
+    return struct.pack(">BBBBHIBB", MAINTENANCE_IN, SA_REPORT_SUPPORTED_OPCODES, options, opcode,
+                       service_action or 0, alloc_len, 0, 0)
+
+
+def sanitize(service_action: int, immediate: bool = True, ause: bool = False, param_len: int = 0) -> bytes:
+    """
+    SANITIZE: 48 [Immed|ZNR|AUSE|ServiceAction:5] 00 00 00 00 00 [ParamLen:2] 00
+    With immediate set the command returns at once and the progress of the sanitize is
+    reported by REQUEST SENSE. OVERWRITE takes a parameter list (see sanitize_overwrite_params).
+    """
+    byte1 = (0x80 if immediate else 0) | (0x20 if ause else 0) | (service_action & 0x1F)
+    return struct.pack(">BBIBHB", SANITIZE, byte1, 0, 0, param_len, 0)
+
+
+def sanitize_overwrite_params(pattern: bytes, passes: int = 1, invert: bool = False) -> bytes:
+    """
+    SANITIZE OVERWRITE parameter list: [Invert|Test:2|Count:5] 00 [PatternLen:2] [Pattern]
+    The device repeats pattern to fill every logical block, passes (1-31) times.
+    """
+    return struct.pack(">BBH", (0x80 if invert else 0) | (passes & 0x1F), 0, len(pattern)) + pattern
+
+
+def format_unit(fmtdata: bool = True) -> bytes:
+    """
+    FORMAT UNIT: 04 [FmtPInfo:2|LongList|FmtData|CmpLst|DefectListFormat:3] 00 00 00 00
+    FMTPINFO is left 0, so a drive formatted with protection information loses it.
+    """
+    return bytes((FORMAT_UNIT, 0x10 if fmtdata else 0x00, 0, 0, 0, 0))
+
+
+def format_unit_params(pattern: Optional[bytes] = None, immediate: bool = True) -> bytes:
+    """
+    Short FORMAT UNIT parameter list header [ProtFieldUsage] [FOV|DPRY|DCRT|STPF|IP|Immed] [DefectListLen:2],
+    followed, when pattern is given, by an initialization pattern descriptor
+    [IPModifier] [PatternType=1, repeat] [PatternLen:2] [Pattern] written to every block.
+    """
+    flags = 0x80 | (0x02 if immediate else 0)  # FOV: the flags below are valid
+    descriptor = b""
+    if pattern is not None:
+        flags |= 0x08
+        descriptor = struct.pack(">BBH", 0, 0x01, len(pattern)) + pattern
+    return struct.pack(">BBH", 0, flags, 0) + descriptor
+
+
+def write_same16(lba: int, num_blocks: int, unmap: bool = False, ndob: bool = False) -> bytes:
+    """
+    WRITE SAME (16): 93 [WrProtect:3|Anchor|Unmap|0|0|NDOB] [LBA:8] [Blocks:4] [Group] 00
+    One block of data-out is written to every block of the range; with unmap set the
+    device may deallocate the blocks instead. ndob sends no data and writes zeros.
+    """
+    byte1 = (0x08 if unmap else 0) | (0x01 if ndob else 0)
+    return struct.pack(">BBQIBB", WRITE_SAME_16, byte1, lba, num_blocks, 0, 0)
+
+
+def unmap(param_len: int) -> bytes:
+    """
+    UNMAP: 42 [Anchor] 00 00 00 00 [Group] [ParamLen:2] 00
+    """
+    return struct.pack(">BBIBHB", UNMAP, 0, 0, 0, param_len, 0)
+
+
+def unmap_params(ranges: list[tuple[int, int]]) -> bytes:
+    """
+    UNMAP parameter list: [DataLen:2] [DescriptorDataLen:2] 00 00 00 00, then one 16-byte
+    descriptor [LBA:8] [Blocks:4] 00 00 00 00 per (lba, blocks) range.
+    """
+    descriptors = b"".join(struct.pack(">QI4x", lba, blocks) for lba, blocks in ranges)
+    return struct.pack(">HH4x", len(descriptors) + 6, len(descriptors)) + descriptors
+
+
+def ata_pass_through16(protocol: int, command: int, features: int = 0, count: int = 0, lba: int = 0,
+                       device: int = 0, t_dir_in: bool = True, byt_blok: bool = True,
+                       t_length: int = ATA_TLEN_SECTOR_COUNT, extend: bool = False,
+                       ck_cond: bool = False) -> bytes:
+    """
+    ATA PASS-THROUGH (16) as defined by SAT:
+    85 [Protocol|Ext] [CkCond|TDir|BytBlok|TLength] [Features:2] [Count:2]
+       [LBA 31:24][LBA 7:0][LBA 39:32][LBA 15:8][LBA 47:40][LBA 23:16] [Device] [Command] 00
+    """
+    byte1 = ((protocol & 0x0F) << 1) | (1 if extend else 0)
+    byte2 = ((1 if ck_cond else 0) << 5) | ((1 if t_dir_in else 0) << 3) | \
+            ((1 if byt_blok else 0) << 2) | (t_length & 0x03)
+    return bytes((
+        ATA_PASS_THROUGH_16, byte1, byte2,
+        (features >> 8) & 0xFF, features & 0xFF,
+        (count >> 8) & 0xFF, count & 0xFF,
+        (lba >> 24) & 0xFF, lba & 0xFF,
+        (lba >> 32) & 0xFF, (lba >> 8) & 0xFF,
+        (lba >> 40) & 0xFF, (lba >> 16) & 0xFF,
+        device, command, 0,
+    ))
+
+
+def ata_smart_read_log(log_address: int, sectors: int = 1) -> bytes:
+    """
+    SMART READ LOG (ATA B0h / D5h) wrapped in ATA PASS-THROUGH (16), PIO data-in.
+    """
+    return ata_pass_through16(ATA_PROTO_PIO_IN, ATA_SMART, features=SMART_READ_LOG, count=sectors,
+                              lba=(SMART_LBA_HIGH << 16) | (SMART_LBA_MID << 8) | log_address)
+
+
+def ata_smart_read_data() -> bytes:
+    """
+    SMART READ DATA (ATA B0h / D0h): one 512-byte sector with the attribute table.
+    """
+    return ata_pass_through16(ATA_PROTO_PIO_IN, ATA_SMART, features=SMART_READ_DATA, count=1,
+                              lba=(SMART_LBA_HIGH << 16) | (SMART_LBA_MID << 8))
+
+
+def ata_smart_read_thresholds() -> bytes:
+    """
+    SMART READ ATTRIBUTE THRESHOLDS (ATA B0h / D1h), obsolete in ACS but still answered by most drives.
+    """
+    return ata_pass_through16(ATA_PROTO_PIO_IN, ATA_SMART, features=SMART_READ_THRESHOLDS, count=1,
+                              lba=(SMART_LBA_HIGH << 16) | (SMART_LBA_MID << 8))
+
+
+def ata_read_log_ext(log_address: int, page: int = 0, pages: int = 1) -> bytes:
+    """
+    READ LOG EXT (ATA 2Fh), 48-bit PIO data-in of pages 512-byte pages of a General Purpose
+    Log starting at page. The LBA field carries the log address in bits 7:0 and the page
+    number in bits 15:8 (low byte) and 39:32 (high byte).
+    """
+    lba = (((page >> 8) & 0xFF) << 32) | ((page & 0xFF) << 8) | (log_address & 0xFF)
+    return ata_pass_through16(ATA_PROTO_PIO_IN, ATA_READ_LOG_EXT, count=pages, lba=lba, extend=True)
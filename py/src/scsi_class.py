@@ -1,14 +1,44 @@
-import subprocess
+import os
 import struct
-import re
-from typing import Optional
+import time
+from typing import Callable, Iterable, Iterator, Optional, Union
+
+import scsi_cdb
+from checkpoint import DEFAULT_INTERVAL, open_journal, scan_journal
+from direct_io import READ_MODES, direct_reader, sg_mmap_transport
+from imaging import IMAGE_CHUNK_BYTES, MAP_SUFFIX, image_map
+from read_pipeline import pipelined_reader
+from retry import DEFAULT_POLICY, failure_detail, retry_policy
+from provisioning import LBPRZ_ZEROS, UNMAPPED_STATUSES, parse_lba_status, provisioning_report
+from sampling import (DEFAULT_CONFIDENCE, DEFAULT_SAMPLES, HOT_SPOT_BYTES, hot_spots, sample_report,
+                      stratified_sample)
+from scsi_tools import get_block_device, get_scsi_hctl
+from surface_map import DEFAULT_ZONES, UNREADABLE, surface_map
+from sg_queue import sg_async_queue
+from sg_transport import check_transfer, open_transport, scsi_command_error, short_transfer_error, sg_transport
+from verifier import DEFAULT_ZERO_BUFFER, zero_verifier
+from vpd import VPD_DEVICE_ID, VPD_LOGICAL_BLOCK_PROVISIONING, vpd_engine
+
+STD_INQUIRY_LEN = 96
 
 
 class scsi_device:
-    def __init__(self, device: str):
+    def __init__(self, device: str, transport: Union[str, sg_transport] = "sg_io",
+                 retry: retry_policy = DEFAULT_POLICY):
+        """
+        transport selects how commands reach the device: "sg_io" (default) keeps the
+        device open and uses the SG_IO ioctl, "sg_raw" forks sg_raw for every command.
+        An already constructed transport can also be passed in.
+        retry decides which failed commands are sent again (see retry.py); every
+        command this class sends goes through it.
+        """
         self.device: str = device
+        self.retry: retry_policy = retry
+        self._transport_spec: Union[str, sg_transport] = transport
+        self._transport: Optional[sg_transport] = None
         # device info
         self.serial_number: Optional[str] = None
+        self.wwid: Optional[str] = None
         self.model: Optional[str] = None
         self.vendor: Optional[str] = None
         self.firmware_version: Optional[str] = None
@@ -16,6 +46,9 @@ class scsi_device:
         self.size: int = 0
         self.block_size: int = 0
         self.no_blocks: int = 0
+        # logical block provisioning (READ CAPACITY (16) and VPD 0xB2)
+        self.lbpme: bool = False
+        self.lbprz: int = 0
         # read capacity
         self.errors: list[str] = []
 
@@ -34,23 +67,25 @@ class scsi_device:
         """
         return f"{self.device}, {self.size} bytes, {self.block_size} bytes/block, {self.serial_number}, {self.model}, {self.vendor}, {self.firmware_version}"
 
+    def __enter__(self) -> "scsi_device":
+        return self
 
-    def __parse_hex_from_stderr(self, stderr_text: str) -> bytes:
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    @property
+    def transport(self) -> sg_transport:
         """
-        Extracts and returns the raw binary data from sg_raw's stderr hex dump
-        Example line:
-        Received 8 bytes of data:
-        00     3b 9e 12 af 00 00 02 00
+        The transport is opened on first use so constructing a scsi_device never touches the device.
         """
-        hex_bytes: list[int] = []
-        for line in stderr_text.splitlines():
-            # Match lines with hex bytes: e.g. "00     3b 9e 12 af 00 00 02 00"
-            match = re.match(r'^\s*\d+\s+((?:[0-9a-fA-F]{2}\s+)+)', line)
-            if match:
-                hex_str = match.group(1)
-                hex_bytes += [int(b, 16) for b in hex_str.strip().split()]
-        
-        return bytes(hex_bytes)
+        if self._transport is None:
+            self._transport = open_transport(self.device, self._transport_spec)
+        return self._transport
+
+    def close(self) -> None:
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
 
 
     def read_capacity(self) -> bool:
@@ -62,35 +97,28 @@ class scsi_device:
         The last LBA is the highest addressable block on the device, and the block length
         is the size of each block in bytes. The total number of blocks is calculated as
         last LBA + 1, and the total size of the device is calculated as total_blocks * block_len.
+        Drives over 2 TiB report a saturated last LBA of 0xFFFFFFFF to READ CAPACITY (10),
+        in which case READ CAPACITY (16) is sent to get the real 64-bit value.
         The method also sets the instance variables size, block_size, and no_blocks
         to reflect the device's capacity.
         """
-        cmd: list[str] = ["sg_raw", "-r", "8", self.device, "25", "00", "00", "00", "00", "00", "00", "00", "00", "00"]
+        rdata = bytearray(scsi_cdb.READ_CAPACITY_10_REPLY_LEN)
+        received = self.retry.run(self.transport.execute, scsi_cdb.read_capacity10(), memoryview(rdata))
 
-        data: str = ""  # Ensure 'data' is always defined
-        try:
-            result = subprocess.run(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                check=True,
-                text=True  # <--- MUST be False to get raw bytes
-                )
-            data = result.stderr
-
-            if len(data) < 8:
-                raise RuntimeError("Invalid READ CAPACITY response")
-
-        except subprocess.CalledProcessError as e:
-            print(f"Command failed: {e}")
-            print(e.stderr.decode())
+        if received < scsi_cdb.READ_CAPACITY_10_REPLY_LEN:
+            raise RuntimeError("Invalid READ CAPACITY response")
 
-        rdata = self.__parse_hex_from_stderr(data)
+        last_lba, block_len = struct.unpack(">II", rdata)
 
-        if len(rdata) < 8:
-            raise RuntimeError("Failed to parse 8 bytes from stderr output")
+        if last_lba == scsi_cdb.READ_10_MAX_LBA:
+            rdata = bytearray(scsi_cdb.READ_CAPACITY_16_REPLY_LEN)
+            received = self.retry.run(self.transport.execute, scsi_cdb.read_capacity16(), memoryview(rdata))
+            if received < 12:
+                raise RuntimeError("Invalid READ CAPACITY (16) response")
+            last_lba, block_len = struct.unpack_from(">QI", rdata)
+            if received > 14:
+                self._set_provisioning(rdata[14])
 
-        last_lba, block_len = struct.unpack(">II", rdata[:8])
         total_blocks = last_lba + 1
         self.size = total_blocks * block_len
         self.block_size = block_len
@@ -98,41 +126,675 @@ class scsi_device:
         
         return True
 
-    def __sg_raw_read10(self, device: str, lba: int, num_blocks: int, block_size: int) -> bytes:
-        lba_bytes = struct.pack(">I", lba)
-        blocks_byte = struct.pack(">H", num_blocks)
-
-        # Construct READ(10) CDB: 28 00 [LBA:4] 00 [TransferLen:2] 00
-        cdb = [
-            "28", "00",
-            f"{lba_bytes[0]:02x}", f"{lba_bytes[1]:02x}", f"{lba_bytes[2]:02x}", f"{lba_bytes[3]:02x}",
-            "00",
-            f"{blocks_byte[0]:02x}", f"{blocks_byte[1]:02x}",
-            "00"
-        ]
-
-        read_len = num_blocks * block_size
-        cmd = ["sg_raw", "-r", str(read_len), device] + cdb
-        result = subprocess.run(cmd, capture_output=True, check=True)
-        return result.stdout
-
-    def blank_check(self, device: str, total_blocks: int, block_size: int) -> bool:
-        print(f"[+] Beginning blank check using READ(10)...")
-        CHUNK_BLOCKS = 1000  # Number of blocks to read at a time
-        lba = 0
-        while lba < total_blocks:
-            blocks_to_read = min(CHUNK_BLOCKS, total_blocks - lba)
+    def _set_provisioning(self, flags: int) -> None:
+        self.lbpme = bool(flags & 0x80)
+        self.lbprz = LBPRZ_ZEROS if flags & 0x40 else 0
+
+    def read_provisioning(self) -> bool:
+        """
+        read_provisioning sends READ CAPACITY (16) for the LBPME (provisioning enabled) and
+        LBPRZ (unmapped blocks read as zeros) bits in byte 14, then refines lbprz from the
+        Logical Block Provisioning VPD page (0xB2) when the device has one: its 3-bit LBPRZ
+        field tells zeros (001b) apart from a vendor provisioning pattern (010b).
+        """
+        rdata = bytearray(scsi_cdb.READ_CAPACITY_16_REPLY_LEN)
+        received = self.retry.run(self.transport.execute, scsi_cdb.read_capacity16(), memoryview(rdata))
+        if received < 15:
+            raise RuntimeError("Invalid READ CAPACITY (16) response")
+        self._set_provisioning(rdata[14])
+        engine = vpd_engine(self.transport)
+        try:
+            if VPD_LOGICAL_BLOCK_PROVISIONING in engine.supported_pages():
+                self.lbprz = engine.page(VPD_LOGICAL_BLOCK_PROVISIONING).get("lbprz", self.lbprz)
+        except (scsi_command_error, RuntimeError):
+            pass
+        return True
+
+    def lba_status(self, start_lba: int = 0, end_lba: Optional[int] = None) -> Iterator[tuple[int, int, bool]]:
+        """
+        lba_status yields (lba, blocks, mapped) extents covering [start_lba, end_lba) in order,
+        from as many GET LBA STATUS commands as it takes. Only deallocated (1h) and
+        anchored (2h) blocks are unmapped; mapped, "mapped or unknown", unknown and
+        reserved statuses all count as mapped, and so does a gap between the device's
+        descriptors, so nothing is skipped unless the device says it holds no data.
+        """
+        end_lba = self.no_blocks if end_lba is None else end_lba
+        lba = start_lba
+        while lba < end_lba:
+            extents = parse_lba_status(self.retry.run(self.transport.read_data, scsi_cdb.get_lba_status(lba),
+                                                      scsi_cdb.GET_LBA_STATUS_REPLY_LEN))
+            reached = lba
+            for first, blocks, status in extents:
+                if first > reached:
+                    yield reached, min(first, end_lba) - reached, True
+                    reached = min(first, end_lba)
+                last = min(first + blocks, end_lba)
+                if last > reached:
+                    yield reached, last - reached, status not in UNMAPPED_STATUSES
+                    reached = last
+                if reached >= end_lba:
+                    break
+            if reached == lba:
+                raise RuntimeError(f"GET LBA STATUS reported nothing for LBA {lba}")
+            lba = reached
+
+    def read_inquiry(self) -> bool:
+        """
+        read_inquiry sends a standard INQUIRY and fills in vendor, model and firmware_version
+        from the T10 vendor (bytes 8-15), product (16-31) and revision (32-35) fields.
+        """
+        data = self.retry.run(self.transport.read_data, scsi_cdb.inquiry(0, 0x00, STD_INQUIRY_LEN),
+                              STD_INQUIRY_LEN)
+        if len(data) < 36:
+            raise RuntimeError("Invalid INQUIRY response")
+        self.vendor = str(data[8:16], "ascii", "ignore").strip()
+        self.model = str(data[16:32], "ascii", "ignore").strip()
+        self.firmware_version = str(data[32:36], "ascii", "ignore").strip()
+        return True
+
+    def read_serial(self) -> bool:
+        """
+        read_serial reads the Unit Serial Number VPD page (0x80) into serial_number.
+        """
+        data = self.retry.run(self.transport.read_data, scsi_cdb.inquiry(1, 0x80, STD_INQUIRY_LEN),
+                              STD_INQUIRY_LEN)
+        if len(data) < 4:
+            raise RuntimeError("Invalid serial number VPD response")
+        length = data[3]
+        self.serial_number = str(data[4:4 + length], "ascii", "ignore").strip()
+        return True
+
+    def read_wwid(self) -> bool:
+        """
+        read_wwid sets wwid from the Device Identification VPD page (0x83): the logical
+        unit's NAA, EUI-64 or SCSI name string designator, in that order of preference,
+        written the way Linux writes it to sysfs (naa.HEX, eui.HEX or the name itself).
+        wwid stays None if the device has none of them.
+        """
+        designators = vpd_engine(self.transport).page(VPD_DEVICE_ID).get("designators", [])
+        prefixes = {"NAA": "naa.", "EUI-64": "eui.", "SCSI name string": ""}
+        self.wwid = None
+        for kind, prefix in prefixes.items():
+            for designator in designators:
+                if designator["type"] == kind and designator["association"] == "logical unit" and designator["value"]:
+                    self.wwid = prefix + designator["value"]
+                    return True
+        return True
+
+    def identify(self) -> bool:
+        """
+        identify fills in every identity field: INQUIRY data, serial number and capacity.
+        """
+        return self.read_inquiry() and self.read_serial() and self.read_capacity()
+
+    def open_journal(self, path: Optional[str] = None, resume: bool = False,
+                     interval: float = DEFAULT_INTERVAL) -> scan_journal:
+        """
+        Returns a checkpoint journal for a blank check of this device, reading the serial
+        number, WWID and capacity first if they are not known. The default journal is named
+        after the serial and the WWID, or the H:C:T:L address of a device without one, so
+        drives with blank serial numbers do not share a journal. With resume, an existing
+        journal is continued only if it was written for this serial, WWID and capacity.
+        """
+        if self.serial_number is None:
+            self.read_serial()
+        if self.wwid is None:
             try:
-                data = self.__sg_raw_read10(device, lba, blocks_to_read, block_size)
-                if any(byte != 0x00 for byte in data):
-                    print(f"[!] Non-zero data found at LBA {lba}")
+                self.read_wwid()
+            except (scsi_command_error, RuntimeError):
+                pass
+        if not self.no_blocks:
+            self.read_capacity()
+        unit = self.wwid or get_scsi_hctl(self.device) or os.path.basename(self.device)
+        return open_journal(path, self.device, self.serial_number, self.no_blocks, self.block_size,
+                            resume, interval, self.wwid, unit)
+
+    def read_range(self, start_lba: int, end_lba: int, chunk_blocks: int = 1000, queue_depth: int = 1,
+                   read_mode: str = "sg") -> Iterator[tuple[int, int, memoryview]]:
+        """
+        read_range yields (lba, blocks, data) for the LBAs [start_lba, end_lba) in order,
+        reading the capacity first if it is not known. read_mode and queue_depth pick the
+        read path as for blank_check; data is only valid until the next chunk is read,
+        and a READ that fails or transfers less than the chunk raises.
+        """
+        if not self.block_size:
+            self.read_capacity()
+        yield from self._read_chunks(end_lba, self.block_size, chunk_blocks, queue_depth, read_mode, start_lba)
+
+    def _read_chunks(self, total_blocks: int, block_size: int, chunk_blocks: int,
+                     queue_depth: int, read_mode: str = "sg",
+                     start_lba: int = 0) -> Iterator[tuple[int, int, memoryview]]:
+        """
+        Yields (lba, blocks, data) covering LBAs start_lba up to total_blocks of the device in order.
+        With queue_depth 1 each READ is issued synchronously through the transport; above
+        that an sg_async_queue keeps queue_depth READs in flight on the sg device.
+        read_mode "mmap" reads into the sg reserved buffer mapped into this process, and
+        "direct" reads the block device with O_DIRECT; both hand out views of the kernel's
+        buffer so the data is never copied or cached. "pipeline" reads through the
+        transport on a reader thread, max(2, queue_depth) chunks ahead of the caller.
+        Whatever the path, data always holds all of the chunk: a READ that transfers less
+        raises short_transfer_error (see check_transfer) rather than yield stale bytes.
+        """
+        yield from self._read_extents([(start_lba, total_blocks)], block_size, chunk_blocks, queue_depth, read_mode)
+
+    def _read_extents(self, extents: Iterable[tuple[int, int]], block_size: int, chunk_blocks: int,
+                      queue_depth: int, read_mode: str = "sg") -> Iterator[tuple[int, int, memoryview]]:
+        """
+        _read_chunks over several [start, end) LBA extents, in the order given. extents is
+        only advanced once the extent before it has been read, so it may be a generator.
+        The mmap transport, async queue or O_DIRECT reader is opened once for all of them,
+        so a fragmented thin LUN does not pay that setup per extent.
+        """
+        if read_mode == "mmap":
+            with sg_mmap_transport(self.device, chunk_blocks * block_size) as transport:
+                # The driver may grant a smaller reserved buffer than asked for
+                chunk_blocks = max(1, min(chunk_blocks, transport.reserved // block_size))
+                for start_lba, end_lba in extents:
+                    for lba in range(start_lba, end_lba, chunk_blocks):
+                        blocks = min(chunk_blocks, end_lba - lba)
+                        cdb = scsi_cdb.read(lba, blocks)
+                        data = self.retry.run(transport.read_data, cdb, blocks * block_size)
+                        check_transfer(self.device, cdb, len(data), blocks * block_size)
+                        yield lba, blocks, data
+            return
+
+        if read_mode == "pipeline":
+            reader = pipelined_reader(self.transport, block_size, chunk_blocks, max(2, queue_depth), self.retry)
+            for start_lba, end_lba in extents:
+                yield from reader.read_stream(start_lba, end_lba - start_lba)
+            return
+
+        if read_mode == "direct":
+            with direct_reader(get_block_device(self.device), chunk_blocks * block_size) as reader:
+                for start_lba, end_lba in extents:
+                    for lba in range(start_lba, end_lba, chunk_blocks):
+                        blocks = min(chunk_blocks, end_lba - lba)
+                        yield lba, blocks, reader.read(lba * block_size, blocks * block_size)
+            return
+
+        if queue_depth > 1:
+            with sg_async_queue(self.device, queue_depth, chunk_blocks * block_size, retry=self.retry) as queue:
+                for start_lba, end_lba in extents:
+                    yield from queue.read_stream(start_lba, end_lba - start_lba, chunk_blocks, block_size)
+            return
+
+        buffer = memoryview(bytearray(chunk_blocks * block_size))
+        for start_lba, end_lba in extents:
+            lba = start_lba
+            while lba < end_lba:
+                blocks = min(chunk_blocks, end_lba - lba)
+                data = buffer[:blocks * block_size]
+                cdb = scsi_cdb.read(lba, blocks)
+                check_transfer(self.device, cdb, self.retry.run(self.transport.execute, cdb, data), len(data))
+                yield lba, blocks, data
+                lba += blocks
+
+    def blank_check(self, total_blocks: Optional[int] = None, block_size: Optional[int] = None,
+                    queue_depth: int = 1, progress: Optional[Callable[[int, int], Optional[bool]]] = None,
+                    chunk_blocks: int = 1000, read_mode: str = "sg",
+                    journal: Optional[scan_journal] = None, verifier=None) -> bool:
+        """
+        blank_check reads the whole device and returns True only if every byte is zero,
+        or matches verifier (see verifier.make_verifier: 0xFF, a repeating pattern or
+        LBA-tagged blocks) when one is given.
+        total_blocks and block_size default to the values found by read_capacity, which is
+        called first if the capacity is not known yet.
+        Each read covers chunk_blocks blocks. READ(10) is used while the LBA and length fit,
+        READ(16) otherwise, so drives over 2 TiB and chunks over 65535 blocks both work.
+        queue_depth above 1 keeps that many READs queued on the drive at once so it never
+        idles between commands.
+        read_mode picks how data reaches the verifier: "sg" (the transport), "mmap" (the sg
+        reserved buffer mapped into this process), "direct" (O_DIRECT reads of the block
+        device) or "pipeline" (the transport, read on a separate thread so the next chunk
+        is read while the last is verified). queue_depth applies to "sg", and to
+        "pipeline" as the number of buffers.
+        journal, if given (see open_journal), records every verified chunk and the scan
+        starts from the journal's resume point rather than LBA 0. The final verdict is
+        written to it; an interrupted scan leaves it resumable.
+        progress, if given, replaces the console output: it is called with (blocks checked,
+        total blocks) after every chunk, and returning False from it stops the check.
+        Failure reasons are appended to self.errors either way.
+        """
+        def log(message: str, end: str = "\n") -> None:
+            if progress is None:
+                print(message, end=end)
+
+        if total_blocks is None or block_size is None:
+            if not self.no_blocks:
+                self.read_capacity()
+            total_blocks = total_blocks or self.no_blocks
+            block_size = block_size or self.block_size
+
+        if not 1 <= chunk_blocks <= scsi_cdb.READ_16_MAX_BLOCKS:
+            raise ValueError(f"chunk_blocks must be between 1 and {scsi_cdb.READ_16_MAX_BLOCKS}")
+        if read_mode not in READ_MODES:
+            raise ValueError(f"read_mode must be one of {READ_MODES}")
+        if read_mode not in ("sg", "pipeline") and queue_depth > 1:
+            raise ValueError(f"queue_depth above 1 needs read_mode 'sg' or 'pipeline', not '{read_mode}'")
+        if read_mode == "direct":
+            log("[+] Beginning blank check using O_DIRECT reads...")
+        else:
+            command = "READ(16)" if scsi_cdb.needs_read16(total_blocks - 1, chunk_blocks) else "READ(10)"
+            log(f"[+] Beginning blank check using {command}, queue depth {queue_depth}, {read_mode} buffers...")
+        if verifier is None:
+            verifier = zero_verifier(min(chunk_blocks * block_size, DEFAULT_ZERO_BUFFER))
+        unexpected = "Non-zero data" if isinstance(verifier, zero_verifier) else f"Data not matching {verifier}"
+        start_lba = journal.resume_lba() if journal is not None else 0
+        if start_lba:
+            log(f"[+] Resuming from LBA {start_lba}, journal {journal.path}")
+        next_lba = start_lba
+        try:
+            for lba, blocks, data in self._read_chunks(total_blocks, block_size, chunk_blocks, queue_depth,
+                                                       read_mode, start_lba):
+                next_lba = lba + blocks
+                found = verifier.locate(data, lba, block_size)
+                if found is not None:
+                    bad_lba, offset = found
+                    self.errors.append(f"{unexpected} found at LBA {bad_lba}, byte offset {offset}")
+                    log(f"\n[!] {unexpected} found at LBA {bad_lba}, byte offset {offset}")
+                    if journal is not None:
+                        journal.finish("fail")
                     return False
-            except subprocess.CalledProcessError as e:
-                print(f"[!] READ(10) failed at LBA {lba}: {e}")
-                return False
+                if journal is not None:
+                    journal.record(lba, blocks)
+
+                if progress is not None:
+                    if progress(lba + blocks, total_blocks) is False:
+                        self.errors.append(f"Blank check stopped at LBA {lba + blocks}")
+                        if journal is not None:
+                            journal.finish("stopped")
+                        return False
+                else:
+                    print(f"    Checked up to block {lba + blocks} / {total_blocks}", end="\r")
+            if journal is not None:
+                journal.finish("pass")
+        except (scsi_command_error, OSError) as e:
+            # The chunk starting at next_lba is the one that failed
+            if read_mode == "direct":
+                command = "O_DIRECT read"
+            else:
+                command = "READ(16)" if scsi_cdb.needs_read16(next_lba + chunk_blocks - 1, chunk_blocks) else "READ(10)"
+            self.errors.append(f"{command} failed at LBA {next_lba}{failure_detail(e)}: {e}")
+            log(f"\n[!] {command} failed at LBA {next_lba}{failure_detail(e)}: {e}")
+            if journal is not None:
+                journal.finish("fail")
+            return False
+        finally:
+            # Ctrl-C and anything else unexpected: keep what was verified so far
+            if journal is not None and journal.state == "running":
+                journal.save()
+
+        if isinstance(verifier, zero_verifier):
+            log("\n[+] Blank check successful. All data is zero.")
+        else:
+            log(f"\n[+] Blank check successful. All data matches {verifier}.")
+        return True
+
+    def provisioning_check(self, queue_depth: int = 1, chunk_blocks: int = 1000, read_mode: str = "sg",
+                           progress: Optional[Callable[[int, int], Optional[bool]]] = None,
+                           verifier=None) -> provisioning_report:
+        """
+        provisioning_check is blank_check for thin-provisioned devices. When READ CAPACITY (16)
+        sets LBPME and the device reads unmapped blocks as zeros (LBPRZ 001b), only the
+        extents GET LBA STATUS reports as mapped are read and verified; unmapped extents are
+        counted as guaranteed zero without being read. They read as zeros, so with a verifier
+        expecting anything else an unmapped extent fails the check. A device without that
+        guarantee, or without GET LBA STATUS, gets a full blank_check instead and the report
+        says why. The other arguments are as in blank_check; progress counts the blocks
+        verified or known to be zero.
+        """
+        def log(message: str, end: str = "\n") -> None:
+            if progress is None:
+                print(message, end=end)
+
+        if not self.no_blocks:
+            self.read_capacity()
+        total_blocks, block_size = self.no_blocks, self.block_size
+        if verifier is None:
+            verifier = zero_verifier(min(chunk_blocks * block_size, DEFAULT_ZERO_BUFFER))
+        report = provisioning_report(self.device, total_blocks, block_size)
+        start = time.monotonic()
+        try:
+            self.read_provisioning()
+            report.lbpme, report.lbprz = self.lbpme, self.lbprz
+            if not self.lbpme:
+                report.reason = "LBPME not set, the device is fully provisioned"
+            elif self.lbprz != LBPRZ_ZEROS:
+                report.reason = f"LBPRZ {self.lbprz}, unmapped blocks are not guaranteed to read as zeros"
+            else:
+                self.retry.run(self.transport.read_data, scsi_cdb.get_lba_status(0, 64), 64)
+        except (scsi_command_error, RuntimeError) as e:
+            report.reason = str(e)
 
-            print(f"    Checked up to block {lba + blocks_to_read} / {total_blocks}", end="\r")
-            lba += blocks_to_read
+        if report.reason:
+            def checked(done: int, total: int) -> Optional[bool]:
+                report.verified_blocks = done
+                if progress is not None:
+                    return progress(done, total)
+                print(f"    Checked up to block {done} / {total}", end="\r")
+                return None
+
+            log(f"[+] Provisioning not used ({report.reason}), reading every block")
+            report.passed = self.blank_check(total_blocks, block_size, queue_depth, checked, chunk_blocks, read_mode,
+                                             verifier=verifier)
+            report.error = None if report.passed else self.errors[-1]
+            report.verified_extents = 1 if report.verified_blocks else 0
+            report.elapsed = time.monotonic() - start
+            log("\n" + report.summary())
+            return report
+
+        def fail(message: str) -> provisioning_report:
+            report.passed = False
+            report.error = message
+            self.errors.append(message)
+            report.elapsed = time.monotonic() - start
+            log("\n" + report.summary())
+            return report
+
+        report.provisioned = True
+        unexpected = "Non-zero data" if isinstance(verifier, zero_verifier) else f"Data not matching {verifier}"
+        log(f"[+] Provisioning-aware blank check of {self.device}: reading mapped extents only...")
+        previous: Optional[bool] = None
+        lba = 0
+        stopped: Optional[str] = None
+
+        def mapped_extents() -> Iterator[tuple[int, int]]:
+            # Counts the unmapped extents and hands the mapped ones to the reader, which
+            # stays open across all of them; a failure ends the walk with stopped set
+            nonlocal previous, lba, stopped
+            for lba, blocks, mapped in self.lba_status(0, total_blocks):
+                if mapped != previous:
+                    if mapped:
+                        report.verified_extents += 1
+                    else:
+                        report.zero_extents += 1
+                    previous = mapped
+                if mapped:
+                    yield lba, lba + blocks
+                    continue
+                if not isinstance(verifier, zero_verifier):
+                    stopped = f"LBA {lba}-{lba + blocks - 1} is unmapped and reads as zeros, not {verifier}"
+                    return
+                report.zero_blocks += blocks
+                if progress is not None:
+                    if progress(report.covered_blocks, total_blocks) is False:
+                        stopped = f"Provisioning-aware blank check stopped at LBA {lba + blocks}"
+                        return
+                else:
+                    print(f"    Checked {report.covered_blocks} / {total_blocks} blocks, "
+                          f"{report.verified_blocks} by read", end="\r")
+
+        try:
+            for chunk_lba, chunk, data in self._read_extents(mapped_extents(), block_size, chunk_blocks, queue_depth,
+                                                             read_mode):
+                found = verifier.locate(data, chunk_lba, block_size)
+                if found is not None:
+                    return fail(f"{unexpected} found at LBA {found[0]}, byte offset {found[1]}")
+                report.verified_blocks += chunk
+                if progress is not None:
+                    if progress(report.covered_blocks, total_blocks) is False:
+                        return fail(f"Provisioning-aware blank check stopped at LBA {chunk_lba + chunk}")
+                else:
+                    print(f"    Checked {report.covered_blocks} / {total_blocks} blocks, "
+                          f"{report.verified_blocks} by read", end="\r")
+        except (scsi_command_error, OSError, RuntimeError) as e:
+            return fail(f"Reading LBA status or data failed in the extent at LBA {lba}{failure_detail(e)}: {e}")
+        if stopped is not None:
+            return fail(stopped)
+        report.elapsed = time.monotonic() - start
+        log("\n" + report.summary())
+        return report
+
+    def sample_check(self, samples: int = DEFAULT_SAMPLES, time_budget: Optional[float] = None,
+                     confidence: float = DEFAULT_CONFIDENCE, seed: Optional[int] = None,
+                     progress: Optional[Callable[[int, int], Optional[bool]]] = None,
+                     verifier=None) -> sample_report:
+        """
+        sample_check is a fast triage before blank_check. It reads the hot spots where
+        partition tables and superblocks live, then up to samples regions picked at random
+        from equal strata across the whole capacity, stopping early once time_budget seconds
+        have passed (hot spots are always read). The first non-zero byte or unreadable
+        region fails the drive; a pass comes with an upper bound, at the given confidence,
+        on the fraction of the drive that could still hold data. If the budget runs out
+        before any random region is read the report is inconclusive, which is not a pass.
+        progress behaves as in blank_check, counting regions instead of blocks, and
+        verifier, if given, replaces the all-zero check as it does there.
+        """
+        def log(message: str, end: str = "\n") -> None:
+            if progress is None:
+                print(message, end=end)
+
+        if not self.no_blocks:
+            self.read_capacity()
+        total_blocks, block_size = self.no_blocks, self.block_size
+        report = sample_report(total_blocks, block_size, confidence)
+        spots = hot_spots(total_blocks, block_size)
+        picks = stratified_sample(total_blocks, block_size, samples, seed)
+        report.samples_planned = len(picks)
+        regions = spots + picks
+
+        if verifier is None:
+            verifier = zero_verifier(HOT_SPOT_BYTES)
+        buffer = memoryview(bytearray(max(blocks for _, blocks in regions) * block_size))
+        log(f"[+] Sampling {len(spots)} hot spots and {len(picks)} random regions...")
+        start = time.monotonic()
+        for index, (lba, blocks) in enumerate(regions):
+            hot = index < len(spots)
+            if not hot and time_budget is not None and time.monotonic() - start >= time_budget:
+                report.budget_exhausted = True
+                break
+            data = buffer[:blocks * block_size]
+            cdb = scsi_cdb.read(lba, blocks)
+            try:
+                check_transfer(self.device, cdb, self.retry.run(self.transport.execute, cdb, data), len(data))
+            except (scsi_command_error, OSError) as e:
+                report.passed = False
+                report.error = f"READ failed at LBA {lba}{failure_detail(e)}: {e}"
+                break
+            report.blocks_read += blocks
+            found = verifier.locate(data, lba, block_size)
+            if found is not None:
+                report.passed = False
+                report.dirty = found
+                break
+            if hot:
+                report.hot_spots_read += 1
+            else:
+                report.samples_read += 1
 
-        print("\n[+] Blank check successful. All data is zero.")
-        return True
\ No newline at end of file
+            if progress is not None:
+                if progress(index + 1, len(regions)) is False:
+                    report.passed = False
+                    report.error = f"Sampling stopped after {index + 1} regions"
+                    break
+            else:
+                print(f"    Sampled {index + 1} / {len(regions)} regions", end="\r")
+        report.elapsed = time.monotonic() - start
+
+        if not report:
+            self.errors.append(str(report))
+        log(f"\n[{'+' if report else '!'}] {report}")
+        return report
+
+    def _read_piece(self, lba: int, blocks: int, block_size: int, data: memoryview) -> int:
+        """
+        Re-reads one piece of a chunk that failed and returns how many of its blocks
+        arrived, counting from lba: 0 if the READ failed outright, fewer than blocks if
+        it came back short. The blocks after those are unreadable.
+        """
+        try:
+            received = self.retry.run(self.transport.execute, scsi_cdb.read(lba, blocks), data)
+        except (scsi_command_error, OSError):
+            return 0
+        return min(received, len(data)) // block_size
+
+    def surface_scan(self, chunk_blocks: int = 1000, retry_blocks: int = 8, zones: int = DEFAULT_ZONES,
+                     progress: Optional[Callable[[int, int], Optional[bool]]] = None) -> surface_map:
+        """
+        surface_scan reads the whole device like blank_check but does not stop at the
+        first problem: every non-zero block and every unreadable block is recorded in a
+        surface_map, together with per-zone read latency. A chunk that fails to read, or
+        transfers less than it asked for, is retried in pieces of retry_blocks so only the
+        bad blocks are marked unreadable; so is whatever part of a piece does not arrive.
+        Reads are synchronous through the transport so each command's latency is exact.
+        progress behaves as in blank_check; returning False stops the scan early and
+        the map covers what was scanned.
+        """
+        def log(message: str, end: str = "\n") -> None:
+            if progress is None:
+                print(message, end=end)
+
+        if not self.no_blocks:
+            self.read_capacity()
+        if self.serial_number is None:
+            try:
+                self.read_serial()
+            except (scsi_command_error, RuntimeError, OSError):
+                pass
+        total_blocks, block_size = self.no_blocks, self.block_size
+        result = surface_map(self.device, total_blocks, block_size, zones, self.serial_number)
+        verifier = zero_verifier(min(chunk_blocks * block_size, DEFAULT_ZERO_BUFFER))
+        buffer = memoryview(bytearray(chunk_blocks * block_size))
+
+        log(f"[+] Mapping the full surface of {self.device}...")
+        start = time.monotonic()
+        for lba in range(0, total_blocks, chunk_blocks):
+            blocks = min(chunk_blocks, total_blocks - lba)
+            data = buffer[:blocks * block_size]
+            cdb = scsi_cdb.read(lba, blocks)
+            began = time.perf_counter()
+            try:
+                received = self.retry.run(self.transport.execute, cdb, data)
+                result.add_latency(lba, time.perf_counter() - began)
+                check_transfer(self.device, cdb, received, len(data))
+                result.add_data(data, lba, verifier)
+            except (scsi_command_error, OSError) as e:
+                # A short READ completed, so its latency is already counted
+                if not isinstance(e, short_transfer_error):
+                    result.add_latency(lba, time.perf_counter() - began)
+                for piece in range(lba, lba + blocks, retry_blocks):
+                    piece_blocks = min(retry_blocks, lba + blocks - piece)
+                    piece_data = buffer[:piece_blocks * block_size]
+                    arrived = self._read_piece(piece, piece_blocks, block_size, piece_data)
+                    if arrived:
+                        result.add_data(piece_data[:arrived * block_size], piece, verifier)
+                    if arrived < piece_blocks:
+                        result.add_region(piece + arrived, piece + piece_blocks, UNREADABLE)
+            result.scanned_blocks = lba + blocks
+
+            if progress is not None:
+                if progress(lba + blocks, total_blocks) is False:
+                    break
+            else:
+                print(f"    Mapped {lba + blocks} / {total_blocks} blocks, "
+                      f"{result.nonzero_bytes} non-zero bytes so far", end="\r")
+        result.elapsed = time.monotonic() - start
+        log("\n" + result.summary())
+        return result
+
+    def _write_chunk(self, fd: int, result: image_map, data: memoryview, lba: int, verifier: zero_verifier) -> None:
+        """
+        pwrites one chunk into the image at its LBA's offset, or leaves a hole if it is all zero.
+        """
+        if verifier.is_zero(data):
+            result.hole_bytes += len(data)
+            return
+        offset, written = lba * result.block_size, 0
+        while written < len(data):
+            written += os.pwrite(fd, data[written:], offset + written)
+        result.written_bytes += len(data)
+
+    def image(self, path: str, map_path: Optional[str] = None, chunk_blocks: Optional[int] = None,
+              read_mode: str = "pipeline", queue_depth: int = 2, retry_blocks: int = 8,
+              progress: Optional[Callable[[int, int], Optional[bool]]] = None) -> image_map:
+        """
+        image copies the whole device into a sparse image file at path. The file is sized to
+        the device first and each chunk is pwritten at its own offset; all-zero chunks are
+        skipped, so they read back as zeros from holes. Chunks default to IMAGE_CHUNK_BYTES
+        and are read with read_mode as in blank_check ("pipeline" reads ahead on a
+        separate thread while the last chunk is written).
+        A chunk that cannot be read, or comes back short, is retried in pieces of
+        retry_blocks like surface_scan, and what stays unreadable (including the part of a
+        piece that does not arrive) is left as a hole and recorded in the image_map, saved
+        to map_path (path + '.map.json' by default). Without progress, MB/s and ETA are
+        printed as the image is written; progress behaves as in blank_check.
+        """
+        def log(message: str, end: str = "\n") -> None:
+            if progress is None:
+                print(message, end=end)
+
+        if not self.no_blocks:
+            self.read_capacity()
+        if self.serial_number is None:
+            try:
+                self.read_serial()
+            except (scsi_command_error, RuntimeError, OSError):
+                pass
+        total_blocks, block_size = self.no_blocks, self.block_size
+        if chunk_blocks is None:
+            chunk_blocks = min(max(1, IMAGE_CHUNK_BYTES // block_size), scsi_cdb.READ_16_MAX_BLOCKS)
+        result = image_map(map_path or path + MAP_SUFFIX, self.device, path, total_blocks, block_size,
+                           self.serial_number)
+        verifier = zero_verifier(min(chunk_blocks * block_size, DEFAULT_ZERO_BUFFER))
+        piece_buffer = memoryview(bytearray(retry_blocks * block_size))
+
+        log(f"[+] Imaging {self.device} ({total_blocks * block_size} bytes) to {path}...")
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        start = time.monotonic()
+        shown = 0.0
+
+        def advance(end_lba: int) -> bool:
+            nonlocal shown
+            result.elapsed = time.monotonic() - start
+            result.advance(end_lba)
+            if progress is not None:
+                return progress(end_lba, total_blocks) is not False
+            if result.elapsed - shown >= 0.5 or end_lba == total_blocks:
+                shown = result.elapsed
+                print(result.progress_line(), end="\r")
+            return True
+
+        state = "failed"
+        try:
+            os.ftruncate(fd, total_blocks * block_size)
+            lba = 0
+            stopped = False
+            while lba < total_blocks and not stopped:
+                chunks = self._read_chunks(total_blocks, block_size, chunk_blocks, queue_depth, read_mode, lba)
+                try:
+                    while True:
+                        try:
+                            chunk_lba, blocks, data = next(chunks)
+                        except StopIteration:
+                            break
+                        except (scsi_command_error, OSError):
+                            # The chunk at lba failed even after retries, or came back short: salvage
+                            # what is readable of it, then start reading again after it
+                            blocks = min(chunk_blocks, total_blocks - lba)
+                            for piece in range(lba, lba + blocks, retry_blocks):
+                                piece_blocks = min(retry_blocks, lba + blocks - piece)
+                                piece_data = piece_buffer[:piece_blocks * block_size]
+                                arrived = self._read_piece(piece, piece_blocks, block_size, piece_data)
+                                if arrived:
+                                    self._write_chunk(fd, result, piece_data[:arrived * block_size], piece,
+                                                      verifier)
+                                if arrived < piece_blocks:
+                                    result.add_unreadable(piece + arrived, piece + piece_blocks)
+                            lba += blocks
+                            stopped = not advance(lba)
+                            break
+                        self._write_chunk(fd, result, data, chunk_lba, verifier)
+                        lba = chunk_lba + blocks
+                        if not advance(lba):
+                            stopped = True
+                            break
+                finally:
+                    chunks.close()
+            os.fsync(fd)
+            state = "stopped" if stopped else "complete"
+        finally:
+            os.close(fd)
+            result.elapsed = time.monotonic() - start
+            result.finish(state)
+        log("\n" + result.summary())
+        return result
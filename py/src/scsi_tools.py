@@ -1,5 +1,9 @@
 
 import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from sg_transport import scsi_command_error
 
 def scan_scsi_devices() -> list[str]:
     """
@@ -18,3 +22,55 @@ def scan_scsi_devices() -> list[str]:
             device_paths.append(dev_path)
 
     return sorted(device_paths)
+
+
+def get_scsi_host(device: str) -> str:
+    """
+    Returns the SCSI host adapter (HBA) a generic device hangs off, e.g. 'host2' for
+    /dev/sg5 when its sysfs device is 2:0:5:0. Returns 'unknown' if sysfs has no link.
+    """
+    hctl = get_scsi_hctl(device)
+    if hctl is None:
+        return "unknown"
+    return f"host{hctl.split(':')[0]}"
+
+
+def get_scsi_hctl(device: str) -> Optional[str]:
+    """
+    Returns the Host:Channel:Target:LUN address of a generic device, e.g. '2:0:5:0' for
+    /dev/sg5, or None if sysfs has no link for it.
+    """
+    link = os.path.join("/sys/class/scsi_generic", os.path.basename(device), "device")
+    if not os.path.exists(link):
+        return None
+    return os.path.basename(os.path.realpath(link))
+
+
+def get_block_device(device: str) -> str:
+    """
+    Returns the block device behind a generic device, e.g. '/dev/sdb' for /dev/sg1.
+    Anything that is not a /dev/sgX node with a block device in sysfs is returned unchanged.
+    """
+    block_dir = os.path.join("/sys/class/scsi_generic", os.path.basename(device), "device", "block")
+    if not os.path.isdir(block_dir):
+        return device
+    names = sorted(os.listdir(block_dir))
+    return os.path.join("/dev", names[0]) if names else device
+
+
+def read_fleet(devices: list[str], read_device: Callable[[str, str], dict], max_workers: int = 16,
+               transport: str = "sg_io") -> dict[str, dict]:
+    """
+    Calls read_device(device, transport) for many devices at once, one worker per device
+    up to max_workers. Returns {device: result} or {device: {'error': message}} for
+    devices that failed.
+    """
+    results: dict[str, dict] = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {device: pool.submit(read_device, device, transport) for device in devices}
+        for device, future in futures.items():
+            try:
+                results[device] = future.result()
+            except (scsi_command_error, RuntimeError, OSError) as e:
+                results[device] = {"error": str(e)}
+    return results
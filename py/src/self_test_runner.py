@@ -0,0 +1,243 @@
+"""
+Runs SCSI self-tests on many drives at once and waits for each to finish.
+
+Tests are started in the background with SEND DIAGNOSTIC, then every drive is polled
+from one thread: a heap orders the drives by when they are next due, REQUEST SENSE
+gives the progress of a running test and the Self-Test Results log page (0x10) the
+outcome. Poll intervals adapt to each drive: with a progress indication the next poll
+is aimed at half the estimated time left, without one the interval doubles, always
+within [min_interval, max_interval]. Drives that run past their timeout are aborted.
+"""
+import heapq
+import itertools
+import sys
+import time
+from typing import Callable, Optional
+
+import scsi_cdb
+from log_pages import LOG_SELF_TEST_RESULTS, SELF_TEST_RESULT_IN_PROGRESS, parse_log_page, parse_self_test_entry
+from scsi_tools import scan_scsi_devices
+from sense import decode_sense
+from sg_transport import open_transport, scsi_command_error, sg_transport
+
+SELF_TESTS = {
+    "short": scsi_cdb.SELF_TEST_BACKGROUND_SHORT,
+    "extended": scsi_cdb.SELF_TEST_BACKGROUND_EXTENDED,
+}
+# SPC limits a short self-test to two minutes; extended tests scale with capacity
+DEFAULT_TIMEOUTS = {"short": 600.0, "extended": 48 * 3600.0}
+MIN_POLL_INTERVAL = 1.0
+MAX_POLL_INTERVAL = 300.0
+LOG_SENSE_REPLY_LEN = 512
+COMMAND_TIMEOUT_MS = 10000
+ASC_SELF_TEST_IN_PROGRESS = (0x04, 0x09)
+
+
+def sense_progress(sense) -> tuple[bool, Optional[float]]:
+    """
+    (self-test in progress, fraction done or None) from REQUEST SENSE data in fixed or
+    descriptor format, as decoded by sense.decode_sense.
+    """
+    decoded = decode_sense(sense)
+    if decoded is None or (decoded.asc, decoded.ascq) != ASC_SELF_TEST_IN_PROGRESS:
+        return False, None
+    return True, decoded.progress
+
+
+def next_poll_interval(job, now: float, progress: Optional[float], min_interval: float,
+                       max_interval: float) -> float:
+    """
+    When to poll a long-running drive operation next: half the estimated time left when
+    the drive reports progress, else double the last interval. job needs interval,
+    progress, started, timeout and _last_progress; progress and _last_progress are updated.
+    """
+    interval = job.interval * 2
+    if progress is not None:
+        if job._last_progress is not None:
+            then, before = job._last_progress
+            if progress > before and now > then:
+                interval = (1.0 - progress) / ((progress - before) / (now - then)) / 2
+        job.progress = progress
+        job._last_progress = (now, progress)
+    remaining = job.started + job.timeout - now
+    return max(min_interval, min(interval, max_interval, max(remaining, 0.0)))
+
+
+class self_test_job:
+    """
+    One drive's self-test. state moves from 'queued' to 'running' and ends as 'pass',
+    'fail', 'timeout' or 'error'; result is the drive's parsed log entry for the test.
+    """
+    def __init__(self, device: str, test: str, timeout: float):
+        self.device: str = device
+        self.test: str = test
+        self.timeout: float = timeout
+        self.state: str = "queued"
+        self.progress: Optional[float] = None
+        self.result: Optional[dict] = None
+        self.message: str = ""
+        self.started: float = 0.0
+        self.ended: float = 0.0
+        self.polls: int = 0
+        self.interval: float = 0.0
+        self.transport: Optional[sg_transport] = None
+        # Newest log entry before the test started, to recognise ours once the log shifts
+        self.baseline: Optional[bytes] = None
+        self._last_progress: Optional[tuple[float, float]] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.state in ("pass", "fail", "timeout", "error")
+
+    def status_line(self) -> str:
+        elapsed = (self.ended or time.monotonic()) - self.started if self.started else 0.0
+        progress = f"{100.0 * self.progress:6.2f}%" if self.progress is not None else "   ?   "
+        line = f"{self.device:<10} {self.test:<8} {self.state.upper():<8} [{progress}] {elapsed:8.0f}s {self.polls} polls"
+        if self.message:
+            line += f"  {self.message}"
+        return line
+
+
+class self_test_orchestrator:
+    """
+    Starts a short or extended background self-test on every device and polls them all
+    until each has a result or its timeout passes. on_result, if given, is called with
+    each job as soon as that drive finishes.
+    """
+    def __init__(self, devices: Optional[list[str]] = None, test: str = "short", transport: str = "sg_io",
+                 timeout: Optional[float] = None, min_interval: float = MIN_POLL_INTERVAL,
+                 max_interval: float = MAX_POLL_INTERVAL,
+                 on_result: Optional[Callable[[self_test_job], None]] = None):
+        if test not in SELF_TESTS:
+            raise ValueError(f"test must be one of {tuple(SELF_TESTS)}")
+        if devices is None:
+            devices = scan_scsi_devices()
+        self.test: str = test
+        self.transport: str = transport
+        self.timeout: float = timeout if timeout is not None else DEFAULT_TIMEOUTS[test]
+        self.min_interval: float = min_interval
+        self.max_interval: float = max_interval
+        self.on_result: Optional[Callable[[self_test_job], None]] = on_result
+        self.jobs: list[self_test_job] = [self_test_job(device, test, self.timeout) for device in devices]
+
+    def _read_log(self, job: self_test_job) -> list[tuple[int, int, memoryview]]:
+        """
+        The self-test log parameters in entry order, as views valid until the next command.
+        """
+        data = job.transport.read_data(scsi_cdb.log_sense(LOG_SELF_TEST_RESULTS, alloc_len=LOG_SENSE_REPLY_LEN),
+                                       LOG_SENSE_REPLY_LEN, timeout_ms=COMMAND_TIMEOUT_MS)
+        return sorted(parse_log_page(data)[2], key=lambda param: param[0])
+
+    def _start(self, job: self_test_job) -> None:
+        job.transport = open_transport(job.device, self.transport)
+        params = self._read_log(job)
+        job.baseline = bytes(params[0][2]) if params else None
+        job.transport.execute(scsi_cdb.send_diagnostic(SELF_TESTS[self.test]), timeout_ms=COMMAND_TIMEOUT_MS)
+        job.state = "running"
+        job.started = time.monotonic()
+        job.interval = self.min_interval
+
+    def _finish(self, job: self_test_job, state: str, message: str = "") -> None:
+        job.state = state
+        job.message = message
+        job.ended = time.monotonic()
+        if job.transport is not None:
+            job.transport.close()
+            job.transport = None
+        if self.on_result is not None:
+            self.on_result(job)
+
+    def _our_entry(self, job: self_test_job) -> Optional[dict]:
+        """
+        The log entry for the test this run started, once the drive has logged it.
+        """
+        params = self._read_log(job)
+        if not params:
+            return None
+        # The log is newest first: ours is on top once the previous newest entry moved down
+        if job.baseline is not None and (len(params) < 2 or params[1][2] != job.baseline):
+            return None
+        return parse_self_test_entry(params[0][0], params[0][2])
+
+    def _poll(self, job: self_test_job) -> None:
+        job.polls += 1
+        now = time.monotonic()
+        sense = job.transport.read_data(scsi_cdb.request_sense(), scsi_cdb.REQUEST_SENSE_REPLY_LEN,
+                                        timeout_ms=COMMAND_TIMEOUT_MS)
+        running, progress = sense_progress(sense)
+        if not running:
+            entry = self._our_entry(job)
+            if entry is not None and entry["result"] != SELF_TEST_RESULT_IN_PROGRESS:
+                job.result = entry
+                job.progress = 1.0
+                self._finish(job, "pass" if entry["result"] == 0 else "fail", entry["status"])
+                return
+        if now - job.started > job.timeout:
+            try:
+                job.transport.execute(scsi_cdb.send_diagnostic(scsi_cdb.SELF_TEST_ABORT),
+                                      timeout_ms=COMMAND_TIMEOUT_MS)
+            finally:
+                self._finish(job, "timeout", f"aborted after {job.timeout:.0f}s")
+            return
+        job.interval = self._next_interval(job, now, progress)
+
+    def _next_interval(self, job: self_test_job, now: float, progress: Optional[float]) -> float:
+        return next_poll_interval(job, now, progress, self.min_interval, self.max_interval)
+
+    def _render(self, first: bool) -> None:
+        lines = [job.status_line() for job in self.jobs]
+        if not first:
+            sys.stdout.write(f"\x1b[{len(lines)}A")
+        for line in lines:
+            sys.stdout.write(f"\x1b[2K{line}\n")
+        sys.stdout.flush()
+
+    def run(self, live: bool = True) -> bool:
+        """
+        Runs the self-tests and returns True only if every drive passed. With live set,
+        one status line per device is redrawn after every poll.
+        """
+        order = itertools.count()
+        due: list[tuple[float, int, self_test_job]] = []
+        for job in self.jobs:
+            try:
+                self._start(job)
+            except (scsi_command_error, OSError, RuntimeError) as e:
+                self._finish(job, "error", str(e))
+                continue
+            heapq.heappush(due, (job.started + job.interval, next(order), job))
+
+        first = True
+        while due:
+            if live:
+                self._render(first)
+                first = False
+            when, _, job = heapq.heappop(due)
+            delay = when - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                self._poll(job)
+            except (scsi_command_error, OSError, RuntimeError) as e:
+                if not job.finished:
+                    self._finish(job, "error", str(e))
+            if not job.finished:
+                heapq.heappush(due, (time.monotonic() + job.interval, next(order), job))
+        if live:
+            self._render(first)
+        return all(job.state == "pass" for job in self.jobs)
+
+    def summary(self) -> str:
+        counts: dict[str, int] = {}
+        lines = [f"[+] {self.test.capitalize()} self-test summary:"]
+        for job in self.jobs:
+            counts[job.state] = counts.get(job.state, 0) + 1
+            elapsed = job.ended - job.started if job.started else 0.0
+            detail = f" - {job.message}" if job.message else ""
+            failure = ""
+            if job.result is not None and job.result["failure_lba"] is not None:
+                failure = f", first failure at LBA {job.result['failure_lba']}"
+            lines.append(f"    {job.device:<10} {job.state.upper()} in {elapsed:.0f}s{detail}{failure}")
+        totals = ", ".join(f"{count} {state}" for state, count in sorted(counts.items()))
+        lines.append(f"    {len(self.jobs)} devices: {totals}")
+        return "\n".join(lines)
@@ -0,0 +1,285 @@
+"""
+SCSI sense data decoding.
+
+decode_sense understands fixed (0x70/0x71) and descriptor (0x72/0x73) format sense and
+returns the sense key, ASC/ASCQ and, where the device supplied them, the information
+field (the failing LBA for medium errors) and the sense-key specific bytes (progress
+of a format, sanitize or self-test). Descriptions come from ASC_DESCRIPTIONS, built once
+at import with the ASC-wide ranges (diagnostic failure on component NN and the like)
+expanded, so a lookup is one dictionary access.
+"""
+import struct
+from typing import Optional
+
+NO_SENSE = 0x0
+RECOVERED_ERROR = 0x1
+NOT_READY = 0x2
+MEDIUM_ERROR = 0x3
+HARDWARE_ERROR = 0x4
+ILLEGAL_REQUEST = 0x5
+UNIT_ATTENTION = 0x6
+DATA_PROTECT = 0x7
+BLANK_CHECK = 0x8
+VENDOR_SPECIFIC = 0x9
+COPY_ABORTED = 0xA
+ABORTED_COMMAND = 0xB
+VOLUME_OVERFLOW = 0xD
+MISCOMPARE = 0xE
+COMPLETED = 0xF
+
+SENSE_KEYS = {
+    NO_SENSE: "NO SENSE",
+    RECOVERED_ERROR: "RECOVERED ERROR",
+    NOT_READY: "NOT READY",
+    MEDIUM_ERROR: "MEDIUM ERROR",
+    HARDWARE_ERROR: "HARDWARE ERROR",
+    ILLEGAL_REQUEST: "ILLEGAL REQUEST",
+    UNIT_ATTENTION: "UNIT ATTENTION",
+    DATA_PROTECT: "DATA PROTECT",
+    BLANK_CHECK: "BLANK CHECK",
+    VENDOR_SPECIFIC: "VENDOR SPECIFIC",
+    COPY_ABORTED: "COPY ABORTED",
+    ABORTED_COMMAND: "ABORTED COMMAND",
+    VOLUME_OVERFLOW: "VOLUME OVERFLOW",
+    MISCOMPARE: "MISCOMPARE",
+    COMPLETED: "COMPLETED",
+}
+
+_ASC_TABLE = {
+    (0x00, 0x00): "No additional sense information",
+    (0x00, 0x16): "Operation in progress",
+    (0x00, 0x17): "Cleaning requested",
+    (0x01, 0x00): "No index/sector signal",
+    (0x02, 0x00): "No seek complete",
+    (0x03, 0x00): "Peripheral device write fault",
+    (0x04, 0x00): "Logical unit not ready, cause not reportable",
+    (0x04, 0x01): "Logical unit is in process of becoming ready",
+    (0x04, 0x02): "Logical unit not ready, initializing command required",
+    (0x04, 0x03): "Logical unit not ready, manual intervention required",
+    (0x04, 0x04): "Logical unit not ready, format in progress",
+    (0x04, 0x07): "Logical unit not ready, operation in progress",
+    (0x04, 0x09): "Logical unit not ready, self-test in progress",
+    (0x04, 0x0A): "Logical unit not accessible, asymmetric access state transition",
+    (0x04, 0x0B): "Logical unit not accessible, target port in standby state",
+    (0x04, 0x11): "Logical unit not ready, notify (enable spinup) required",
+    (0x04, 0x1B): "Logical unit not ready, sanitize in progress",
+    (0x04, 0x1C): "Logical unit not ready, additional power use not yet granted",
+    (0x05, 0x00): "Logical unit does not respond to selection",
+    (0x08, 0x00): "Logical unit communication failure",
+    (0x08, 0x01): "Logical unit communication time-out",
+    (0x08, 0x02): "Logical unit communication parity error",
+    (0x09, 0x00): "Track following error",
+    (0x0B, 0x00): "Warning",
+    (0x0B, 0x01): "Warning - specified temperature exceeded",
+    (0x0B, 0x02): "Warning - enclosure degraded",
+    (0x0C, 0x00): "Write error",
+    (0x0C, 0x02): "Write error - auto reallocation failed",
+    (0x0C, 0x03): "Write error - recommend reassignment",
+    (0x10, 0x00): "ID CRC or ECC error",
+    (0x10, 0x01): "Logical block guard check failed",
+    (0x10, 0x02): "Logical block application tag check failed",
+    (0x10, 0x03): "Logical block reference tag check failed",
+    (0x11, 0x00): "Unrecovered read error",
+    (0x11, 0x01): "Read retries exhausted",
+    (0x11, 0x02): "Error too long to correct",
+    (0x11, 0x04): "Unrecovered read error - auto reallocate failed",
+    (0x11, 0x0B): "Unrecovered read error - recommend reassignment",
+    (0x11, 0x0C): "Unrecovered read error - recommend rewrite the data",
+    (0x11, 0x14): "Read error - LBA marked bad by application client",
+    (0x12, 0x00): "Address mark not found for ID field",
+    (0x13, 0x00): "Address mark not found for data field",
+    (0x14, 0x00): "Recorded entity not found",
+    (0x14, 0x01): "Record not found",
+    (0x15, 0x00): "Random positioning error",
+    (0x15, 0x01): "Mechanical positioning error",
+    (0x16, 0x00): "Data synchronization mark error",
+    (0x17, 0x00): "Recovered data with no error correction applied",
+    (0x17, 0x01): "Recovered data with retries",
+    (0x18, 0x00): "Recovered data with error correction applied",
+    (0x18, 0x02): "Recovered data - data auto-reallocated",
+    (0x19, 0x00): "Defect list error",
+    (0x1A, 0x00): "Parameter list length error",
+    (0x1C, 0x00): "Defect list not found",
+    (0x1D, 0x00): "Miscompare during verify operation",
+    (0x20, 0x00): "Invalid command operation code",
+    (0x21, 0x00): "Logical block address out of range",
+    (0x24, 0x00): "Invalid field in CDB",
+    (0x25, 0x00): "Logical unit not supported",
+    (0x26, 0x00): "Invalid field in parameter list",
+    (0x27, 0x00): "Write protected",
+    (0x28, 0x00): "Not ready to ready change, medium may have changed",
+    (0x29, 0x00): "Power on, reset, or bus device reset occurred",
+    (0x29, 0x01): "Power on occurred",
+    (0x29, 0x02): "SCSI bus reset occurred",
+    (0x29, 0x03): "Bus device reset function occurred",
+    (0x29, 0x04): "Device internal reset",
+    (0x29, 0x07): "I_T nexus loss occurred",
+    (0x2A, 0x00): "Parameters changed",
+    (0x2A, 0x01): "Mode parameters changed",
+    (0x2A, 0x02): "Log parameters changed",
+    (0x2A, 0x09): "Capacity data has changed",
+    (0x2A, 0x10): "Timestamp changed",
+    (0x2C, 0x00): "Command sequence error",
+    (0x2F, 0x00): "Commands cleared by another initiator",
+    (0x2F, 0x01): "Commands cleared by power loss notification",
+    (0x31, 0x00): "Medium format corrupted",
+    (0x31, 0x01): "Format command failed",
+    (0x31, 0x03): "Sanitize command failed",
+    (0x32, 0x00): "No defect spare location available",
+    (0x32, 0x01): "Defect list update failure",
+    (0x35, 0x00): "Enclosure services failure",
+    (0x38, 0x07): "Thin provisioning soft threshold reached",
+    (0x3A, 0x00): "Medium not present",
+    (0x3E, 0x00): "Logical unit has not self-configured yet",
+    (0x3E, 0x01): "Logical unit failure",
+    (0x3E, 0x02): "Timeout on logical unit",
+    (0x3E, 0x03): "Logical unit failed self-test",
+    (0x3F, 0x00): "Target operating conditions have changed",
+    (0x3F, 0x01): "Microcode has been changed",
+    (0x3F, 0x03): "Inquiry data has changed",
+    (0x3F, 0x0E): "Reported LUNs data has changed",
+    (0x43, 0x00): "Message error",
+    (0x44, 0x00): "Internal target failure",
+    (0x45, 0x00): "Select or reselect failure",
+    (0x47, 0x00): "SCSI parity error",
+    (0x48, 0x00): "Initiator detected error message received",
+    (0x49, 0x00): "Invalid message error",
+    (0x4B, 0x00): "Data phase error",
+    (0x4C, 0x00): "Logical unit failed self-configuration",
+    (0x4E, 0x00): "Overlapped commands attempted",
+    (0x53, 0x00): "Media load or eject failed",
+    (0x55, 0x00): "System resource failure",
+    (0x5D, 0x00): "Failure prediction threshold exceeded",
+    (0x5D, 0x10): "Hardware impending failure general hard drive failure",
+    (0x5D, 0x30): "Data channel impending failure general hard drive failure",
+    (0x5D, 0x50): "Servo impending failure general hard drive failure",
+    (0x5D, 0x60): "Spindle impending failure general hard drive failure",
+    (0x5D, 0xFF): "Failure prediction threshold exceeded (false)",
+    (0x5E, 0x00): "Low power condition on",
+    (0x5E, 0x01): "Idle condition activated by timer",
+    (0x5E, 0x03): "Standby condition activated by timer",
+    (0x65, 0x00): "Voltage fault",
+    (0x67, 0x0A): "Set target port groups command failed",
+}
+
+# ASCs whose ASCQ is a component or task number rather than a distinct condition
+_ASC_RANGES = {
+    0x40: "Diagnostic failure on component {:02x}h",
+    0x4D: "Tagged overlapped commands, task tag {:02x}h",
+    0x70: "Decompression exception short algorithm id of {:02x}h",
+}
+
+
+def _build_descriptions() -> dict[tuple[int, int], str]:
+    table = dict(_ASC_TABLE)
+    for asc, template in _ASC_RANGES.items():
+        for ascq in range(0x100):
+            table.setdefault((asc, ascq), template.format(ascq))
+    return table
+
+
+ASC_DESCRIPTIONS: dict[tuple[int, int], str] = _build_descriptions()
+
+
+def asc_description(asc: int, ascq: int) -> str:
+    description = ASC_DESCRIPTIONS.get((asc, ascq))
+    if description is not None:
+        return description
+    if asc >= 0x80 or ascq >= 0x80:
+        return f"Vendor specific ASC/ASCQ {asc:02x}h/{ascq:02x}h"
+    return f"ASC/ASCQ {asc:02x}h/{ascq:02x}h"
+
+
+class sense_data:
+    """
+    Decoded sense. information is the INFORMATION field when the device marked it valid
+    (for medium errors, the first failing LBA); progress is the sense-key specific
+    progress indication as a fraction, for NOT READY and NO SENSE.
+    """
+    def __init__(self, response_code: int, key: int, asc: int, ascq: int, information: Optional[int] = None,
+                 command_specific: Optional[int] = None, sense_key_specific: Optional[bytes] = None,
+                 fru: int = 0):
+        self.response_code: int = response_code
+        self.key: int = key
+        self.asc: int = asc
+        self.ascq: int = ascq
+        self.information: Optional[int] = information
+        self.command_specific: Optional[int] = command_specific
+        self.sense_key_specific: Optional[bytes] = sense_key_specific
+        self.fru: int = fru
+
+    @property
+    def descriptor_format(self) -> bool:
+        return self.response_code in (0x72, 0x73)
+
+    @property
+    def deferred(self) -> bool:
+        return self.response_code in (0x71, 0x73)
+
+    @property
+    def key_name(self) -> str:
+        return SENSE_KEYS.get(self.key, f"sense key {self.key:x}h")
+
+    @property
+    def description(self) -> str:
+        return asc_description(self.asc, self.ascq)
+
+    @property
+    def progress(self) -> Optional[float]:
+        if self.sense_key_specific is None or self.key not in (NO_SENSE, NOT_READY):
+            return None
+        return ((self.sense_key_specific[1] << 8) | self.sense_key_specific[2]) / 0x10000
+
+    def __repr__(self) -> str:
+        return (f"sense_data(key=0x{self.key:x}, asc=0x{self.asc:02x}, ascq=0x{self.ascq:02x}, "
+                f"information={self.information})")
+
+    def __str__(self) -> str:
+        text = f"{self.key_name}, {self.description}"
+        if self.information is not None:
+            text += f", information {self.information}"
+        if self.progress is not None:
+            text += f", {100.0 * self.progress:.1f}% done"
+        if self.deferred:
+            text += " (deferred)"
+        return text
+
+
+def decode_sense(data) -> Optional[sense_data]:
+    """
+    Decodes fixed or descriptor format sense, or returns None if data is empty or
+    not sense data at all.
+    """
+    if data is None or len(data) < 1:
+        return None
+    response_code = data[0] & 0x7F
+    if response_code in (0x70, 0x71):
+        if len(data) < 3:
+            return None
+        key = data[2] & 0x0F
+        asc = data[12] if len(data) > 12 else 0
+        ascq = data[13] if len(data) > 13 else 0
+        information = struct.unpack_from(">I", data, 3)[0] if data[0] & 0x80 and len(data) >= 7 else None
+        command_specific = struct.unpack_from(">I", data, 8)[0] if len(data) >= 12 else None
+        sks = bytes(data[15:18]) if len(data) >= 18 and data[15] & 0x80 else None
+        fru = data[14] if len(data) > 14 else 0
+        return sense_data(response_code, key, asc, ascq, information, command_specific, sks, fru)
+    if response_code in (0x72, 0x73):
+        if len(data) < 4:
+            return None
+        result = sense_data(response_code, data[1] & 0x0F, data[2], data[3])
+        offset, end = 8, min(len(data), 8 + (data[7] if len(data) > 7 else 0))
+        while offset + 2 <= end:
+            kind, length = data[offset], data[offset + 1]
+            body = data[offset + 2:offset + 2 + length]
+            if kind == 0x00 and len(body) >= 10 and body[0] & 0x80:
+                result.information = struct.unpack_from(">Q", body, 2)[0]
+            elif kind == 0x01 and len(body) >= 10:
+                result.command_specific = struct.unpack_from(">Q", body, 2)[0]
+            elif kind == 0x02 and len(body) >= 5 and body[2] & 0x80:
+                result.sense_key_specific = bytes(body[2:5])
+            elif kind == 0x03 and len(body) >= 2:
+                result.fru = body[1]
+            offset += 2 + length
+        return result
+    return None
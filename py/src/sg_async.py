@@ -0,0 +1,349 @@
+"""
+asyncio interface to sg devices.
+
+async_scsi_device submits commands with the sg v3 write()/read() interface on a
+non-blocking file descriptor registered with the event loop (loop.add_reader), so a
+command is a future that resolves when the driver reports it complete. Nothing blocks
+the loop, and one thread can keep many commands in flight on hundreds of drives.
+"""
+import asyncio
+import ctypes
+import errno
+import os
+import struct
+import time
+from collections import deque
+from typing import Callable, Optional
+
+import metrics
+import scsi_cdb
+from retry import DEFAULT_POLICY, failure_detail, retry_policy
+from sg_queue import SG_MAX_QUEUE, sg_request
+from sg_transport import DEFAULT_TIMEOUT_MS, check_transfer, scsi_command_error, sg_io_hdr
+from verifier import DEFAULT_ZERO_BUFFER, zero_verifier
+
+STD_INQUIRY_LEN = 96
+
+
+class async_scsi_device:
+    """
+    Up to queue_depth commands in flight on one sg device, each in an sg_request slot
+    whose buffers are reused. Coroutines waiting for a slot queue up in order. The
+    device is opened on first use (or by open()) and must be closed with aclose() or
+    'async with' once commands are finished, on the loop that used it. retry decides
+    which failed commands are sent again.
+    """
+    def __init__(self, device: str, queue_depth: int = 8, max_transfer: int = 1 << 20,
+                 timeout_ms: int = DEFAULT_TIMEOUT_MS, retry: retry_policy = DEFAULT_POLICY):
+        if not 1 <= queue_depth <= SG_MAX_QUEUE:
+            raise ValueError(f"queue_depth must be between 1 and {SG_MAX_QUEUE}")
+        self.device: str = device
+        self.queue_depth: int = queue_depth
+        self.max_transfer: int = max_transfer
+        self.timeout_ms: int = timeout_ms
+        self.retry: retry_policy = retry
+        self.fd: int = -1
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._slots: list[sg_request] = [sg_request(i, max_transfer) for i in range(queue_depth)]
+        self._free: deque[sg_request] = deque(self._slots)
+        # Counts free slots; coroutines waiting for one are served in order
+        self._available = asyncio.Semaphore(queue_depth)
+        self._futures: dict[int, asyncio.Future] = {}
+        self._next_pack_id: int = 0
+        self._reply = sg_io_hdr()
+        self._reply_bytes = memoryview(self._reply).cast("B")
+        # device info, as on scsi_device
+        self.serial_number: Optional[str] = None
+        self.model: Optional[str] = None
+        self.vendor: Optional[str] = None
+        self.firmware_version: Optional[str] = None
+        self.size: int = 0
+        self.block_size: int = 0
+        self.no_blocks: int = 0
+        self.errors: list[str] = []
+
+    def __str__(self) -> str:
+        return f"{self.device}, {self.size} bytes, {self.block_size} bytes/block, {self.serial_number}, {self.model}, {self.vendor}, {self.firmware_version}"
+
+    async def __aenter__(self) -> "async_scsi_device":
+        self.open()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.aclose()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._futures)
+
+    def open(self) -> None:
+        """
+        Opens the device and registers it with the running event loop.
+        """
+        if self.fd >= 0:
+            return
+        self._loop = asyncio.get_running_loop()
+        self.fd = self._open()
+        self._loop.add_reader(self.fd, self._on_readable)
+
+    def _open(self) -> int:
+        return os.open(self.device, os.O_RDWR | os.O_NONBLOCK)
+
+    def _submit(self, slot: sg_request) -> None:
+        os.write(self.fd, slot._hdr_bytes)
+
+    def _read_reply(self) -> bool:
+        """
+        Reads one completed header into self._reply; False once none are left.
+        """
+        try:
+            os.readv(self.fd, [self._reply_bytes])
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return False
+            raise
+        return True
+
+    def _on_readable(self) -> None:
+        while self._futures:
+            try:
+                if not self._read_reply():
+                    break
+            except OSError as e:
+                # The driver could not hand back a completion; fail everything waiting on it
+                for future in self._futures.values():
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            slot = self._slots[self._reply.usr_ptr or 0]  # ctypes reads a NULL usr_ptr back as None
+            ctypes.memmove(ctypes.addressof(slot.hdr), ctypes.addressof(self._reply), ctypes.sizeof(sg_io_hdr))
+            slot.done = True
+            recorder = metrics.recorder
+            if recorder is not None and slot.submitted:
+                hdr = slot.hdr
+                recorder.record(self.device, slot.cdb[0], time.perf_counter() - slot.submitted, hdr.duration,
+                                hdr.resid, hdr.status, hdr.host_status, hdr.driver_status)
+                slot.submitted = 0.0
+            future = self._futures.pop(slot.index)
+            if future.cancelled():
+                # Nobody is left to consume the data
+                self.release(slot)
+            else:
+                future.set_result(slot)
+
+    def release(self, slot: sg_request) -> None:
+        """
+        Returns a slot obtained from submit() once its data has been consumed.
+        """
+        slot.attempts = 0
+        self._free.append(slot)
+        self._available.release()
+
+    async def submit(self, cdb: bytes, length: int, lba: int = 0, blocks: int = 0) -> asyncio.Future:
+        """
+        Waits for a free slot, queues a data-in command in it and returns a future that
+        resolves to the slot when the command completes. The caller checks the slot and
+        must release() it; the data is a view of the slot's buffer until then.
+        """
+        if length > self.max_transfer:
+            raise ValueError(f"Transfer of {length} bytes exceeds max_transfer {self.max_transfer}")
+        self.open()
+        await self._available.acquire()
+        slot = self._free.popleft()
+        slot.lba = lba
+        slot.blocks = blocks
+        try:
+            return self._issue(slot, cdb, length)
+        except BaseException:
+            self.release(slot)
+            raise
+
+    def _issue(self, slot: sg_request, cdb: bytes, length: int) -> asyncio.Future:
+        slot.prepare(cdb, length, self._next_pack_id, self.timeout_ms)
+        self._next_pack_id = (self._next_pack_id + 1) & 0x7FFFFFFF
+        if metrics.recorder is not None:
+            slot.submitted = time.perf_counter()
+        future = self._loop.create_future()
+        self._submit(slot)
+        self._futures[slot.index] = future
+        return future
+
+    async def resubmit(self, slot: sg_request, error: scsi_command_error, cdb: bytes,
+                       length: int) -> Optional[asyncio.Future]:
+        """
+        Sends a failed command again in the slot it failed in, after the retry policy's
+        backoff, and returns the new future; or None once the policy gives up, leaving
+        the slot to the caller to release.
+        """
+        slot.attempts += 1
+        if slot.attempts == 1:
+            slot.first_failure = time.monotonic()
+        wait = self.retry.delay(error, slot.attempts, time.monotonic() - slot.first_failure)
+        if wait is None:
+            return None
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return self._issue(slot, cdb, length)
+
+    async def read_data(self, cdb: bytes, length: int) -> bytes:
+        """
+        Sends one data-in command and returns a copy of the data it transferred.
+        """
+        slot = await (await self.submit(cdb, length))
+        try:
+            while True:
+                try:
+                    received = slot.check(self.device)
+                    return bytes(slot.view[:received])
+                except scsi_command_error as e:
+                    future = await self.resubmit(slot, e, cdb, length)
+                    if future is None:
+                        raise
+                    await future
+        finally:
+            self.release(slot)
+
+    async def read_capacity(self) -> bool:
+        """
+        As scsi_device.read_capacity: READ CAPACITY (10), then (16) if the last LBA saturates.
+        """
+        data = await self.read_data(scsi_cdb.read_capacity10(), scsi_cdb.READ_CAPACITY_10_REPLY_LEN)
+        if len(data) < scsi_cdb.READ_CAPACITY_10_REPLY_LEN:
+            raise RuntimeError("Invalid READ CAPACITY response")
+        last_lba, block_len = struct.unpack(">II", data)
+        if last_lba == scsi_cdb.READ_10_MAX_LBA:
+            data = await self.read_data(scsi_cdb.read_capacity16(), scsi_cdb.READ_CAPACITY_16_REPLY_LEN)
+            if len(data) < 12:
+                raise RuntimeError("Invalid READ CAPACITY (16) response")
+            last_lba, block_len = struct.unpack_from(">QI", data)
+        self.no_blocks = last_lba + 1
+        self.block_size = block_len
+        self.size = self.no_blocks * block_len
+        return True
+
+    async def read_inquiry(self) -> bool:
+        data = await self.read_data(scsi_cdb.inquiry(0, 0x00, STD_INQUIRY_LEN), STD_INQUIRY_LEN)
+        if len(data) < 36:
+            raise RuntimeError("Invalid INQUIRY response")
+        self.vendor = str(data[8:16], "ascii", "ignore").strip()
+        self.model = str(data[16:32], "ascii", "ignore").strip()
+        self.firmware_version = str(data[32:36], "ascii", "ignore").strip()
+        return True
+
+    async def read_serial(self) -> bool:
+        data = await self.read_data(scsi_cdb.inquiry(1, 0x80, STD_INQUIRY_LEN), STD_INQUIRY_LEN)
+        if len(data) < 4:
+            raise RuntimeError("Invalid serial number VPD response")
+        self.serial_number = str(data[4:4 + data[3]], "ascii", "ignore").strip()
+        return True
+
+    async def identify(self) -> bool:
+        """
+        INQUIRY, serial number and capacity, all three in flight together.
+        """
+        await asyncio.gather(self.read_inquiry(), self.read_serial(), self.read_capacity())
+        return True
+
+    async def blank_check(self, chunk_blocks: int = 1000,
+                          progress: Optional[Callable[[int, int], Optional[bool]]] = None) -> bool:
+        """
+        Reads the whole device with queue_depth READs in flight and returns True only if
+        every byte is zero. Chunks are verified in LBA order as they complete; a READ
+        that transfers less than its chunk fails the check. Failure
+        reasons are appended to self.errors; progress works as in scsi_device.blank_check
+        except that there is no console output without it.
+        """
+        if not self.no_blocks:
+            await self.read_capacity()
+        total_blocks, block_size = self.no_blocks, self.block_size
+        chunk_blocks = max(1, min(chunk_blocks, self.max_transfer // block_size))
+        verifier = zero_verifier(min(chunk_blocks * block_size, DEFAULT_ZERO_BUFFER))
+        pending: deque[asyncio.Future] = deque()
+        next_lba = 0
+
+        async def fill() -> None:
+            nonlocal next_lba
+            while len(pending) < self.queue_depth and next_lba < total_blocks:
+                blocks = min(chunk_blocks, total_blocks - next_lba)
+                pending.append(await self.submit(scsi_cdb.read(next_lba, blocks), blocks * block_size,
+                                                 next_lba, blocks))
+                next_lba += blocks
+
+        try:
+            await fill()
+            while pending:
+                slot = await pending[0]
+                try:
+                    received = check_transfer(self.device, slot.cdb, slot.check(self.device),
+                                              slot.blocks * block_size)
+                except scsi_command_error as e:
+                    # Retried in place at the head of the queue so chunks stay in LBA order
+                    future = await self.resubmit(slot, e, scsi_cdb.read(slot.lba, slot.blocks),
+                                                 slot.blocks * block_size)
+                    if future is not None:
+                        pending[0] = future
+                        continue
+                    pending.popleft()
+                    self.release(slot)
+                    command = "READ(16)" if scsi_cdb.needs_read16(slot.lba + slot.blocks - 1, slot.blocks) else "READ(10)"
+                    self.errors.append(f"{command} failed at LBA {slot.lba}{failure_detail(e)}: {e}")
+                    return False
+                pending.popleft()
+                try:
+                    found = verifier.locate(slot.view[:received], slot.lba, block_size)
+                    if found is not None:
+                        self.errors.append(f"Non-zero data found at LBA {found[0]}, byte offset {found[1]}")
+                        return False
+                    done = slot.lba + slot.blocks
+                finally:
+                    self.release(slot)
+                if progress is not None and progress(done, total_blocks) is False:
+                    self.errors.append(f"Blank check stopped at LBA {done}")
+                    return False
+                await fill()
+            return True
+        finally:
+            # Completions still owed for abandoned reads release their own slots
+            for future in pending:
+                if future.done() and not future.cancelled() and future.exception() is None:
+                    self.release(future.result())
+                else:
+                    future.cancel()
+
+    async def aclose(self) -> None:
+        """
+        Waits for commands still in flight, then unregisters and closes the device.
+        """
+        if self.fd < 0:
+            return
+        outstanding = list(self._futures.values())
+        if outstanding:
+            await asyncio.wait(outstanding, timeout=self.timeout_ms / 1000.0)
+        self._loop.remove_reader(self.fd)
+        self._close()
+        self.fd = -1
+
+    def _close(self) -> None:
+        os.close(self.fd)
+
+
+async def blank_check_devices(devices: list[str], queue_depth: int = 8, chunk_blocks: int = 1000,
+                              progress: Optional[Callable[[str, int, int], Optional[bool]]] = None,
+                              device_class: type = async_scsi_device) -> dict[str, list[str]]:
+    """
+    Blank checks every device concurrently on the running loop and returns the
+    errors found per device (an empty list means the device is blank).
+    progress, if given, is called with (device, blocks checked, total blocks).
+    """
+    async def check(device: str) -> list[str]:
+        dev = device_class(device, queue_depth=queue_depth)
+        try:
+            async with dev:
+                callback = None if progress is None else lambda done, total: progress(device, done, total)
+                await dev.blank_check(chunk_blocks, callback)
+        except (scsi_command_error, OSError, RuntimeError) as e:
+            dev.errors.append(str(e))
+        return dev.errors
+
+    results = await asyncio.gather(*(check(device) for device in devices))
+    return dict(zip(devices, results))
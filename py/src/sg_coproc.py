@@ -0,0 +1,255 @@
+"""
+Client for the C helper's co-process mode (c/scsi_serial --serve).
+
+One long-running process executes SG_IO for any number of devices, so where the ctypes
+ioctl path is not available commands still cost a pipe round trip instead of a
+fork/exec. Requests can also be pipelined with execute_batch.
+
+The binary is built from c/scsi_serial.c with 'make -C c'. Starting the co-process
+exchanges an empty handshake request first, so a build that predates --serve or speaks
+another protocol version is refused with a message saying to rebuild it.
+"""
+import os
+import struct
+import subprocess
+import threading
+import time
+from typing import Optional, Union
+
+import metrics
+from sg_transport import DEFAULT_TIMEOUT_MS, SG_INFO_OK, SG_INFO_OK_MASK, TRANSPORTS, scsi_command_error, sg_transport
+
+REQUEST_HDR = struct.Struct("<BBHIII")     # direction, cdb_len, device_len, transfer_len, timeout_ms, tag
+RESPONSE_HDR = struct.Struct("<IiBBHHHII")  # tag, error, status, sense_len, host, driver, info, duration, data_len
+DIR_NONE = 0
+DIR_FROM_DEV = 1
+DIR_TO_DEV = 2
+PIPE_WINDOW = 60 * 1024  # response bytes allowed in flight before a batch stops to read
+PROTOCOL_VERSION = 1     # must match PROTOCOL_VERSION in c/scsi_serial.c
+REBUILD_HINT = "rebuild it with 'make -C c'"
+
+DEFAULT_BINARY = os.environ.get(
+    "SCSI_COPROC",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "c", "scsi_serial"),
+)
+
+
+class coproc_result:
+    """
+    Outcome of one co-process command: the raw SG_IO status fields, sense data and the
+    number of data-in bytes received.
+    """
+    def __init__(self, tag: int, error: int, status: int, host_status: int, driver_status: int, info: int,
+                 duration: int, received: int, sense: bytes):
+        self.tag: int = tag
+        self.error: int = error
+        self.status: int = status
+        self.host_status: int = host_status
+        self.driver_status: int = driver_status
+        self.info: int = info
+        self.duration: int = duration
+        self.received: int = received
+        self.sense: bytes = sense
+
+    @property
+    def ok(self) -> bool:
+        return self.error == 0 and (self.info & SG_INFO_OK_MASK) == SG_INFO_OK
+
+
+class sg_coproc:
+    """
+    A running scsi_serial --serve process. Commands are framed onto its stdin and
+    results read back from its stdout in the same order. One lock serialises users,
+    so a single co-process can be shared by every transport in the program.
+    """
+    def __init__(self, binary: str = DEFAULT_BINARY):
+        if not os.access(binary, os.X_OK):
+            raise RuntimeError(f"{binary} not found or not executable, build it with 'make -C c'")
+        self.binary: str = binary
+        self._process = subprocess.Popen([binary, "--serve"], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                         bufsize=0)
+        self._stdin = self._process.stdin
+        self._stdout = self._process.stdout
+        self._tag: int = 0
+        self.lock = threading.Lock()
+        self._handshake()
+
+    def _handshake(self) -> None:
+        """
+        Sends the empty request a current --serve build answers with its protocol version.
+        A stale binary exits or answers with something else; either way it is stopped and
+        RuntimeError says to rebuild it.
+        """
+        header = bytearray(RESPONSE_HDR.size)
+        try:
+            self._write_all(REQUEST_HDR.pack(DIR_NONE, 0, 0, 0, 0, 0))
+            self._read_exact(memoryview(header))
+        except (RuntimeError, OSError):
+            self.close()
+            raise RuntimeError(f"{self.binary} does not support the co-process handshake (built before "
+                               f"--serve or from an older scsi_serial.c), {REBUILD_HINT}") from None
+        version = RESPONSE_HDR.unpack(header)[6]
+        if version != PROTOCOL_VERSION:
+            self.close()
+            raise RuntimeError(f"{self.binary} speaks co-process protocol {version}, expected "
+                               f"{PROTOCOL_VERSION}, {REBUILD_HINT}")
+
+    def _send(self, device: bytes, cdb: bytes, direction: int, length: int, data_out: Optional[bytes],
+              timeout_ms: int) -> int:
+        tag = self._tag
+        self._tag = (self._tag + 1) & 0xFFFFFFFF
+        self._write_all(REQUEST_HDR.pack(direction, len(cdb), len(device), length, timeout_ms, tag) + device + bytes(cdb))
+        if direction == DIR_TO_DEV and length:
+            self._write_all(memoryview(data_out))
+        return tag
+
+    def _write_all(self, data) -> None:
+        view = memoryview(data)
+        while len(view):
+            view = view[self._stdin.write(view):]
+
+    def _read_exact(self, view: memoryview) -> None:
+        while len(view):
+            n = self._stdout.readinto(view)
+            if not n:
+                raise RuntimeError(f"{self.binary} --serve exited (status {self._process.poll()})")
+            view = view[n:]
+
+    def _receive(self, data_in: Optional[memoryview]) -> coproc_result:
+        header = bytearray(RESPONSE_HDR.size)
+        self._read_exact(memoryview(header))
+        tag, error, status, sense_len, host, driver, info, duration, data_len = RESPONSE_HDR.unpack(header)
+        sense = bytearray(sense_len)
+        self._read_exact(memoryview(sense))
+        if data_len:
+            if data_in is None or data_len > len(data_in):
+                raise RuntimeError(f"Co-process returned {data_len} bytes for a {len(data_in or b'')} byte buffer")
+            # Straight into the caller's buffer, no intermediate bytes object
+            self._read_exact(data_in[:data_len])
+        return coproc_result(tag, error, status, host, driver, info, duration, data_len, bytes(sense))
+
+    @staticmethod
+    def _direction(data_in: Optional[memoryview], data_out: Optional[bytes]) -> tuple[int, int]:
+        if data_in is not None and len(data_in) > 0:
+            return DIR_FROM_DEV, len(data_in)
+        if data_out:
+            return DIR_TO_DEV, len(data_out)
+        return DIR_NONE, 0
+
+    def execute(self, device: str, cdb: bytes, data_in: Optional[memoryview] = None,
+                data_out: Optional[bytes] = None, timeout_ms: int = DEFAULT_TIMEOUT_MS) -> coproc_result:
+        direction, length = self._direction(data_in, data_out)
+        with self.lock:
+            self._send(os.fsencode(device), cdb, direction, length, data_out, timeout_ms)
+            return self._receive(data_in)
+
+    def execute_batch(self, commands: list[tuple[str, bytes, Optional[memoryview], Optional[bytes]]],
+                      timeout_ms: int = DEFAULT_TIMEOUT_MS) -> list[coproc_result]:
+        """
+        Runs (device, cdb, data_in, data_out) commands back to back. Requests are written
+        ahead of their responses, up to PIPE_WINDOW bytes of expected replies, so the
+        co-process never waits on this side between commands.
+        """
+        results: list[coproc_result] = []
+        with self.lock:
+            pending: list[Optional[memoryview]] = []
+            window = 0
+            for device, cdb, data_in, data_out in commands:
+                direction, length = self._direction(data_in, data_out)
+                reply = RESPONSE_HDR.size + (length if direction == DIR_FROM_DEV else 0)
+                if pending and window + reply > PIPE_WINDOW:
+                    results += [self._receive(view) for view in pending]
+                    pending, window = [], 0
+                self._send(os.fsencode(device), cdb, direction, length, data_out, timeout_ms)
+                pending.append(data_in)
+                window += reply
+            results += [self._receive(view) for view in pending]
+        return results
+
+    def close(self) -> None:
+        if self._process.poll() is None:
+            try:
+                self._stdin.close()
+            except OSError:
+                pass  # the process already went away
+            self._process.wait()
+        self._stdout.close()
+
+
+_shared: Optional[sg_coproc] = None
+_shared_lock = threading.Lock()
+
+
+def shared_coproc() -> sg_coproc:
+    """
+    The process-wide co-process, started on first use.
+    """
+    global _shared
+    with _shared_lock:
+        if _shared is None or _shared._process.poll() is not None:
+            _shared = sg_coproc()
+        return _shared
+
+
+class sg_coproc_transport(sg_transport):
+    """
+    Transport that sends every command through the shared scsi_serial co-process.
+    """
+    name = "coproc"
+
+    def __init__(self, device: str, coproc: Optional[sg_coproc] = None):
+        super().__init__(device)
+        self.coproc: sg_coproc = coproc or shared_coproc()
+
+    def _raise_on_error(self, cdb: bytes, result: coproc_result) -> None:
+        if result.error:
+            raise OSError(result.error, f"SG_IO on {self.device} failed: {os.strerror(result.error)}")
+        if not result.ok:
+            raise scsi_command_error(
+                f"SCSI command 0x{cdb[0]:02x} failed on {self.device}: status=0x{result.status:02x} "
+                f"host=0x{result.host_status:x} driver=0x{result.driver_status:x}",
+                opcode=cdb[0],
+                status=result.status,
+                host_status=result.host_status,
+                driver_status=result.driver_status,
+                sense=result.sense,
+            )
+
+    def execute(self, cdb: bytes, data_in: Optional[memoryview] = None, data_out: Optional[bytes] = None,
+                timeout_ms: int = DEFAULT_TIMEOUT_MS) -> int:
+        recorder = metrics.recorder
+        start = time.perf_counter() if recorder is not None else 0.0
+        result = self.coproc.execute(self.device, cdb, data_in, data_out, timeout_ms)
+        if recorder is not None:
+            recorder.record(self.device, cdb[0], time.perf_counter() - start, result.duration,
+                            (len(data_in) if data_in is not None else 0) - result.received,
+                            result.status, result.host_status, result.driver_status)
+        self._raise_on_error(cdb, result)
+        return result.received
+
+    def execute_batch(self, commands: list[tuple[bytes, Optional[memoryview]]],
+                      timeout_ms: int = DEFAULT_TIMEOUT_MS) -> list[Union[int, scsi_command_error]]:
+        """
+        Pipelines the commands through the co-process instead of one round trip each.
+        """
+        recorder = metrics.recorder
+        start = time.perf_counter() if recorder is not None else 0.0
+        batch = self.coproc.execute_batch([(self.device, cdb, data_in, None) for cdb, data_in in commands],
+                                          timeout_ms)
+        share = (time.perf_counter() - start) / len(batch) if recorder is not None and batch else 0.0
+        results: list[Union[int, scsi_command_error]] = []
+        for (cdb, data_in), result in zip(commands, batch):
+            if recorder is not None:
+                # Per-command wall time is not observable inside a pipeline; each gets an equal share
+                recorder.record(self.device, cdb[0], share, result.duration,
+                                (len(data_in) if data_in is not None else 0) - result.received,
+                                result.status, result.host_status, result.driver_status)
+            try:
+                self._raise_on_error(cdb, result)
+                results.append(result.received)
+            except scsi_command_error as e:
+                results.append(e)
+        return results
+
+
+TRANSPORTS[sg_coproc_transport.name] = sg_coproc_transport
@@ -0,0 +1,846 @@
+"""
+File-backed SCSI target for running the tools and benchmarks without a /dev/sg device.
+
+The emulator answers INQUIRY (standard and VPD), READ CAPACITY (10/16), READ (10/16),
+LOG SENSE, SEND DIAGNOSTIC and REQUEST SENSE from a (usually sparse) image file. Every
+opcode can be given a fixed latency, CHECK CONDITION errors can be injected per opcode
+or per LBA, and READs can be cut short with read_limit. Opened writable it also erases:
+SANITIZE, FORMAT UNIT, WRITE SAME (16) and UNMAP change the image, and a sanitize or
+format runs in the background for erase_seconds, reporting its progress through REQUEST
+SENSE like a real drive. A thin emulator answers GET LBA STATUS from the image's holes:
+a hole is a deallocated extent.
+
+It plugs in five ways:
+  emulated_transport         calls the emulator directly (open_transport(image, "emulated"))
+  emulated_sg_io_transport   runs the real sg_io_transport ctypes path, with the SG_IO ioctl
+                             answered by the emulator instead of the kernel
+  emulated_async_device      async_scsi_device with completions queued by the emulator and
+                             signalled through a pipe the event loop watches
+  emulated_async_queue       sg_async_queue completing its commands the same way
+  python3 sg_emulator.py     an sg_raw compatible command line, for the sg_raw transport;
+                             the device argument is the image file
+"""
+import collections
+import ctypes
+import hashlib
+import json
+import os
+import struct
+import sys
+import time
+from typing import Callable, Optional
+
+import metrics
+import scsi_cdb
+from retry import DEFAULT_POLICY, NO_RETRY, retry_policy
+from sg_async import async_scsi_device
+from sg_queue import sg_async_queue, sg_request
+from sg_transport import (DEFAULT_TIMEOUT_MS, SG_DXFER_FROM_DEV, SG_DXFER_TO_DEV, TRANSPORTS,
+                          scsi_command_error, sg_io_hdr, sg_io_transport, sg_transport)
+
+STATUS_GOOD = 0x00
+STATUS_CHECK_CONDITION = 0x02
+DRIVER_SENSE = 0x08
+SG_INFO_CHECK = 0x1
+
+SENSE_NO_SENSE = 0x0
+SENSE_NOT_READY = 0x2
+SENSE_MEDIUM_ERROR = 0x3
+SENSE_HARDWARE_ERROR = 0x4
+SENSE_ILLEGAL_REQUEST = 0x5
+SENSE_DATA_PROTECT = 0x7
+
+ASC_INVALID_OPCODE = (0x20, 0x00)
+ASC_LBA_OUT_OF_RANGE = (0x21, 0x00)
+ASC_INVALID_FIELD_IN_CDB = (0x24, 0x00)
+ASC_INVALID_FIELD_IN_PARAMETER_LIST = (0x26, 0x00)
+ASC_WRITE_PROTECTED = (0x27, 0x00)
+ASC_FORMAT_IN_PROGRESS = (0x04, 0x04)
+ASC_SANITIZE_IN_PROGRESS = (0x04, 0x1B)
+ASC_UNRECOVERED_READ_ERROR = (0x11, 0x00)
+ASC_SELF_TEST_IN_PROGRESS = (0x04, 0x09)
+
+UNMAP_MAX_BLOCKS = 1 << 22
+UNMAP_MAX_DESCRIPTORS = 64
+SELF_TEST_LOG_ENTRIES = 20
+SELF_TEST_IN_PROGRESS = 0xF
+SELF_TEST_ABORTED = 0x1
+CONFIG_ENV = "SG_EMULATOR_CONFIG"
+FALLOC_FL_KEEP_SIZE = 0x01
+FALLOC_FL_PUNCH_HOLE = 0x02
+FILL_BYTES = 1 << 20
+# Commands a drive still accepts while it is sanitizing or formatting
+ERASE_ALLOWED_OPCODES = (scsi_cdb.INQUIRY, scsi_cdb.REQUEST_SENSE, scsi_cdb.MAINTENANCE_IN)
+
+_libc = ctypes.CDLL(None, use_errno=True)
+
+
+class emulated_check_condition(Exception):
+    """
+    Raised by a command handler to end the command with CHECK CONDITION and the given sense data.
+    """
+    def __init__(self, sense: bytes):
+        super().__init__(f"check condition, sense {sense.hex()}")
+        self.sense: bytes = sense
+
+
+def fixed_sense(key: int, asc: int, ascq: int, information: Optional[int] = None) -> bytes:
+    """
+    Builds 18 bytes of fixed format sense data (response code 0x70). When information is
+    given (the failing LBA for medium errors) the VALID bit is set.
+    """
+    sense = bytearray(18)
+    sense[0] = 0x70 | (0x80 if information is not None else 0)
+    sense[2] = key & 0x0F
+    if information is not None:
+        struct.pack_into(">I", sense, 3, information & 0xFFFFFFFF)
+    sense[7] = 10
+    sense[12] = asc
+    sense[13] = ascq
+    return bytes(sense)
+
+
+class injected_error:
+    """
+    A CHECK CONDITION the emulator returns instead of running a command.
+    opcode selects the command; lba, if set, limits the error to READs covering that block.
+    count is how many times it fires before it disappears, None for every time.
+    """
+    def __init__(self, opcode: int, sense_key: int = SENSE_MEDIUM_ERROR, asc: int = ASC_UNRECOVERED_READ_ERROR[0],
+                 ascq: int = ASC_UNRECOVERED_READ_ERROR[1], lba: Optional[int] = None, count: Optional[int] = None):
+        self.opcode: int = opcode
+        self.sense_key: int = sense_key
+        self.asc: int = asc
+        self.ascq: int = ascq
+        self.lba: Optional[int] = lba
+        self.count: Optional[int] = count
+
+    def matches(self, opcode: int, lba: int, blocks: int) -> bool:
+        if opcode != self.opcode or self.count == 0:
+            return False
+        return self.lba is None or lba <= self.lba < lba + blocks
+
+    def fire(self) -> bytes:
+        if self.count is not None:
+            self.count -= 1
+        return fixed_sense(self.sense_key, self.asc, self.ascq, self.lba)
+
+
+def _payload(data_in: Optional[memoryview], payload: bytes, alloc_len: int) -> int:
+    """
+    Copies as much of a reply as the allocation length and the data-in buffer allow.
+    """
+    if data_in is None:
+        return 0
+    n = min(len(payload), alloc_len, len(data_in))
+    data_in[:n] = payload[:n]
+    return n
+
+
+class scsi_emulator:
+    """
+    One emulated logical unit backed by an image file. Capacity is the image size in
+    blocks; holes in a sparse image read back as zeros, just like an unwritten drive.
+    latency maps an opcode to seconds spent before the command completes.
+    Write commands need writable, otherwise they fail with DATA PROTECT like a
+    write-protected drive. sanitize says whether SANITIZE is implemented.
+    read_limit, if set, caps the bytes every READ transfers while it still completes
+    with GOOD status, the way a host adapter that truncates transfers would.
+    """
+    def __init__(self, image: str, block_size: int = 512, vendor: str = "EMULATED", model: str = "SPARSE IMAGE",
+                 revision: str = "0001", serial: Optional[str] = None, latency: Optional[dict[int, float]] = None,
+                 rotation_rate: int = 1, thin: bool = False, self_test_seconds: float = 2.0,
+                 writable: bool = False, sanitize: bool = True, erase_seconds: float = 2.0,
+                 read_limit: Optional[int] = None):
+        self.image: str = image
+        self.writable: bool = writable
+        self.fd: int = os.open(image, os.O_RDWR if writable else os.O_RDONLY)
+        self.block_size: int = block_size
+        self.blocks: int = os.fstat(self.fd).st_size // block_size
+        self.vendor: str = vendor
+        self.model: str = model
+        self.revision: str = revision
+        self.serial: str = serial or hashlib.sha1(os.path.abspath(image).encode()).hexdigest()[:16].upper()
+        self.latency: dict[int, float] = dict(latency or {})
+        self.rotation_rate: int = rotation_rate
+        self.thin: bool = thin
+        self.self_test_seconds: float = self_test_seconds
+        self.sanitize: bool = sanitize
+        self.erase_seconds: float = erase_seconds
+        self.read_limit: Optional[int] = read_limit
+        # The running sanitize or format: (not-ready ASC/ASCQ, start time)
+        self.erase: Optional[tuple[tuple[int, int], float]] = None
+        self.errors: list[injected_error] = []
+        self.commands: int = 0
+        self.bytes_read: int = 0
+        self.created: float = time.monotonic()
+        # Newest first: (self-test code, start time, aborted)
+        self.self_tests: list[tuple[int, float, bool]] = []
+        self.handlers: dict[int, Callable[[bytes, Optional[memoryview]], int]] = {
+            scsi_cdb.INQUIRY: self._inquiry,
+            scsi_cdb.READ_CAPACITY_10: self._read_capacity10,
+            scsi_cdb.SERVICE_ACTION_IN_16: self._service_action_in16,
+            scsi_cdb.READ_10: self._read10,
+            scsi_cdb.READ_16: self._read16,
+            scsi_cdb.LOG_SENSE: self._log_sense,
+            scsi_cdb.SEND_DIAGNOSTIC: self._send_diagnostic,
+            scsi_cdb.REQUEST_SENSE: self._request_sense,
+            scsi_cdb.MAINTENANCE_IN: self._maintenance_in,
+        }
+        self.write_handlers: dict[int, Callable[[bytes, Optional[bytes]], int]] = {
+            scsi_cdb.FORMAT_UNIT: self._format_unit,
+            scsi_cdb.WRITE_SAME_16: self._write_same16,
+            scsi_cdb.UNMAP: self._unmap,
+        }
+        if sanitize:
+            self.write_handlers[scsi_cdb.SANITIZE] = self._sanitize
+
+    @classmethod
+    def from_config(cls, image: str, config: dict) -> "scsi_emulator":
+        """
+        Builds an emulator from a JSON-style dict: constructor arguments, plus 'latency'
+        keyed by opcode (int or hex string) and 'errors' as injected_error arguments.
+        """
+        options = {k: v for k, v in config.items() if k not in ("latency", "errors")}
+        emulator = cls(image, latency={int(str(op), 0): s for op, s in config.get("latency", {}).items()}, **options)
+        for error in config.get("errors", []):
+            emulator.inject_error(**error)
+        return emulator
+
+    def inject_error(self, opcode: int, sense_key: int = SENSE_MEDIUM_ERROR, asc: int = ASC_UNRECOVERED_READ_ERROR[0],
+                     ascq: int = ASC_UNRECOVERED_READ_ERROR[1], lba: Optional[int] = None,
+                     count: Optional[int] = None) -> injected_error:
+        error = injected_error(opcode, sense_key, asc, ascq, lba, count)
+        self.errors.append(error)
+        return error
+
+    def close(self) -> None:
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def handle(self, cdb: bytes, data_in: Optional[memoryview] = None, data_out: Optional[bytes] = None) -> int:
+        """
+        Runs one command and returns the number of bytes written to data_in.
+        Raises emulated_check_condition when the command fails.
+        """
+        self.commands += 1
+        opcode = cdb[0]
+        delay = self.latency.get(opcode)
+        if delay:
+            time.sleep(delay)
+        if self._erase_running() and opcode not in ERASE_ALLOWED_OPCODES:
+            raise emulated_check_condition(fixed_sense(SENSE_NOT_READY, *self.erase[0]))
+
+        if self.errors:
+            lba, blocks = self._read_range(cdb)
+            for error in self.errors:
+                if error.matches(opcode, lba, blocks):
+                    raise emulated_check_condition(error.fire())
+
+        write_handler = self.write_handlers.get(opcode)
+        if write_handler is not None:
+            if not self.writable:
+                raise emulated_check_condition(fixed_sense(SENSE_DATA_PROTECT, *ASC_WRITE_PROTECTED))
+            return write_handler(cdb, data_out)
+        handler = self.handlers.get(opcode)
+        if handler is None:
+            raise emulated_check_condition(fixed_sense(SENSE_ILLEGAL_REQUEST, *ASC_INVALID_OPCODE))
+        return handler(cdb, data_in)
+
+    @staticmethod
+    def _read_range(cdb: bytes) -> tuple[int, int]:
+        if cdb[0] == scsi_cdb.READ_10:
+            return struct.unpack_from(">I", cdb, 2)[0], struct.unpack_from(">H", cdb, 7)[0]
+        if cdb[0] == scsi_cdb.READ_16:
+            return struct.unpack_from(">QI", cdb, 2)
+        return 0, 0
+
+    # READ
+
+    def _read(self, lba: int, blocks: int, data_in: Optional[memoryview]) -> int:
+        if lba + blocks > self.blocks:
+            raise emulated_check_condition(fixed_sense(SENSE_ILLEGAL_REQUEST, *ASC_LBA_OUT_OF_RANGE))
+        if data_in is None or blocks == 0:
+            return 0
+        length = min(blocks * self.block_size, len(data_in))
+        if self.read_limit is not None:
+            length = min(length, self.read_limit)
+        received = os.preadv(self.fd, [data_in[:length]], lba * self.block_size)
+        self.bytes_read += received
+        return received
+
+    def _read10(self, cdb: bytes, data_in: Optional[memoryview]) -> int:
+        return self._read(*self._read_range(cdb), data_in)
+
+    def _read16(self, cdb: bytes, data_in: Optional[memoryview]) -> int:
+        return self._read(*self._read_range(cdb), data_in)
+
+    # READ CAPACITY
+
+    def _read_capacity10(self, cdb: bytes, data_in: Optional[memoryview]) -> int:
+        last_lba = min(self.blocks - 1, scsi_cdb.READ_10_MAX_LBA)
+        return _payload(data_in, struct.pack(">II", last_lba, self.block_size), scsi_cdb.READ_CAPACITY_10_REPLY_LEN)
+
+    def _service_action_in16(self, cdb: bytes, data_in: Optional[memoryview]) -> int:
+        if cdb[1] & 0x1F == scsi_cdb.SA_GET_LBA_STATUS and self.thin:
+            return self._get_lba_status(cdb, data_in)
+        if cdb[1] & 0x1F != scsi_cdb.SA_READ_CAPACITY_16:
+            raise emulated_check_condition(fixed_sense(SENSE_ILLEGAL_REQUEST, *ASC_INVALID_FIELD_IN_CDB))
+        reply = bytearray(scsi_cdb.READ_CAPACITY_16_REPLY_LEN)
+        struct.pack_into(">QI", reply, 0, self.blocks - 1, self.block_size)
+        if self.thin:
+            reply[14] = 0xC0  # LBPME and LBPRZ: unmapped blocks read back as zeros
+        return _payload(data_in, reply, struct.unpack_from(">I", cdb, 10)[0])
+
+    def _get_lba_status(self, cdb: bytes, data_in: Optional[memoryview]) -> int:
+        """
+        Extents from the starting LBA on, found with SEEK_DATA and SEEK_HOLE: data is
+        mapped, holes are deallocated.
+        """
+        lba, alloc_len = struct.unpack_from(">QI", cdb, 2)
+        if lba >= self.blocks:
+            raise emulated_check_condition(fixed_sense(SENSE_ILLEGAL_REQUEST, *ASC_LBA_OUT_OF_RANGE))
+        size = self.blocks * self.block_size
+        descriptors = bytearray()
+        room = max(1, (alloc_len - 8) // scsi_cdb.LBA_STATUS_DESCRIPTOR_LEN)
+        while lba < self.blocks and len(descriptors) < room * scsi_cdb.LBA_STATUS_DESCRIPTOR_LEN:
+            offset = lba * self.block_size
+            try:
+                data = min(os.lseek(self.fd, offset, os.SEEK_DATA), size)
+            except OSError:
+                data = size  # ENXIO: nothing but hole up to the end
+            if data // self.block_size > lba:
+                end, status = data // self.block_size, 1
+            else:
+                # Any data in a block maps the whole block
+                hole = min(os.lseek(self.fd, data, os.SEEK_HOLE), size)
+                end, status = max(lba + 1, -(-hole // self.block_size)), 0
+            end = min(end, self.blocks, lba + 0xFFFFFFFF)
+            descriptors += struct.pack(">QIB3x", lba, end - lba, status)
+            lba = end
+        return _payload(data_in, struct.pack(">I4x", len(descriptors) + 4) + descriptors, alloc_len)
+
+    # INQUIRY
+
+    def _inquiry(self, cdb: bytes, data_in: Optional[memoryview]) -> int:
+        alloc_len = struct.unpack_from(">H", cdb, 3)[0]
+        if not cdb[1] & 0x01:
+            reply = bytearray(96)
+            reply[2] = 0x06            # SPC-4
+            reply[3] = 0x02            # response data format
+            reply[4] = len(reply) - 5
+            reply[8:16] = self.vendor.encode("ascii").ljust(8)[:8]
+            reply[16:32] = self.model.encode("ascii").ljust(16)[:16]
+            reply[32:36] = self.revision.encode("ascii").ljust(4)[:4]
+            return _payload(data_in, reply, alloc_len)
+
+        body = self._vpd_page(cdb[2])
+        if body is None:
+            raise emulated_check_condition(fixed_sense(SENSE_ILLEGAL_REQUEST, *ASC_INVALID_FIELD_IN_CDB))
+        return _payload(data_in, struct.pack(">BBH", 0x00, cdb[2], len(body)) + body, alloc_len)
+
+    def _vpd_page(self, page: int) -> Optional[bytes]:
+        if page == 0x00:
+            return bytes((0x00, 0x80, 0x83, 0xB0, 0xB1, 0xB2))
+        if page == 0x80:
+            return self.serial.encode("ascii")
+        if page == 0x83:
+            naa = 0x5 << 60 | int(hashlib.sha1(self.serial.encode()).hexdigest()[:15], 16)
+            t10 = self.vendor.encode("ascii").ljust(8)[:8] + self.serial.encode("ascii")
+            return (bytes((0x01, 0x03, 0x00, 8)) + struct.pack(">Q", naa)
+                    + bytes((0x02, 0x01, 0x00, len(t10))) + t10)
+        if page == 0xB0:
+            body = bytearray(0x3C)
+            max_blocks = (1 << 20) // self.block_size
+            struct.pack_into(">HII", body, 2, 8, max_blocks, max_blocks)
+            if self.thin:
+                # Maximum UNMAP LBA count and block descriptor count; WRITE SAME length unlimited
+                struct.pack_into(">II", body, 16, UNMAP_MAX_BLOCKS, UNMAP_MAX_DESCRIPTORS)
+            return bytes(body)
+        if page == 0xB1:
+            return struct.pack(">HBB", self.rotation_rate, 0, 0x03) + bytes(0x3C - 4)
+        if page == 0xB2:
+            flags = 0xC4 if self.thin else 0x00  # LBPU, LBPWS, LBPRZ=1
+            return bytes((0, flags, 0x02 if self.thin else 0x00, 0))
+        return None
+
+    # LOG SENSE
+
+    def _log_sense(self, cdb: bytes, data_in: Optional[memoryview]) -> int:
+        page = cdb[2] & 0x3F
+        alloc_len = struct.unpack_from(">H", cdb, 7)[0]
+        if cdb[3] != 0:
+            raise emulated_check_condition(fixed_sense(SENSE_ILLEGAL_REQUEST, *ASC_INVALID_FIELD_IN_CDB))
+        if page == 0x00:
+            params = bytes((0x00, 0x02, 0x03, 0x05, 0x0D, 0x0E, 0x10, 0x2F))
+        elif page in (0x02, 0x03, 0x05):
+            # Error counters: nothing ever fails, bytes processed counts READ data
+            processed = self.bytes_read if page == 0x03 else 0
+            params = b"".join(struct.pack(">HBBI", code, 0x02, 4, 0) for code in range(5))
+            params += struct.pack(">HBBQ", 0x0005, 0x02, 8, processed) + struct.pack(">HBBI", 0x0006, 0x02, 4, 0)
+        elif page == 0x0D:
+            params = struct.pack(">HBBxB", 0x0000, 0x03, 2, 35) + struct.pack(">HBBxB", 0x0001, 0x03, 2, 60)
+        elif page == 0x0E:
+            params = (struct.pack(">HBB4s2s", 0x0001, 0x01, 6, b"2024", b"01")
+                      + struct.pack(">HBB4s2s", 0x0002, 0x01, 6, b"2024", b"02")
+                      + struct.pack(">HBBI", 0x0003, 0x01, 4, 50000)
+                      + struct.pack(">HBBI", 0x0004, 0x01, 4, 12)
+                      + struct.pack(">HBBI", 0x0005, 0x01, 4, 600000)
+                      + struct.pack(">HBBI", 0x0006, 0x01, 4, 30))
+        elif page == 0x10:
+            params = self._self_test_results()
+        elif page == 0x2F:
+            params = struct.pack(">HBBBBBB", 0x0000, 0x03, 4, 0, 0, 35, 60)
+        else:
+            raise emulated_check_condition(fixed_sense(SENSE_ILLEGAL_REQUEST, *ASC_INVALID_FIELD_IN_CDB))
+        return _payload(data_in, struct.pack(">BBH", page, 0, len(params)) + params, alloc_len)
+
+    def _self_test_results(self) -> bytes:
+        """
+        Self-Test Results log page parameters: 20 entries of 20 bytes, newest first.
+        """
+        now = time.monotonic()
+        params = bytearray()
+        for number in range(1, SELF_TEST_LOG_ENTRIES + 1):
+            entry = bytearray(16)
+            if number <= len(self.self_tests):
+                code, started, aborted = self.self_tests[number - 1]
+                if aborted:
+                    result = SELF_TEST_ABORTED
+                elif now - started < self.self_test_seconds:
+                    result = SELF_TEST_IN_PROGRESS
+                else:
+                    result = 0
+                entry[0] = (code << 5) | result
+                hours = int((started - self.created) // 3600)
+                struct.pack_into(">HQ", entry, 2, hours & 0xFFFF, 0xFFFFFFFFFFFFFFFF)
+            params += struct.pack(">HBB", number, 0x03, len(entry)) + entry
+        return bytes(params)
+
+    # REQUEST SENSE
+
+    def _request_sense(self, cdb: bytes, data_in: Optional[memoryview]) -> int:
+        """
+        NO SENSE, or while a background self-test runs, SELF-TEST IN PROGRESS with the
+        fraction done (of 65536) in the sense-key specific progress indication. A running
+        sanitize or format reports NOT READY with its progress the same way.
+        """
+        sense = bytearray(fixed_sense(SENSE_NO_SENSE, 0, 0))
+        if self._erase_running():
+            sense = bytearray(fixed_sense(SENSE_NOT_READY, *self.erase[0]))
+            sense[15] = 0x80  # SKSV
+            elapsed = time.monotonic() - self.erase[1]
+            struct.pack_into(">H", sense, 16, int(elapsed / self.erase_seconds * 0x10000) & 0xFFFF)
+        elif self.self_tests:
+            _, started, aborted = self.self_tests[0]
+            elapsed = time.monotonic() - started
+            if not aborted and elapsed < self.self_test_seconds:
+                sense[12], sense[13] = ASC_SELF_TEST_IN_PROGRESS
+                sense[15] = 0x80  # SKSV
+                struct.pack_into(">H", sense, 16, int(elapsed / self.self_test_seconds * 0x10000) & 0xFFFF)
+        return _payload(data_in, bytes(sense), cdb[4])
+
+    # REPORT SUPPORTED OPERATION CODES
+
+    def _supports(self, opcode: int, service_action: Optional[int]) -> bool:
+        if opcode == scsi_cdb.SANITIZE:
+            return self.sanitize and service_action in (scsi_cdb.SANITIZE_OVERWRITE, scsi_cdb.SANITIZE_BLOCK_ERASE,
+                                                        scsi_cdb.SANITIZE_CRYPTO_ERASE,
+                                                        scsi_cdb.SANITIZE_EXIT_FAILURE_MODE)
+        if opcode == scsi_cdb.UNMAP:
+            return self.thin
+        if opcode == scsi_cdb.SERVICE_ACTION_IN_16:
+            return service_action == scsi_cdb.SA_READ_CAPACITY_16 or (self.thin and
+                                                                      service_action == scsi_cdb.SA_GET_LBA_STATUS)
+        if opcode == scsi_cdb.MAINTENANCE_IN:
+            return service_action == scsi_cdb.SA_REPORT_SUPPORTED_OPCODES
+        return service_action is None and (opcode in self.handlers or opcode in self.write_handlers)
+
+    def _maintenance_in(self, cdb: bytes, data_in: Optional[memoryview]) -> int:
+        options = cdb[2] & 0x07
+        if cdb[1] & 0x1F != scsi_cdb.SA_REPORT_SUPPORTED_OPCODES or options not in (scsi_cdb.RSOC_ONE_COMMAND,
+                                                                                    scsi_cdb.RSOC_ONE_SERVICE_ACTION):
+            raise emulated_check_condition(fixed_sense(SENSE_ILLEGAL_REQUEST, *ASC_INVALID_FIELD_IN_CDB))
+        opcode = cdb[3]
+        service_action = struct.unpack_from(">H", cdb, 4)[0] if options == scsi_cdb.RSOC_ONE_SERVICE_ACTION else None
+        if not self._supports(opcode, service_action):
+            reply = bytes((0, scsi_cdb.RSOC_NOT_SUPPORTED, 0, 0))
+        else:
+            cdb_len = 6 if opcode < 0x20 else 10 if opcode < 0x80 else 16 if opcode < 0xA0 else 12
+            reply = struct.pack(">BBH", 0, scsi_cdb.RSOC_SUPPORTED, cdb_len) + bytes((opcode,)) + b"\xff" * (cdb_len - 1)
+        return _payload(data_in, reply, struct.unpack_from(">I", cdb, 6)[0])
+
+    # SANITIZE, FORMAT UNIT, WRITE SAME, UNMAP
+
+    def _erase_running(self) -> bool:
+        if self.erase is not None and time.monotonic() - self.erase[1] >= self.erase_seconds:
+            self.erase = None
+        return self.erase is not None
+
+    def _start_erase(self, asc: tuple[int, int], immediate: bool) -> None:
+        """
+        Starts the background phase of a sanitize or format; without immediate the
+        command holds until it is over.
+        """
+        if immediate:
+            self.erase = (asc, time.monotonic())
+        else:
+            time.sleep(self.erase_seconds)
+
+    def _zero(self, lba: int, blocks: int) -> None:
+        """
+        Deallocates [lba, lba + blocks) by punching a hole, so it reads back as zeros.
+        """
+        offset, length = lba * self.block_size, blocks * self.block_size
+        if _libc.fallocate(self.fd, FALLOC_FL_PUNCH_HOLE | FALLOC_FL_KEEP_SIZE,
+                           ctypes.c_long(offset), ctypes.c_long(length)) == 0:
+            return
+        zeros = bytes(min(length, FILL_BYTES))
+        for start in range(offset, offset + length, len(zeros)):
+            os.pwrite(self.fd, zeros[:offset + length - start], start)
+
+    def _fill(self, lba: int, blocks: int, pattern: bytes) -> None:
+        """
+        Writes pattern, repeated to fill each block, to every block of [lba, lba + blocks).
+        """
+        block = (pattern * (self.block_size // len(pattern) + 1))[:self.block_size]
+        if not any(block):
+            self._zero(lba, blocks)
+            return
+        run = block * max(1, FILL_BYTES // self.block_size)
+        offset, end = lba * self.block_size, (lba + blocks) * self.block_size
+        for start in range(offset, end, len(run)):
+            os.pwrite(self.fd, run[:end - start], start)
+
+    def _sanitize(self, cdb: bytes, data_out: Optional[bytes]) -> int:
+        """
+        Overwrite writes the pattern from the parameter list; block and crypto erase leave
+        the image reading as zeros, as most SSDs do after a key change.
+        """
+        action = cdb[1] & 0x1F
+        if action == scsi_cdb.SANITIZE_EXIT_FAILURE_MODE:
+            return 0
+        if action == scsi_cdb.SANITIZE_OVERWRITE:
+            params = data_out or b""
+            pattern = params[4:4 + struct.unpack_from(">H", params, 2)[0]] if len(params) >= 4 else b""
+            if not pattern or len(pattern) > self.block_size:
+                raise emulated_check_condition(fixed_sense(SENSE_ILLEGAL_REQUEST, *ASC_INVALID_FIELD_IN_PARAMETER_LIST))
+            self._fill(0, self.blocks, pattern)
+        elif action in (scsi_cdb.SANITIZE_BLOCK_ERASE, scsi_cdb.SANITIZE_CRYPTO_ERASE):
+            self._zero(0, self.blocks)
+        else:
+            raise emulated_check_condition(fixed_sense(SENSE_ILLEGAL_REQUEST, *ASC_INVALID_FIELD_IN_CDB))
+        self._start_erase(ASC_SANITIZE_IN_PROGRESS, bool(cdb[1] & 0x80))
+        return 0
+
+    def _format_unit(self, cdb: bytes, data_out: Optional[bytes]) -> int:
+        """
+        Formats to zeros, or to the initialization pattern when the parameter list has one.
+        """
+        pattern, immediate = b"\x00", False
+        if cdb[1] & 0x10:
+            params = data_out or b""
+            if len(params) < 4:
+                raise emulated_check_condition(fixed_sense(SENSE_ILLEGAL_REQUEST, *ASC_INVALID_FIELD_IN_PARAMETER_LIST))
+            immediate = bool(params[1] & 0x80 and params[1] & 0x02)
+            if params[1] & 0x08 and len(params) >= 8:
+                pattern = params[8:8 + struct.unpack_from(">H", params, 6)[0]] or pattern
+        self._fill(0, self.blocks, pattern)
+        self._start_erase(ASC_FORMAT_IN_PROGRESS, immediate)
+        return 0
+
+    def _write_same16(self, cdb: bytes, data_out: Optional[bytes]) -> int:
+        lba, blocks = struct.unpack_from(">QI", cdb, 2)
+        if blocks == 0:
+            blocks = self.blocks - lba
+        if lba + blocks > self.blocks:
+            raise emulated_check_condition(fixed_sense(SENSE_ILLEGAL_REQUEST, *ASC_LBA_OUT_OF_RANGE))
+        if cdb[1] & 0x01:
+            self._zero(lba, blocks)
+            return 0
+        if not data_out or len(data_out) != self.block_size:
+            raise emulated_check_condition(fixed_sense(SENSE_ILLEGAL_REQUEST, *ASC_INVALID_FIELD_IN_CDB))
+        self._fill(lba, blocks, data_out)
+        return 0
+
+    def _unmap(self, cdb: bytes, data_out: Optional[bytes]) -> int:
+        if not self.thin:
+            raise emulated_check_condition(fixed_sense(SENSE_ILLEGAL_REQUEST, *ASC_INVALID_OPCODE))
+        params = data_out or b""
+        if len(params) < 8:
+            return 0
+        end = min(len(params), 8 + struct.unpack_from(">H", params, 2)[0])
+        for offset in range(8, end - scsi_cdb.UNMAP_DESCRIPTOR_LEN + 1, scsi_cdb.UNMAP_DESCRIPTOR_LEN):
+            lba, blocks = struct.unpack_from(">QI", params, offset)
+            if lba + blocks > self.blocks:
+                raise emulated_check_condition(fixed_sense(SENSE_ILLEGAL_REQUEST, *ASC_LBA_OUT_OF_RANGE))
+            self._zero(lba, blocks)
+        return 0
+
+    # SEND DIAGNOSTIC
+
+    def _send_diagnostic(self, cdb: bytes, data_in: Optional[memoryview]) -> int:
+        code = cdb[1] >> 5
+        if cdb[1] & 0x04 or code == 0:
+            return 0
+        if code == scsi_cdb.SELF_TEST_ABORT:
+            if self.self_tests:
+                test_code, started, _ = self.self_tests[0]
+                if time.monotonic() - started < self.self_test_seconds:
+                    self.self_tests[0] = (test_code, started, True)
+            return 0
+        if code not in (scsi_cdb.SELF_TEST_BACKGROUND_SHORT, scsi_cdb.SELF_TEST_BACKGROUND_EXTENDED,
+                        scsi_cdb.SELF_TEST_FOREGROUND_SHORT, scsi_cdb.SELF_TEST_FOREGROUND_EXTENDED):
+            raise emulated_check_condition(fixed_sense(SENSE_ILLEGAL_REQUEST, *ASC_INVALID_FIELD_IN_CDB))
+        started = time.monotonic()
+        if code in (scsi_cdb.SELF_TEST_FOREGROUND_SHORT, scsi_cdb.SELF_TEST_FOREGROUND_EXTENDED):
+            # Foreground tests hold the command until they finish and are logged as background codes
+            time.sleep(self.self_test_seconds)
+            code -= 4
+            started -= self.self_test_seconds
+        self.self_tests.insert(0, (code, started, False))
+        del self.self_tests[SELF_TEST_LOG_ENTRIES:]
+        return 0
+
+
+def _writable(flags: int) -> bool:
+    return flags & os.O_ACCMODE != os.O_RDONLY
+
+
+class emulated_transport(sg_transport):
+    """
+    Sends commands straight to a scsi_emulator; the device is the image file.
+    """
+    name = "emulated"
+
+    takes_open_flags = True
+
+    def __init__(self, device: str, emulator: Optional[scsi_emulator] = None, flags: int = os.O_RDONLY):
+        super().__init__(device)
+        self._owned: bool = emulator is None
+        self.emulator: scsi_emulator = emulator or scsi_emulator(device, writable=_writable(flags))
+
+    def execute(self, cdb: bytes, data_in: Optional[memoryview] = None, data_out: Optional[bytes] = None,
+                timeout_ms: int = DEFAULT_TIMEOUT_MS) -> int:
+        recorder = metrics.recorder
+        start = time.perf_counter() if recorder is not None else 0.0
+        try:
+            received = self.emulator.handle(cdb, data_in, data_out)
+        except emulated_check_condition as e:
+            if recorder is not None:
+                recorder.record(self.device, cdb[0], time.perf_counter() - start, None, 0,
+                                STATUS_CHECK_CONDITION, 0, DRIVER_SENSE)
+            raise scsi_command_error(
+                f"SCSI command 0x{cdb[0]:02x} failed on {self.device}: status=0x{STATUS_CHECK_CONDITION:02x}",
+                opcode=cdb[0], status=STATUS_CHECK_CONDITION, driver_status=DRIVER_SENSE, sense=e.sense,
+            )
+        if recorder is not None:
+            transferred = len(data_in) if data_in is not None else 0
+            recorder.record(self.device, cdb[0], time.perf_counter() - start, None, transferred - received)
+        return received
+
+    def close(self) -> None:
+        if self._owned:
+            self.emulator.close()
+
+
+class emulated_sg_io_transport(sg_io_transport):
+    """
+    The full sg_io_transport code path (ctypes header, CDB, sense and data buffers)
+    with the SG_IO ioctl answered by a scsi_emulator, so benchmarks measure the same
+    per-command work the real transport does minus the kernel.
+    """
+    name = "sg_io_emulated"
+
+    def __init__(self, device: str, flags: int = os.O_RDONLY, emulator: Optional[scsi_emulator] = None):
+        self._owned: bool = emulator is None
+        self.emulator: scsi_emulator = emulator or scsi_emulator(device, writable=_writable(flags))
+        super().__init__(device, flags)
+
+    def _open(self, flags: int) -> int:
+        return -1
+
+    def _submit(self, hdr: sg_io_hdr) -> None:
+        service_sg_header(self.emulator, hdr)
+
+    def close(self) -> None:
+        super().close()
+        if self._owned:
+            self.emulator.close()
+
+
+def service_sg_header(emulator: scsi_emulator, hdr: sg_io_hdr) -> None:
+    """
+    Executes the command described by an sg_io_hdr on the emulator and fills in the
+    header's status, sense, resid and duration the way the sg driver would.
+    """
+    start = time.perf_counter()
+    cdb = ctypes.string_at(hdr.cmdp, hdr.cmd_len)
+    data_in = data_out = None
+    if hdr.dxfer_len and hdr.dxfer_direction == SG_DXFER_FROM_DEV:
+        data_in = memoryview((ctypes.c_ubyte * hdr.dxfer_len).from_address(hdr.dxferp)).cast("B")
+    elif hdr.dxfer_len and hdr.dxfer_direction == SG_DXFER_TO_DEV:
+        data_out = ctypes.string_at(hdr.dxferp, hdr.dxfer_len)
+
+    hdr.status = hdr.masked_status = hdr.host_status = hdr.driver_status = hdr.sb_len_wr = 0
+    hdr.info = 0
+    transferred = 0
+    try:
+        transferred = emulator.handle(cdb, data_in, data_out)
+    except emulated_check_condition as e:
+        sense = e.sense[:hdr.mx_sb_len]
+        ctypes.memmove(hdr.sbp, sense, len(sense))
+        hdr.sb_len_wr = len(sense)
+        hdr.status = STATUS_CHECK_CONDITION
+        hdr.masked_status = STATUS_CHECK_CONDITION >> 1
+        hdr.driver_status = DRIVER_SENSE
+        hdr.info = SG_INFO_CHECK
+    hdr.resid = hdr.dxfer_len - transferred
+    hdr.duration = int((time.perf_counter() - start) * 1000)
+
+
+class emulated_async_device(async_scsi_device):
+    """
+    async_scsi_device whose commands are executed by a scsi_emulator as they are
+    submitted. Completed slots are queued and a byte is written to a pipe per
+    completion, so the event loop sees the same readiness it would on an sg fd.
+    """
+    def __init__(self, device: str, queue_depth: int = 8, max_transfer: int = 1 << 20,
+                 timeout_ms: int = DEFAULT_TIMEOUT_MS, emulator: Optional[scsi_emulator] = None,
+                 retry: retry_policy = DEFAULT_POLICY):
+        super().__init__(device, queue_depth, max_transfer, timeout_ms, retry)
+        self._owned: bool = emulator is None
+        self.emulator: scsi_emulator = emulator or scsi_emulator(device)
+        self._completed: collections.deque[sg_request] = collections.deque()
+        self._signal: int = -1
+
+    def _open(self) -> int:
+        read_fd, self._signal = os.pipe2(os.O_NONBLOCK)
+        return read_fd
+
+    def _submit(self, slot: sg_request) -> None:
+        service_sg_header(self.emulator, slot.hdr)
+        self._completed.append(slot)
+        os.write(self._signal, b"\0")
+
+    def _read_reply(self) -> bool:
+        if not self._completed:
+            return False
+        os.read(self.fd, 1)
+        slot = self._completed.popleft()
+        ctypes.memmove(ctypes.addressof(self._reply), ctypes.addressof(slot.hdr), ctypes.sizeof(sg_io_hdr))
+        return True
+
+    def _close(self) -> None:
+        os.close(self.fd)
+        os.close(self._signal)
+        if self._owned:
+            self.emulator.close()
+
+
+class emulated_async_queue(sg_async_queue):
+    """
+    sg_async_queue whose commands are executed by a scsi_emulator as they are submitted
+    and whose completions are signalled through a pipe, as in emulated_async_device.
+    """
+    def __init__(self, device: str, queue_depth: int = 8, max_transfer: int = 1 << 20,
+                 timeout_ms: int = DEFAULT_TIMEOUT_MS, retry: retry_policy = NO_RETRY,
+                 emulator: Optional[scsi_emulator] = None):
+        self._owned: bool = emulator is None
+        self.emulator: scsi_emulator = emulator or scsi_emulator(device)
+        self._completed: collections.deque[sg_request] = collections.deque()
+        self._signal: int = -1
+        super().__init__(device, queue_depth, max_transfer, timeout_ms, retry)
+
+    def _open(self) -> int:
+        read_fd, self._signal = os.pipe2(os.O_NONBLOCK)
+        return read_fd
+
+    def _submit(self, slot: sg_request) -> None:
+        service_sg_header(self.emulator, slot.hdr)
+        self._completed.append(slot)
+        os.write(self._signal, b"\0")
+
+    def _read_reply(self) -> bool:
+        if not self._completed:
+            return False
+        os.read(self.fd, 1)
+        slot = self._completed.popleft()
+        ctypes.memmove(ctypes.addressof(self._reply), ctypes.addressof(slot.hdr), ctypes.sizeof(sg_io_hdr))
+        return True
+
+    def _close(self) -> None:
+        os.close(self.fd)
+        os.close(self._signal)
+        if self._owned:
+            self.emulator.close()
+
+
+TRANSPORTS[emulated_transport.name] = emulated_transport
+TRANSPORTS[emulated_sg_io_transport.name] = emulated_sg_io_transport
+
+
+def create_image(path: str, blocks: int, block_size: int = 512) -> str:
+    """
+    Creates (or resizes) a sparse image file of blocks * block_size bytes, all zeros.
+    """
+    with open(path, "ab") as f:
+        f.truncate(blocks * block_size)
+    return path
+
+
+def sg_raw_main(argv: list[str]) -> int:
+    """
+    Enough of sg_raw's command line for sg_raw_transport: [-t secs] [-b] [-r len] [-s len] DEVICE CDB...
+    DEVICE is the image file. Emulator options come from the JSON file named by $SG_EMULATOR_CONFIG.
+    Each run is a fresh emulator, so injected errors with a count start over every command.
+    Exit status follows sg3_utils: 0 on success, the sense key on CHECK CONDITION.
+    """
+    binary = False
+    request_len = send_len = 0
+    args = iter(argv)
+    positional: list[str] = []
+    for arg in args:
+        if arg in ("-b", "--binary"):
+            binary = True
+        elif arg in ("-r", "--request"):
+            request_len = int(next(args), 0)
+        elif arg in ("-s", "--send"):
+            send_len = int(next(args), 0)
+        elif arg in ("-t", "--timeout"):
+            next(args)
+        else:
+            positional.append(arg)
+    if len(positional) < 2:
+        print("usage: sg_emulator.py [-t secs] [-b] [-r len] [-s len] IMAGE CDB...", file=sys.stderr)
+        return 1
+
+    config: dict = {}
+    if os.environ.get(CONFIG_ENV):
+        with open(os.environ[CONFIG_ENV]) as f:
+            config = json.load(f)
+    # sg_raw opens the device read-write
+    emulator = scsi_emulator.from_config(positional[0], {"writable": True, **config})
+    cdb = bytes(int(byte, 16) for byte in positional[1:])
+    data_out = sys.stdin.buffer.read(send_len) if send_len else None
+    data_in = memoryview(bytearray(request_len))
+    try:
+        received = emulator.handle(cdb, data_in if request_len else None, data_out)
+    except emulated_check_condition as e:
+        print(f"SCSI Status: Check Condition\n\nSense Information:\n {e.sense.hex(' ')}", file=sys.stderr)
+        return e.sense[2] & 0x0F or 1
+    finally:
+        emulator.close()
+
+    if binary:
+        sys.stdout.buffer.write(data_in[:received])
+    elif request_len:
+        print(f"Received {received} bytes of data:")
+        for offset in range(0, received, 16):
+            print(f" {offset:02x}     {data_in[offset:offset + 16].hex(' ')}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(sg_raw_main(sys.argv[1:]))
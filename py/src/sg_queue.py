@@ -0,0 +1,272 @@
+import ctypes
+import errno
+import os
+import select
+import time
+from collections import deque
+from typing import Iterator
+
+import metrics
+import scsi_cdb
+from retry import NO_RETRY, retry_policy
+from sg_transport import (
+    DEFAULT_TIMEOUT_MS,
+    MAX_CDB_LEN,
+    SENSE_BUFFER_LEN,
+    SG_DXFER_FROM_DEV,
+    SG_INFO_OK,
+    SG_INFO_OK_MASK,
+    check_transfer,
+    scsi_command_error,
+    sg_io_hdr,
+)
+
+SG_MAX_QUEUE = 16  # commands the sg driver accepts in flight on one file descriptor
+
+
+class sg_request:
+    """
+    One command slot of an sg_async_queue. The header, CDB, sense and data buffers
+    are allocated once and reused for every command submitted through the slot.
+    """
+    def __init__(self, index: int, data_len: int):
+        self.index: int = index
+        self.cdb = (ctypes.c_ubyte * MAX_CDB_LEN)()
+        self.sense = (ctypes.c_ubyte * SENSE_BUFFER_LEN)()
+        self.data: bytearray = bytearray(data_len)
+        self.view: memoryview = memoryview(self.data)
+        # Pins the bytearray so its address stays valid while commands are in flight
+        self._data_ptr = ctypes.c_ubyte.from_buffer(self.data)
+        self.hdr = sg_io_hdr()
+        self.hdr.interface_id = ord('S')
+        self.hdr.mx_sb_len = SENSE_BUFFER_LEN
+        self.hdr.cmdp = ctypes.addressof(self.cdb)
+        self.hdr.sbp = ctypes.addressof(self.sense)
+        self.hdr.dxferp = ctypes.addressof(self._data_ptr)
+        self.hdr.usr_ptr = index
+        self._hdr_bytes = memoryview(self.hdr).cast("B")
+        # Set by the caller when the slot is submitted, for matching results to work
+        self.lba: int = 0
+        self.blocks: int = 0
+        self.done: bool = False
+        self.submitted: float = 0.0
+        # Retries of the current command, for the retry policy
+        self.attempts: int = 0
+        self.first_failure: float = 0.0
+
+    def prepare(self, cdb: bytes, length: int, pack_id: int, timeout_ms: int) -> None:
+        hdr = self.hdr
+        ctypes.memmove(self.cdb, cdb, len(cdb))
+        hdr.cmd_len = len(cdb)
+        hdr.dxfer_direction = SG_DXFER_FROM_DEV
+        hdr.dxfer_len = length
+        hdr.pack_id = pack_id
+        hdr.timeout = timeout_ms
+        self.done = False
+
+    def check(self, device: str) -> int:
+        """
+        Raises scsi_command_error if the completed command failed, otherwise returns
+        the number of bytes transferred.
+        """
+        hdr = self.hdr
+        if (hdr.info & SG_INFO_OK_MASK) != SG_INFO_OK:
+            raise scsi_command_error(
+                f"SCSI command 0x{self.cdb[0]:02x} failed on {device}: status=0x{hdr.status:02x} "
+                f"host=0x{hdr.host_status:x} driver=0x{hdr.driver_status:x}",
+                opcode=self.cdb[0],
+                status=hdr.status,
+                host_status=hdr.host_status,
+                driver_status=hdr.driver_status,
+                sense=bytes(self.sense[:hdr.sb_len_wr]),
+            )
+        return hdr.dxfer_len - hdr.resid
+
+
+class sg_async_queue:
+    """
+    Keeps up to queue_depth commands in flight on one sg file descriptor using the
+    sg v3 asynchronous interface: write() submits a header, read() returns the header
+    of whichever command completed first and poll() reports when one is ready.
+    Each command carries its slot index in usr_ptr and a running tag in pack_id.
+    retry decides which failed reads read_stream sends again.
+    """
+    def __init__(self, device: str, queue_depth: int = 8, max_transfer: int = 1 << 20,
+                 timeout_ms: int = DEFAULT_TIMEOUT_MS, retry: retry_policy = NO_RETRY):
+        if not 1 <= queue_depth <= SG_MAX_QUEUE:
+            raise ValueError(f"queue_depth must be between 1 and {SG_MAX_QUEUE}")
+        self.device: str = device
+        self.queue_depth: int = queue_depth
+        self.timeout_ms: int = timeout_ms
+        self.retry: retry_policy = retry
+        self.fd: int = self._open()
+        self._poll = select.poll()
+        self._poll.register(self.fd, select.POLLIN)
+        self._slots: list[sg_request] = [sg_request(i, max_transfer) for i in range(queue_depth)]
+        self._free: deque[sg_request] = deque(self._slots)
+        self._in_flight: int = 0
+        self._next_pack_id: int = 0
+        self._reply = sg_io_hdr()
+        self._reply_bytes = memoryview(self._reply).cast("B")
+
+    def __enter__(self) -> "sg_async_queue":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def _open(self) -> int:
+        return os.open(self.device, os.O_RDWR | os.O_NONBLOCK)
+
+    def _submit(self, slot: sg_request) -> None:
+        os.write(self.fd, slot._hdr_bytes)
+
+    def _read_reply(self) -> bool:
+        """
+        Reads one completed header into self._reply; False once none are left.
+        """
+        try:
+            os.readv(self.fd, [self._reply_bytes])
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return False
+            raise
+        return True
+
+    def submit(self, cdb: bytes, length: int, lba: int = 0, blocks: int = 0) -> sg_request:
+        """
+        Queues a data-in command in a free slot and returns the slot. Raises
+        RuntimeError if every slot is already in flight.
+        """
+        if not self._free:
+            raise RuntimeError("No free command slots, reap completions first")
+        slot = self._free.popleft()
+        slot.lba = lba
+        slot.blocks = blocks
+        try:
+            self._issue(slot, cdb, length)
+        except BaseException:
+            self._free.appendleft(slot)
+            raise
+        return slot
+
+    def _issue(self, slot: sg_request, cdb: bytes, length: int) -> None:
+        slot.prepare(cdb, length, self._next_pack_id, self.timeout_ms)
+        self._next_pack_id = (self._next_pack_id + 1) & 0x7FFFFFFF
+        if metrics.recorder is not None:
+            slot.submitted = time.perf_counter()
+        self._submit(slot)
+        self._in_flight += 1
+
+    def release(self, slot: sg_request) -> None:
+        """
+        Returns a completed slot to the free list once its data has been consumed.
+        """
+        slot.attempts = 0
+        self._free.append(slot)
+
+    def reap(self, timeout_ms: int = -1) -> list[sg_request]:
+        """
+        Waits up to timeout_ms (-1 waits forever) for completions and returns every
+        slot that finished. Completed slots stay reserved until release() is called.
+        """
+        completed: list[sg_request] = []
+        if self._in_flight == 0:
+            return completed
+        if not self._poll.poll(timeout_ms):
+            return completed
+        while self._in_flight:
+            if not self._read_reply():
+                break
+            slot = self._slots[self._reply.usr_ptr or 0]  # ctypes reads a NULL usr_ptr back as None
+            ctypes.memmove(ctypes.addressof(slot.hdr), ctypes.addressof(self._reply), ctypes.sizeof(sg_io_hdr))
+            slot.done = True
+            recorder = metrics.recorder
+            if recorder is not None and slot.submitted:
+                # Wall time here includes time spent queued behind other commands
+                hdr = slot.hdr
+                recorder.record(self.device, slot.cdb[0], time.perf_counter() - slot.submitted, hdr.duration,
+                                hdr.resid, hdr.status, hdr.host_status, hdr.driver_status)
+                slot.submitted = 0.0
+            self._in_flight -= 1
+            completed.append(slot)
+        return completed
+
+    def read_stream(self, start_lba: int, total_blocks: int, chunk_blocks: int,
+                    block_size: int) -> Iterator[tuple[int, int, memoryview]]:
+        """
+        Reads total_blocks starting at start_lba with READ(10)/READ(16) commands of chunk_blocks each,
+        keeping the queue full. Yields (lba, blocks, data) in LBA order; data is only
+        valid until the generator is resumed, when its slot is reused for a new read.
+        A read that transfers less than its chunk fails like any other (short_transfer_error).
+        A failed read the retry policy allows is resubmitted in its own slot while the
+        reads behind it stay queued.
+        """
+        if chunk_blocks * block_size > len(self._slots[0].data):
+            raise ValueError("chunk_blocks * block_size exceeds the queue's max_transfer")
+        pending: deque[sg_request] = deque()
+        next_lba = start_lba
+        end_lba = start_lba + total_blocks
+        try:
+            while pending or next_lba < end_lba:
+                while self._free and next_lba < end_lba:
+                    blocks = min(chunk_blocks, end_lba - next_lba)
+                    pending.append(self.submit(scsi_cdb.read(next_lba, blocks), blocks * block_size,
+                                               next_lba, blocks))
+                    next_lba += blocks
+
+                head = pending[0]
+                while not head.done:
+                    self.reap()
+                try:
+                    received = check_transfer(self.device, head.cdb, head.check(self.device),
+                                              head.blocks * block_size)
+                except scsi_command_error as e:
+                    if self._retry(head, e, block_size):
+                        continue
+                    pending.popleft()
+                    self.release(head)
+                    raise
+                pending.popleft()
+                try:
+                    yield head.lba, head.blocks, head.view[:received]
+                finally:
+                    self.release(head)
+        finally:
+            # Collect anything still queued so the slots can be reused or closed cleanly
+            for slot in pending:
+                while not slot.done and self._in_flight:
+                    if not self.reap(self.timeout_ms):
+                        break
+                if slot.done:
+                    self.release(slot)
+
+    def _retry(self, slot: sg_request, error: scsi_command_error, block_size: int) -> bool:
+        """
+        Resubmits a failed read in the same slot if the retry policy allows another
+        attempt, waiting out its backoff first. Returns False once it does not.
+        """
+        slot.attempts += 1
+        if slot.attempts == 1:
+            slot.first_failure = time.monotonic()
+        wait = self.retry.delay(error, slot.attempts, time.monotonic() - slot.first_failure)
+        if wait is None:
+            return False
+        if wait > 0:
+            time.sleep(wait)
+        self._issue(slot, scsi_cdb.read(slot.lba, slot.blocks), slot.blocks * block_size)
+        return True
+
+    def close(self) -> None:
+        if self.fd >= 0:
+            while self._in_flight and self.reap(self.timeout_ms):
+                pass
+            self._close()
+            self.fd = -1
+
+    def _close(self) -> None:
+        os.close(self.fd)
@@ -0,0 +1,336 @@
+import abc
+import ctypes
+import fcntl
+import os
+import subprocess
+import time
+from typing import Optional, Union
+
+import metrics
+from buffer_pool import buffer_pool
+from sense import SENSE_KEYS, decode_sense, sense_data
+
+SG_IO = 0x2285
+SG_DXFER_NONE = -1
+SG_DXFER_TO_DEV = -2
+SG_DXFER_FROM_DEV = -3
+SG_FLAG_MMAP_IO = 0x20
+SG_GET_RESERVED_SIZE = 0x2272
+SG_SET_RESERVED_SIZE = 0x2275
+SG_INFO_OK_MASK = 0x1
+SG_INFO_OK = 0x0
+SENSE_BUFFER_LEN = 32
+# sg3_utils exit status -> sense key; 3 covers both MEDIUM and HARDWARE ERROR
+SG_RAW_EXIT_SENSE_KEYS = {2: 0x2, 3: 0x3, 5: 0x5, 6: 0x6, 11: 0xB}
+MAX_CDB_LEN = 16
+DEFAULT_TIMEOUT_MS = 5000
+
+
+class sg_io_hdr(ctypes.Structure):
+    _fields_ = [
+        ("interface_id", ctypes.c_int),
+        ("dxfer_direction", ctypes.c_int),
+        ("cmd_len", ctypes.c_ubyte),
+        ("mx_sb_len", ctypes.c_ubyte),
+        ("iovec_count", ctypes.c_ushort),
+        ("dxfer_len", ctypes.c_uint),
+        ("dxferp", ctypes.c_void_p),
+        ("cmdp", ctypes.c_void_p),
+        ("sbp", ctypes.c_void_p),
+        ("timeout", ctypes.c_uint),
+        ("flags", ctypes.c_uint),
+        ("pack_id", ctypes.c_int),
+        ("usr_ptr", ctypes.c_void_p),
+        ("status", ctypes.c_ubyte),
+        ("masked_status", ctypes.c_ubyte),
+        ("msg_status", ctypes.c_ubyte),
+        ("sb_len_wr", ctypes.c_ubyte),
+        ("host_status", ctypes.c_ushort),
+        ("driver_status", ctypes.c_ushort),
+        ("resid", ctypes.c_int),
+        ("duration", ctypes.c_uint),
+        ("info", ctypes.c_uint),
+    ]
+
+
+class scsi_command_error(RuntimeError):
+    """
+    Raised when a SCSI command does not complete with GOOD status.
+    Carries the raw status fields and any sense data returned by the device
+    so callers can decide whether the failure is worth retrying. Decoded sense
+    is appended to the message. Transports that only learn a sense key (sg_raw
+    reports it as its exit status) pass it as sense_key instead.
+    """
+    def __init__(self, message: str, opcode: int = 0, status: int = 0, host_status: int = 0,
+                 driver_status: int = 0, sense: bytes = b"", sense_key: Optional[int] = None):
+        self.decoded: Optional[sense_data] = decode_sense(sense)
+        if self.decoded is not None:
+            message = f"{message}: {self.decoded}"
+        super().__init__(message)
+        self.opcode: int = opcode
+        self.status: int = status
+        self.host_status: int = host_status
+        self.driver_status: int = driver_status
+        self.sense: bytes = sense
+        self._sense_key: Optional[int] = sense_key
+
+    @property
+    def sense_key(self) -> Optional[int]:
+        return self.decoded.key if self.decoded is not None else self._sense_key
+
+    @property
+    def asc(self) -> Optional[tuple[int, int]]:
+        return (self.decoded.asc, self.decoded.ascq) if self.decoded is not None else None
+
+    @property
+    def lba(self) -> Optional[int]:
+        """
+        The failing LBA the device reported in the sense INFORMATION field, if any.
+        """
+        return self.decoded.information if self.decoded is not None else None
+
+
+class short_transfer_error(scsi_command_error):
+    """
+    Raised when a data-in command completed with GOOD status but transferred fewer bytes
+    than it asked for (a non-zero residual). Whatever the buffer held before is still in
+    the part that did not arrive, so the data must not be verified or copied as is.
+    received and expected are in bytes.
+    """
+    def __init__(self, message: str, opcode: int = 0, received: int = 0, expected: int = 0):
+        super().__init__(message, opcode=opcode)
+        self.received: int = received
+        self.expected: int = expected
+
+
+def check_transfer(device: str, cdb: bytes, received: int, expected: int) -> int:
+    """
+    Returns received, or raises short_transfer_error if a data-in command moved fewer
+    than expected bytes. Every READ whose data is verified, hashed or copied goes
+    through this.
+    """
+    if received != expected:
+        raise short_transfer_error(
+            f"SCSI command 0x{cdb[0]:02x} on {device} transferred {received} of {expected} bytes",
+            opcode=cdb[0], received=received, expected=expected,
+        )
+    return received
+
+
+class sg_transport(abc.ABC):
+    """
+    Base class for the ways a SCSI command can reach a device.
+    A transport takes a CDB plus an optional data-in buffer (filled in place) or
+    data-out payload and returns the number of bytes the device transferred.
+    Subclasses implement execute; everything else is built on it.
+    """
+    name: str = "base"
+    # Transports that open the device node themselves take open() flags as flags=
+    takes_open_flags: bool = False
+
+    def __init__(self, device: str):
+        self.device: str = device
+        self.pool: buffer_pool = buffer_pool()
+        self._scratch: Optional[memoryview] = None
+
+    @abc.abstractmethod
+    def execute(self, cdb: bytes, data_in: Optional[memoryview] = None, data_out: Optional[bytes] = None,
+                timeout_ms: int = DEFAULT_TIMEOUT_MS) -> int:
+        """
+        Runs one command and returns the bytes transferred; raises scsi_command_error
+        unless it completed with GOOD status.
+        """
+
+    def read_data(self, cdb: bytes, length: int, timeout_ms: int = DEFAULT_TIMEOUT_MS) -> memoryview:
+        """
+        Runs a data-in command into the transport's pooled scratch buffer and returns a
+        view of the bytes received. The view is only valid until the next read_data call.
+        """
+        if self._scratch is None or len(self._scratch) < length:
+            if self._scratch is not None:
+                self.pool.release(self._scratch)
+            self._scratch = self.pool.acquire(length)
+        received = self.execute(cdb, self._scratch[:length], timeout_ms=timeout_ms)
+        return self._scratch[:received]
+
+    def execute_batch(self, commands: list[tuple[bytes, Optional[memoryview]]],
+                      timeout_ms: int = DEFAULT_TIMEOUT_MS) -> list[Union[int, scsi_command_error]]:
+        """
+        Runs (cdb, data_in) commands in order and returns, per command, the bytes received
+        or the scsi_command_error it failed with, so one refused command does not stop the
+        rest. Transports that can pipeline commands override this.
+        """
+        results: list[Union[int, scsi_command_error]] = []
+        for cdb, data_in in commands:
+            try:
+                results.append(self.execute(cdb, data_in, timeout_ms=timeout_ms))
+            except scsi_command_error as e:
+                results.append(e)
+        return results
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self) -> "sg_transport":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class sg_io_transport(sg_transport):
+    """
+    Issues commands with the SG_IO ioctl on a file descriptor that stays open for
+    the lifetime of the transport. The header, CDB and sense buffers are allocated
+    once and reused, and data-in goes straight into the caller's buffer.
+    """
+    name = "sg_io"
+    takes_open_flags = True
+
+    def __init__(self, device: str, flags: int = os.O_RDONLY):
+        super().__init__(device)
+        self.fd: int = self._open(flags)
+        self._cdb = (ctypes.c_ubyte * MAX_CDB_LEN)()
+        self._sense = (ctypes.c_ubyte * SENSE_BUFFER_LEN)()
+        self._hdr = sg_io_hdr()
+        self._hdr.interface_id = ord('S')
+        self._hdr.mx_sb_len = SENSE_BUFFER_LEN
+        self._hdr.cmdp = ctypes.addressof(self._cdb)
+        self._hdr.sbp = ctypes.addressof(self._sense)
+
+    def execute(self, cdb: bytes, data_in: Optional[memoryview] = None, data_out: Optional[bytes] = None,
+                timeout_ms: int = DEFAULT_TIMEOUT_MS) -> int:
+        hdr = self._hdr
+        ctypes.memmove(self._cdb, cdb, len(cdb))
+        hdr.cmd_len = len(cdb)
+        hdr.timeout = timeout_ms
+
+        # Keep a reference to the ctypes view so the buffer stays exported during the ioctl
+        buf = None
+        if data_in is not None and len(data_in) > 0:
+            buf = ctypes.c_ubyte.from_buffer(data_in)
+            hdr.dxfer_direction = SG_DXFER_FROM_DEV
+            hdr.dxfer_len = len(data_in)
+        elif data_out is not None and len(data_out) > 0:
+            try:
+                buf = ctypes.c_ubyte.from_buffer(data_out)
+            except TypeError:
+                # Read-only payloads such as bytes have to be copied once
+                buf = (ctypes.c_ubyte * len(data_out)).from_buffer_copy(data_out)
+            hdr.dxfer_direction = SG_DXFER_TO_DEV
+            hdr.dxfer_len = len(data_out)
+        else:
+            hdr.dxfer_direction = SG_DXFER_NONE
+            hdr.dxfer_len = 0
+        hdr.dxferp = ctypes.addressof(buf) if buf is not None else None
+        return self._issue(cdb)
+
+    def _issue(self, cdb: bytes) -> int:
+        """
+        Submits the prepared header, recording the command if instrumentation is enabled.
+        """
+        hdr = self._hdr
+        recorder = metrics.recorder
+        if recorder is None:
+            self._submit(hdr)
+        else:
+            start = time.perf_counter()
+            self._submit(hdr)
+            recorder.record(self.device, cdb[0], time.perf_counter() - start, hdr.duration, hdr.resid,
+                            hdr.status, hdr.host_status, hdr.driver_status)
+        return self._check(cdb)
+
+    def _check(self, cdb: bytes) -> int:
+        """
+        Raises scsi_command_error unless the last command completed cleanly,
+        otherwise returns the number of bytes it transferred.
+        """
+        hdr = self._hdr
+        if (hdr.info & SG_INFO_OK_MASK) != SG_INFO_OK:
+            raise scsi_command_error(
+                f"SCSI command 0x{cdb[0]:02x} failed on {self.device}: status=0x{hdr.status:02x} "
+                f"host=0x{hdr.host_status:x} driver=0x{hdr.driver_status:x}",
+                opcode=cdb[0],
+                status=hdr.status,
+                host_status=hdr.host_status,
+                driver_status=hdr.driver_status,
+                sense=bytes(self._sense[:hdr.sb_len_wr]),
+            )
+        return hdr.dxfer_len - hdr.resid
+
+    def _open(self, flags: int) -> int:
+        return os.open(self.device, flags)
+
+    def _submit(self, hdr: sg_io_hdr) -> None:
+        fcntl.ioctl(self.fd, SG_IO, hdr)
+
+    def close(self) -> None:
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class sg_raw_transport(sg_transport):
+    """
+    Fallback transport that starts one sg_raw (sg3_utils) process per command.
+    Only useful where the SG_IO ioctl is not available to Python; every command
+    pays a fork/exec.
+    """
+    name = "sg_raw"
+
+    def execute(self, cdb: bytes, data_in: Optional[memoryview] = None, data_out: Optional[bytes] = None,
+                timeout_ms: int = DEFAULT_TIMEOUT_MS) -> int:
+        cmd: list[str] = ["sg_raw", "-t", str(max(1, timeout_ms // 1000))]
+        if data_in is not None and len(data_in) > 0:
+            cmd += ["-b", "-r", str(len(data_in))]
+        if data_out:
+            cmd += ["-s", str(len(data_out))]
+        cmd.append(self.device)
+        cmd += [f"{byte:02x}" for byte in cdb]
+
+        start = time.perf_counter()
+        result = subprocess.run(cmd, input=data_out or None, capture_output=True)
+        recorder = metrics.recorder
+        if recorder is not None:
+            # sg_raw only reports an exit code; anything else is counted as a failed status
+            recorder.record(self.device, cdb[0], time.perf_counter() - start, None, 0,
+                            0 if result.returncode == 0 else result.returncode)
+        if result.returncode != 0:
+            sense_key = SG_RAW_EXIT_SENSE_KEYS.get(result.returncode)
+            category = f", {SENSE_KEYS[sense_key]}" if sense_key is not None else ""
+            raise scsi_command_error(
+                f"sg_raw failed on {self.device} (exit {result.returncode}{category}): "
+                f"{result.stderr.decode(errors='ignore').strip()}",
+                opcode=cdb[0],
+                sense_key=sense_key,
+            )
+
+        if data_in is None:
+            return 0
+        received = min(len(result.stdout), len(data_in))
+        data_in[:received] = result.stdout[:received]
+        return received
+
+
+TRANSPORTS: dict[str, type[sg_transport]] = {
+    sg_io_transport.name: sg_io_transport,
+    sg_raw_transport.name: sg_raw_transport,
+}
+
+
+def open_transport(device: str, transport: Union[str, sg_transport] = "sg_io",
+                   writable: bool = False) -> sg_transport:
+    """
+    Returns a transport for device. transport is either the name of a registered
+    transport ("sg_io" or "sg_raw") or an already constructed transport instance.
+    writable opens the device read-write, as commands that change the medium need;
+    sg_raw, sg_mmap and the coprocessor always open it read-write.
+    """
+    if isinstance(transport, sg_transport):
+        return transport
+    if transport not in TRANSPORTS:
+        raise ValueError(f"Unknown transport '{transport}', expected one of {sorted(TRANSPORTS)}")
+    cls = TRANSPORTS[transport]
+    if writable and cls.takes_open_flags:
+        return cls(device, flags=os.O_RDWR)
+    return cls(device)
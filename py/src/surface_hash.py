@@ -0,0 +1,309 @@
+"""
+Merkle-tree fingerprint of a whole device surface.
+
+The LBA space is cut into fixed ranges of range_blocks blocks. Each range is read and
+hashed on its own (a leaf), by a pool of workers that each hold their own transport:
+both SG_IO and hashlib release the GIL, so ranges really are read and hashed in
+parallel. Leaves are combined pairwise into a Merkle tree whose root is the device's
+fingerprint. Leaf and node hashes are domain separated (a 0x00 or 0x01 prefix) so a
+leaf can never pass for a node.
+
+The result is saved as JSON (device identity, parameters, root) with the leaf digests
+next to it in a binary .tree file. verify_ranges re-reads only the ranges covering the
+LBAs in question and checks them against the saved leaves, after checking the saved
+leaves still add up to the saved root.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Optional
+
+from retry import DEFAULT_POLICY, retry_policy
+from scsi_class import scsi_device
+from sg_transport import scsi_command_error
+
+SURFACE_HASH_VERSION = 1
+DEFAULT_ALGORITHM = "sha256"
+DEFAULT_RANGE_BYTES = 64 << 20  # one leaf per 64 MiB: about 300,000 leaves on a 20 TB drive
+DEFAULT_WORKERS = 4
+LEAF_PREFIX = b"\x00"
+NODE_PREFIX = b"\x01"
+TREE_SUFFIX = ".tree"
+
+
+def node_hash(algorithm: str, left: bytes, right: bytes) -> bytes:
+    return hashlib.new(algorithm, NODE_PREFIX + left + right).digest()
+
+
+def merkle_levels(algorithm: str, leaves: list[bytes]) -> list[list[bytes]]:
+    """
+    Every level of the tree, leaves first and the root last. An odd node at the end of
+    a level is carried up unchanged.
+    """
+    if not leaves:
+        return [[hashlib.new(algorithm, LEAF_PREFIX).digest()]]
+    levels = [list(leaves)]
+    while len(levels[-1]) > 1:
+        level = levels[-1]
+        parents = [node_hash(algorithm, level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            parents.append(level[-1])
+        levels.append(parents)
+    return levels
+
+
+def merkle_root(algorithm: str, leaves: list[bytes]) -> bytes:
+    return merkle_levels(algorithm, leaves)[-1][0]
+
+
+class surface_hash:
+    """
+    Leaf digests and root of one device. A leaf whose range could not be read holds an
+    all-zero digest and is listed in unreadable with the error, and the fingerprint is
+    then incomplete: it still identifies the readable data but cannot vouch for the rest.
+    """
+    def __init__(self, device: str, blocks: int, block_size: int, range_blocks: int,
+                 serial: Optional[str] = None, algorithm: str = DEFAULT_ALGORITHM):
+        self.device: str = device
+        self.serial: Optional[str] = serial
+        self.blocks: int = blocks
+        self.block_size: int = block_size
+        self.range_blocks: int = range_blocks
+        self.algorithm: str = algorithm
+        self.digest_size: int = hashlib.new(algorithm).digest_size
+        self.leaves: list[bytes] = [bytes(self.digest_size)] * self.leaf_count
+        self.unreadable: dict[int, str] = {}
+        self.root: Optional[bytes] = None
+        self.started: float = time.time()
+        self.elapsed: float = 0.0
+
+    @property
+    def leaf_count(self) -> int:
+        return -(-self.blocks // self.range_blocks)
+
+    @property
+    def complete(self) -> bool:
+        return self.root is not None and not self.unreadable
+
+    def leaf_range(self, index: int) -> tuple[int, int]:
+        """
+        [start, end) LBAs hashed into leaf index.
+        """
+        start = index * self.range_blocks
+        return start, min(start + self.range_blocks, self.blocks)
+
+    def leaves_covering(self, start_lba: int, end_lba: int) -> range:
+        """
+        Indexes of the leaves that cover LBAs [start_lba, end_lba).
+        """
+        if not 0 <= start_lba < end_lba <= self.blocks:
+            raise ValueError(f"LBA range {start_lba}-{end_lba} is outside 0-{self.blocks}")
+        return range(start_lba // self.range_blocks, -(-end_lba // self.range_blocks))
+
+    def finish(self) -> bytes:
+        self.root = merkle_root(self.algorithm, self.leaves)
+        return self.root
+
+    def summary(self) -> str:
+        state = "complete" if self.complete else f"INCOMPLETE, {len(self.unreadable)} unreadable ranges"
+        lines = [
+            f"[+] Surface hash of {self.device}: {self.algorithm} Merkle root "
+            f"{self.root.hex() if self.root else None} ({state})",
+            f"    {self.leaf_count} ranges of {self.range_blocks} blocks, {self.blocks} x {self.block_size} bytes "
+            f"hashed in {self.elapsed:.1f}s",
+        ]
+        for index, error in sorted(self.unreadable.items())[:20]:
+            start, end = self.leaf_range(index)
+            lines.append(f"      unreadable LBA {start}-{end - 1}: {error}")
+        return "\n".join(lines)
+
+    def to_dict(self) -> dict:
+        return {
+            "version": SURFACE_HASH_VERSION,
+            "device": self.device,
+            "serial": self.serial,
+            "blocks": self.blocks,
+            "block_size": self.block_size,
+            "range_blocks": self.range_blocks,
+            "algorithm": self.algorithm,
+            "leaves": self.leaf_count,
+            "root": self.root.hex() if self.root else None,
+            "unreadable": {str(index): error for index, error in sorted(self.unreadable.items())},
+            "started": self.started,
+            "elapsed": self.elapsed,
+        }
+
+    def save(self, path: str) -> None:
+        """
+        Writes the result to path and the leaf digests to path + '.tree', each atomically.
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        for target, mode, content in ((path + TREE_SUFFIX, "wb", b"".join(self.leaves)),
+                                      (path, "w", json.dumps(self.to_dict()))):
+            tmp_path = f"{target}.{os.getpid()}.tmp"
+            with open(tmp_path, mode) as f:
+                f.write(content)
+            os.replace(tmp_path, target)
+
+    @classmethod
+    def load(cls, path: str) -> "surface_hash":
+        """
+        Reads a saved result and its tree. Raises ValueError if the tree no longer adds
+        up to the saved root.
+        """
+        with open(path, "r") as f:
+            data = json.load(f)
+        if data.get("version") != SURFACE_HASH_VERSION:
+            raise ValueError(f"{path} is not a version {SURFACE_HASH_VERSION} surface hash")
+        result = cls(data["device"], data["blocks"], data["block_size"], data["range_blocks"],
+                     data.get("serial"), data["algorithm"])
+        with open(path + TREE_SUFFIX, "rb") as f:
+            tree = f.read()
+        size = result.digest_size
+        if len(tree) != result.leaf_count * size:
+            raise ValueError(f"{path}{TREE_SUFFIX} holds {len(tree) // size} leaves, expected {result.leaf_count}")
+        result.leaves = [tree[i:i + size] for i in range(0, len(tree), size)]
+        result.unreadable = {int(index): error for index, error in data.get("unreadable", {}).items()}
+        result.started = data["started"]
+        result.elapsed = data["elapsed"]
+        result.finish()
+        if data["root"] is not None and result.root.hex() != data["root"]:
+            raise ValueError(f"{path}{TREE_SUFFIX} does not match the saved root {data['root']}")
+        return result
+
+
+class surface_hasher:
+    """
+    Hashes the ranges of one device with workers threads, each with its own scsi_device
+    (and so its own transport) reading through the same READ paths as blank_check.
+    """
+    def __init__(self, device: str, transport: str = "sg_io", workers: int = DEFAULT_WORKERS,
+                 range_bytes: int = DEFAULT_RANGE_BYTES, chunk_blocks: int = 1000, read_mode: str = "sg",
+                 algorithm: str = DEFAULT_ALGORITHM, retry: retry_policy = DEFAULT_POLICY):
+        self.device: str = device
+        self.transport: str = transport
+        self.workers: int = workers
+        self.range_bytes: int = range_bytes
+        self.chunk_blocks: int = chunk_blocks
+        self.read_mode: str = read_mode
+        self.algorithm: str = algorithm
+        self.retry: retry_policy = retry
+        self._local = threading.local()
+        self._devices: list[scsi_device] = []
+        self._lock = threading.Lock()
+
+    def _worker_device(self) -> scsi_device:
+        dev = getattr(self._local, "device", None)
+        if dev is None:
+            dev = scsi_device(self.device, transport=self.transport, retry=self.retry)
+            self._local.device = dev
+            with self._lock:
+                self._devices.append(dev)
+        return dev
+
+    def _hash_leaf(self, result: surface_hash, index: int) -> bytes:
+        dev = self._worker_device()
+        start, end = result.leaf_range(index)
+        digest = hashlib.new(result.algorithm, LEAF_PREFIX)
+        for _, _, data in dev.read_range(start, end, self.chunk_blocks, 1, self.read_mode):
+            digest.update(data)
+        return digest.digest()
+
+    def _close_devices(self) -> None:
+        for dev in self._devices:
+            dev.close()
+        self._devices.clear()
+        self._local = threading.local()
+
+    def _hash_leaves(self, result: surface_hash, indexes,
+                     progress: Optional[Callable[[int, int], Optional[bool]]]) -> dict[int, bytes]:
+        """
+        Hashes the given leaves in parallel and returns {index: digest}. Leaves that could
+        not be read, or were not reached because progress returned False, are left out
+        and recorded in result.unreadable.
+        """
+        digests: dict[int, bytes] = {}
+        done = 0
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                futures = {pool.submit(self._hash_leaf, result, index): index for index in indexes}
+                try:
+                    for future in as_completed(futures):
+                        index = futures[future]
+                        try:
+                            digests[index] = future.result()
+                        except (scsi_command_error, OSError) as e:
+                            result.unreadable[index] = str(e)
+                        done += 1
+                        if progress is not None and progress(done, len(futures)) is False:
+                            break
+                finally:
+                    for future in futures:
+                        future.cancel()
+        finally:
+            self._close_devices()
+        for index in indexes:
+            if index not in digests and index not in result.unreadable:
+                result.unreadable[index] = "stopped before this range was hashed"
+        return digests
+
+    def run(self, progress: Optional[Callable[[int, int], Optional[bool]]] = None) -> surface_hash:
+        """
+        Hashes the whole device and returns the finished surface_hash. progress, if given,
+        is called with (ranges hashed, total ranges); returning False from it stops the run,
+        leaving the ranges not yet hashed marked unreadable.
+        """
+        with scsi_device(self.device, transport=self.transport, retry=self.retry) as dev:
+            dev.read_capacity()
+            try:
+                dev.read_serial()
+            except (scsi_command_error, RuntimeError, OSError):
+                pass
+        range_blocks = max(1, self.range_bytes // dev.block_size)
+        result = surface_hash(self.device, dev.no_blocks, dev.block_size, range_blocks, dev.serial_number,
+                              self.algorithm)
+        start = time.monotonic()
+        for index, digest in self._hash_leaves(result, range(result.leaf_count), progress).items():
+            result.leaves[index] = digest
+        result.elapsed = time.monotonic() - start
+        result.finish()
+        return result
+
+    def verify_ranges(self, saved: surface_hash, start_lba: int = 0,
+                      end_lba: Optional[int] = None) -> list[dict]:
+        """
+        Re-reads only the ranges covering [start_lba, end_lba) (the whole device by default)
+        and returns one entry per range: its LBAs, and 'match', 'mismatch' or 'unreadable'.
+        Raises ValueError if the device is no longer the one the hash was taken of: its
+        capacity differs or, when the hash recorded a serial number, the unit serial does
+        not match it (or cannot be read).
+        """
+        with scsi_device(self.device, transport=self.transport, retry=self.retry) as dev:
+            dev.read_capacity()
+            if saved.serial:
+                try:
+                    dev.read_serial()
+                except (scsi_command_error, RuntimeError, OSError):
+                    pass
+        if (dev.no_blocks, dev.block_size) != (saved.blocks, saved.block_size):
+            raise ValueError(f"{self.device} is {dev.no_blocks} x {dev.block_size} bytes, the hash was taken "
+                             f"of {saved.blocks} x {saved.block_size} bytes")
+        if saved.serial and dev.serial_number != saved.serial:
+            raise ValueError(f"{self.device} has serial {dev.serial_number or 'unknown'}, the hash was taken "
+                             f"of serial {saved.serial}")
+        check = surface_hash(self.device, saved.blocks, saved.block_size, saved.range_blocks, saved.serial,
+                             saved.algorithm)
+        indexes = saved.leaves_covering(start_lba, saved.blocks if end_lba is None else end_lba)
+        digests = self._hash_leaves(check, indexes, None)
+        results = []
+        for index in indexes:
+            first, end = saved.leaf_range(index)
+            if index in digests:
+                matches = index not in saved.unreadable and digests[index] == saved.leaves[index]
+                results.append({"start": first, "end": end, "state": "match" if matches else "mismatch"})
+            else:
+                results.append({"start": first, "end": end, "state": "unreadable", "error": check.unreadable[index]})
+        return results
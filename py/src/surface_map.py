@@ -0,0 +1,199 @@
+import json
+import os
+import time
+from typing import Optional
+
+from verifier import zero_verifier
+
+SURFACE_MAP_VERSION = 1
+DEFAULT_ZONES = 1000
+NONZERO = "nonzero"
+UNREADABLE = "unreadable"
+
+
+def _subtract(ranges: list[list[int]], remove: list[list[int]]) -> list[list[int]]:
+    """
+    Parts of sorted [start, end) ranges not covered by the sorted ranges in remove.
+    """
+    result: list[list[int]] = []
+    i = 0
+    for start, end in ranges:
+        while i < len(remove) and remove[i][1] <= start:
+            i += 1
+        j = i
+        while j < len(remove) and remove[j][0] < end:
+            if remove[j][0] > start:
+                result.append([start, remove[j][0]])
+            start = max(start, remove[j][1])
+            j += 1
+        if start < end:
+            result.append([start, end])
+    return result
+
+
+class surface_map:
+    """
+    Result of a full-surface scan. Non-zero and unreadable blocks are kept as run-length
+    regions [start, end, kind], so the map stays a handful of entries even on a 20 TB drive
+    unless the data really is scattered. Read latency is summarised per zone: the surface
+    is split into zones equal ranges and each keeps its command count, total and worst time.
+    """
+    def __init__(self, device: str, blocks: int, block_size: int, zones: int = DEFAULT_ZONES,
+                 serial: Optional[str] = None):
+        self.device: str = device
+        self.serial: Optional[str] = serial
+        self.blocks: int = blocks
+        self.block_size: int = block_size
+        self.zone_blocks: int = max(1, -(-blocks // max(1, zones)))
+        zone_count = -(-blocks // self.zone_blocks)
+        self.zone_commands: list[int] = [0] * zone_count
+        self.zone_total_ms: list[float] = [0.0] * zone_count
+        self.zone_max_ms: list[float] = [0.0] * zone_count
+        self.regions: list[list] = []
+        self.nonzero_bytes: int = 0
+        self.scanned_blocks: int = 0
+        self.started: float = time.time()
+        self.elapsed: float = 0.0
+
+    def add_region(self, start: int, end: int, kind: str) -> None:
+        """
+        Adds [start, end) of the given kind. Regions arrive in LBA order during a scan,
+        so a region touching the previous one of the same kind just extends it.
+        """
+        if self.regions and self.regions[-1][2] == kind and self.regions[-1][1] >= start:
+            self.regions[-1][1] = max(self.regions[-1][1], end)
+        else:
+            self.regions.append([start, end, kind])
+
+    def add_data(self, data: memoryview, lba: int, verifier: zero_verifier) -> None:
+        """
+        Maps the non-zero blocks of one chunk read from lba. Clean chunks cost one
+        is_zero call; dirty ones are walked block by block to find the exact runs.
+        """
+        if verifier.is_zero(data):
+            return
+        self.nonzero_bytes += len(data) - bytes(data).count(0)
+        block_size = self.block_size
+        blocks = len(data) // block_size
+        block = 0
+        while block < blocks:
+            offset = verifier.first_nonzero(data[block * block_size:])
+            if offset < 0:
+                break
+            block += offset // block_size
+            end = block + 1
+            while end < blocks and not verifier.is_zero(data[end * block_size:(end + 1) * block_size]):
+                end += 1
+            self.add_region(lba + block, lba + end, NONZERO)
+            block = end
+
+    def add_latency(self, lba: int, seconds: float) -> None:
+        zone = min(lba // self.zone_blocks, len(self.zone_commands) - 1)
+        ms = seconds * 1000.0
+        self.zone_commands[zone] += 1
+        self.zone_total_ms[zone] += ms
+        if ms > self.zone_max_ms[zone]:
+            self.zone_max_ms[zone] = ms
+
+    def ranges(self, kind: str) -> list[list[int]]:
+        return [[start, end] for start, end, region_kind in self.regions if region_kind == kind]
+
+    def blocks_of(self, kind: str) -> int:
+        return sum(end - start for start, end in self.ranges(kind))
+
+    def zone_mean_ms(self) -> list[float]:
+        return [total / count if count else 0.0 for total, count in zip(self.zone_total_ms, self.zone_commands)]
+
+    def slowest_zones(self, count: int = 5) -> list[tuple[int, float, float]]:
+        """
+        (first LBA, mean ms, max ms) of the zones with the highest mean latency.
+        """
+        means = self.zone_mean_ms()
+        order = sorted(range(len(means)), key=lambda zone: means[zone], reverse=True)[:count]
+        return [(zone * self.zone_blocks, means[zone], self.zone_max_ms[zone]) for zone in order if means[zone]]
+
+    def summary(self) -> str:
+        lines = [
+            f"[+] Surface map of {self.device}: {self.scanned_blocks}/{self.blocks} blocks scanned in {self.elapsed:.1f}s",
+            f"    Non-zero: {self.nonzero_bytes} bytes in {self.blocks_of(NONZERO)} blocks, "
+            f"{len(self.ranges(NONZERO))} regions",
+            f"    Unreadable: {self.blocks_of(UNREADABLE)} blocks, {len(self.ranges(UNREADABLE))} regions",
+        ]
+        for start, end, kind in self.regions[:20]:
+            lines.append(f"      {kind:<10} LBA {start}-{end - 1} ({(end - start) * self.block_size} bytes)")
+        if len(self.regions) > 20:
+            lines.append(f"      ... {len(self.regions) - 20} more regions")
+        for lba, mean_ms, max_ms in self.slowest_zones():
+            lines.append(f"    Slow zone at LBA {lba}: mean {mean_ms:.2f} ms, worst {max_ms:.2f} ms")
+        return "\n".join(lines)
+
+    def to_dict(self) -> dict:
+        return {
+            "version": SURFACE_MAP_VERSION,
+            "device": self.device,
+            "serial": self.serial,
+            "blocks": self.blocks,
+            "block_size": self.block_size,
+            "started": self.started,
+            "elapsed": self.elapsed,
+            "scanned_blocks": self.scanned_blocks,
+            "nonzero_bytes": self.nonzero_bytes,
+            "regions": self.regions,
+            "zone_blocks": self.zone_blocks,
+            "zone_commands": self.zone_commands,
+            "zone_total_ms": [round(ms, 3) for ms in self.zone_total_ms],
+            "zone_max_ms": [round(ms, 3) for ms in self.zone_max_ms],
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "surface_map":
+        if data.get("version") != SURFACE_MAP_VERSION:
+            raise ValueError(f"Not a version {SURFACE_MAP_VERSION} surface map")
+        result = cls(data["device"], data["blocks"], data["block_size"], serial=data.get("serial"))
+        result.zone_blocks = data["zone_blocks"]
+        result.zone_commands = data["zone_commands"]
+        result.zone_total_ms = data["zone_total_ms"]
+        result.zone_max_ms = data["zone_max_ms"]
+        result.regions = [list(region) for region in data["regions"]]
+        result.nonzero_bytes = data["nonzero_bytes"]
+        result.scanned_blocks = data["scanned_blocks"]
+        result.started = data["started"]
+        result.elapsed = data["elapsed"]
+        return result
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.to_dict(), f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "surface_map":
+        with open(path, "r") as f:
+            return cls.from_dict(json.load(f))
+
+
+def diff_maps(old: surface_map, new: surface_map, slow_factor: float = 2.0) -> dict:
+    """
+    Compares two scans of the same drive. Returns the regions that appeared and disappeared
+    for each kind, and the zones whose mean latency grew by more than slow_factor.
+    Raises ValueError if the maps are not for the same capacity.
+    """
+    if (old.blocks, old.block_size) != (new.blocks, new.block_size):
+        raise ValueError(f"Maps cover different capacities: {old.blocks} x {old.block_size} "
+                         f"and {new.blocks} x {new.block_size}")
+    result: dict = {}
+    for kind in (NONZERO, UNREADABLE):
+        before, after = old.ranges(kind), new.ranges(kind)
+        result[kind] = {"added": _subtract(after, before), "removed": _subtract(before, after)}
+
+    slower: list[dict] = []
+    if old.zone_blocks == new.zone_blocks:
+        for zone, (was, now) in enumerate(zip(old.zone_mean_ms(), new.zone_mean_ms())):
+            if was and now > was * slow_factor:
+                slower.append({"lba": zone * new.zone_blocks, "old_ms": round(was, 3), "new_ms": round(now, 3)})
+    result["slower_zones"] = slower
+    if old.serial and new.serial and old.serial != new.serial:
+        result["serial_changed"] = [old.serial, new.serial]
+    return result
@@ -0,0 +1,195 @@
+import struct
+from typing import Optional
+
+DEFAULT_ZERO_BUFFER = 1 << 20  # 1 MiB, compared against in windows of this size
+BISECT_LIMIT = 64              # below this many bytes a plain scan is cheaper than another memcmp
+
+
+class zero_verifier:
+    """
+    Checks buffers for all-zero content at memcmp speed.
+    A zero buffer is allocated once and each window of the data is compared with
+    bytes.startswith, which ends up in memcmp without copying or allocating.
+    The slow path (locating the first non-zero byte) only runs when a chunk fails.
+    """
+    def __init__(self, zero_buffer_size: int = DEFAULT_ZERO_BUFFER):
+        self._zeros: bytes = bytes(zero_buffer_size)
+
+    def is_zero(self, data) -> bool:
+        """
+        Returns True if every byte in data (any bytes-like object) is zero.
+        """
+        view = memoryview(data)
+        if view.format != "B":
+            view = view.cast("B")
+        zeros = self._zeros
+        window = len(zeros)
+        for offset in range(0, len(view), window):
+            if not zeros.startswith(view[offset:offset + window]):
+                return False
+        return True
+
+    def first_nonzero(self, data) -> int:
+        """
+        Returns the offset of the first non-zero byte in data, or -1 if it is all zero.
+        """
+        view = memoryview(data)
+        if view.format != "B":
+            view = view.cast("B")
+        zeros = self._zeros
+        window = len(zeros)
+        for offset in range(0, len(view), window):
+            part = view[offset:offset + window]
+            if zeros.startswith(part):
+                continue
+            # Bisect down to a small range with memcmp, then scan it
+            lo, hi = 0, len(part)
+            while hi - lo > BISECT_LIMIT:
+                mid = (lo + hi) // 2
+                if zeros.startswith(part[lo:mid]):
+                    lo = mid
+                else:
+                    hi = mid
+            for i in range(lo, hi):
+                if part[i]:
+                    return offset + i
+        return -1
+
+    def locate(self, data, start_lba: int, block_size: int) -> Optional[tuple[int, int]]:
+        """
+        Returns (lba, byte offset within that block) of the first non-zero byte in a
+        chunk that was read starting at start_lba, or None if the chunk is all zero.
+        """
+        if self.is_zero(data):
+            return None
+        offset = self.first_nonzero(data)
+        return start_lba + offset // block_size, offset % block_size
+
+
+def _first_difference(data: memoryview, expected: memoryview) -> int:
+    """
+    Offset of the first byte where data and expected (the same length) differ, -1 if none.
+    Bisects with memcmp down to BISECT_LIMIT bytes, then scans.
+    """
+    if data == expected:
+        return -1
+    lo, hi = 0, len(data)
+    while hi - lo > BISECT_LIMIT:
+        mid = (lo + hi) // 2
+        if data[lo:mid] == expected[lo:mid]:
+            lo = mid
+        else:
+            hi = mid
+    for i in range(lo, hi):
+        if data[i] != expected[i]:
+            return i
+    return -1
+
+
+class repeat_verifier:
+    """
+    Checks that every logical block holds pattern repeated from the block's first byte,
+    as SANITIZE OVERWRITE and FORMAT UNIT initialization patterns leave it (0xFF fill is
+    a one-byte pattern). The expected data for window_size bytes of whole blocks is
+    built once per block size and compared window by window at memcmp speed.
+    """
+    def __init__(self, pattern: bytes, window_size: int = DEFAULT_ZERO_BUFFER):
+        if not pattern:
+            raise ValueError("pattern must not be empty")
+        self.pattern: bytes = bytes(pattern)
+        self.window_size: int = window_size
+        self._block_size: int = 0
+        self._expected: Optional[memoryview] = None
+
+    def __str__(self) -> str:
+        return f"pattern {self.pattern.hex()}"
+
+    def _template(self, block_size: int) -> memoryview:
+        if block_size != self._block_size:
+            block = (self.pattern * (block_size // len(self.pattern) + 1))[:block_size]
+            self._expected = memoryview(block * max(1, self.window_size // block_size))
+            self._block_size = block_size
+        return self._expected
+
+    def expected(self, start_lba: int, blocks: int, block_size: int) -> memoryview:
+        """
+        Expected contents of up to one window of blocks starting at start_lba.
+        """
+        return self._template(block_size)[:blocks * block_size]
+
+    def locate(self, data, start_lba: int, block_size: int) -> Optional[tuple[int, int]]:
+        """
+        Returns (lba, byte offset within that block) of the first byte that does not match
+        the pattern, or None if the whole chunk matches.
+        """
+        view = memoryview(data)
+        if view.format != "B":
+            view = view.cast("B")
+        window = max(block_size, self.window_size // block_size * block_size)
+        for offset in range(0, len(view), window):
+            part = view[offset:offset + window]
+            lba = start_lba + offset // block_size
+            expected = self.expected(lba, -(-len(part) // block_size), block_size)[:len(part)]
+            found = _first_difference(part, expected)
+            if found >= 0:
+                return lba + found // block_size, found % block_size
+        return None
+
+
+class lba_verifier(repeat_verifier):
+    """
+    Checks per-LBA tagged data: each block starts with its own LBA, big-endian in
+    tag_bytes bytes (4 as the FORMAT UNIT IP modifier writes it, or 8), and the rest
+    of the block holds pattern. The tags are rewritten into the expected window for
+    each chunk, so the comparison itself is still one memcmp per window.
+    """
+    def __init__(self, pattern: bytes = b"\x00", tag_bytes: int = 4, window_size: int = DEFAULT_ZERO_BUFFER):
+        if tag_bytes not in (4, 8):
+            raise ValueError("tag_bytes must be 4 or 8")
+        super().__init__(pattern, window_size)
+        self.tag_bytes: int = tag_bytes
+        self._tagged: Optional[memoryview] = None
+
+    def __str__(self) -> str:
+        return f"LBA-tagged pattern {self.pattern.hex()}"
+
+    def _template(self, block_size: int) -> memoryview:
+        if block_size != self._block_size:
+            body = (self.pattern * (block_size // len(self.pattern) + 1))[:block_size - self.tag_bytes]
+            block = bytes(self.tag_bytes) + body
+            self._expected = memoryview(bytearray(block * max(1, self.window_size // block_size)))
+            self._block_size = block_size
+        return self._expected
+
+    def expected(self, start_lba: int, blocks: int, block_size: int) -> memoryview:
+        expected = self._template(block_size)
+        mask = (1 << (8 * self.tag_bytes)) - 1
+        fmt = ">I" if self.tag_bytes == 4 else ">Q"
+        for block in range(min(blocks, len(expected) // block_size)):
+            struct.pack_into(fmt, expected, block * block_size, (start_lba + block) & mask)
+        return expected[:blocks * block_size]
+
+
+PATTERN_HELP = "zero, ff, repeat:HEX (HEX repeated in every block) or lba[:HEX] (LBA-tagged blocks)"
+
+
+def make_verifier(spec: str, window_size: int = DEFAULT_ZERO_BUFFER):
+    """
+    A verifier from a pattern spec (see PATTERN_HELP). Every verifier has the same
+    locate(data, start_lba, block_size) as zero_verifier, so scanners take any of them.
+    """
+    kind, _, argument = spec.partition(":")
+    kind = kind.lower()
+    try:
+        pattern = bytes.fromhex(argument) if argument else None
+    except ValueError:
+        raise ValueError(f"Invalid pattern '{argument}', expected hex bytes") from None
+    if kind == "zero" and pattern is None:
+        return zero_verifier(window_size)
+    if kind == "ff" and pattern is None:
+        return repeat_verifier(b"\xff", window_size)
+    if kind == "repeat" and pattern:
+        return repeat_verifier(pattern, window_size)
+    if kind == "lba":
+        return lba_verifier(pattern or b"\x00", window_size=window_size)
+    raise ValueError(f"Unknown pattern '{spec}', expected {PATTERN_HELP}")
@@ -0,0 +1,199 @@
+import struct
+from typing import Callable, Optional
+
+import scsi_cdb
+from scsi_tools import read_fleet
+from sg_transport import open_transport, scsi_command_error, sg_transport
+
+VPD_SUPPORTED_PAGES = 0x00
+VPD_UNIT_SERIAL = 0x80
+VPD_DEVICE_ID = 0x83
+VPD_BLOCK_LIMITS = 0xB0
+VPD_BLOCK_CHARACTERISTICS = 0xB1
+VPD_LOGICAL_BLOCK_PROVISIONING = 0xB2
+
+FIRST_ALLOC_LEN = 252      # enough for most pages in a single INQUIRY
+MAX_ALLOC_LEN = 0xFFFF     # INQUIRY allocation length is 16 bits
+
+DESIGNATOR_TYPES = {
+    0x0: "vendor specific",
+    0x1: "T10 vendor ID",
+    0x2: "EUI-64",
+    0x3: "NAA",
+    0x4: "relative target port",
+    0x5: "target port group",
+    0x6: "logical unit group",
+    0x7: "MD5 logical unit",
+    0x8: "SCSI name string",
+    0xA: "UUID",
+}
+ASSOCIATIONS = {0: "logical unit", 1: "target port", 2: "target device"}
+PROVISIONING_TYPES = {0: "full", 1: "resource", 2: "thin"}
+
+
+def _ascii(data) -> str:
+    return str(data, "ascii", "ignore").strip().strip("\x00")
+
+
+def parse_supported_pages(page: bytes) -> dict:
+    return {"pages": list(page[4:])}
+
+
+def parse_unit_serial(page: bytes) -> dict:
+    return {"serial": _ascii(page[4:])}
+
+
+def parse_device_id(page: bytes) -> dict:
+    """
+    Device Identification (0x83): a list of designation descriptors.
+    """
+    designators: list[dict] = []
+    view = memoryview(page)
+    offset = 4
+    while offset + 4 <= len(view):
+        code_set = view[offset] & 0x0F
+        association = (view[offset + 1] >> 4) & 0x03
+        designator_type = view[offset + 1] & 0x0F
+        length = view[offset + 3]
+        value = view[offset + 4:offset + 4 + length]
+        designators.append({
+            "type": DESIGNATOR_TYPES.get(designator_type, f"type 0x{designator_type:x}"),
+            "association": ASSOCIATIONS.get(association, f"association {association}"),
+            # Code sets 2 (ASCII) and 3 (UTF-8) are text, everything else is binary
+            "value": _ascii(value) if code_set in (2, 3) else value.hex(),
+        })
+        offset += 4 + length
+    return {"designators": designators}
+
+
+def parse_block_limits(page: bytes) -> dict:
+    """
+    Block Limits (0xB0): transfer and UNMAP limits, all counts in logical blocks.
+    """
+    if len(page) < 44:
+        return {"raw": page.hex()}
+    (granularity, max_transfer, optimal_transfer, max_prefetch, max_unmap_lbas,
+     max_unmap_descriptors, unmap_granularity, unmap_alignment, max_write_same) = struct.unpack_from(">HIIIIIIIQ", page, 6)
+    return {
+        "max_compare_and_write": page[5],
+        "optimal_transfer_granularity": granularity,
+        "max_transfer_length": max_transfer,
+        "optimal_transfer_length": optimal_transfer,
+        "max_prefetch_length": max_prefetch,
+        "max_unmap_lba_count": max_unmap_lbas,
+        "max_unmap_descriptor_count": max_unmap_descriptors,
+        "optimal_unmap_granularity": unmap_granularity,
+        "unmap_granularity_alignment": unmap_alignment & 0x7FFFFFFF if unmap_alignment & 0x80000000 else None,
+        "max_write_same_length": max_write_same,
+    }
+
+
+def parse_block_characteristics(page: bytes) -> dict:
+    """
+    Block Device Characteristics (0xB1): rotation rate (1 means solid state) and form factor.
+    """
+    if len(page) < 8:
+        return {"raw": page.hex()}
+    rotation_rate = struct.unpack_from(">H", page, 4)[0]
+    return {
+        "rotation_rate": rotation_rate,
+        "solid_state": rotation_rate == 1,
+        "form_factor": page[7] & 0x0F,
+    }
+
+
+def parse_logical_block_provisioning(page: bytes) -> dict:
+    """
+    Logical Block Provisioning (0xB2): which unmap commands the device supports and
+    what unmapped blocks read back as.
+    """
+    if len(page) < 8:
+        return {"raw": page.hex()}
+    flags = page[5]
+    return {
+        "threshold_exponent": page[4],
+        "lbpu": bool(flags & 0x80),       # UNMAP supported
+        "lbpws": bool(flags & 0x40),      # WRITE SAME(16) with UNMAP supported
+        "lbpws10": bool(flags & 0x20),    # WRITE SAME(10) with UNMAP supported
+        # 001b: unmapped blocks read as zeros (provisioning.LBPRZ_ZEROS); 010b: they read as
+        # the provisioning initialization pattern, which need not be zeros
+        "lbprz": (flags >> 2) & 0x07,
+        "anc_sup": bool(flags & 0x02),
+        "dp": bool(flags & 0x01),
+        "provisioning_type": PROVISIONING_TYPES.get(page[6] & 0x07, str(page[6] & 0x07)),
+    }
+
+
+PAGE_PARSERS: dict[int, Callable[[bytes], dict]] = {
+    VPD_SUPPORTED_PAGES: parse_supported_pages,
+    VPD_UNIT_SERIAL: parse_unit_serial,
+    VPD_DEVICE_ID: parse_device_id,
+    VPD_BLOCK_LIMITS: parse_block_limits,
+    VPD_BLOCK_CHARACTERISTICS: parse_block_characteristics,
+    VPD_LOGICAL_BLOCK_PROVISIONING: parse_logical_block_provisioning,
+}
+
+
+class vpd_engine:
+    """
+    Reads VPD pages from one device. The supported-pages list (0x00) is fetched once
+    and cached. Every page is first read with FIRST_ALLOC_LEN; only when the page header
+    says it is longer than that is it read a second time with the exact length.
+    """
+    def __init__(self, transport: sg_transport):
+        self.transport: sg_transport = transport
+        self._supported: Optional[list[int]] = None
+
+    def read_page(self, page: int) -> bytes:
+        """
+        Returns the complete raw page, header included.
+        """
+        data = self.transport.read_data(scsi_cdb.inquiry(1, page, FIRST_ALLOC_LEN), FIRST_ALLOC_LEN)
+        if len(data) < 4:
+            raise RuntimeError(f"VPD page 0x{page:02x} response too short")
+        page_len = min(struct.unpack_from(">H", data, 2)[0] + 4, MAX_ALLOC_LEN)
+        if page_len > FIRST_ALLOC_LEN:
+            data = self.transport.read_data(scsi_cdb.inquiry(1, page, page_len), page_len)
+        return bytes(data[:page_len])
+
+    def supported_pages(self) -> list[int]:
+        if self._supported is None:
+            self._supported = parse_supported_pages(self.read_page(VPD_SUPPORTED_PAGES))["pages"]
+        return self._supported
+
+    def page(self, page: int) -> dict:
+        """
+        Reads and parses one page. Pages without a parser come back as {'raw': hex}.
+        """
+        raw = self.read_page(page)
+        parser = PAGE_PARSERS.get(page)
+        return parser(raw) if parser is not None else {"raw": raw.hex()}
+
+    def all_pages(self) -> dict[int, dict]:
+        """
+        Reads every page the device lists as supported. A page the device then
+        refuses is reported as {'error': message} rather than aborting the rest.
+        """
+        pages: dict[int, dict] = {}
+        for code in self.supported_pages():
+            if code == VPD_SUPPORTED_PAGES:
+                pages[code] = {"pages": list(self.supported_pages())}
+                continue
+            try:
+                pages[code] = self.page(code)
+            except (scsi_command_error, RuntimeError, OSError) as e:
+                pages[code] = {"error": str(e)}
+        return pages
+
+
+def read_device_vpd(device: str, transport: str = "sg_io") -> dict[int, dict]:
+    with open_transport(device, transport) as t:
+        return vpd_engine(t).all_pages()
+
+
+def read_fleet_vpd(devices: list[str], max_workers: int = 16, transport: str = "sg_io") -> dict[str, dict]:
+    """
+    Reads all VPD pages from many devices at once as {device: {page: parsed}}, see
+    scsi_tools.read_fleet.
+    """
+    return read_fleet(devices, read_device_vpd, max_workers, transport)
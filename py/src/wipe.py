@@ -0,0 +1,458 @@
+"""
+Device-side erase of many drives at once.
+
+Writing zeros from the host moves every byte of the drive over the bus; every method
+here has the drive do the work instead. detect_erase_support asks the drive which erase
+commands it implements with REPORT SUPPORTED OPERATION CODES (falling back to FORMAT
+UNIT, which SBC makes mandatory, when the drive does not implement that) and reads the
+Logical Block Provisioning (0xB2) and Block Limits (0xB0) VPD pages. erase_support.methods
+then lists what the drive can do, fastest first:
+
+  crypto      SANITIZE CRYPTOGRAPHIC ERASE: the media key is replaced, seconds
+  block       SANITIZE BLOCK ERASE: every flash block is erased, seconds to minutes
+  write_same  WRITE SAME (16) with UNMAP of a zero block, on a drive that deallocates
+              (LBPWS) and reads deallocated blocks as zeros (LBPRZ 001b)
+  unmap       UNMAP of every LBA, on a drive with LBPU and LBPRZ whose Block Limits
+              allow UNMAP (a maximum LBA or descriptor count of 0 means they do not)
+  overwrite   SANITIZE OVERWRITE with the pattern, the drive writing every block
+  format      FORMAT UNIT with the pattern as initialization pattern
+  write_same  on a drive that cannot deallocate, written block by block by the drive
+
+SANITIZE and FORMAT UNIT are started with IMMED and polled with REQUEST SENSE, whose
+sense-key specific field carries the progress, at the adaptive intervals the self-test
+runner uses. WRITE SAME and UNMAP are sent range by range and their progress is the share
+of LBAs done. Each drive has its own worker thread and, once erased, goes straight on to
+blank_check against the pattern it was erased to, at most per_hba drives per host
+adapter reading at a time as in fleet.py.
+"""
+import sys
+import threading
+import time
+from typing import Optional
+
+import scsi_cdb
+from fleet import DEFAULT_PER_HBA
+from provisioning import LBPRZ_ZEROS
+from scsi_class import scsi_device
+from scsi_tools import get_scsi_host
+from self_test_runner import MAX_POLL_INTERVAL, MIN_POLL_INTERVAL, next_poll_interval
+from sense import ILLEGAL_REQUEST, NO_SENSE, NOT_READY, UNIT_ATTENTION, decode_sense
+from sg_transport import open_transport, scsi_command_error, sg_transport
+from verifier import DEFAULT_ZERO_BUFFER, lba_verifier, make_verifier, repeat_verifier
+from vpd import VPD_BLOCK_LIMITS, VPD_LOGICAL_BLOCK_PROVISIONING, vpd_engine
+
+ERASE_METHODS = ("crypto", "block", "write_same", "unmap", "overwrite", "format")
+SANITIZE_ACTIONS = {
+    "crypto": scsi_cdb.SANITIZE_CRYPTO_ERASE,
+    "block": scsi_cdb.SANITIZE_BLOCK_ERASE,
+    "overwrite": scsi_cdb.SANITIZE_OVERWRITE,
+}
+# Methods that can leave a pattern other than zeros behind
+PATTERN_METHODS = ("overwrite", "format", "write_same")
+# After a crypto erase blocks read back as the old data under the new key, so there is
+# nothing a blank check could compare them with
+UNVERIFIABLE_METHODS = ("crypto",)
+# ASC/ASCQ of a drive busy with a format, an operation or a sanitize
+ERASE_IN_PROGRESS = ((0x04, 0x04), (0x04, 0x07), (0x04, 0x1B), (0x00, 0x16))
+RSOC_REPLY_LEN = 64
+COMMAND_TIMEOUT_MS = 60000
+WRITE_SAME_TIMEOUT_MS = 600000
+DEFAULT_WRITE_SAME_BYTES = 1 << 30  # per WRITE SAME when Block Limits sets no maximum
+DEFAULT_TIMEOUT = 72 * 3600.0       # an overwrite of a large hard drive takes well over a day
+
+
+def erase_pattern(spec: str) -> bytes:
+    """
+    The pattern a verifier.make_verifier spec asks every block to hold: zero, ff or
+    repeat:HEX. LBA-tagged blocks cannot be written by the drive and raise ValueError.
+    """
+    verifier = make_verifier(spec)
+    if isinstance(verifier, lba_verifier):
+        raise ValueError(f"Pattern '{spec}' cannot be written by the drive, expected zero, ff or repeat:HEX")
+    return verifier.pattern if isinstance(verifier, repeat_verifier) else b"\x00"
+
+
+def command_supported(transport: sg_transport, opcode: int, service_action: Optional[int] = None) -> bool:
+    """
+    True if REPORT SUPPORTED OPERATION CODES says the drive implements the command.
+    Raises scsi_command_error (ILLEGAL REQUEST) if the drive does not implement REPORT
+    SUPPORTED OPERATION CODES itself.
+    """
+    data = transport.read_data(scsi_cdb.report_supported_opcode(opcode, service_action, RSOC_REPLY_LEN),
+                               RSOC_REPLY_LEN, timeout_ms=COMMAND_TIMEOUT_MS)
+    return len(data) >= 2 and data[1] & 0x07 in (scsi_cdb.RSOC_SUPPORTED, scsi_cdb.RSOC_SUPPORTED_VENDOR)
+
+
+class erase_support:
+    """
+    The erase commands one drive implements and the limits that apply to them.
+    reported is False when the drive could not say (no REPORT SUPPORTED OPERATION CODES)
+    and the commands were inferred.
+    """
+    def __init__(self):
+        self.reported: bool = True
+        self.sanitize: set[int] = set()
+        self.format_unit: bool = False
+        self.write_same: bool = False
+        self.unmap: bool = False
+        self.lbpu: bool = False
+        self.lbpws: bool = False
+        self.lbprz: bool = False
+        self.max_unmap_blocks: int = 0
+        self.max_unmap_descriptors: int = 0
+        self.max_write_same_blocks: int = 0
+
+    def methods(self, pattern: bytes = b"\x00", verify: bool = True) -> list[str]:
+        """
+        The usable methods, fastest first. A pattern other than zeros rules out the methods
+        that cannot write one, and verify rules out those whose result cannot be checked.
+        """
+        zero = not any(pattern)
+        methods = []
+        if zero and scsi_cdb.SANITIZE_CRYPTO_ERASE in self.sanitize:
+            methods.append("crypto")
+        if zero and scsi_cdb.SANITIZE_BLOCK_ERASE in self.sanitize:
+            methods.append("block")
+        if zero and self.write_same and self.lbpws and self.lbprz:
+            methods.append("write_same")
+        if zero and self.unmap and self.lbpu and self.lbprz and self.max_unmap_blocks and self.max_unmap_descriptors:
+            methods.append("unmap")
+        if scsi_cdb.SANITIZE_OVERWRITE in self.sanitize:
+            methods.append("overwrite")
+        if self.format_unit:
+            methods.append("format")
+        if self.write_same and "write_same" not in methods:
+            methods.append("write_same")
+        if verify:
+            methods = [method for method in methods if method not in UNVERIFIABLE_METHODS]
+        return methods
+
+    def __str__(self) -> str:
+        names = {action: method for method, action in SANITIZE_ACTIONS.items()}
+        sanitize = ", ".join(names[action] for action in sorted(self.sanitize) if action in names) or "none"
+        source = "" if self.reported else " (inferred, no REPORT SUPPORTED OPERATION CODES)"
+        return (f"sanitize: {sanitize}, format unit: {self.format_unit}, write same(16): {self.write_same}, "
+                f"unmap: {self.unmap}, LBPRZ: {self.lbprz}{source}")
+
+
+def detect_erase_support(transport: sg_transport) -> erase_support:
+    """
+    What one drive can erase with. Errors other than the drive refusing REPORT
+    SUPPORTED OPERATION CODES are raised.
+    """
+    support = erase_support()
+    try:
+        for action in (scsi_cdb.SANITIZE_OVERWRITE, scsi_cdb.SANITIZE_BLOCK_ERASE, scsi_cdb.SANITIZE_CRYPTO_ERASE):
+            if command_supported(transport, scsi_cdb.SANITIZE, action):
+                support.sanitize.add(action)
+        support.format_unit = command_supported(transport, scsi_cdb.FORMAT_UNIT)
+        support.write_same = command_supported(transport, scsi_cdb.WRITE_SAME_16)
+        support.unmap = command_supported(transport, scsi_cdb.UNMAP)
+    except scsi_command_error as e:
+        if e.sense_key != ILLEGAL_REQUEST:
+            raise
+        # REPORT SUPPORTED OPERATION CODES is optional; SANITIZE cannot be assumed
+        support.reported = False
+        support.sanitize.clear()
+        support.format_unit = True
+
+    engine = vpd_engine(transport)
+    try:
+        pages = engine.supported_pages()
+    except (scsi_command_error, RuntimeError):
+        pages = []
+    if VPD_LOGICAL_BLOCK_PROVISIONING in pages:
+        provisioning = engine.page(VPD_LOGICAL_BLOCK_PROVISIONING)
+        support.lbpu = provisioning.get("lbpu", False)
+        support.lbpws = provisioning.get("lbpws", False)
+        # LBPRZ 010b only promises the provisioning initialization pattern, not zeros
+        support.lbprz = provisioning.get("lbprz", 0) == LBPRZ_ZEROS
+        if not support.reported:
+            support.write_same = support.lbpws
+            support.unmap = support.lbpu
+    if VPD_BLOCK_LIMITS in pages:
+        limits = engine.page(VPD_BLOCK_LIMITS)
+        support.max_unmap_blocks = limits.get("max_unmap_lba_count", 0)
+        support.max_unmap_descriptors = limits.get("max_unmap_descriptor_count", 0)
+        support.max_write_same_blocks = limits.get("max_write_same_length", 0)
+    return support
+
+
+class erase_failed(RuntimeError):
+    """
+    The drive reported that the erase itself failed.
+    """
+
+
+class wipe_job:
+    """
+    One drive's erase and blank check. state moves from 'queued' through 'erasing' and
+    'verifying' and ends as 'pass', 'fail', 'erased' (no blank check asked for),
+    'timeout' or 'error'. progress is the fraction of the current phase done.
+    """
+    def __init__(self, device: str, host: str, timeout: float):
+        self.device: str = device
+        self.host: str = host
+        self.timeout: float = timeout
+        self.state: str = "queued"
+        self.method: Optional[str] = None
+        self.support: Optional[erase_support] = None
+        self.progress: Optional[float] = None
+        self.message: str = ""
+        self.started: float = 0.0
+        self.erased: float = 0.0
+        self.ended: float = 0.0
+        self.polls: int = 0
+        self.interval: float = 0.0
+        self._last_progress: Optional[tuple[float, float]] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.state in ("pass", "fail", "erased", "timeout", "error")
+
+    def status_line(self) -> str:
+        elapsed = (self.ended or time.monotonic()) - self.started if self.started else 0.0
+        progress = f"{100.0 * self.progress:6.2f}%" if self.progress is not None else "   ?   "
+        line = (f"{self.device:<10} {self.host:<8} {self.state.upper():<9} {self.method or '-':<10} "
+                f"[{progress}] {elapsed:8.0f}s")
+        if self.message:
+            line += f"  {self.message}"
+        return line
+
+
+class wipe_orchestrator:
+    """
+    Erases every device with method ('auto' for the fastest the drive supports, or one of
+    ERASE_METHODS) to pattern (zero, ff or repeat:HEX) and, with verify, blank checks it
+    against that pattern. Erasing runs on the drives themselves, so all of them erase at
+    once; only the blank checks are limited to per_hba drives per host adapter.
+    Devices are never scanned for: every drive to be erased has to be named.
+    A method in UNVERIFIABLE_METHODS raises ValueError unless verify is off.
+    With provisioning, the blank check of a thin-provisioned drive only reads the extents
+    still mapped after the erase (see scsi_device.provisioning_check).
+    """
+    def __init__(self, devices: list[str], method: str = "auto", pattern: str = "zero", verify: bool = True,
+                 transport: str = "sg_io", per_hba: int = DEFAULT_PER_HBA, timeout: float = DEFAULT_TIMEOUT,
+                 min_interval: float = MIN_POLL_INTERVAL, max_interval: float = MAX_POLL_INTERVAL,
+                 queue_depth: int = 1, chunk_blocks: int = 1000, read_mode: str = "sg",
+                 provisioning: bool = False):
+        if method != "auto" and method not in ERASE_METHODS:
+            raise ValueError(f"method must be 'auto' or one of {ERASE_METHODS}")
+        self.pattern_bytes: bytes = erase_pattern(pattern)
+        if any(self.pattern_bytes) and method not in ("auto",) + PATTERN_METHODS:
+            raise ValueError(f"{method} cannot write pattern '{pattern}', only {', '.join(PATTERN_METHODS)} can")
+        if method in UNVERIFIABLE_METHODS and verify:
+            raise ValueError(f"{method} erase leaves nothing a blank check could verify, pass --no-verify to use it")
+        self.method: str = method
+        self.pattern: str = pattern
+        self.verify: bool = verify
+        self.transport: str = transport
+        self.per_hba: int = per_hba
+        self.timeout: float = timeout
+        self.min_interval: float = min_interval
+        self.max_interval: float = max_interval
+        self.queue_depth: int = queue_depth
+        self.chunk_blocks: int = chunk_blocks
+        self.read_mode: str = read_mode
+        self.provisioning: bool = provisioning
+        self.jobs: list[wipe_job] = [wipe_job(device, get_scsi_host(device), timeout) for device in devices]
+        self._host_slots: dict[str, threading.BoundedSemaphore] = {
+            job.host: threading.BoundedSemaphore(per_hba) for job in self.jobs
+        }
+
+    def _choose(self, job: wipe_job) -> str:
+        methods = job.support.methods(self.pattern_bytes, self.verify)
+        if self.method == "auto":
+            if not methods:
+                raise RuntimeError(f"no erase method for pattern '{self.pattern}' ({job.support})")
+            return methods[0]
+        if self.method not in job.support.methods(self.pattern_bytes, verify=False):
+            raise RuntimeError(f"{self.method} is not supported ({job.support})")
+        return self.method
+
+    def _check_timeout(self, job: wipe_job) -> None:
+        if time.monotonic() - job.started > job.timeout:
+            raise TimeoutError(f"still erasing after {job.timeout:.0f}s")
+
+    def _wait(self, job: wipe_job, transport: sg_transport) -> None:
+        """
+        Polls REQUEST SENSE until the drive no longer reports a sanitize or format in progress.
+        Raises erase_failed if it then reports an error, TimeoutError past the job's timeout.
+        A UNIT ATTENTION (a reset, changed parameters) says nothing about the erase; REQUEST
+        SENSE clears it, so polling carries on.
+        """
+        job.interval = self.min_interval
+        while True:
+            time.sleep(job.interval)
+            job.polls += 1
+            sense = decode_sense(bytes(transport.read_data(scsi_cdb.request_sense(), scsi_cdb.REQUEST_SENSE_REPLY_LEN,
+                                                           timeout_ms=COMMAND_TIMEOUT_MS)))
+            if sense is None:
+                return
+            if sense.key == UNIT_ATTENTION:
+                self._check_timeout(job)
+                continue
+            running = (sense.asc, sense.ascq) in ERASE_IN_PROGRESS or (sense.key == NO_SENSE
+                                                                       and sense.progress is not None)
+            if not running:
+                if sense.key != NO_SENSE:
+                    raise erase_failed(f"erase failed: {sense}")
+                return
+            if sense.key not in (NO_SENSE, NOT_READY):
+                raise erase_failed(f"erase failed: {sense}")
+            self._check_timeout(job)
+            job.interval = next_poll_interval(job, time.monotonic(), sense.progress, self.min_interval,
+                                              self.max_interval)
+
+    def _write_same(self, job: wipe_job, dev: scsi_device) -> None:
+        """
+        WRITE SAME (16) over the whole device, unmapping when the pattern is zeros and the
+        drive can deallocate blocks that then read back as zeros (LBPWS and LBPRZ 001b).
+        """
+        support, block_size = job.support, dev.block_size
+        per_command = support.max_write_same_blocks or DEFAULT_WRITE_SAME_BYTES // block_size
+        per_command = max(1, min(per_command, scsi_cdb.WRITE_SAME_16_MAX_BLOCKS))
+        block = (self.pattern_bytes * (block_size // len(self.pattern_bytes) + 1))[:block_size]
+        unmap = not any(block) and support.lbpws and support.lbprz
+        for lba in range(0, dev.no_blocks, per_command):
+            blocks = min(per_command, dev.no_blocks - lba)
+            dev.retry.run(dev.transport.execute, scsi_cdb.write_same16(lba, blocks, unmap=unmap), None, block,
+                          WRITE_SAME_TIMEOUT_MS)
+            job.progress = (lba + blocks) / dev.no_blocks
+            self._check_timeout(job)
+
+    def _unmap(self, job: wipe_job, dev: scsi_device) -> None:
+        """
+        UNMAP of every LBA, as many ranges per command as Block Limits allows. A maximum
+        UNMAP LBA or descriptor count of 0 means the drive does not support UNMAP and raises
+        RuntimeError; 0xFFFFFFFF means no limit.
+        """
+        support = job.support
+        if not support.max_unmap_blocks or not support.max_unmap_descriptors:
+            raise RuntimeError("Block Limits report a maximum UNMAP count of 0, UNMAP is not supported")
+        descriptors = min(support.max_unmap_descriptors, scsi_cdb.UNMAP_MAX_DESCRIPTORS)
+        limit = support.max_unmap_blocks
+        if limit == 0xFFFFFFFF:
+            limit = descriptors * 0xFFFFFFFF
+        lba = 0
+        while lba < dev.no_blocks:
+            ranges: list[tuple[int, int]] = []
+            budget = limit
+            while lba < dev.no_blocks and budget and len(ranges) < descriptors:
+                blocks = min(dev.no_blocks - lba, budget, 0xFFFFFFFF)
+                ranges.append((lba, blocks))
+                lba += blocks
+                budget -= blocks
+            params = scsi_cdb.unmap_params(ranges)
+            dev.retry.run(dev.transport.execute, scsi_cdb.unmap(len(params)), None, params, WRITE_SAME_TIMEOUT_MS)
+            job.progress = lba / dev.no_blocks
+            self._check_timeout(job)
+
+    def _erase(self, job: wipe_job, dev: scsi_device) -> None:
+        transport = dev.transport
+        if job.method in SANITIZE_ACTIONS:
+            params = (scsi_cdb.sanitize_overwrite_params(self.pattern_bytes) if job.method == "overwrite"
+                      else None)
+            transport.execute(scsi_cdb.sanitize(SANITIZE_ACTIONS[job.method], param_len=len(params or b"")),
+                              data_out=params, timeout_ms=COMMAND_TIMEOUT_MS)
+            self._wait(job, transport)
+        elif job.method == "format":
+            params = scsi_cdb.format_unit_params(self.pattern_bytes)
+            transport.execute(scsi_cdb.format_unit(), data_out=params, timeout_ms=COMMAND_TIMEOUT_MS)
+            self._wait(job, transport)
+        elif job.method == "write_same":
+            self._write_same(job, dev)
+        else:
+            self._unmap(job, dev)
+
+    def _finish(self, job: wipe_job, state: str, message: str = "") -> None:
+        job.state = state
+        job.message = message
+        job.ended = time.monotonic()
+
+    def _verify(self, job: wipe_job) -> None:
+        self._host_slots[job.host].acquire()
+        try:
+            job.state = "verifying"
+            job.progress = 0.0
+            with scsi_device(job.device, transport=self.transport) as dev:
+                dev.read_capacity()
+                verifier = make_verifier(self.pattern, min(self.chunk_blocks * dev.block_size, DEFAULT_ZERO_BUFFER))
+                if self.provisioning:
+                    report = dev.provisioning_check(queue_depth=self.queue_depth, chunk_blocks=self.chunk_blocks,
+                                                    read_mode=self.read_mode, verifier=verifier,
+                                                    progress=lambda checked, total: setattr(job, "progress",
+                                                                                            checked / total))
+                    if report:
+                        self._finish(job, "pass", f"{job.method} in {job.erased - job.started:.0f}s, {report}")
+                    else:
+                        self._finish(job, "fail", str(report))
+                elif dev.blank_check(queue_depth=self.queue_depth, chunk_blocks=self.chunk_blocks,
+                                   read_mode=self.read_mode, verifier=verifier,
+                                   progress=lambda checked, total: setattr(job, "progress", checked / total)):
+                    self._finish(job, "pass", f"{job.method} in {job.erased - job.started:.0f}s, verified")
+                else:
+                    self._finish(job, "fail", dev.errors[-1] if dev.errors else "")
+        finally:
+            self._host_slots[job.host].release()
+
+    def _worker(self, job: wipe_job) -> None:
+        try:
+            with scsi_device(job.device, transport=open_transport(job.device, self.transport, writable=True)) as dev:
+                dev.read_capacity()
+                job.support = detect_erase_support(dev.transport)
+                job.method = self._choose(job)
+                job.state = "erasing"
+                job.started = time.monotonic()
+                self._erase(job, dev)
+            job.erased = time.monotonic()
+            job.progress = 1.0
+            if not self.verify:
+                self._finish(job, "erased", f"{job.method} in {job.erased - job.started:.0f}s")
+                return
+            self._verify(job)
+        except TimeoutError as e:
+            self._finish(job, "timeout", str(e))
+        except erase_failed as e:
+            self._finish(job, "fail", str(e))
+        except Exception as e:
+            self._finish(job, "error", str(e))
+
+    def _render(self, first: bool) -> None:
+        lines = [job.status_line() for job in self.jobs]
+        if not first:
+            sys.stdout.write(f"\x1b[{len(lines)}A")
+        for line in lines:
+            sys.stdout.write(f"\x1b[2K{line}\n")
+        sys.stdout.flush()
+
+    def run(self, refresh: float = 0.5, live: bool = True) -> bool:
+        """
+        Erases (and verifies) every device and returns True only if all of them ended as
+        'pass', or as 'erased' without verify. With live set, one status line per device
+        is redrawn every refresh seconds.
+        """
+        for job in self.jobs:
+            # Daemon threads: a drive stuck inside an ioctl must not keep the process alive
+            threading.Thread(target=self._worker, args=(job,), name=f"wipe-{job.device}", daemon=True).start()
+
+        first = True
+        while True:
+            if live:
+                self._render(first)
+                first = False
+            if all(job.finished for job in self.jobs):
+                break
+            time.sleep(refresh)
+        return all(job.state == ("pass" if self.verify else "erased") for job in self.jobs)
+
+    def summary(self) -> str:
+        counts: dict[str, int] = {}
+        lines = ["[+] Wipe summary:"]
+        for job in self.jobs:
+            counts[job.state] = counts.get(job.state, 0) + 1
+            detail = f" - {job.message}" if job.message else ""
+            lines.append(f"    {job.device:<10} {job.host:<8} {job.state.upper()} ({job.method or 'no method'}){detail}")
+        totals = ", ".join(f"{count} {state}" for state, count in sorted(counts.items()))
+        lines.append(f"    {len(self.jobs)} devices: {totals}")
+        return "\n".join(lines)
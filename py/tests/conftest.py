@@ -0,0 +1,48 @@
+import os
+import sys
+
+PY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(PY_DIR, "src"))
+
+import pytest
+
+from scsi_class import scsi_device
+from sg_emulator import create_image, emulated_transport, scsi_emulator
+
+BLOCK_SIZE = 512
+IMAGE_BLOCKS = 8192
+
+
+def write_blocks(path: str, lba: int, data: bytes, block_size: int = BLOCK_SIZE) -> None:
+    fd = os.open(path, os.O_WRONLY)
+    try:
+        os.pwrite(fd, data, lba * block_size)
+    finally:
+        os.close(fd)
+
+
+@pytest.fixture
+def image(tmp_path) -> str:
+    """
+    A sparse, all-zero image of IMAGE_BLOCKS blocks.
+    """
+    return create_image(str(tmp_path / "disk.img"), IMAGE_BLOCKS, BLOCK_SIZE)
+
+
+@pytest.fixture
+def make_device():
+    """
+    Builds scsi_devices on emulators of an image; every one is closed after the test.
+    """
+    opened: list[tuple[scsi_device, scsi_emulator]] = []
+
+    def make(path: str, **options) -> scsi_device:
+        emulator = scsi_emulator(path, block_size=BLOCK_SIZE, **options)
+        dev = scsi_device(path, transport=emulated_transport(path, emulator))
+        opened.append((dev, emulator))
+        return dev
+
+    yield make
+    for dev, emulator in opened:
+        dev.close()
+        emulator.close()
@@ -0,0 +1,75 @@
+import struct
+
+from ata_smart import (ATTRIBUTE, SECTOR, SELF_TEST_ENTRY, THRESHOLD, parse_self_test_log, parse_smart_data,
+                       parse_statistics_page, read_fleet_smart)
+
+
+def sealed(sector: bytearray) -> bytes:
+    """
+    Sets the checksum byte so the sector sums to zero.
+    """
+    sector[SECTOR - 1] = -sum(sector[:SECTOR - 1]) & 0xFF
+    return bytes(sector)
+
+
+def smart_data(attributes: list[tuple[int, int, int]]) -> bytes:
+    sector = bytearray(SECTOR)
+    struct.pack_into("<H", sector, 0, 0x10)
+    for index, (attribute_id, current, raw) in enumerate(attributes):
+        ATTRIBUTE.pack_into(sector, 2 + index * ATTRIBUTE.size, attribute_id, 0x01, current, current,
+                            raw.to_bytes(6, "little"), 0)
+    sector[363] = 0x0F << 4 | 4  # in progress, 40% remaining
+    sector[372], sector[373] = 2, 0xFF
+    struct.pack_into("<H", sector, 375, 600)
+    return sealed(sector)
+
+
+def thresholds(limits: list[tuple[int, int]]) -> bytes:
+    sector = bytearray(SECTOR)
+    for index, (attribute_id, threshold) in enumerate(limits):
+        THRESHOLD.pack_into(sector, 2 + index * THRESHOLD.size, attribute_id, threshold, bytes(10))
+    return sealed(sector)
+
+
+def test_smart_data_merges_thresholds():
+    report = parse_smart_data(smart_data([(5, 100, 8), (9, 90, 12345)]), thresholds([(5, 100), (9, 0)]))
+    assert report["checksum_ok"]
+    reallocated, hours = report["attributes"]
+    assert (reallocated["name"], reallocated["raw"], reallocated["failing"]) == ("reallocated_sector_count", 8, True)
+    assert (hours["name"], hours["raw"], hours["failing"]) == ("power_on_hours", 12345, False)
+    assert (report["self_test_status"], report["self_test_percent_remaining"]) == (0xF, 40)
+    assert report["extended_self_test_minutes"] == 600
+
+
+def test_smart_data_bad_checksum():
+    data = bytearray(smart_data([(5, 100, 0)]))
+    data[10] ^= 0xFF
+    assert not parse_smart_data(data)["checksum_ok"]
+
+
+def test_self_test_log_newest_first():
+    sector = bytearray(SECTOR)
+    for index, hours in enumerate((100, 200, 300)):
+        status = 0x70 if hours == 200 else 0x00  # the middle one failed in the read element
+        SELF_TEST_ENTRY.pack_into(sector, 2 + index * SELF_TEST_ENTRY.size, 0x02, status, hours, 0,
+                                  0xF0001234, bytes(15))
+    sector[508] = 2
+    entries = parse_self_test_log(sector)
+    assert [entry["power_on_hours"] for entry in entries] == [200, 100, 300]
+    assert entries[0]["failing_lba"] == 0x1234
+    assert entries[1]["failing_lba"] is None
+
+
+def test_statistics_page_temperatures_are_signed():
+    qwords = [0x0001 | 0x05 << 16, 1 << 63 | 1 << 62 | 0xFB, 1 << 63, 1 << 63 | 1 << 62 | 1 << 59 | 70]
+    data = struct.pack("<4Q", *qwords) + bytes(SECTOR - 32)
+    stats = parse_statistics_page(data)["statistics"]
+    assert stats["current_temperature"] == -5
+    assert "average_short_term_temperature" not in stats
+    assert stats["average_long_term_temperature"] == 70
+    assert stats["average_long_term_temperature_condition_met"]
+
+
+def test_read_fleet_smart_reports_failing_devices(tmp_path):
+    missing = str(tmp_path / "missing.img")
+    assert set(read_fleet_smart([missing], transport="emulated")[missing]) == {"error"}
@@ -0,0 +1,50 @@
+import os
+from typing import Optional
+
+import pytest
+
+from checkpoint import checkpoint_mismatch, open_journal
+from conftest import BLOCK_SIZE, IMAGE_BLOCKS
+from scsi_class import scsi_device
+from sg_emulator import create_image, emulated_transport, scsi_emulator
+
+
+class blank_serial_emulator(scsi_emulator):
+    """
+    A drive that reports an empty Unit Serial Number page but still has its own NAA.
+    """
+    def _vpd_page(self, page: int) -> Optional[bytes]:
+        return b"" if page == 0x80 else super()._vpd_page(page)
+
+
+@pytest.fixture
+def home(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path / "home"))
+    return tmp_path / "home"
+
+
+def blank_serial_device(path: str) -> scsi_device:
+    return scsi_device(path, transport=emulated_transport(path, blank_serial_emulator(path, block_size=BLOCK_SIZE)))
+
+
+def test_drives_with_blank_serials_get_their_own_journals(tmp_path, home):
+    paths = [create_image(str(tmp_path / f"disk{n}.img"), IMAGE_BLOCKS, BLOCK_SIZE) for n in range(2)]
+    journals = []
+    for path in paths:
+        with blank_serial_device(path) as dev:
+            journals.append(dev.open_journal())
+            assert dev.serial_number == ""
+            assert dev.wwid.startswith("naa.")
+    assert journals[0].path != journals[1].path
+    assert all(os.path.dirname(journal.path).startswith(str(home)) for journal in journals)
+
+
+def test_resume_refuses_a_journal_of_another_wwid(tmp_path, home):
+    path = str(tmp_path / "journal.json")
+    journal = open_journal(path, "/dev/sg1", "", IMAGE_BLOCKS, BLOCK_SIZE, wwid="naa.5000c500aaaaaaaa")
+    journal.record(0, 100)
+    journal.save()
+    with pytest.raises(checkpoint_mismatch, match="WWID"):
+        open_journal(path, "/dev/sg2", "", IMAGE_BLOCKS, BLOCK_SIZE, resume=True, wwid="naa.5000c500bbbbbbbb")
+    resumed = open_journal(path, "/dev/sg1", "", IMAGE_BLOCKS, BLOCK_SIZE, resume=True, wwid="naa.5000c500aaaaaaaa")
+    assert resumed.resume_lba() == 100
@@ -0,0 +1,44 @@
+import os
+import shutil
+import subprocess
+
+import pytest
+
+import scsi_cdb
+from sg_coproc import sg_coproc
+
+C_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "c", "scsi_serial.c")
+
+
+@pytest.fixture(scope="module")
+def binary(tmp_path_factory) -> str:
+    compiler = shutil.which("gcc") or shutil.which("cc")
+    if compiler is None:
+        pytest.skip("no C compiler to build scsi_serial")
+    path = str(tmp_path_factory.mktemp("coproc") / "scsi_serial")
+    subprocess.run([compiler, "-O2", "-Wall", "-o", path, C_SOURCE], check=True)
+    return path
+
+
+def test_current_build_answers_commands(binary, image):
+    coproc = sg_coproc(binary)
+    try:
+        # A regular file cannot take SG_IO: the co-process reports the errno instead of exiting
+        result = coproc.execute(image, scsi_cdb.inquiry(0, 0, 96), memoryview(bytearray(96)))
+        assert result.error != 0
+        assert coproc._process.poll() is None
+    finally:
+        coproc.close()
+
+
+def test_stale_binary_is_refused(tmp_path):
+    stale = tmp_path / "scsi_serial"
+    stale.write_text("#!/bin/sh\necho 'Failed to open device' >&2\nexit 1\n")
+    stale.chmod(0o755)
+    with pytest.raises(RuntimeError, match="make -C c"):
+        sg_coproc(str(stale))
+
+
+def test_missing_binary_is_refused(tmp_path):
+    with pytest.raises(RuntimeError, match="not found"):
+        sg_coproc(str(tmp_path / "missing"))
@@ -0,0 +1,58 @@
+import threading
+import time
+
+from fleet import fleet_blank_check, fleet_job
+
+
+class scripted_fleet(fleet_blank_check):
+    """
+    A fleet whose drive checks are scripted: the first device hangs until released, the
+    others pass at once. Records how many checks ran at the same time.
+    """
+    def __init__(self, devices: list[str], **options):
+        super().__init__(devices, transport="emulated", **options)
+        self.release = threading.Event()
+        self.started: list[str] = []
+        self.running: int = 0
+        self.most_running: int = 0
+        self.exited = threading.Event()
+
+    def _check(self, job: fleet_job) -> None:
+        with self._lock:
+            self.started.append(job.device)
+            self.running += 1
+            self.most_running = max(self.most_running, self.running)
+        try:
+            if job.device == self.jobs[0].device:
+                self.release.wait(5.0)
+                self.exited.set()
+            self._finish(job, "pass", "")
+        finally:
+            with self._lock:
+                self.running -= 1
+
+
+def test_stalled_drive_keeps_its_slot_until_its_worker_exits(tmp_path):
+    devices = [str(tmp_path / "stuck.img"), str(tmp_path / "next.img")]
+    fleet = scripted_fleet(devices, per_hba=1, stall_timeout=0.05)
+    assert not fleet.run(refresh=0.01, live=False)
+    stuck, queued = fleet.jobs
+    assert stuck.state == "stalled"
+    assert queued.state == "error"
+    assert fleet.started == [stuck.device]
+    # Once the hung command returns the slot is freed, and the abandoned drive is not started
+    fleet.release.set()
+    assert fleet.exited.wait(5.0)
+    time.sleep(0.05)
+    assert fleet.started == [stuck.device]
+    assert fleet.most_running == 1
+    assert not stuck.holding_slot and not queued.holding_slot
+
+
+def test_every_drive_runs_when_none_stalls(tmp_path):
+    devices = [str(tmp_path / f"disk{n}.img") for n in range(4)]
+    fleet = scripted_fleet(devices, per_hba=2, stall_timeout=5.0)
+    fleet.release.set()
+    assert fleet.run(refresh=0.01, live=False)
+    assert sorted(fleet.started) == sorted(devices)
+    assert fleet.most_running <= 2
@@ -0,0 +1,57 @@
+import importlib.util
+import os
+
+import pytest
+
+from conftest import PY_DIR
+
+
+def load_script(name: str):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(PY_DIR, f"{name}.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class cached_inventory:
+    entry = {"vendor": "SEAGATE", "model": "ST4000NM0023", "revision": "GS0F", "serial": "Z1Z0ABCD"}
+
+    def get(self, device: str) -> dict:
+        return dict(self.entry, device=device)
+
+    def save(self) -> None:
+        pass
+
+
+class unavailable_inventory:
+    def get(self, device: str) -> dict:
+        raise RuntimeError(f"{device} is not a SCSI generic device, it cannot be cached")
+
+    def save(self) -> None:
+        pass
+
+
+def no_commands(device: str):
+    raise AssertionError(f"{device} was sent a command despite a cache hit")
+
+
+@pytest.mark.parametrize("script, function, expected", [
+    ("scsi_serial", "get_serial", ["Serial Number: Z1Z0ABCD", "Part Number (Product ID): 'ST4000NM0023'"]),
+    ("scsi_part", "get_part_number", ["Part Number (Product ID): 'ST4000NM0023'", "Revision Level: 'GS0F'"]),
+])
+def test_identity_comes_from_the_cache(script, function, expected, monkeypatch, capsys):
+    module = load_script(script)
+    monkeypatch.setattr(module, "inventory_cache", cached_inventory)
+    monkeypatch.setattr(module, "sg_io_transport", no_commands)
+    getattr(module, function)("/dev/sg3")
+    assert capsys.readouterr().out.splitlines() == expected
+
+
+@pytest.mark.parametrize("script, function", [("scsi_serial", "get_serial"), ("scsi_part", "get_part_number")])
+def test_falls_back_to_inquiry_without_a_cache_entry(script, function, monkeypatch, capsys):
+    module = load_script(script)
+    opened = []
+    monkeypatch.setattr(module, "inventory_cache", unavailable_inventory)
+    monkeypatch.setattr(module, "sg_io_transport", lambda device: opened.append(device) or no_commands(device))
+    getattr(module, function)("/dev/sg3")
+    assert opened == ["/dev/sg3"]
@@ -0,0 +1,44 @@
+import pytest
+
+import scsi_cdb
+from conftest import IMAGE_BLOCKS, write_blocks
+from imaging import image_map
+
+
+@pytest.mark.parametrize("read_mode", ["sg", "pipeline"])
+def test_image_copies_data_and_leaves_holes(image, make_device, tmp_path, read_mode):
+    write_blocks(image, 3000, b"\x5a" * 2048)
+    target = str(tmp_path / "copy.img")
+    result = make_device(image).image(target, chunk_blocks=500, read_mode=read_mode, queue_depth=1,
+                                      progress=lambda done, total: None)
+    assert result.state == "complete" and result.unreadable == []
+    with open(image, "rb") as source, open(target, "rb") as copy:
+        assert source.read() == copy.read()
+    assert image_map.load(target + ".map.json").imaged_blocks == IMAGE_BLOCKS
+
+
+def test_image_records_unreadable_pieces(image, make_device, tmp_path):
+    dev = make_device(image)
+    dev.transport.emulator.inject_error(scsi_cdb.READ_10, lba=1234)
+    result = dev.image(str(tmp_path / "copy.img"), chunk_blocks=500, read_mode="sg", queue_depth=1,
+                       retry_blocks=8, progress=lambda done, total: None)
+    assert result.unreadable == [[1232, 1240]]
+
+
+@pytest.mark.parametrize("read_mode", ["sg", "pipeline"])
+def test_short_reads_are_unreadable_not_stale(image, make_device, tmp_path, read_mode):
+    write_blocks(image, 1, b"\x5a" * 512)
+    write_blocks(image, 2502, b"\xff" * 512)
+    target = str(tmp_path / "copy.img")
+    dev = make_device(image, read_limit=1024)
+    result = dev.image(target, chunk_blocks=500, read_mode=read_mode, queue_depth=1, retry_blocks=4,
+                       progress=lambda done, total: None)
+    # The first two blocks of every 4-block piece arrive, the other two are unreadable
+    assert result.unreadable_blocks == IMAGE_BLOCKS // 2
+    assert result.unreadable[0] == [2, 4]
+    assert result.imaged_blocks == IMAGE_BLOCKS
+    with open(target, "rb") as copy:
+        data = copy.read()
+    assert data[512:1024] == b"\x5a" * 512
+    assert data[2502 * 512:2503 * 512] == b"\0" * 512
+    assert data.count(0) == len(data) - 512
@@ -0,0 +1,128 @@
+import os
+
+import pytest
+
+import inventory
+from inventory import inventory_cache, sysfs_identity
+
+
+class fake_sysfs:
+    """
+    A scsi_generic tree under tmp_path: /dev/sgN links to H:C:T:L with the attributes
+    sysfs_identity reads, and a udev database entry per device.
+    """
+    def __init__(self, root):
+        self.root = root
+        self.sg = root / "sys" / "class" / "scsi_generic"
+        self.udev = root / "run" / "udev" / "data"
+        self.sg.mkdir(parents=True)
+        self.udev.mkdir(parents=True)
+
+    def add(self, name: str, hctl: str, wwid: str, rev: str = "0001", minor: int = 1) -> str:
+        unit = self.root / "sys" / "devices" / hctl
+        (unit / "block" / "sdb").mkdir(parents=True, exist_ok=True)
+        (self.sg / name).mkdir(exist_ok=True)
+        link = self.sg / name / "device"
+        if not link.exists():
+            os.symlink(unit, link)
+        (self.sg / name / "dev").write_text(f"21:{minor}\n")
+        self.set(name, wwid=wwid, vendor="SEAGATE", model="ST4000NM0023", rev=rev)
+        (unit / "block" / "sdb" / "size").write_text("7814037168\n")
+        (self.udev / f"c21:{minor}").write_text("E:ID_SERIAL=x\n")
+        return f"/dev/{name}"
+
+    def set(self, name: str, **attributes: str) -> None:
+        for attribute, value in attributes.items():
+            (self.sg / name / "device" / attribute).write_text(f"{value}\n")
+
+    def touch_udev(self, minor: int = 1) -> None:
+        path = self.udev / f"c21:{minor}"
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+class queried_device:
+    """
+    Stands in for scsi_device in inventory_cache.refresh and counts the drives queried.
+    """
+    queried: list[str] = []
+
+    def __init__(self, device: str):
+        self.device = device
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def identify(self) -> bool:
+        queried_device.queried.append(self.device)
+        self.vendor, self.model, self.firmware_version = "SEAGATE", "ST4000NM0023", "0001"
+        self.serial_number = f"SERIAL{len(queried_device.queried)}"
+        self.no_blocks, self.block_size = 7814037168, 512
+        self.size = self.no_blocks * self.block_size
+        return True
+
+
+@pytest.fixture
+def sysfs(tmp_path, monkeypatch):
+    tree = fake_sysfs(tmp_path)
+    monkeypatch.setattr(inventory, "SG_SYSFS", str(tree.sg))
+    monkeypatch.setattr(inventory, "UDEV_DATA", str(tree.udev))
+    monkeypatch.setattr(inventory, "scsi_device", queried_device)
+    queried_device.queried = []
+    return tree
+
+
+@pytest.fixture
+def cache(tmp_path) -> inventory_cache:
+    return inventory_cache(str(tmp_path / "inventory.json"))
+
+
+def test_key_prefers_the_wwid(sysfs):
+    device = sysfs.add("sg1", "2:0:1:0", "naa.5000c500aaaaaaaa")
+    assert sysfs_identity(device)[0] == "sg1:naa.5000c500aaaaaaaa"
+    sysfs.set("sg1", wwid="")
+    assert sysfs_identity(device)[0] == "sg1:2:0:1:0"
+
+
+def test_warm_lookup_sends_no_command(sysfs, cache):
+    device = sysfs.add("sg1", "2:0:1:0", "naa.5000c500aaaaaaaa")
+    first = cache.get(device)
+    cache.save()
+    reloaded = inventory_cache(cache.path)
+    assert reloaded.get(device) == first
+    assert queried_device.queried == [device]
+
+
+@pytest.mark.parametrize("change", [
+    lambda sysfs: sysfs.set("sg1", rev="0002"),
+    lambda sysfs: sysfs.set("sg1", wwid="naa.5000c500bbbbbbbb"),
+    lambda sysfs: sysfs.touch_udev(),
+])
+def test_changed_fingerprint_forces_a_refresh(sysfs, cache, change):
+    device = sysfs.add("sg1", "2:0:1:0", "naa.5000c500aaaaaaaa")
+    first = cache.get(device)
+    change(sysfs)
+    assert cache.lookup(device) is None
+    second = cache.get(device)
+    assert queried_device.queried == [device, device]
+    assert second["serial"] != first["serial"]
+
+
+def test_refresh_drops_stale_entries_for_the_same_sg_node(sysfs, cache):
+    device = sysfs.add("sg1", "2:0:1:0", "naa.5000c500aaaaaaaa")
+    other = sysfs.add("sg2", "2:0:2:0", "naa.5000c500cccccccc", minor=2)
+    cache.get(device)
+    cache.get(other)
+    # A different drive now sits on sg1
+    sysfs.set("sg1", wwid="naa.5000c500bbbbbbbb")
+    cache.get(device)
+    assert sorted(cache.entries) == ["sg1:naa.5000c500bbbbbbbb", "sg2:naa.5000c500cccccccc"]
+
+
+def test_not_a_generic_device(sysfs, cache):
+    with pytest.raises(RuntimeError):
+        cache.get("/dev/sg9")
+    assert set(cache.inventory(["/dev/sg9"])[0]) == {"device", "error"}
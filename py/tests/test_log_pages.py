@@ -0,0 +1,44 @@
+import struct
+
+from log_pages import (LOG_READ_ERRORS, LOG_SELF_TEST_RESULTS, LOG_START_STOP_CYCLES, LOG_TEMPERATURE,
+                       iter_log_parameters, parse_self_test_results, parse_temperature, read_fleet_logs)
+
+
+def page(code: int, params: bytes) -> bytes:
+    return struct.pack(">BBH", code, 0, len(params)) + params
+
+
+def parameter(code: int, value: bytes, control: int = 0x03) -> bytes:
+    return struct.pack(">HBB", code, control, len(value)) + value
+
+
+def test_page_cut_short_yields_the_complete_parameters():
+    data = page(LOG_TEMPERATURE, parameter(0, b"\x00\x28") + parameter(1, b"\x00\x46"))
+    assert [code for code, _, _ in iter_log_parameters(data[:-1])] == [0]
+
+
+def test_temperature_unknown():
+    data = page(LOG_TEMPERATURE, parameter(0, b"\x00\xff") + parameter(1, b"\x00\x46"))
+    assert parse_temperature(data) == {"current_temperature": None, "reference_temperature": 70}
+
+
+def test_self_test_results_skip_unused_entries():
+    used = bytes((0x20 | 0x07, 3)) + struct.pack(">HQ", 1200, 4096) + bytes((0x03, 0x11, 0x00, 0))
+    unused = bytes(16)
+    data = page(LOG_SELF_TEST_RESULTS, parameter(2, unused) + parameter(1, used))
+    entries = parse_self_test_results(data)
+    assert len(entries) == 1
+    entry = entries[0]
+    assert (entry["number"], entry["code"], entry["result"], entry["segment"]) == (1, 1, 7, 3)
+    assert (entry["power_on_hours"], entry["failure_lba"]) == (1200, 4096)
+    assert (entry["sense_key"], entry["asc"], entry["ascq"]) == (0x03, 0x11, 0x00)
+
+
+def test_read_fleet_logs_reports_each_device(image, tmp_path):
+    missing = str(tmp_path / "missing.img")
+    results = read_fleet_logs([image, missing], max_workers=2, transport="emulated")
+    logs = results[image]
+    assert logs[LOG_TEMPERATURE] == {"current_temperature": 35, "reference_temperature": 60}
+    assert logs[LOG_START_STOP_CYCLES]["manufacture_date"] == "2024-W01"
+    assert logs[LOG_READ_ERRORS]
+    assert set(results[missing]) == {"error"}
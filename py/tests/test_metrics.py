@@ -0,0 +1,45 @@
+from metrics import metrics_recorder
+
+
+def samples(text: str) -> dict[str, float]:
+    values = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            values[name] = float(value)
+    return values
+
+
+def types(text: str) -> dict[str, str]:
+    return {line.split()[2]: line.split()[3] for line in text.splitlines() if line.startswith("# TYPE")}
+
+
+def test_summary_sum_and_count_cover_the_quantile_window():
+    recorder = metrics_recorder(capacity=4)
+    # Two slow commands drop out of the window; the four fast ones stay in it
+    for wall, duration_ms in [(1.0, 1000), (1.0, 1000), (0.01, 10), (0.01, 10), (0.02, 20), (0.02, None)]:
+        recorder.record("/dev/sg0", 0x88, wall, duration_ms)
+    text = recorder.to_prometheus()
+    values = samples(text)
+    labels = 'device="/dev/sg0",opcode="0x88"'
+    assert values[f"scsi_command_latency_seconds_count{{{labels}}}"] == 4
+    assert abs(values[f"scsi_command_latency_seconds_sum{{{labels}}}"] - 0.06) < 1e-6
+    assert values[f'scsi_command_latency_seconds{{{labels},quantile="0.99"}}'] == 0.02
+    assert values[f"scsi_command_kernel_duration_seconds_count{{{labels}}}"] == 3
+    assert abs(values[f"scsi_command_kernel_duration_seconds_sum{{{labels}}}"] - 0.04) < 1e-6
+    assert values[f"scsi_commands_total{{{labels}}}"] == 6
+    assert abs(values[f"scsi_command_seconds_total{{{labels}}}"] - 2.06) < 1e-6
+    assert types(text) == {
+        "scsi_command_latency_seconds": "summary",
+        "scsi_command_kernel_duration_seconds": "summary",
+        "scsi_commands_total": "counter",
+        "scsi_command_seconds_total": "counter",
+        "scsi_command_errors_total": "counter",
+    }
+
+
+def test_no_kernel_summary_without_kernel_durations():
+    recorder = metrics_recorder(capacity=4)
+    recorder.record("/dev/sg0", 0x28, 0.01)
+    assert not any(name.startswith("scsi_command_kernel_duration_seconds")
+                   for name in samples(recorder.to_prometheus()))
@@ -0,0 +1,102 @@
+import struct
+
+import scsi_cdb
+import scsi_class
+from conftest import IMAGE_BLOCKS, write_blocks
+from provisioning import LBA_STATUS_ANCHORED, LBA_STATUS_DEALLOCATED, LBA_STATUS_MAPPED, parse_lba_status
+from read_pipeline import pipelined_reader
+from scsi_class import scsi_device
+from sg_emulator import emulated_transport, scsi_emulator
+from verifier import make_verifier
+
+
+def lba_status_reply(extents: list[tuple[int, int, int]]) -> bytes:
+    body = b"".join(struct.pack(">QIB3x", lba, blocks, status) for lba, blocks, status in extents)
+    return struct.pack(">I4x", len(body) + 4) + body
+
+
+class canned_lba_status(emulated_transport):
+    """
+    An emulated drive whose GET LBA STATUS answers come from a fixed extent list.
+    """
+    def __init__(self, device: str, emulator: scsi_emulator, extents: list[tuple[int, int, int]]):
+        super().__init__(device, emulator)
+        self.extents = extents
+
+    def execute(self, cdb, data_in=None, data_out=None, timeout_ms=5000) -> int:
+        if cdb[0] == scsi_cdb.SERVICE_ACTION_IN_16 and cdb[1] & 0x1F == scsi_cdb.SA_GET_LBA_STATUS:
+            lba = struct.unpack_from(">Q", cdb, 2)[0]
+            reply = lba_status_reply([extent for extent in self.extents if extent[0] + extent[1] > lba])
+            data_in[:len(reply)] = reply
+            return len(reply)
+        return super().execute(cdb, data_in, data_out, timeout_ms)
+
+
+def test_parse_lba_status():
+    reply = lba_status_reply([(0, 16, LBA_STATUS_MAPPED), (16, 100, LBA_STATUS_DEALLOCATED | 0xF0)])
+    assert parse_lba_status(reply) == [(0, 16, 0), (16, 100, 1)]
+    assert parse_lba_status(reply[:8 + 16]) == [(0, 16, 0)]
+    assert parse_lba_status(b"\0\0\0") == []
+
+
+def test_only_deallocated_and_anchored_are_unmapped(image):
+    emulator = scsi_emulator(image, thin=True)
+    extents = [(0, 100, 0), (100, 100, 1), (200, 100, 2), (300, 100, 3), (400, 100, 4), (500, IMAGE_BLOCKS - 500, 7)]
+    with scsi_device(image, transport=canned_lba_status(image, emulator, extents)) as dev:
+        dev.read_capacity()
+        assert [mapped for _, _, mapped in dev.lba_status()] == [True, False, False, True, True, True]
+    emulator.close()
+
+
+def test_unknown_status_is_read_and_verified(image):
+    write_blocks(image, 350, b"\x01")
+    emulator = scsi_emulator(image, thin=True)
+    extents = [(0, 300, LBA_STATUS_DEALLOCATED), (300, 100, 4), (400, IMAGE_BLOCKS - 400, LBA_STATUS_ANCHORED)]
+    with scsi_device(image, transport=canned_lba_status(image, emulator, extents)) as dev:
+        report = dev.provisioning_check(progress=lambda done, total: None)
+    emulator.close()
+    assert not report
+    assert "LBA 350" in report.error
+
+
+def test_thin_drive_reads_only_mapped_extents(image, make_device):
+    write_blocks(image, 80, b"\0" * 8192)
+    report = make_device(image, thin=True).provisioning_check(progress=lambda done, total: None)
+    assert report and report.provisioned
+    assert (report.verified_blocks, report.verified_extents) == (16, 1)
+    assert report.zero_blocks == IMAGE_BLOCKS - 16
+
+
+def test_fully_provisioned_drive_is_read_in_full(image, make_device):
+    report = make_device(image).provisioning_check(progress=lambda done, total: None)
+    assert report and not report.provisioned
+    assert "LBPME" in report.reason
+    assert report.verified_blocks == IMAGE_BLOCKS
+
+
+def test_unmapped_extents_fail_a_pattern(image, make_device):
+    dev = make_device(image, thin=True)
+    report = dev.provisioning_check(verifier=make_verifier("repeat:a5"), progress=lambda done, total: None)
+    assert not report
+    assert "unmapped" in report.error
+
+
+def test_fragmented_drive_opens_one_reader_and_reports_progress_once(image, make_device, monkeypatch):
+    for lba in range(0, IMAGE_BLOCKS, 1024):
+        write_blocks(image, lba, b"\0" * 8192)
+    readers = []
+
+    class counted_reader(pipelined_reader):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            readers.append(self)
+
+    monkeypatch.setattr(scsi_class, "pipelined_reader", counted_reader)
+    done = []
+    report = make_device(image, thin=True).provisioning_check(read_mode="pipeline",
+                                                              progress=lambda covered, total: done.append(covered))
+    assert report and report.verified_extents == IMAGE_BLOCKS // 1024
+    assert len(readers) == 1
+    # One report per chunk read or unmapped extent, never the same count twice
+    assert done == sorted(set(done))
+    assert done[-1] == IMAGE_BLOCKS
@@ -0,0 +1,94 @@
+import pytest
+
+from retry import NO_RETRY, failure_detail, retry_policy
+from sense import ABORTED_COMMAND, ILLEGAL_REQUEST, MEDIUM_ERROR, NOT_READY, UNIT_ATTENTION
+from sg_emulator import fixed_sense
+from sg_transport import scsi_command_error, short_transfer_error
+
+
+def check_condition(key: int, asc: int = 0, ascq: int = 0, information=None) -> scsi_command_error:
+    return scsi_command_error("SCSI command 0x28 failed", opcode=0x28, status=0x02,
+                              sense=fixed_sense(key, asc, ascq, information))
+
+
+POLICY = retry_policy(retries=3, unit_attention_retries=2, not_ready_timeout=30.0, backoff=0.5, max_backoff=2.0)
+
+
+def test_unit_attention_is_retried_at_once_up_to_its_limit():
+    error = check_condition(UNIT_ATTENTION, 0x29, 0x00)
+    assert [POLICY.delay(error, attempt, 0.0) for attempt in (1, 2, 3)] == [0.0, 0.0, None]
+
+
+def test_not_ready_becoming_ready_backs_off():
+    error = check_condition(NOT_READY, 0x04, 0x01)
+    assert [POLICY.delay(error, attempt, 1.0) for attempt in (1, 2, 3, 4)] == [0.5, 1.0, 2.0, 2.0]
+
+
+def test_not_ready_stops_at_the_timeout():
+    error = check_condition(NOT_READY, 0x04, 0x01)
+    assert POLICY.delay(error, 5, 29.5) == 0.5  # never waits past the timeout
+    assert POLICY.delay(error, 6, 30.0) is None
+
+
+@pytest.mark.parametrize("asc, ascq", [(0x04, 0x02), (0x04, 0x1B), (0x3A, 0x00)])
+def test_not_ready_for_other_reasons_fails_at_once(asc, ascq):
+    assert POLICY.delay(check_condition(NOT_READY, asc, ascq), 1, 0.0) is None
+
+
+def test_not_ready_without_sense_data_is_retried():
+    error = scsi_command_error("sg_raw failed", sense_key=NOT_READY)
+    assert POLICY.delay(error, 1, 0.0) == 0.5
+
+
+def test_medium_error_fails_at_once():
+    error = check_condition(MEDIUM_ERROR, 0x11, 0x00, information=4242)
+    assert POLICY.delay(error, 1, 0.0) is None
+    assert failure_detail(error) == " (medium error at LBA 4242)"
+
+
+def test_aborted_command_busy_and_transient_host_errors_back_off_up_to_retries():
+    errors = [check_condition(ABORTED_COMMAND, 0x47, 0x00),
+              scsi_command_error("busy", status=0x08),
+              scsi_command_error("reset", host_status=0x08)]
+    for error in errors:
+        assert [POLICY.delay(error, attempt, 0.0) for attempt in (1, 2, 3, 4)] == [0.5, 1.0, 2.0, None]
+
+
+@pytest.mark.parametrize("error", [
+    check_condition(ILLEGAL_REQUEST, 0x24, 0x00),
+    short_transfer_error("short", opcode=0x28, received=512, expected=4096),
+    ValueError("not a SCSI error"),
+])
+def test_other_errors_are_not_retried(error):
+    assert POLICY.delay(error, 1, 0.0) is None
+
+
+def test_no_retry_policy():
+    assert NO_RETRY.delay(check_condition(UNIT_ATTENTION, 0x29, 0x00), 1, 0.0) is None
+    assert NO_RETRY.delay(check_condition(NOT_READY, 0x04, 0x01), 1, 0.0) is None
+
+
+def test_run_retries_until_the_command_succeeds():
+    failures = [check_condition(UNIT_ATTENTION, 0x29, 0x00), check_condition(UNIT_ATTENTION, 0x2A, 0x01)]
+
+    def command(value):
+        if failures:
+            raise failures.pop(0)
+        return value
+
+    assert POLICY.run(command, "done") == "done"
+    assert not failures
+
+
+def test_run_raises_the_error_it_gives_up_on():
+    error = check_condition(MEDIUM_ERROR, 0x11, 0x00)
+    calls = []
+
+    def command():
+        calls.append(1)
+        raise error
+
+    with pytest.raises(scsi_command_error) as raised:
+        POLICY.run(command)
+    assert raised.value is error
+    assert len(calls) == 1
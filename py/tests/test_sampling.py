@@ -0,0 +1,48 @@
+from conftest import IMAGE_BLOCKS, write_blocks
+from sampling import confidence_bound, hot_spots, sample_report, stratified_sample
+
+
+def test_zero_budget_is_inconclusive(image, make_device):
+    dev = make_device(image)
+    report = dev.sample_check(200, time_budget=0, seed=1, progress=lambda done, total: None)
+    assert report.samples_read == 0
+    assert report.inconclusive
+    assert not report
+    assert str(report).startswith("INCONCLUSIVE")
+    assert dev.errors == [str(report)]
+
+
+def test_clean_drive_passes_with_a_bound(image, make_device):
+    dev = make_device(image)
+    report = dev.sample_check(50, seed=1, progress=lambda done, total: None)
+    assert report
+    assert report.samples_read == report.samples_planned > 0
+    assert report.bound == confidence_bound(report.samples_read)
+    assert str(report).startswith("PASS")
+
+
+def test_hot_spot_data_fails(image, make_device):
+    write_blocks(image, 0, b"\x55\xaa")
+    report = make_device(image).sample_check(50, seed=1, progress=lambda done, total: None)
+    assert not report
+    assert report.dirty == (0, 0)
+
+
+def test_short_read_fails(image, make_device):
+    dev = make_device(image, read_limit=512)
+    report = dev.sample_check(50, seed=1, progress=lambda done, total: None)
+    assert not report and not report.inconclusive
+    assert "transferred 512 of" in report.error
+
+
+def test_failure_is_not_inconclusive():
+    report = sample_report(IMAGE_BLOCKS, 512, 0.95)
+    report.passed = False
+    report.error = "READ failed"
+    assert not report.inconclusive
+    assert str(report).startswith("FAIL")
+
+
+def test_regions_fit_the_drive():
+    for lba, blocks in hot_spots(IMAGE_BLOCKS, 512) + stratified_sample(IMAGE_BLOCKS, 512, 100, seed=3):
+        assert 0 <= lba and lba + blocks <= IMAGE_BLOCKS
@@ -0,0 +1,77 @@
+import time
+
+from self_test_runner import self_test_orchestrator
+from sg_emulator import emulated_transport, scsi_emulator
+
+SELF_TEST_ABORTED = 0x1
+
+
+def run(image: str, emulator: scsi_emulator, timeout: float = 5.0) -> self_test_orchestrator:
+    orchestrator = self_test_orchestrator([image], transport=emulated_transport(image, emulator), timeout=timeout,
+                                          min_interval=0.02, max_interval=0.05)
+    orchestrator.run(live=False)
+    return orchestrator
+
+
+class empty_log_emulator(scsi_emulator):
+    """
+    A drive whose Self-Test Results page carries no parameters at all.
+    """
+    def _self_test_results(self) -> bytes:
+        return b""
+
+
+class lazy_log_emulator(scsi_emulator):
+    """
+    A drive that logs a finished self-test only lag seconds after REQUEST SENSE stops
+    reporting it in progress.
+    """
+    def __init__(self, image: str, lag: float, **options):
+        super().__init__(image, **options)
+        self.lag: float = lag
+
+    def _self_test_results(self) -> bytes:
+        now = time.monotonic()
+        tests = self.self_tests
+        self.self_tests = [test for test in tests if test[2] or now - test[1] >= self.self_test_seconds + self.lag]
+        try:
+            return super()._self_test_results()
+        finally:
+            self.self_tests = tests
+
+
+def test_first_self_test_on_an_empty_log(image):
+    emulator = scsi_emulator(image, self_test_seconds=0.1)
+    job = run(image, emulator).jobs[0]
+    assert job.state == "pass"
+    assert job.result["number"] == 1 and job.result["result"] == 0
+    assert job.polls >= 2
+    emulator.close()
+
+
+def test_earlier_entries_are_not_taken_for_ours(image):
+    emulator = lazy_log_emulator(image, lag=0.15, self_test_seconds=0.1)
+    # An extended test aborted an hour ago is the newest entry when ours starts
+    emulator.self_tests = [(2, time.monotonic() - 3600, True)]
+    job = run(image, emulator).jobs[0]
+    assert job.state == "pass"
+    assert (job.result["code"], job.result["result"]) == (1, 0)
+    assert [aborted for _, _, aborted in emulator.self_tests] == [False, True]
+    emulator.close()
+
+
+def test_timeout_aborts_the_self_test(image):
+    emulator = scsi_emulator(image, self_test_seconds=60.0)
+    job = run(image, emulator, timeout=0.1).jobs[0]
+    assert job.state == "timeout"
+    assert emulator.self_tests[0][2], "SEND DIAGNOSTIC with SELF_TEST_ABORT was not sent"
+    assert job.transport is None
+    emulator.close()
+
+
+def test_drive_that_never_logs_a_result_times_out(image):
+    emulator = empty_log_emulator(image, self_test_seconds=0.05)
+    job = run(image, emulator, timeout=0.2).jobs[0]
+    assert job.state == "timeout"
+    assert job.result is None
+    emulator.close()
@@ -0,0 +1,58 @@
+import struct
+
+from self_test_runner import ASC_SELF_TEST_IN_PROGRESS, sense_progress
+from sense import MEDIUM_ERROR, NOT_READY, decode_sense
+from sg_emulator import fixed_sense
+
+
+def descriptor_sense(key: int, asc: int, ascq: int, descriptors: bytes = b"") -> bytes:
+    return bytes((0x72, key, asc, ascq, 0, 0, 0, len(descriptors))) + descriptors
+
+
+def progress_descriptor(fraction: float) -> bytes:
+    return bytes((0x02, 0x06, 0, 0, 0x80)) + struct.pack(">H", int(fraction * 0x10000)) + b"\x00"
+
+
+def fixed_progress(fraction: float) -> bytes:
+    sense = bytearray(fixed_sense(NOT_READY, *ASC_SELF_TEST_IN_PROGRESS))
+    sense[15] = 0x80  # SKSV
+    struct.pack_into(">H", sense, 16, int(fraction * 0x10000))
+    return bytes(sense)
+
+
+def test_fixed_sense_with_information():
+    sense = decode_sense(fixed_sense(MEDIUM_ERROR, 0x11, 0x00, information=123456))
+    assert (sense.key, sense.asc, sense.ascq) == (MEDIUM_ERROR, 0x11, 0x00)
+    assert sense.information == 123456
+    assert not sense.descriptor_format
+    assert sense.progress is None
+
+
+def test_descriptor_sense_with_information_and_progress():
+    information = bytes((0x00, 0x0A, 0x80, 0)) + struct.pack(">Q", 1 << 40)
+    sense = decode_sense(descriptor_sense(NOT_READY, 0x04, 0x1B, information + progress_descriptor(0.5)))
+    assert sense.descriptor_format
+    assert sense.information == 1 << 40
+    assert sense.progress == 0.5
+
+
+def test_not_sense_data():
+    assert decode_sense(b"") is None
+    assert decode_sense(bytes(18)) is None
+
+
+def test_sense_progress_fixed_and_descriptor_format():
+    assert sense_progress(fixed_progress(0.25)) == (True, 0.25)
+    descriptor = descriptor_sense(NOT_READY, *ASC_SELF_TEST_IN_PROGRESS, progress_descriptor(0.75))
+    assert sense_progress(descriptor) == (True, 0.75)
+
+
+def test_sense_progress_without_progress_indication():
+    assert sense_progress(fixed_sense(NOT_READY, *ASC_SELF_TEST_IN_PROGRESS)) == (True, None)
+    assert sense_progress(descriptor_sense(NOT_READY, *ASC_SELF_TEST_IN_PROGRESS)) == (True, None)
+
+
+def test_sense_progress_of_other_conditions():
+    assert sense_progress(fixed_sense(NOT_READY, 0x04, 0x1B)) == (False, None)
+    assert sense_progress(fixed_sense(0, 0, 0)) == (False, None)
+    assert sense_progress(b"\x70\x00") == (False, None)
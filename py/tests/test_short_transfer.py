@@ -0,0 +1,99 @@
+"""
+A READ that completes with GOOD status but a residual must never be verified as if the
+whole buffer had arrived.
+"""
+import asyncio
+
+import pytest
+
+import scsi_cdb
+import scsi_class
+from conftest import write_blocks
+from scsi_class import scsi_device
+from sg_emulator import (emulated_async_device, emulated_async_queue, emulated_sg_io_transport, emulated_transport,
+                         scsi_emulator)
+from sg_transport import check_transfer, short_transfer_error
+
+
+def test_check_transfer_passes_full_transfers():
+    assert check_transfer("dev", scsi_cdb.read(0, 8), 4096, 4096) == 4096
+
+
+def test_check_transfer_raises_on_residual():
+    with pytest.raises(short_transfer_error) as info:
+        check_transfer("dev", scsi_cdb.read(0, 8), 512, 4096)
+    assert (info.value.received, info.value.expected) == (512, 4096)
+    assert info.value.opcode == scsi_cdb.READ_10
+
+
+def test_blank_check_fails_short_reads(image, make_device):
+    # Only the first block of every chunk arrives, so the 0xFF block is never actually read
+    write_blocks(image, 2500, b"\xff" * 512)
+    dev = make_device(image, read_limit=512)
+    assert not dev.blank_check(chunk_blocks=1000, progress=lambda done, total: None)
+    assert "transferred 512 of 512000 bytes" in dev.errors[-1]
+
+
+def test_blank_check_passes_full_reads(image, make_device):
+    dev = make_device(image)
+    assert dev.blank_check(chunk_blocks=1000, progress=lambda done, total: None)
+
+
+def test_async_queue_fails_short_reads(image):
+    emulator = scsi_emulator(image, read_limit=512)
+    with emulated_async_queue(image, queue_depth=4, max_transfer=64 * 512, emulator=emulator) as queue:
+        stream = queue.read_stream(0, 256, 64, 512)
+        with pytest.raises(short_transfer_error):
+            next(stream)
+        stream.close()
+    emulator.close()
+
+
+def test_async_queue_reads_full_chunks(image):
+    write_blocks(image, 100, b"\xff" * 512)
+    with emulated_async_queue(image, queue_depth=4, max_transfer=64 * 512) as queue:
+        chunks = [(lba, blocks, bytes(data)) for lba, blocks, data in queue.read_stream(0, 256, 64, 512)]
+    assert [(lba, blocks) for lba, blocks, _ in chunks] == [(0, 64), (64, 64), (128, 64), (192, 64)]
+    assert all(len(data) == 64 * 512 for _, _, data in chunks)
+    assert chunks[1][2][36 * 512] == 0xFF
+
+
+class emulated_mmap_transport(emulated_sg_io_transport):
+    """
+    Stands in for sg_mmap_transport: read_data hands out a view sliced to the bytes received.
+    """
+    def __init__(self, device: str, reserve: int, emulator: scsi_emulator):
+        super().__init__(device, emulator=emulator)
+        self.reserved: int = reserve
+
+
+def test_blank_check_mmap_fails_short_reads(image, monkeypatch):
+    write_blocks(image, 2500, b"\xff" * 512)
+    emulator = scsi_emulator(image, read_limit=512)
+    monkeypatch.setattr(scsi_class, "sg_mmap_transport",
+                        lambda device, reserve: emulated_mmap_transport(device, reserve, emulator))
+    with scsi_device(image, transport=emulated_transport(image, emulator)) as dev:
+        assert not dev.blank_check(read_mode="mmap", progress=lambda done, total: None)
+        assert "transferred 512 of 512000 bytes" in dev.errors[-1]
+    emulator.close()
+
+
+def test_blank_check_pipeline_fails_short_reads(image, make_device):
+    write_blocks(image, 2500, b"\xff" * 512)
+    dev = make_device(image, read_limit=512)
+    assert not dev.blank_check(read_mode="pipeline", queue_depth=3, progress=lambda done, total: None)
+    assert "transferred 512 of 512000 bytes" in dev.errors[-1]
+
+
+def test_async_blank_check_fails_short_reads(image):
+    write_blocks(image, 2500, b"\xff" * 512)
+
+    async def check() -> list[str]:
+        emulator = scsi_emulator(image, read_limit=512)
+        async with emulated_async_device(image, queue_depth=4, max_transfer=1000 * 512, emulator=emulator) as dev:
+            assert not await dev.blank_check(1000)
+        emulator.close()
+        return dev.errors
+
+    errors = asyncio.run(check())
+    assert "transferred 512 of 512000 bytes" in errors[-1]
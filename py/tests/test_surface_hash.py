@@ -0,0 +1,45 @@
+import shutil
+
+import pytest
+
+from conftest import write_blocks
+from surface_hash import surface_hash, surface_hasher
+
+
+def hasher(path: str) -> surface_hasher:
+    return surface_hasher(path, transport="emulated", workers=2, range_bytes=512 * 1024, chunk_blocks=256)
+
+
+def test_verify_finds_the_changed_range(image, tmp_path):
+    saved = hasher(image).run()
+    path = str(tmp_path / "disk.hash")
+    saved.save(path)
+    write_blocks(image, 3000, b"\x01")
+    results = hasher(image).verify_ranges(surface_hash.load(path))
+    changed = [entry for entry in results if entry["state"] != "match"]
+    assert changed == [{"start": 2048, "end": 3072, "state": "mismatch"}]
+
+
+def test_verify_refuses_another_drive_with_the_same_geometry(image, tmp_path):
+    saved = hasher(image).run()
+    assert saved.serial
+    other = str(tmp_path / "other.img")
+    shutil.copyfile(image, other)
+    with pytest.raises(ValueError, match="serial"):
+        hasher(other).verify_ranges(saved)
+
+
+def test_verify_refuses_a_different_capacity(image, tmp_path):
+    saved = hasher(image).run()
+    with open(image, "ab") as f:
+        f.truncate((saved.blocks + 8) * saved.block_size)
+    with pytest.raises(ValueError, match="bytes"):
+        hasher(image).verify_ranges(saved)
+
+
+def test_read_range_reads_only_the_asked_lbas(image, make_device):
+    write_blocks(image, 1000, b"\x07" * 512)
+    dev = make_device(image)
+    chunks = [(lba, blocks, bytes(data)) for lba, blocks, data in dev.read_range(990, 1300, chunk_blocks=128)]
+    assert [(lba, blocks) for lba, blocks, _ in chunks] == [(990, 128), (1118, 128), (1246, 54)]
+    assert chunks[0][2][10 * 512:11 * 512] == b"\x07" * 512
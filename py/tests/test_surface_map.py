@@ -0,0 +1,34 @@
+import scsi_cdb
+from conftest import IMAGE_BLOCKS, write_blocks
+from surface_map import NONZERO, UNREADABLE, diff_maps
+
+
+def test_maps_data_and_unreadable_blocks(image, make_device):
+    write_blocks(image, 2500, b"\xff" * 1024)
+    dev = make_device(image)
+    dev.transport.emulator.inject_error(scsi_cdb.READ_10, lba=5000)
+    result = dev.surface_scan(chunk_blocks=1000, retry_blocks=8, progress=lambda done, total: None)
+    assert result.ranges(NONZERO) == [[2500, 2502]]
+    assert result.ranges(UNREADABLE) == [[5000, 5008]]
+    assert result.scanned_blocks == IMAGE_BLOCKS
+
+
+def test_short_reads_leave_the_tail_unreadable(image, make_device):
+    write_blocks(image, 2500, b"\xff" * 512)
+    write_blocks(image, 2502, b"\xff" * 512)
+    dev = make_device(image, read_limit=1024)
+    result = dev.surface_scan(chunk_blocks=1000, retry_blocks=4, progress=lambda done, total: None)
+    # Only the first two blocks of every 4-block piece arrive
+    assert result.ranges(NONZERO) == [[2500, 2501]]
+    unreadable = result.ranges(UNREADABLE)
+    assert unreadable[0] == [2, 4]
+    assert [2502, 2504] in unreadable
+    assert result.blocks_of(UNREADABLE) == IMAGE_BLOCKS // 2
+
+
+def test_diff_reports_new_unreadable_regions(image, make_device):
+    old = make_device(image).surface_scan(progress=lambda done, total: None)
+    dev = make_device(image)
+    dev.transport.emulator.inject_error(scsi_cdb.READ_10, lba=100)
+    new = dev.surface_scan(progress=lambda done, total: None)
+    assert diff_maps(old, new)[UNREADABLE]["added"] == [[96, 104]]
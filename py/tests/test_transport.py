@@ -0,0 +1,29 @@
+import pytest
+
+import sg_coproc  # noqa: F401 (registers its transport)
+import sg_emulator  # noqa: F401 (registers its transports)
+from direct_io import DEFAULT_RESERVE, sg_mmap_transport
+from sg_transport import TRANSPORTS, open_transport
+
+
+class recorded_mmap_transport(sg_mmap_transport):
+    """
+    sg_mmap_transport with the device open and the mapping left out; records how it was built.
+    """
+    def __init__(self, device: str, reserve: int = DEFAULT_RESERVE):
+        self.device: str = device
+        self.reserved: int = reserve
+
+
+@pytest.mark.parametrize("name", sorted(TRANSPORTS))
+def test_every_transport_can_be_opened_writable(name):
+    cls = TRANSPORTS[name]
+    if cls.takes_open_flags:
+        # Each one that says it takes open flags has to accept them
+        assert "flags" in cls.__init__.__code__.co_varnames
+
+
+def test_sg_mmap_opened_writable(monkeypatch):
+    monkeypatch.setitem(TRANSPORTS, "sg_mmap", recorded_mmap_transport)
+    transport = open_transport("/dev/sg7", "sg_mmap", writable=True)
+    assert (transport.device, transport.reserved) == ("/dev/sg7", DEFAULT_RESERVE)
@@ -0,0 +1,96 @@
+import struct
+
+from provisioning import LBPRZ_ZEROS
+from vpd import (FIRST_ALLOC_LEN, VPD_BLOCK_LIMITS, VPD_DEVICE_ID, VPD_LOGICAL_BLOCK_PROVISIONING,
+                 parse_block_limits, parse_device_id, parse_logical_block_provisioning, vpd_engine)
+
+
+def vpd_page(code: int, body: bytes) -> bytes:
+    return struct.pack(">BBH", 0x00, code, len(body)) + body
+
+
+def designator(code_set: int, association: int, kind: int, value: bytes) -> bytes:
+    return bytes((code_set, association << 4 | kind, 0, len(value))) + value
+
+
+def test_block_limits():
+    body = bytearray(0x3C)
+    body[1] = 1  # MAXIMUM COMPARE AND WRITE LENGTH
+    struct.pack_into(">HIIIIIIIQ", body, 2, 8, 2048, 256, 0, 0x400000, 64, 8, 0x80000004, 0xFFFF)
+    limits = parse_block_limits(vpd_page(VPD_BLOCK_LIMITS, bytes(body)))
+    assert limits["max_compare_and_write"] == 1
+    assert (limits["max_transfer_length"], limits["optimal_transfer_length"]) == (2048, 256)
+    assert (limits["max_unmap_lba_count"], limits["max_unmap_descriptor_count"]) == (0x400000, 64)
+    assert (limits["optimal_unmap_granularity"], limits["unmap_granularity_alignment"]) == (8, 4)
+    assert limits["max_write_same_length"] == 0xFFFF
+
+
+def test_block_limits_without_unmap_and_alignment():
+    limits = parse_block_limits(vpd_page(VPD_BLOCK_LIMITS, bytes(0x3C)))
+    assert (limits["max_unmap_lba_count"], limits["max_unmap_descriptor_count"]) == (0, 0)
+    assert limits["unmap_granularity_alignment"] is None
+    assert limits["max_write_same_length"] == 0
+
+
+def test_block_limits_too_short():
+    page = vpd_page(VPD_BLOCK_LIMITS, bytes(16))
+    assert parse_block_limits(page) == {"raw": page.hex()}
+
+
+def test_logical_block_provisioning():
+    page = vpd_page(VPD_LOGICAL_BLOCK_PROVISIONING, bytes((0x09, 0x80 | 0x40 | LBPRZ_ZEROS << 2 | 0x02, 0x02, 0)))
+    provisioning = parse_logical_block_provisioning(page)
+    assert provisioning["threshold_exponent"] == 9
+    assert (provisioning["lbpu"], provisioning["lbpws"], provisioning["lbpws10"]) == (True, True, False)
+    assert provisioning["lbprz"] == LBPRZ_ZEROS
+    assert (provisioning["anc_sup"], provisioning["dp"]) == (True, False)
+    assert provisioning["provisioning_type"] == "thin"
+
+
+def test_logical_block_provisioning_initialization_pattern():
+    page = vpd_page(VPD_LOGICAL_BLOCK_PROVISIONING, bytes((0, 0x80 | 0x02 << 2, 0x01, 0)))
+    provisioning = parse_logical_block_provisioning(page)
+    assert provisioning["lbprz"] == 2
+    assert provisioning["provisioning_type"] == "resource"
+
+
+def test_device_id():
+    page = vpd_page(VPD_DEVICE_ID, designator(0x01, 0, 0x3, bytes.fromhex("5000c500a1b2c3d4"))
+                    + designator(0x02, 0, 0x1, b"SEAGATE Z1Z0ABCD\x00")
+                    + designator(0x01, 1, 0x4, b"\x00\x00\x00\x01"))
+    designators = parse_device_id(page)["designators"]
+    assert designators == [
+        {"type": "NAA", "association": "logical unit", "value": "5000c500a1b2c3d4"},
+        {"type": "T10 vendor ID", "association": "logical unit", "value": "SEAGATE Z1Z0ABCD"},
+        {"type": "relative target port", "association": "target port", "value": "00000001"},
+    ]
+
+
+class canned_vpd:
+    """
+    Answers INQUIRY with one page, truncated to the allocation length like a real device.
+    """
+    def __init__(self, page: bytes):
+        self.page: bytes = page
+        self.lengths: list[int] = []
+
+    def read_data(self, cdb: bytes, length: int, timeout_ms: int = 0) -> bytes:
+        self.lengths.append(length)
+        return self.page[:length]
+
+
+def test_read_page_rereads_a_page_longer_than_the_first_read():
+    descriptors = b"".join(designator(0x02, 0, 0x8, f"iqn.2024-01.test:unit{n:03d}".encode()) for n in range(12))
+    page = vpd_page(VPD_DEVICE_ID, descriptors)
+    assert len(page) > FIRST_ALLOC_LEN
+    transport = canned_vpd(page)
+    assert vpd_engine(transport).read_page(VPD_DEVICE_ID) == page
+    assert transport.lengths == [FIRST_ALLOC_LEN, len(page)]
+    assert len(parse_device_id(page)["designators"]) == 12
+
+
+def test_read_page_short_page_is_read_once():
+    page = vpd_page(VPD_LOGICAL_BLOCK_PROVISIONING, bytes(4))
+    transport = canned_vpd(page)
+    assert vpd_engine(transport).read_page(VPD_LOGICAL_BLOCK_PROVISIONING) == page
+    assert transport.lengths == [FIRST_ALLOC_LEN]
@@ -0,0 +1,155 @@
+import struct
+import time
+from typing import Optional
+
+import pytest
+
+from sense import MEDIUM_ERROR, NO_SENSE, NOT_READY, UNIT_ATTENTION
+from conftest import write_blocks
+from scsi_class import scsi_device
+from sg_emulator import ASC_SANITIZE_IN_PROGRESS, emulated_transport, fixed_sense, scsi_emulator
+from wipe import detect_erase_support, erase_failed, erase_support, wipe_job, wipe_orchestrator
+
+
+def in_progress(fraction: float) -> bytes:
+    sense = bytearray(fixed_sense(NOT_READY, *ASC_SANITIZE_IN_PROGRESS))
+    sense[15] = 0x80  # SKSV
+    struct.pack_into(">H", sense, 16, int(fraction * 0x10000))
+    return bytes(sense)
+
+
+class sense_script:
+    """
+    Answers each REQUEST SENSE with the next of a list of sense data, repeating the last.
+    """
+    def __init__(self, replies: list[bytes]):
+        self.replies: list[bytes] = replies
+        self.polls: int = 0
+
+    def read_data(self, cdb: bytes, length: int, timeout_ms: int = 0) -> bytes:
+        reply = self.replies[min(self.polls, len(self.replies) - 1)]
+        self.polls += 1
+        return reply[:length]
+
+
+def wait(replies: list[bytes], timeout: float = 60.0) -> sense_script:
+    orchestrator = wipe_orchestrator([], min_interval=0.0, max_interval=0.0)
+    job = wipe_job("/dev/sdx", "host0", timeout)
+    job.started = time.monotonic()
+    transport = sense_script(replies)
+    orchestrator._wait(job, transport)
+    return transport
+
+
+def test_wait_returns_once_the_sanitize_completes():
+    transport = wait([in_progress(0.25), in_progress(0.75), fixed_sense(NO_SENSE, 0, 0)])
+    assert transport.polls == 3
+
+
+def test_wait_polls_on_through_a_unit_attention():
+    transport = wait([fixed_sense(UNIT_ATTENTION, 0x29, 0x00), in_progress(0.5),
+                      fixed_sense(NO_SENSE, 0, 0)])
+    assert transport.polls == 3
+
+
+def test_wait_raises_when_the_drive_reports_a_failed_erase():
+    with pytest.raises(erase_failed):
+        wait([in_progress(0.5), fixed_sense(MEDIUM_ERROR, 0x31, 0x03)])
+
+
+def test_wait_times_out_on_a_sanitize_that_never_ends():
+    with pytest.raises(TimeoutError):
+        wait([in_progress(0.5)], timeout=0.0)
+
+
+def test_wait_times_out_on_unit_attention_forever():
+    with pytest.raises(TimeoutError):
+        wait([fixed_sense(UNIT_ATTENTION, 0x29, 0x00)], timeout=0.0)
+
+
+class provisioning_emulator(scsi_emulator):
+    """
+    A thin emulator with the Logical Block Provisioning flags and Block Limits UNMAP
+    counts overridden.
+    """
+    def __init__(self, image: str, lbprz: int = 1, max_unmap: Optional[tuple[int, int]] = None, **options):
+        super().__init__(image, thin=True, **options)
+        self.lbprz: int = lbprz
+        self.max_unmap: Optional[tuple[int, int]] = max_unmap
+
+    def _vpd_page(self, page: int) -> Optional[bytes]:
+        body = super()._vpd_page(page)
+        if page == 0xB2:
+            body = bytearray(body)
+            body[1] = 0xC0 | self.lbprz << 2
+        elif page == 0xB0 and self.max_unmap is not None:
+            body = bytearray(body)
+            struct.pack_into(">II", body, 16, *self.max_unmap)
+        return bytes(body)
+
+
+def support_of(image: str, **options) -> erase_support:
+    emulator = provisioning_emulator(image, **options)
+    try:
+        return detect_erase_support(emulated_transport(image, emulator))
+    finally:
+        emulator.close()
+
+
+def test_unmap_is_offered_on_a_thin_drive_that_reads_zeros(image):
+    support = support_of(image)
+    assert support.lbprz
+    assert "unmap" in support.methods()
+
+
+def test_lbprz_initialization_pattern_is_not_zeros(image):
+    support = support_of(image, lbprz=2)
+    assert not support.lbprz
+    assert "unmap" not in support.methods()
+    assert support.methods().index("write_same") > support.methods().index("overwrite")
+
+
+@pytest.mark.parametrize("max_unmap", [(0, 64), (1 << 22, 0)])
+def test_zero_unmap_limits_mean_unmap_is_not_supported(image, max_unmap):
+    support = support_of(image, max_unmap=max_unmap)
+    assert "unmap" not in support.methods()
+    orchestrator = wipe_orchestrator([], method="unmap")
+    job = wipe_job(image, "host0", 60.0)
+    job.support = support
+    with pytest.raises(RuntimeError, match="not supported"):
+        orchestrator._choose(job)
+
+
+def test_crypto_erase_with_verify_is_refused():
+    with pytest.raises(ValueError, match="--no-verify"):
+        wipe_orchestrator([], method="crypto", verify=True)
+    assert wipe_orchestrator([], method="crypto", verify=False).method == "crypto"
+
+
+class recording_transport(emulated_transport):
+    def __init__(self, device: str, emulator: scsi_emulator):
+        super().__init__(device, emulator)
+        self.cdbs: list[bytes] = []
+
+    def execute(self, cdb: bytes, *args, **kwargs) -> int:
+        self.cdbs.append(bytes(cdb))
+        return super().execute(cdb, *args, **kwargs)
+
+
+@pytest.mark.parametrize("lbprz, unmapped", [(1, True), (2, False)])
+def test_write_same_only_unmaps_when_deallocated_blocks_read_as_zeros(image, lbprz, unmapped):
+    write_blocks(image, 100, b"\xaa" * 512)
+    emulator = provisioning_emulator(image, lbprz=lbprz, writable=True)
+    transport = recording_transport(image, emulator)
+    with scsi_device(image, transport=transport) as dev:
+        dev.read_capacity()
+        job = wipe_job(image, "host0", 60.0)
+        job.support = detect_erase_support(transport)
+        job.started = time.monotonic()
+        wipe_orchestrator([], method="write_same")._write_same(job, dev)
+        same = [cdb for cdb in transport.cdbs if cdb[0] == 0x93]
+        assert same and all(bool(cdb[1] & 0x08) == unmapped for cdb in same)
+        assert job.progress == 1.0
+    emulator.close()
+    with open(image, "rb") as f:
+        assert not any(f.read())